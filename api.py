@@ -1,16 +1,32 @@
+import asyncio
 import logging
 import os
 import re
-from urllib.parse import urlencode
-from urllib.request import urlopen
+import time
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, ConfigDict, field_validator
 
 from config import BOT_TOKEN, SERVICES
-from database import DatabaseManager, get_connection, init_database
+import database
+from database import (
+    DatabaseManager,
+    car_number_key,
+    db,
+    db_writer,
+    effective_price_mode,
+    init_database,
+    shutdown_db_executor,
+    start_db_writer,
+)
+from services.idempotency import API_TASK_LOG_TTL_HOURS, RecentTaskCache
+from services.metrics import CONTENT_TYPE, render as render_metrics
+from services.service_search import SERVICE_INDEX
+from services.telegram_notifier import TelegramNotifier
+from services.telegram_webhook import WEBHOOK_PATH, WebhookIngress, secret_matches, webhook_enabled
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -19,14 +35,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="ServiceBot API", version="1.0.0")
-
-FAST_SERVICE_ALIASES = {
-    1: ["проверка", "пров", "провер", "чек"],
-    2: ["заправка", "запр", "топливо", "бенз"],
-    3: ["омыв", "омывка", "омывайка", "зали", "зо", "заливка"],
-    14: ["перепарковка", "перепарк", "парковка", "некорректная", "некк", "нек", "некорр"],
-}
-
+notifier = TelegramNotifier(BOT_TOKEN)
+recent_tasks = RecentTaskCache()
 
 class TaskPayload(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -36,6 +46,7 @@ class TaskPayload(BaseModel):
     task_type: str | int
     timestamp: int
     device_key: str | None = None
+    idempotency_key: str | None = None
 
     @field_validator("car_id")
     @classmethod
@@ -46,6 +57,16 @@ class TaskPayload(BaseModel):
         return normalized
 
 
+class TaskBatchPayload(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    tasks: list[TaskPayload]
+    device_key: str | None = None
+
+
+TASK_BATCH_MAX = max(1, int(os.getenv("TASK_BATCH_MAX", "1000")))
+
+
 def plain_service_name(name: str) -> str:
     return re.sub(r"^[^0-9A-Za-zА-Яа-я]+\s*", "", name).strip()
 
@@ -62,48 +83,134 @@ def resolve_service_id(task_type: str | int) -> int | None:
         numeric = int(normalized)
         return numeric if numeric in SERVICES else None
 
-    for service_id, aliases in FAST_SERVICE_ALIASES.items():
-        if normalized in aliases:
-            return service_id
-
-    for service_id, service in SERVICES.items():
-        clean_name = plain_service_name(service.get("name", "")).lower()
-        if normalized in clean_name or clean_name in normalized:
-            return service_id
-
-    return None
+    return SERVICE_INDEX.resolve(normalized)
 
 
-def is_duplicate_recent(car_id: int, service_id: int, ttl_hours: int) -> bool:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """SELECT 1
-        FROM car_services
-        WHERE car_id = ?
-          AND service_id = ?
-          AND datetime(created_at) >= datetime('now', ?)
-        LIMIT 1""",
-        (car_id, service_id, f"-{ttl_hours} hours"),
-    )
-    row = cur.fetchone()
-    conn.close()
-    return row is not None
+def notifications_enabled() -> bool:
+    return os.getenv("NOTIFY_TELEGRAM", "0") == "1"
 
 
 def maybe_notify_telegram(chat_id: int, car_number: str, service_name: str, price: int) -> None:
-    if os.getenv("NOTIFY_TELEGRAM", "0") != "1":
+    """Ставит уведомление в очередь notifier; сама отправка идёт в фоне."""
+    if not notifications_enabled():
         return
     if not BOT_TOKEN:
         logger.warning("NOTIFY_TELEGRAM=1, but BOT_TOKEN is empty")
         return
 
     text = f"✅ Добавлена услуга: {service_name}\n🚗 {car_number}\n💰 {price}₽"
-    payload = urlencode({"chat_id": chat_id, "text": text}).encode("utf-8")
-    try:
-        urlopen(f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage", data=payload, timeout=3)
-    except Exception as exc:  # noqa: BLE001
-        logger.warning("Telegram notify failed: %s", exc)
+    if not notifier.notify(chat_id, text):
+        logger.warning("Telegram notify queue rejected message for chat_id=%s", chat_id)
+
+
+def service_price(service_id: int, price_mode: str) -> tuple[str, int]:
+    service = SERVICES[service_id]
+    price_key = "night_price" if price_mode == "night" else "day_price"
+    return plain_service_name(service.get("name", "")), int(service.get(price_key, 0) or 0)
+
+
+def ingest_task_batch(tasks: list[TaskPayload], batch_device_key: str | None) -> tuple[list[dict], list[tuple]]:
+    """Обрабатывает пачку задач: одна выборка контекста, одна проверка дублей, одна транзакция.
+
+    Повтор — это тот же ключ идемпотентности или та же услуга той же машине в активной
+    смене за DEDUPE_TTL_HOURS, пока услуга не удалена. Горячие повторы ключа отсекает
+    recent_tasks без SQLite, остальные проверяются по api_task_log. Возвращает статусы
+    по каждой задаче и список добавленных услуг для уведомлений.
+    """
+    required_device_key = os.getenv("DEVICE_KEY")
+    auto_start = os.getenv("AUTO_START_SHIFT", "0") == "1"
+    ttl_hours = max(1, int(os.getenv("DEDUPE_TTL_HOURS", "6")))
+    now_ts = int(time.time())
+    since_ts = now_ts - ttl_hours * 3600
+    results: list[dict] = [{"index": index, "status": "ok"} for index in range(len(tasks))]
+
+    def fail(index: int, reason: str) -> None:
+        results[index] = {"index": index, "status": "error", "reason": reason}
+
+    accepted: list[tuple[int, TaskPayload, int, str]] = []
+    for index, task in enumerate(tasks):
+        if required_device_key and (task.device_key or batch_device_key) != required_device_key:
+            fail(index, "unauthorized")
+            continue
+        service_id = resolve_service_id(task.task_type)
+        if service_id is None:
+            fail(index, "unknown_task_type")
+            continue
+        if recent_tasks.seen_key(task.idempotency_key):
+            results[index]["dedup"] = True
+            continue
+        accepted.append((index, task, service_id, car_number_key(task.car_id)))
+    if not accepted:
+        return results, []
+
+    notifications: list[tuple] = []
+    log_rows: list[tuple] = []
+    with db.session(immediate=True):
+        contexts = DatabaseManager.get_task_batch_context([task.chat_id for _, task, _, _ in accepted])
+        for chat_id, context in contexts.items():
+            if context["shift_id"] is None and auto_start:
+                context["shift_id"] = DatabaseManager.start_shift(context["user_id"])
+
+        in_shift: list[tuple[int, TaskPayload, int, str, dict]] = []
+        for index, task, service_id, car in accepted:
+            context = contexts.get(task.chat_id)
+            if context is None:
+                fail(index, "user_not_registered")
+            elif context["shift_id"] is None:
+                fail(index, "no_active_shift")
+            else:
+                in_shift.append((index, task, service_id, car, context))
+
+        seen_keys, seen_tasks = DatabaseManager.find_api_task_duplicates(
+            [task.idempotency_key for _, task, _, _, _ in in_shift],
+            [(context["shift_id"], car, service_id) for _, _, service_id, car, context in in_shift],
+            since_ts,
+        )
+        by_shift: dict[int, dict[str, list[tuple]]] = {}
+        for index, task, service_id, car, context in in_shift:
+            shift_id = context["shift_id"]
+            if task.idempotency_key in seen_keys or (shift_id, car, service_id) in seen_tasks:
+                if task.idempotency_key in seen_keys:
+                    recent_tasks.remember(task.idempotency_key, seen_keys[task.idempotency_key])
+                results[index]["dedup"] = True
+                continue
+            seen_tasks.add((shift_id, car, service_id))
+            if task.idempotency_key:
+                seen_keys[task.idempotency_key] = now_ts
+            price_mode = effective_price_mode(context["price_mode"], context["price_mode_lock_until"])
+            service_name, price = service_price(service_id, price_mode)
+            by_shift.setdefault(shift_id, {}).setdefault(task.car_id, []).append((service_id, service_name, price, 1))
+            notifications.append((task.chat_id, task.car_id, service_name, price))
+            log_rows.append(
+                (task.device_key or batch_device_key, task.chat_id, shift_id, car, service_id, now_ts, task.idempotency_key)
+            )
+
+        for shift_id, cars in by_shift.items():
+            DatabaseManager.add_services_to_shift_cars(shift_id, cars)
+        DatabaseManager.log_api_tasks(log_rows)
+
+    for *_, ts, idem_key in log_rows:
+        recent_tasks.remember(idem_key, ts)
+    return results, notifications
+
+
+def load_bot_application():
+    # bot.py тяжёлый (обработчики, кэши, init_database) — импортируется только воркером-лидером
+    from bot import ALLOWED_UPDATES, build_application
+
+    return build_application(), ALLOWED_UPDATES
+
+
+async def prune_api_task_log_loop(interval: float = 3600) -> None:
+    while True:
+        try:
+            before_ts = int(time.time()) - API_TASK_LOG_TTL_HOURS * 3600
+            removed = await run_in_threadpool(db_writer.call, DatabaseManager.prune_api_task_log, before_ts)
+            if removed:
+                logger.info("api_task_log pruned rows=%s", removed)
+        except Exception:
+            logger.exception("api_task_log prune failed")
+        await asyncio.sleep(interval)
 
 
 @app.exception_handler(RequestValidationError)
@@ -121,51 +228,90 @@ async def generic_exception_handler(_: Request, exc: Exception) -> JSONResponse:
 
 
 @app.on_event("startup")
-def on_startup() -> None:
+async def on_startup() -> None:
     init_database()
+    start_db_writer()
+    if notifications_enabled() and BOT_TOKEN:
+        await notifier.start()
+    app.state.prune_task = asyncio.create_task(prune_api_task_log_loop())
+    if webhook_enabled():
+        app.state.webhook = WebhookIngress(load_bot_application, lock_path=f"{database.DB_PATH}.webhook.lock")
+        await app.state.webhook.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    webhook = getattr(app.state, "webhook", None)
+    if webhook is not None:
+        await webhook.stop()
+    prune_task = getattr(app.state, "prune_task", None)
+    if prune_task is not None:
+        prune_task.cancel()
+    await notifier.stop()
+    # после остановки встроенного бота: пул, писатель и соединения БД общие для процесса
+    await run_in_threadpool(shutdown_db_executor)
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(
+    request: Request,
+    x_telegram_bot_api_secret_token: str | None = Header(default=None),
+) -> Response:
+    webhook = getattr(app.state, "webhook", None)
+    if webhook is None:
+        return JSONResponse(status_code=404, content={"status": "error", "reason": "webhook_disabled"})
+    if not secret_matches(x_telegram_bot_api_secret_token, webhook.secret):
+        return JSONResponse(status_code=403, content={"status": "error", "reason": "forbidden"})
+    try:
+        payload = await request.json()
+        await webhook.accept(payload)
+    except (ValueError, KeyError, TypeError):
+        return JSONResponse(status_code=400, content={"status": "error", "reason": "bad_update"})
+    return Response(status_code=200)
+
+
+TASK_ERROR_STATUS = {
+    "unauthorized": 401,
+    "user_not_registered": 404,
+    "no_active_shift": 409,
+    "unknown_task_type": 422,
+}
 
 
 @app.post("/api/task")
-async def create_task(payload: TaskPayload) -> JSONResponse:
-    required_device_key = os.getenv("DEVICE_KEY")
-    if required_device_key and payload.device_key != required_device_key:
-        return JSONResponse(status_code=401, content={"status": "error", "reason": "unauthorized"})
-
-    user = DatabaseManager.get_user(payload.chat_id)
-    if not user:
-        return JSONResponse(status_code=404, content={"status": "error", "reason": "user_not_registered"})
-
-    shift = DatabaseManager.get_active_shift(user["id"])
-    if not shift:
-        if os.getenv("AUTO_START_SHIFT", "0") == "1":
-            shift_id = DatabaseManager.start_shift(user["id"])
-            shift = DatabaseManager.get_shift(shift_id)
-        else:
-            return JSONResponse(status_code=409, content={"status": "error", "reason": "no_active_shift"})
-
-    car_number = payload.car_id
-    shift_cars = DatabaseManager.get_shift_cars(shift["id"])
-    car = next((item for item in shift_cars if str(item.get("car_number", "")).strip().upper() == car_number), None)
-    if car:
-        car_db_id = int(car["id"])
-    else:
-        car_db_id = DatabaseManager.add_car(shift["id"], car_number)
-
-    service_id = resolve_service_id(payload.task_type)
-    if service_id is None:
-        return JSONResponse(status_code=422, content={"status": "error", "reason": "unknown_task_type"})
-
-    ttl_hours = max(1, int(os.getenv("DEDUPE_TTL_HOURS", "6")))
-    if is_duplicate_recent(car_db_id, service_id, ttl_hours):
+async def create_task(payload: TaskPayload, idempotency_key: str | None = Header(default=None)) -> JSONResponse:
+    if idempotency_key and not payload.idempotency_key:
+        payload.idempotency_key = idempotency_key
+    results, notifications = await run_in_threadpool(db_writer.call, ingest_task_batch, [payload], None)
+    result = results[0]
+    if result["status"] == "error":
+        return JSONResponse(
+            status_code=TASK_ERROR_STATUS.get(result["reason"], 422),
+            content={"status": "error", "reason": result["reason"]},
+        )
+    if result.get("dedup"):
         return JSONResponse(status_code=200, content={"status": "ok", "dedup": True})
 
-    service = SERVICES[service_id]
-    service_name = plain_service_name(service.get("name", ""))
-    price_mode = DatabaseManager.get_price_mode(user["id"])
-    price_key = "night_price" if price_mode == "night" else "day_price"
-    price = int(service.get(price_key, 0) or 0)
+    for notification in notifications:
+        maybe_notify_telegram(*notification)
+    return JSONResponse(status_code=200, content={"status": "ok"})
 
-    DatabaseManager.add_service_to_car(car_db_id, service_id, service_name, price)
-    maybe_notify_telegram(payload.chat_id, car_number, service_name, price)
 
-    return JSONResponse(status_code=200, content={"status": "ok"})
+@app.post("/api/tasks:batch")
+async def create_tasks_batch(payload: TaskBatchPayload) -> JSONResponse:
+    if len(payload.tasks) > TASK_BATCH_MAX:
+        return JSONResponse(status_code=413, content={"status": "error", "reason": "batch_too_large"})
+
+    results, notifications = await run_in_threadpool(db_writer.call, ingest_task_batch, payload.tasks, payload.device_key)
+    for notification in notifications:
+        maybe_notify_telegram(*notification)
+
+    counts = {"ok": 0, "dedup": 0, "error": 0}
+    for item in results:
+        counts["dedup" if item.get("dedup") else item["status"]] += 1
+    return JSONResponse(status_code=200, content={"status": "ok", "counts": counts, "results": results})
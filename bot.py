@@ -13,10 +13,6 @@ import re
 import random
 from pathlib import Path
 from typing import Any, List
-import csv
-import shutil
-from dataclasses import dataclass
-
 
 from telegram import (
     Update,
@@ -36,11 +32,42 @@ from telegram.ext import (
 )
 
 from config import BOT_TOKEN, SERVICES, validate_car_number
-from database import DatabaseManager, init_database, DB_PATH
+from database import (
+    AsyncDatabaseManager,
+    DatabaseManager,
+    DB_PATH,
+    get_next_price_boundary,
+    init_database,
+    shutdown_db_executor,
+    start_db_writer,
+)
 from exports import create_decade_pdf, create_decade_xlsx, create_month_xlsx
 from services.planning import compute_plan_metrics
+from services.broadcast import BroadcastProgress, BroadcastRunner
+from services.callback_router import CallbackDataError, CallbackRouter
 from services.dashboard_state_service import DashboardStateService
+from services.backup import BACKUP_INTERVAL_HOURS, create_backup
+from services.fanout import JOB_SEND_RATE, RateLimiter, fan_out
+from services.metrics import (
+    CALLBACK_SECONDS,
+    CALLBACKS_TOTAL,
+    MESSAGE_SECONDS,
+    MESSAGES_TOTAL,
+    Timer,
+    set_labels,
+    start_metrics_server,
+    track_job,
+)
 from services.fast_input_service import parse_fast_input, normalize_alias, is_valid_alias
+from services.leaderboard_engine import LeaderboardEngine
+from services.update_processor import UPDATE_CONCURRENCY, PerUserUpdateProcessor
+from services.report_jobs import ReportJobQueue
+from services.service_ranking import ServiceRanking
+from services.service_search import SERVICE_INDEX
+from services.status import done_status, done_status_document, edit_status, send_status
+from services.user_context import get_user_context, peek_user_context
+from services.telegram_webhook import EMBEDDED_BOT_DATA_KEY
+from services.user_settings import SETTINGS_FLUSH_SECONDS, UserSettingsStore
 from ui.nav import push_screen, pop_screen, get_current_screen, Screen
 
 # Настройка логирования
@@ -72,6 +99,13 @@ MONTH_NAMES_NOMINATIVE = {
 
 # Инициализация базы данных
 init_database()
+LEADERBOARD_ENGINE = LeaderboardEngine().attach()
+SETTINGS_STORE = UserSettingsStore().attach()
+SERVICE_RANKING = ServiceRanking().attach()
+REPORT_JOBS = ReportJobQueue()
+JOB_RATE_LIMITER = RateLimiter(JOB_SEND_RATE)
+BROADCAST_TASKS: dict[int, asyncio.Task] = {}
+CALLBACKS = CallbackRouter()
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 
@@ -98,114 +132,6 @@ def plain_service_name(name: str) -> str:
     return re.sub(r"^[^0-9A-Za-zА-Яа-я]+\s*", "", name).strip()
 
 
-FAST_SERVICE_ALIASES = {
-    1: ["проверка", "пров", "провер", "чек"],
-    2: ["заправка", "запр", "топливо", "бенз"],
-    3: ["омыв", "омывка", "омывайка", "зали", "зо", "заливка"],
-    14: ["перепарковка", "перепарк", "парковка", "некорректная", "некк", "нек", "некорр"],
-}
-
-
-@dataclass(slots=True)
-class FastServiceToken:
-    service_id: int
-    quantity: int = 1
-    half_price: bool = False
-
-
-@dataclass(slots=True)
-class FastParseResult:
-    car_number: str | None
-    services: list[FastServiceToken]
-    error_message: str = ""
-
-
-@dataclass(slots=True)
-class CacheEntry:
-    value: Any
-    expires_at: datetime
-
-
-_SHORT_CACHE_SECONDS = 20
-_LEADERBOARD_CACHE: dict[str, CacheEntry] = {}
-
-
-def _cache_get(cache: dict[str, CacheEntry], key: str) -> Any | None:
-    item = cache.get(key)
-    if not item:
-        return None
-    if item.expires_at < now_local():
-        cache.pop(key, None)
-        return None
-    return item.value
-
-
-def _cache_set(cache: dict[str, CacheEntry], key: str, value: Any, ttl_seconds: int = _SHORT_CACHE_SECONDS) -> Any:
-    cache[key] = CacheEntry(value=value, expires_at=now_local() + timedelta(seconds=ttl_seconds))
-    return value
-
-
-
-
-def get_cached_decade_leaderboard(year: int, month: int, idx: int) -> list[dict]:
-    key = f"leaders:{year:04d}-{month:02d}-d{idx}"
-    cached = _cache_get(_LEADERBOARD_CACHE, key)
-    if cached is not None:
-        return cached
-    value = DatabaseManager.get_decade_leaderboard_daily(year, month, idx)
-    return _cache_set(_LEADERBOARD_CACHE, key, value)
-
-
-def invalidate_leaderboard_cache() -> None:
-    _LEADERBOARD_CACHE.clear()
-    logger.info("leaderboard cache invalidated scope=runtime-memory")
-
-def parse_fast_car_with_services(text: str) -> FastParseResult:
-    parts = [p.strip(" ,.;:!").lower() for p in text.split() if p.strip()]
-    if not parts:
-        return FastParseResult(car_number=None, services=[], error_message="Пустое сообщение.")
-
-    is_valid, normalized, error_msg = validate_car_number(parts[0])
-    if not is_valid:
-        return FastParseResult(car_number=None, services=[], error_message=error_msg)
-
-    services: list[FastServiceToken] = []
-    unknown_tokens: list[str] = []
-    for raw in parts[1:]:
-        token = raw
-        quantity = 1
-        half_price = token.endswith("?")
-        if half_price:
-            token = token[:-1]
-
-        mult_match = re.match(r"^([а-яa-z]+)(\d+)$", token)
-        if mult_match:
-            token = mult_match.group(1)
-            quantity = max(1, int(mult_match.group(2)))
-
-        matched_service_id = None
-        for service_id, aliases in FAST_SERVICE_ALIASES.items():
-            if token in aliases:
-                matched_service_id = service_id
-                break
-
-        if not matched_service_id:
-            unknown_tokens.append(raw)
-            continue
-
-        services.append(FastServiceToken(service_id=matched_service_id, quantity=quantity, half_price=half_price))
-
-    if not services:
-        err = "Не распознал ни одной услуги. Пример: B964AH797 пров запр2 запр?"
-        if unknown_tokens:
-            err += f"\nНеизвестные токены: {', '.join(unknown_tokens[:5])}"
-        return FastParseResult(car_number=normalized, services=[], error_message=err)
-
-    if unknown_tokens:
-        logger.info("fast parse ignored tokens: %s", ", ".join(unknown_tokens))
-    return FastParseResult(car_number=normalized, services=services)
-
-
 def ensure_db_user(telegram_user) -> dict | None:
     db_user = DatabaseManager.get_user(int(telegram_user.id))
     if db_user:
@@ -221,18 +147,20 @@ async def handle_car_number_input(update: Update, context: CallbackContext, db_u
         if not is_valid:
             return False
 
-        active_shift = DatabaseManager.get_active_shift(db_user['id'])
+        active_shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])
         if not active_shift:
             if force_reply:
                 await update.message.reply_text("❌ Нет активной смены! Сначала откройте смену.")
             return False
 
-        car_id = DatabaseManager.add_car(active_shift['id'], normalized_number)
+        # повторный ввод номера открывает ту же машину смены, а не создаёт дубль
+        car = await AsyncDatabaseManager.get_or_create_car_in_shift(active_shift['id'], normalized_number)
+        car_id = car["id"]
         context.user_data.pop('awaiting_car_number', None)
         context.user_data['current_car'] = car_id
 
         try:
-            markup = create_services_keyboard(car_id, 0, False, get_price_mode(context, db_user["id"]), db_user["id"])
+            markup = create_services_keyboard(car_id, 0, False, await AsyncDatabaseManager.run(get_price_mode, context, db_user["id"]), db_user["id"])
         except Exception:
             logger.exception("create_services_keyboard failed for car_id=%s user_id=%s", car_id, db_user.get("id"))
             await update.message.reply_text(
@@ -241,7 +169,7 @@ async def handle_car_number_input(update: Update, context: CallbackContext, db_u
             return True
 
         await update.message.reply_text(
-            f"🚗 Машина: {normalized_number}\n"
+            f"🚗 Машина: {normalized_number}{'' if car['created'] else ' (уже в смене)'}\n"
             f"Выберите услуги:",
             reply_markup=markup,
         )
@@ -252,47 +180,8 @@ async def handle_car_number_input(update: Update, context: CallbackContext, db_u
         return True
 
 
-def get_mode_by_time(current_dt: datetime | None = None) -> str:
-    current = current_dt or now_local()
-    hour = current.hour
-    return "night" if hour >= 21 or hour < 9 else "day"
-
-
-def get_next_price_boundary(current_dt: datetime | None = None) -> datetime:
-    current = current_dt or now_local()
-    today_9 = current.replace(hour=9, minute=0, second=0, microsecond=0)
-    today_21 = current.replace(hour=21, minute=0, second=0, microsecond=0)
-
-    if current < today_9:
-        return today_9
-    if current < today_21:
-        return today_21
-    return (current + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
-
-
 def sync_price_mode_by_schedule(context: CallbackContext, user_id: int) -> str:
-    now_dt = now_local()
-    current_mode = DatabaseManager.get_price_mode(user_id)
-    lock_until_raw = DatabaseManager.get_price_mode_lock_until(user_id)
-    lock_until = None
-
-    if lock_until_raw:
-        try:
-            lock_until = datetime.fromisoformat(lock_until_raw)
-            if lock_until.tzinfo is None:
-                lock_until = lock_until.replace(tzinfo=LOCAL_TZ)
-        except ValueError:
-            lock_until = None
-
-    if lock_until and now_dt < lock_until:
-        context.user_data["price_mode"] = current_mode
-        return current_mode
-
-    target_mode = get_mode_by_time(now_dt)
-    if current_mode != target_mode or lock_until_raw:
-        DatabaseManager.set_price_mode(user_id, target_mode, "")
-        current_mode = target_mode
-
+    current_mode = SETTINGS_STORE.get_price_mode(user_id)
     context.user_data["price_mode"] = current_mode
     return current_mode
 
@@ -300,7 +189,7 @@ def sync_price_mode_by_schedule(context: CallbackContext, user_id: int) -> str:
 def set_manual_price_mode(context: CallbackContext, user_id: int, mode: str) -> str:
     normalized_mode = "night" if mode == "night" else "day"
     next_boundary = get_next_price_boundary(now_local())
-    DatabaseManager.set_price_mode(user_id, normalized_mode, next_boundary.isoformat())
+    SETTINGS_STORE.set_price_mode(user_id, normalized_mode, next_boundary.isoformat())
     context.user_data["price_mode"] = normalized_mode
     return normalized_mode
 
@@ -360,7 +249,10 @@ def subscription_expires_at_for_user(db_user: dict | None) -> datetime | None:
         return None
     if is_admin_telegram(int(db_user["telegram_id"])):
         return None
-    raw = DatabaseManager.get_subscription_expires_at(db_user["id"])
+    return parse_subscription_expires_at(DatabaseManager.get_subscription_expires_at(db_user["id"]))
+
+
+def parse_subscription_expires_at(raw: str) -> datetime | None:
     if not raw:
         return None
     try:
@@ -395,23 +287,40 @@ def is_subscription_active(db_user: dict | None) -> bool:
 
 
 def resolve_user_access(telegram_id: int, context: CallbackContext | None = None) -> tuple[dict | None, bool, bool]:
-    if is_user_banned_telegram(telegram_id):
+    user_context = get_user_context(context, telegram_id)
+    if user_context.banned:
         return None, True, False
 
-    db_user = DatabaseManager.get_user(telegram_id)
+    db_user = dict(user_context.user) if user_context.user else None
     if not db_user:
         return None, False, False
 
-    blocked = is_user_blocked(db_user)
-    if blocked:
+    if user_context.is_blocked:
         return db_user, True, False
 
     if context is not None:
         sync_price_mode_by_schedule(context, db_user["id"])
 
-    ensure_trial_subscription(db_user)
-    subscription_active = is_subscription_active(db_user)
-    return db_user, False, subscription_active
+    if is_admin_telegram(telegram_id):
+        return db_user, False, True
+    expires = parse_subscription_expires_at(user_context.subscription_expires_at) or ensure_trial_subscription(db_user)
+    return db_user, False, bool(expires and now_local() <= expires)
+
+
+def get_db_user(context: CallbackContext | None, telegram_id: int) -> dict | None:
+    """Пользователь из контекста текущего апдейта; без него — запрос к БД."""
+    user_context = peek_user_context(context, telegram_id=telegram_id)
+    if user_context is not None:
+        return dict(user_context.user) if user_context.user else None
+    return DatabaseManager.get_user(telegram_id)
+
+
+def get_current_shift(context: CallbackContext | None, user_id: int) -> dict | None:
+    """Активная смена из контекста текущего апдейта; без него — запрос к БД."""
+    user_context = peek_user_context(context, user_id=user_id)
+    if user_context is not None:
+        return dict(user_context.active_shift) if user_context.active_shift else None
+    return DatabaseManager.get_active_shift(user_id)
 
 
 def main_menu_for_db_user(db_user: dict | None, subscription_active: bool | None = None) -> ReplyKeyboardMarkup:
@@ -424,7 +333,7 @@ def main_menu_for_db_user(db_user: dict | None, subscription_active: bool | None
 
 
 def build_settings_keyboard(db_user: dict | None, is_admin: bool) -> InlineKeyboardMarkup:
-    decade_goal_enabled = bool(db_user and DatabaseManager.is_goal_enabled(db_user["id"]))
+    decade_goal_enabled = bool(db_user and SETTINGS_STORE.is_goal_enabled(db_user["id"]))
     decade_label = "📆 Цель декады: ВКЛ" if decade_goal_enabled else "📆 Цель декады: ВЫКЛ"
     keyboard = [
         [InlineKeyboardButton(decade_label, callback_data="change_decade_goal")],
@@ -476,16 +385,11 @@ def activate_subscription_days(user_id: int, days: int) -> datetime:
 
 def ensure_trial_for_existing_users() -> list[dict]:
     activated = []
-    for row in DatabaseManager.get_all_users_with_stats():
+    for row in DatabaseManager.get_users_without_subscription():
         if is_admin_telegram(int(row["telegram_id"])):
             continue
-        user_db = DatabaseManager.get_user_by_id(int(row["id"]))
-        if not user_db:
-            continue
-        if subscription_expires_at_for_user(user_db):
-            continue
-        expires = activate_subscription_days(user_db["id"], TRIAL_DAYS)
-        activated.append({"id": user_db["id"], "telegram_id": user_db["telegram_id"], "expires_at": expires})
+        expires = activate_subscription_days(row["id"], TRIAL_DAYS)
+        activated.append({"id": row["id"], "telegram_id": row["telegram_id"], "expires_at": expires})
     return activated
 
 
@@ -543,9 +447,9 @@ def build_work_calendar_keyboard(db_user: dict, year: int, month: int, setup_mod
 
     keyboard: list[list[InlineKeyboardButton]] = []
     keyboard.append([
-        InlineKeyboardButton("◀️", callback_data=f"calendar_nav_{year}_{month}_prev"),
+        InlineKeyboardButton("◀️", callback_data=CALLBACKS.encode("kn", year=year, month=month, direction="prev")),
         InlineKeyboardButton(month_title(year, month), callback_data="noop"),
-        InlineKeyboardButton("▶️", callback_data=f"calendar_nav_{year}_{month}_next"),
+        InlineKeyboardButton("▶️", callback_data=CALLBACKS.encode("kn", year=year, month=month, direction="next")),
     ])
 
     weekday_header = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
@@ -562,7 +466,7 @@ def build_work_calendar_keyboard(db_user: dict, year: int, month: int, setup_mod
             day_key = current_day.isoformat()
             if setup_mode:
                 mark = "✅" if day_key in setup_selected else "▫️"
-                row.append(InlineKeyboardButton(f"{mark}{day:02d}", callback_data=f"calendar_setup_pick_{day_key}"))
+                row.append(InlineKeyboardButton(f"{mark}{day:02d}", callback_data=CALLBACKS.encode("kp", day=day_key)))
                 continue
 
             day_type = get_work_day_type(db_user, current_day, overrides)
@@ -571,17 +475,17 @@ def build_work_calendar_keyboard(db_user: dict, year: int, month: int, setup_mod
             if day_key in shifts_days and day_type == "off" and overrides.get(day_key) != "off":
                 day_type = "extra"
             prefix = "🔴" if day_type == "planned" else ("🟡" if day_type == "extra" else "⚪")
-            row.append(InlineKeyboardButton(f"{prefix}{day:02d}", callback_data=f"calendar_day_{day_key}"))
+            row.append(InlineKeyboardButton(f"{prefix}{day:02d}", callback_data=CALLBACKS.encode("kd", day=day_key)))
         keyboard.append(row)
 
     if setup_mode:
-        keyboard.append([InlineKeyboardButton("✅ Сохранить базовые дни", callback_data=f"calendar_setup_save_{year}_{month}")])
+        keyboard.append([InlineKeyboardButton("✅ Сохранить базовые дни", callback_data=CALLBACKS.encode("kv", year=year, month=month))])
         keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="back")])
     else:
         edit_label = "✏️ Редакт.: ВКЛ" if edit_mode else "✏️ Редакт.: ВЫКЛ"
         keyboard.append([
             InlineKeyboardButton("🗓️ Изменить смены", callback_data="calendar_rebase"),
-            InlineKeyboardButton(edit_label, callback_data=f"calendar_edit_toggle_{year}_{month}"),
+            InlineKeyboardButton(edit_label, callback_data=CALLBACKS.encode("ke", year=year, month=month)),
         ])
         keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
     return InlineKeyboardMarkup(keyboard)
@@ -778,52 +682,24 @@ def create_tools_reply_keyboard(is_admin: bool = False) -> ReplyKeyboardMarkup:
     )
 
 def get_service_order(user_id: int | None = None) -> List[int]:
-    visible = [
-        (service_id, service)
-        for service_id, service in SERVICES.items()
-        if not service.get("hidden")
-    ]
-
-    usage = DatabaseManager.get_user_service_usage(user_id) if user_id else {}
-    visible.sort(
-        key=lambda item: (
-            -usage.get(item[0], 0),
-            item[1].get("priority", 999),
-            item[1].get("order", 999),
-            item[0],
-        )
-    )
-    return [service_id for service_id, _ in visible]
+    return list(SERVICE_RANKING.order(user_id))
 
 def chunk_buttons(buttons: List[InlineKeyboardButton], columns: int) -> List[List[InlineKeyboardButton]]:
     return [buttons[i:i + columns] for i in range(0, len(buttons), columns)]
 
 
-def create_services_keyboard(
-    car_id: int,
-    page: int = 0,
-    is_edit_mode: bool = False,
-    mode: str = "day",
-    user_id: int | None = None,
-    history_day: str | None = None,
-) -> InlineKeyboardMarkup:
-    """Клавиатура выбора услуг (3 колонки, 12 услуг на страницу)."""
-    service_ids = get_service_order(user_id)
-
+def build_services_page_layout(service_ids, page: int) -> tuple[int, int, tuple[tuple[int, str], ...]]:
+    """Страница клавиатуры услуг без привязки к машине: (страница, последняя страница, кнопки)."""
     per_page = 12
     max_page = max((len(service_ids) - 1) // per_page, 0)
     page = max(0, min(page, max_page))
 
-    start = page * per_page
-    end = start + per_page
-    page_ids = service_ids[start:end]
-
     def compact(text: str, limit: int = 14) -> str:
         value = (text or "").strip()
         return value if len(value) <= limit else (value[:limit - 1] + "…")
 
-    buttons = []
-    for service_id in page_ids:
+    items = []
+    for service_id in service_ids[page * per_page:(page + 1) * per_page]:
         service = SERVICES[service_id]
         clean_name = plain_service_name(service['name'])
         if service.get("kind") == "group":
@@ -832,33 +708,52 @@ def create_services_keyboard(
             text = "Дальняк"
         else:
             text = clean_name
-        buttons.append(InlineKeyboardButton(compact(text), callback_data=f"service_{service_id}_{car_id}_{page}"))
+        items.append((service_id, compact(text)))
+    return page, max_page, tuple(items)
+
+
+def create_services_keyboard(
+    car_id: int,
+    page: int = 0,
+    is_edit_mode: bool = False,
+    mode: str = "day",
+    user_id: int | None = None,
+    history_day: str | None = None,
+) -> InlineKeyboardMarkup:
+    """Клавиатура выбора услуг (3 колонки, 12 услуг на страницу)."""
+    page, max_page, page_items = SERVICE_RANKING.layout(
+        user_id, (page, mode, is_edit_mode), lambda order: build_services_page_layout(order, page)
+    )
+    buttons = [
+        InlineKeyboardButton(text, callback_data=CALLBACKS.encode("sv", service_id=service_id, car_id=car_id, page=page))
+        for service_id, text in page_items
+    ]
 
     keyboard = []
 
     keyboard.append([
-        InlineKeyboardButton("🧩 Комбо", callback_data=f"combo_menu_{car_id}_{page}_0")
+        InlineKeyboardButton("🧩 Комбо", callback_data=CALLBACKS.encode("cm", car_id=car_id, page=page))
     ])
 
     keyboard.extend(chunk_buttons(buttons, 3))
 
     nav = [InlineKeyboardButton(f"Стр {page + 1}/{max_page + 1}", callback_data="noop")]
     if page > 0:
-        nav.insert(0, InlineKeyboardButton("⬅️ Назад", callback_data=f"service_page_{car_id}_{page-1}"))
+        nav.insert(0, InlineKeyboardButton("⬅️ Назад", callback_data=CALLBACKS.encode("sp", car_id=car_id, page=page - 1)))
     if page < max_page:
-        nav.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"service_page_{car_id}_{page+1}"))
+        nav.append(InlineKeyboardButton("Вперед ➡️", callback_data=CALLBACKS.encode("sp", car_id=car_id, page=page + 1)))
     keyboard.append(nav)
 
     keyboard.append([
-        InlineKeyboardButton("🔎 Поиск", callback_data=f"service_search_{car_id}_{page}"),
-        InlineKeyboardButton("🧹 Очистить", callback_data=f"clear_{car_id}_{page}"),
-        InlineKeyboardButton("💾 Сохранить", callback_data=f"save_{car_id}"),
+        InlineKeyboardButton("🔎 Поиск", callback_data=CALLBACKS.encode("ss", car_id=car_id, page=page)),
+        InlineKeyboardButton("🧹 Очистить", callback_data=CALLBACKS.encode("cl", car_id=car_id, page=page)),
+        InlineKeyboardButton("💾 Сохранить", callback_data=CALLBACKS.encode("sa", car_id=car_id)),
     ])
 
     if history_day:
         keyboard.append([
-            InlineKeyboardButton("🗑️ Удалить машину", callback_data=f"delcar_{car_id}_{history_day}"),
-            InlineKeyboardButton("🔙 К машинам дня", callback_data=f"cleanup_day_{history_day}"),
+            InlineKeyboardButton("🗑️ Удалить машину", callback_data=CALLBACKS.encode("dx", car_id=car_id, day=history_day)),
+            InlineKeyboardButton("🔙 К машинам дня", callback_data=CALLBACKS.encode("ud", day=history_day)),
         ])
 
     return InlineKeyboardMarkup(keyboard)
@@ -1155,7 +1050,7 @@ def build_period_summary_text(user_id: int, start_d: date, end_d: date, title: s
     return "\n".join(lines)
 
 def get_goal_text(user_id: int) -> str:
-    if not DatabaseManager.is_goal_enabled(user_id):
+    if not SETTINGS_STORE.is_goal_enabled(user_id):
         return ""
 
     snapshot = DashboardStateService.build_snapshot(user_id)
@@ -1226,7 +1121,7 @@ def calculate_current_decade_shift_plan(db_user: dict) -> dict:
 
 
 def init_shift_target(db_user: dict, shift_id: int) -> int:
-    if not DatabaseManager.is_goal_enabled(db_user["id"]):
+    if not SETTINGS_STORE.is_goal_enabled(db_user["id"]):
         DatabaseManager.set_shift_target(shift_id, 0)
         return 0
     shift_target = calculate_current_decade_shift_target(db_user)
@@ -1266,39 +1161,9 @@ def build_decade_summary(user_id: int) -> str:
     return "\n".join(lines)
 
 
-def build_csv_report(user_id: int) -> str:
-    rows = DatabaseManager.get_shift_report_rows(user_id)
-    if not rows:
-        return ""
-
-    reports_dir = "reports"
-    os.makedirs(reports_dir, exist_ok=True)
-    filename = f"report_{now_local().strftime('%Y%m%d_%H%M%S')}.csv"
-    path = os.path.join(reports_dir, filename)
-
-    with open(path, "w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["shift_id", "start_time", "end_time", "car_number", "services", "total_amount"])
-        for row in rows:
-            writer.writerow([
-                row.get("shift_id"),
-                row.get("start_time"),
-                row.get("end_time") or "",
-                row.get("car_number") or "",
-                row.get("services") or "",
-                row.get("total_amount") or 0,
-            ])
-    return path
-
 def create_db_backup() -> str:
-    if not os.path.exists(DB_PATH):
-        return ""
-    backups_dir = "backups"
-    os.makedirs(backups_dir, exist_ok=True)
-    filename = f"backup_{now_local().strftime('%Y%m%d_%H%M%S')}.db"
-    path = os.path.join(backups_dir, filename)
-    shutil.copy2(DB_PATH, path)
-    return path
+    result = create_backup(DB_PATH)
+    return result.path if result else ""
 
 async def ensure_goal_message_pinned(context: CallbackContext, chat_id: int, message_id: int) -> None:
     """Пытаемся закрепить сообщение с целью в любом чате, где это поддерживается."""
@@ -1315,7 +1180,7 @@ async def ensure_goal_message_pinned(context: CallbackContext, chat_id: int, mes
 
 async def send_goal_status(update: Update | None, context: CallbackContext, user_id: int, source_message=None):
     """Обновить закреп по цели, только если цель включена пользователем."""
-    goal_text = get_goal_text(user_id)
+    goal_text = await AsyncDatabaseManager.run(get_goal_text, user_id)
     if not goal_text:
         return
 
@@ -1326,7 +1191,7 @@ async def send_goal_status(update: Update | None, context: CallbackContext, user
         return
 
     chat_id = source_message.chat_id
-    bind_chat_id, bind_message_id = DatabaseManager.get_goal_message_binding(user_id)
+    bind_chat_id, bind_message_id = await AsyncDatabaseManager.run(SETTINGS_STORE.get_goal_message_binding, user_id)
 
     if bind_chat_id and int(bind_chat_id) != int(chat_id):
         chat_id = int(bind_chat_id)
@@ -1348,9 +1213,9 @@ async def send_goal_status(update: Update | None, context: CallbackContext, user
                 await context.bot.delete_message(chat_id=bind_chat_id, message_id=bind_message_id)
             except Exception:
                 pass
-            DatabaseManager.clear_goal_message_binding(user_id)
+            await AsyncDatabaseManager.run(SETTINGS_STORE.clear_goal_message_binding, user_id)
         except Exception:
-            DatabaseManager.clear_goal_message_binding(user_id)
+            await AsyncDatabaseManager.run(SETTINGS_STORE.clear_goal_message_binding, user_id)
 
     # если биндинг есть, но сообщение удалено/не доступно — пытаемся опубликовать в том же чате
     target_chat_id = int(bind_chat_id) if bind_chat_id else int(chat_id)
@@ -1367,12 +1232,12 @@ async def send_goal_status(update: Update | None, context: CallbackContext, user
         send_target = _ChatProxy(context.bot, target_chat_id)
 
     message = await send_target.reply_text(goal_text)
-    DatabaseManager.set_goal_message_binding(user_id, target_chat_id, message.message_id)
+    await AsyncDatabaseManager.run(SETTINGS_STORE.set_goal_message_binding, user_id, target_chat_id, message.message_id)
     await ensure_goal_message_pinned(context, message.chat_id, message.message_id)
 
 
 async def disable_goal_status(context: CallbackContext, user_id: int) -> None:
-    chat_id, message_id = DatabaseManager.get_goal_message_binding(user_id)
+    chat_id, message_id = await AsyncDatabaseManager.run(SETTINGS_STORE.get_goal_message_binding, user_id)
     if chat_id and message_id:
         try:
             await context.bot.unpin_chat_message(chat_id=chat_id, message_id=message_id)
@@ -1382,7 +1247,7 @@ async def disable_goal_status(context: CallbackContext, user_id: int) -> None:
             await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
         except Exception:
             pass
-    DatabaseManager.clear_goal_message_binding(user_id)
+    await AsyncDatabaseManager.run(SETTINGS_STORE.clear_goal_message_binding, user_id)
 
 # ========== ОСНОВНЫЕ КОМАНДЫ ==========
 
@@ -1391,32 +1256,32 @@ async def start_command(update: Update, context: CallbackContext):
     user = update.effective_user
 
     if update.message:
-        if is_user_banned_telegram(user.id):
+        if await AsyncDatabaseManager.run(is_user_banned_telegram, user.id):
             await update.message.reply_text("⛔ Ваш профиль заблокирован навсегда. Доступ к боту закрыт.")
             return
 
-        db_user = DatabaseManager.get_user(user.id)
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
 
         is_new_user = False
         if not db_user:
             name = " ".join(part for part in [user.first_name, user.last_name] if part) or user.username or "Пользователь"
-            DatabaseManager.register_user(user.id, name)
-            db_user = DatabaseManager.get_user(user.id)
+            await AsyncDatabaseManager.register_user(user.id, name)
+            db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
             is_new_user = True
 
         if not db_user:
             await update.message.reply_text("❌ Не удалось зарегистрировать пользователя. Повторите /start")
             return
-        if is_user_blocked(db_user):
+        if await AsyncDatabaseManager.run(is_user_blocked, db_user):
             await update.message.reply_text("⛔ Доступ к боту закрыт администратором.")
             return
 
-        expires_at = ensure_trial_subscription(db_user)
-        subscription_active = is_subscription_active(db_user)
+        expires_at = await AsyncDatabaseManager.write(ensure_trial_subscription, db_user)
+        subscription_active = await AsyncDatabaseManager.run(is_subscription_active, db_user)
 
-        context.user_data["price_mode"] = sync_price_mode_by_schedule(context, db_user["id"])
+        context.user_data["price_mode"] = await AsyncDatabaseManager.run(sync_price_mode_by_schedule, context, db_user["id"])
 
-        has_active = DatabaseManager.get_active_shift(db_user['id']) is not None
+        has_active = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']) is not None
 
         if is_new_user and not is_admin_telegram(user.id):
             await update.message.reply_text(
@@ -1443,7 +1308,7 @@ async def start_command(update: Update, context: CallbackContext):
 
 async def menu_command(update: Update, context: CallbackContext):
     user = update.effective_user
-    db_user, blocked, subscription_active = resolve_user_access(user.id, context)
+    db_user, blocked, subscription_active = await AsyncDatabaseManager.run(resolve_user_access, user.id, context)
     if not db_user:
         await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
         return
@@ -1459,7 +1324,7 @@ async def menu_command(update: Update, context: CallbackContext):
 
     await update.message.reply_text(
         "Главное меню открыто.",
-        reply_markup=main_menu_for_db_user(db_user, subscription_active)
+        reply_markup=await AsyncDatabaseManager.run(main_menu_for_db_user, db_user, subscription_active)
     )
     await send_period_reports_for_user(context.application, db_user)
 
@@ -1479,11 +1344,11 @@ def create_tools_inline_keyboard(is_admin: bool = False) -> InlineKeyboardMarkup
 
 
 async def shift_hub_message(update: Update, context: CallbackContext):
-    db_user = DatabaseManager.get_user(update.effective_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
     if not db_user:
         await update.message.reply_text("❌ Пользователь не найден. Напиши /start")
         return
-    if DatabaseManager.get_active_shift(db_user['id']):
+    if await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']):
         await current_shift_message(update, context)
     else:
         await open_shift_message(update, context)
@@ -1513,11 +1378,11 @@ async def help_hub_message(update: Update, context: CallbackContext):
 
 
 async def nav_shift_callback(query, context):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
-    if DatabaseManager.get_active_shift(db_user['id']):
+    if await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']):
         await current_shift(query, context)
     else:
         await open_shift(query, context)
@@ -1538,7 +1403,7 @@ async def nav_help_callback(query, context):
     await query.edit_message_text(
         "❓ FAQ\n\n"
         "Выбери раздел с ответами и гайдами по работе с ботом.",
-        reply_markup=create_faq_topics_keyboard(get_faq_topics(), is_admin=is_admin_telegram(query.from_user.id)),
+        reply_markup=create_faq_topics_keyboard(await AsyncDatabaseManager.run(get_faq_topics), is_admin=is_admin_telegram(query.from_user.id)),
     )
 
 async def nav_navigator_callback(query, context):
@@ -1551,7 +1416,7 @@ async def nav_navigator_callback(query, context):
 
 async def handle_media_message(update: Update, context: CallbackContext):
     user = update.effective_user
-    db_user_for_access, blocked, _ = resolve_user_access(user.id, context)
+    db_user_for_access, blocked, _ = await AsyncDatabaseManager.run(resolve_user_access, user.id, context)
     if blocked:
         return
 
@@ -1562,16 +1427,16 @@ async def handle_media_message(update: Update, context: CallbackContext):
             if not photo:
                 await update.message.reply_text("Пришлите фото (изображение).")
                 return
-            set_section_photo_file_id(section, photo.file_id)
+            await AsyncDatabaseManager.write(set_section_photo_file_id, section, photo.file_id)
             context.user_data.pop("awaiting_admin_section_photo", None)
             await update.message.reply_text("✅ Фото сохранено для раздела.")
             return
 
         if context.user_data.get("awaiting_admin_faq_video") and update.message.video:
             video = update.message.video
-            DatabaseManager.set_app_content("faq_video_file_id", video.file_id)
-            DatabaseManager.set_app_content("faq_video_source_chat_id", str(update.message.chat_id))
-            DatabaseManager.set_app_content("faq_video_source_message_id", str(update.message.message_id))
+            await AsyncDatabaseManager.set_app_content("faq_video_file_id", video.file_id)
+            await AsyncDatabaseManager.set_app_content("faq_video_source_chat_id", str(update.message.chat_id))
+            await AsyncDatabaseManager.set_app_content("faq_video_source_message_id", str(update.message.message_id))
             context.user_data.pop("awaiting_admin_faq_video", None)
             await update.message.reply_text("✅ Видео FAQ обновлено. Пользователи будут получать его как полноценное видео.")
             return
@@ -1582,144 +1447,70 @@ async def handle_message(update: Update, context: CallbackContext):
     """Обработка текстовых сообщений"""
     user = update.effective_user
     text = (update.message.text or "").strip()
-    db_user_for_access, blocked, subscription_active = resolve_user_access(user.id, context)
+    db_user_for_access, blocked, subscription_active = await AsyncDatabaseManager.run(resolve_user_access, user.id, context)
     if not db_user_for_access:
-        db_user_for_access = ensure_db_user(user)
+        db_user_for_access = await AsyncDatabaseManager.run(ensure_db_user, user)
         if db_user_for_access:
-            subscription_active = is_subscription_active(db_user_for_access)
+            subscription_active = await AsyncDatabaseManager.run(is_subscription_active, db_user_for_access)
     if blocked:
+        set_labels(branch="blocked")
         await update.message.reply_text("⛔ Доступ к боту закрыт администратором.")
         return
 
-    # Быстрый ввод: "номер + alias комбо/услуг"
+    # Быстрый ввод: "номер + alias комбо/услуг" ("В964АН797 пров запр3 зо")
     if db_user_for_access and subscription_active:
-        active_shift = DatabaseManager.get_active_shift(db_user_for_access['id'])
+        active_shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user_for_access['id'])
         if active_shift:
-            parsed = parse_fast_input(text, db_user_for_access['id'], FAST_SERVICE_ALIASES)
-            if parsed.car_number and parsed.service_ids:
-                car_id = DatabaseManager.add_car(active_shift['id'], parsed.car_number)
-                mode = get_price_mode(context, db_user_for_access["id"])
-                total_qty = 0
-                for sid in parsed.service_ids:
-                    service = SERVICES.get(int(sid))
+            parsed = await AsyncDatabaseManager.run(parse_fast_input, text, db_user_for_access['id'])
+            if parsed.car_number and parsed.services:
+                set_labels(branch="fast_input")
+                mode = await AsyncDatabaseManager.run(get_price_mode, context, db_user_for_access["id"])
+                items = []
+                for token in parsed.services:
+                    service = SERVICES.get(token.service_id)
                     if not service or service.get('kind') in {'group', 'distance'}:
                         continue
-                    DatabaseManager.add_service_to_car(
-                        car_id,
-                        int(sid),
-                        plain_service_name(service['name']),
-                        get_current_price(int(sid), mode),
-                    )
-                    total_qty += 1
+                    base_price = get_current_price(token.service_id, mode)
+                    price = max(0, base_price // 2) if token.half_price else base_price
+                    items.append((token.service_id, plain_service_name(service['name']), price, token.quantity))
+                total_qty = sum(item[3] for item in items)
 
-                car = DatabaseManager.get_car(car_id)
+                car = await AsyncDatabaseManager.add_car_with_services(active_shift['id'], parsed.car_number, items)
                 note = f"\nНе распознано: {', '.join(parsed.unknown_tokens)}" if parsed.unknown_tokens else ""
                 await update.message.reply_text(
                     f"🚗 Быстро добавлено: {parsed.car_number}\n"
                     f"Услуг: {total_qty}\n"
-                    f"Сумма: {format_money(int(car['total_amount']) if car else 0)}{note}"
+                    f"Сумма: {format_money(int(car['total_amount']))}{note}"
                 )
                 try:
                     await send_goal_status(update, context, db_user_for_access['id'])
                 except Exception:
                     logger.exception("send_goal_status failed in fast add for user_id=%s", db_user_for_access.get("id"))
                 return
-            if parsed.car_number and not parsed.service_ids and len(text.split()) > 1:
-                detail = f"\nНераспознанные токены: {', '.join(parsed.unknown_tokens)}" if parsed.unknown_tokens else ""
-                await update.message.reply_text(f"❌ {parsed.error_message}{detail}")
-                return
-
-    if is_admin_telegram(user.id) and db_user_for_access:
-        section = context.user_data.get("awaiting_admin_section_photo")
-        if section:
-            photo = update.message.photo[-1] if update.message.photo else None
-            if not photo:
-                await update.message.reply_text("Пришлите фото (изображение).")
-                return
-            set_section_photo_file_id(section, photo.file_id)
-            context.user_data.pop("awaiting_admin_section_photo", None)
-            await update.message.reply_text("✅ Фото сохранено для раздела.")
-            return
-
-        if context.user_data.get("awaiting_admin_faq_video") and update.message.video:
-            video = update.message.video
-            DatabaseManager.set_app_content("faq_video_file_id", video.file_id)
-            DatabaseManager.set_app_content("faq_video_source_chat_id", str(update.message.chat_id))
-            DatabaseManager.set_app_content("faq_video_source_message_id", str(update.message.message_id))
-            context.user_data.pop("awaiting_admin_faq_video", None)
-            await update.message.reply_text("✅ Видео FAQ обновлено. Пользователи будут получать его как полноценное видео.")
-            return
-
-
-
-async def handle_message(update: Update, context: CallbackContext):
-    """Обработка текстовых сообщений"""
-    user = update.effective_user
-    text = (update.message.text or "").strip()
-    db_user_for_access, blocked, subscription_active = resolve_user_access(user.id, context)
-    if not db_user_for_access:
-        db_user_for_access = ensure_db_user(user)
-        if db_user_for_access:
-            subscription_active = is_subscription_active(db_user_for_access)
-    if blocked:
-        await update.message.reply_text("⛔ Доступ к боту закрыт администратором.")
-        return
-
-    # Быстрый ввод: "номер + сокращения услуг"
-    if db_user_for_access and subscription_active:
-        active_shift = DatabaseManager.get_active_shift(db_user_for_access['id'])
-        if active_shift:
-            fast = parse_fast_car_with_services(text)
-            if fast.car_number and fast.services:
-                car_id = DatabaseManager.add_car(active_shift['id'], fast.car_number)
-                mode = get_price_mode(context, db_user_for_access["id"])
-                total_qty = 0
-                for parsed in fast.services:
-                    service = SERVICES.get(parsed.service_id)
-                    if not service:
-                        continue
-                    base_price = get_current_price(parsed.service_id, mode)
-                    price = max(0, base_price // 2) if parsed.half_price else base_price
-                    for _ in range(parsed.quantity):
-                        DatabaseManager.add_service_to_car(
-                            car_id,
-                            parsed.service_id,
-                            plain_service_name(service['name']),
-                            price,
-                        )
-                        total_qty += 1
-
-                car = DatabaseManager.get_car(car_id)
-                await update.message.reply_text(
-                    f"🚗 Быстро добавлено: {fast.car_number}\n"
-                    f"Услуг: {total_qty}\n"
-                    f"Сумма: {format_money(int(car['total_amount']) if car else 0)}"
-                )
-                try:
-                    await send_goal_status(update, context, db_user_for_access['id'])
-                except Exception:
-                    logger.exception("send_goal_status failed in fast add for user_id=%s", db_user_for_access.get("id"))
-                return
-            if fast.car_number and not fast.services and len(text.split()) > 1:
-                await update.message.reply_text(f"❌ {fast.error_message}")
+            if parsed.car_number and not parsed.services and len(text.split()) > 1:
+                set_labels(branch="fast_input_error")
+                detail = f"\nНераспознанные токены: {', '.join(parsed.unknown_tokens[:5])}" if parsed.unknown_tokens else ""
+                await update.message.reply_text(f"❌ {parsed.error_message}{detail}\nПример: B964AH797 пров запр2 запр?")
                 return
 
     if is_admin_telegram(user.id) and db_user_for_access:
         if await process_admin_broadcast(update, context, db_user_for_access):
+            set_labels(branch="admin_broadcast")
             return
 
         awaiting_days_for_user = context.user_data.get("awaiting_admin_subscription_days")
         if awaiting_days_for_user:
+            set_labels(branch="admin_subscription_days")
             raw_days = text.strip()
             if not raw_days.isdigit() or int(raw_days) <= 0:
                 await update.message.reply_text("Введите количество дней числом, например: 30")
                 return
-            target_user = DatabaseManager.get_user_by_id(int(awaiting_days_for_user))
+            target_user = await AsyncDatabaseManager.get_user_by_id(int(awaiting_days_for_user))
             context.user_data.pop("awaiting_admin_subscription_days", None)
             if not target_user:
                 await update.message.reply_text("❌ Пользователь не найден")
                 return
-            expires = activate_subscription_days(target_user["id"], int(raw_days))
+            expires = await AsyncDatabaseManager.write(activate_subscription_days, target_user["id"], int(raw_days))
             await update.message.reply_text(
                 f"✅ Подписка активирована на {int(raw_days)} дн. (до {format_subscription_until(expires)})."
             )
@@ -1737,11 +1528,13 @@ async def handle_message(update: Update, context: CallbackContext):
             return
 
         if context.user_data.pop("awaiting_admin_faq_text", None):
-            DatabaseManager.set_app_content("faq_text", update.message.text.strip())
+            set_labels(branch="admin_faq")
+            await AsyncDatabaseManager.set_app_content("faq_text", update.message.text.strip())
             await update.message.reply_text("✅ Текст FAQ обновлён.")
             return
 
         if context.user_data.pop("awaiting_admin_faq_topic_add", None):
+            set_labels(branch="admin_faq")
             if "|" not in text:
                 await update.message.reply_text("Неверный формат. Используйте: Тема | Текст ответа")
                 return
@@ -1749,20 +1542,21 @@ async def handle_message(update: Update, context: CallbackContext):
             if not title or not body:
                 await update.message.reply_text("И тема, и текст ответа должны быть заполнены.")
                 return
-            topics = get_faq_topics()
+            topics = await AsyncDatabaseManager.run(get_faq_topics)
             topic_id = str(int(now_local().timestamp() * 1000))
             topics.append({"id": topic_id, "title": title, "text": body})
-            save_faq_topics(topics)
+            await AsyncDatabaseManager.write(save_faq_topics, topics)
             await update.message.reply_text(f"✅ Тема добавлена: {title}")
             return
 
         editing_topic_id = context.user_data.get("awaiting_admin_faq_topic_edit")
         if editing_topic_id:
+            set_labels(branch="admin_faq")
             if "|" not in text:
                 await update.message.reply_text("Неверный формат. Используйте: Новое название | Новый текст")
                 return
             title, body = [part.strip() for part in text.split("|", 1)]
-            topics = get_faq_topics()
+            topics = await AsyncDatabaseManager.run(get_faq_topics)
             updated = False
             for topic in topics:
                 if topic["id"] == editing_topic_id:
@@ -1774,7 +1568,7 @@ async def handle_message(update: Update, context: CallbackContext):
             if not updated:
                 await update.message.reply_text("❌ Тема не найдена.")
                 return
-            save_faq_topics(topics)
+            await AsyncDatabaseManager.write(save_faq_topics, topics)
             await update.message.reply_text("✅ Тема FAQ обновлена.")
             return
 
@@ -1797,6 +1591,7 @@ async def handle_message(update: Update, context: CallbackContext):
 
     # Ожидание номера машины (FSM-подсказка, но не обязательна)
     if context.user_data.get('awaiting_car_number'):
+        set_labels(branch="awaiting_car_number")
         if not db_user_for_access:
             await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
             context.user_data.pop('awaiting_car_number', None)
@@ -1814,6 +1609,7 @@ async def handle_message(update: Update, context: CallbackContext):
         return
 
     if context.user_data.get("awaiting_decade_goal"):
+        set_labels(branch="decade_goal")
 
         raw_value = text.replace(" ", "").replace("₽", "")
         if not raw_value.isdigit():
@@ -1821,25 +1617,26 @@ async def handle_message(update: Update, context: CallbackContext):
             await update.message.reply_text("❌ Ввод цели отменён: нужно было ввести только цифры.")
             return
         goal_value = int(raw_value)
-        db_user = DatabaseManager.get_user(user.id)
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
         if not db_user:
             await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
             return
-        DatabaseManager.set_decade_goal(db_user["id"], goal_value)
-        DatabaseManager.set_goal_enabled(db_user["id"], True)
+        await AsyncDatabaseManager.set_decade_goal(db_user["id"], goal_value)
+        await AsyncDatabaseManager.run(SETTINGS_STORE.set_goal_enabled, db_user["id"], True)
         context.user_data.pop("awaiting_decade_goal", None)
-        has_active = DatabaseManager.get_active_shift(db_user['id']) is not None
+        has_active = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']) is not None
         await update.message.reply_text(
             "✅ Цель смены обновлена.",
             reply_markup=create_main_reply_keyboard(has_active)
         )
-        active_shift = DatabaseManager.get_active_shift(db_user["id"])
+        active_shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user["id"])
         if active_shift:
-            init_shift_target(db_user, int(active_shift["id"]))
+            await AsyncDatabaseManager.write(init_shift_target, db_user, int(active_shift["id"]))
         await send_goal_status(update, context, db_user['id'])
         return
 
     if context.user_data.get("awaiting_profile_name"):
+        set_labels(branch="profile_name")
         new_name = text.strip()
         if not new_name:
             await update.message.reply_text("❌ Имя не может быть пустым. Попробуй ещё раз.")
@@ -1847,28 +1644,28 @@ async def handle_message(update: Update, context: CallbackContext):
         new_name = " ".join(new_name.split())
         if len(new_name) > 32:
             new_name = new_name[:32].rstrip()
-        db_user = DatabaseManager.get_user(user.id)
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
         if not db_user:
             context.user_data.pop("awaiting_profile_name", None)
             await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
             return
-        DatabaseManager.update_user_name(db_user["id"], new_name)
+        await AsyncDatabaseManager.update_user_name(db_user["id"], new_name)
         context.user_data.pop("awaiting_profile_name", None)
-        updated = DatabaseManager.get_user(user.id)
+        updated = await AsyncDatabaseManager.run(get_db_user, context, user.id)
         await update.message.reply_text(
             f"✅ Имя обновлено: {new_name}",
-            reply_markup=create_main_reply_keyboard(bool(DatabaseManager.get_active_shift(db_user['id'])), is_subscription_active(updated or db_user)),
+            reply_markup=create_main_reply_keyboard(bool(await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])), await AsyncDatabaseManager.run(is_subscription_active, updated or db_user)),
         )
-        invalidate_leaderboard_cache()
         return
 
     if context.user_data.get("awaiting_profile_rank_prefix"):
+        set_labels(branch="profile_rank_prefix")
         rank_prefix = " ".join(text.strip().split())
         if rank_prefix == "-":
             rank_prefix = ""
         if len(rank_prefix) > RANK_PREFIX_MAX_LENGTH:
             rank_prefix = rank_prefix[:RANK_PREFIX_MAX_LENGTH].rstrip()
-        db_user = DatabaseManager.get_user(user.id)
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
         if not db_user:
             context.user_data.pop("awaiting_profile_rank_prefix", None)
             await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
@@ -1876,20 +1673,20 @@ async def handle_message(update: Update, context: CallbackContext):
         if not rank_prefix:
             await update.message.reply_text("❌ Префикс не может быть пустым. Введите текст до 20 символов.")
             return
-        DatabaseManager.set_rank_prefix(db_user["id"], rank_prefix)
+        await AsyncDatabaseManager.set_rank_prefix(db_user["id"], rank_prefix)
         logger.info("profile rank prefix updated user_id=%s prefix=%s", db_user["id"], rank_prefix)
         context.user_data.pop("awaiting_profile_rank_prefix", None)
-        invalidate_leaderboard_cache()
         await _render_profile_view(update.message, context, db_user, user.id, notice=f"✅ Префикс ранга обновлён: {rank_prefix}")
         return
 
     awaiting_combo_name = context.user_data.get("awaiting_combo_name")
     if awaiting_combo_name:
+        set_labels(branch="combo_name")
         raw = text.strip()
         if not raw:
             await update.message.reply_text("Название не может быть пустым")
             return
-        db_user = DatabaseManager.get_user(user.id)
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
         if not db_user:
             await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
             return
@@ -1911,15 +1708,14 @@ async def handle_message(update: Update, context: CallbackContext):
             if not is_valid_alias(combo_alias):
                 await update.message.reply_text("❌ Alias должен быть 2-16 символов: буквы/цифры/_/-")
                 return
-            if DatabaseManager.is_combo_alias_taken(db_user['id'], combo_alias):
+            if await AsyncDatabaseManager.is_combo_alias_taken(db_user['id'], combo_alias):
                 await update.message.reply_text("❌ Такой alias комбо уже существует.")
                 return
-            for aliases in FAST_SERVICE_ALIASES.values():
-                if combo_alias in {normalize_alias(a) for a in aliases}:
-                    await update.message.reply_text("❌ Alias комбо конфликтует с alias услуги.")
-                    return
+            if SERVICE_INDEX.has_alias(combo_alias):
+                await update.message.reply_text("❌ Alias комбо конфликтует с alias услуги.")
+                return
 
-        DatabaseManager.save_user_combo(db_user['id'], name, service_ids, alias=combo_alias)
+        await AsyncDatabaseManager.save_user_combo(db_user['id'], name, service_ids, alias=combo_alias)
         context.user_data.pop("awaiting_combo_name", None)
         suffix = f" (alias: {combo_alias})" if combo_alias else ""
         await update.message.reply_text(f"✅ Комбо «{name}» сохранено{suffix}")
@@ -1927,7 +1723,8 @@ async def handle_message(update: Update, context: CallbackContext):
 
     awaiting_combo_rename = context.user_data.get("awaiting_combo_rename")
     if awaiting_combo_rename:
-        db_user = DatabaseManager.get_user(user.id)
+        set_labels(branch="combo_rename")
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
         if not db_user:
             context.user_data.pop("awaiting_combo_rename", None)
             await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
@@ -1945,24 +1742,24 @@ async def handle_message(update: Update, context: CallbackContext):
             await update.message.reply_text("❌ Alias должен быть 2-16 символов: буквы/цифры/_/-")
             return
         combo_id = int(awaiting_combo_rename)
-        if not DatabaseManager.update_combo_name(combo_id, db_user["id"], new_name):
+        if not await AsyncDatabaseManager.update_combo_name(combo_id, db_user["id"], new_name):
             context.user_data.pop("awaiting_combo_rename", None)
             await update.message.reply_text("❌ Комбо не найдено")
             return
         if combo_alias:
-            if DatabaseManager.is_combo_alias_taken(db_user["id"], combo_alias, exclude_combo_id=combo_id):
+            if await AsyncDatabaseManager.is_combo_alias_taken(db_user["id"], combo_alias, exclude_combo_id=combo_id):
                 await update.message.reply_text("❌ Такой alias комбо уже существует")
                 return
-            for aliases in FAST_SERVICE_ALIASES.values():
-                if combo_alias in {normalize_alias(a) for a in aliases}:
-                    await update.message.reply_text("❌ Alias комбо конфликтует с alias услуги")
-                    return
-            DatabaseManager.update_combo_alias(combo_id, db_user["id"], combo_alias)
+            if SERVICE_INDEX.has_alias(combo_alias):
+                await update.message.reply_text("❌ Alias комбо конфликтует с alias услуги")
+                return
+            await AsyncDatabaseManager.update_combo_alias(combo_id, db_user["id"], combo_alias)
         context.user_data.pop("awaiting_combo_rename", None)
         await update.message.reply_text("✅ Комбо обновлено")
         return
 
     if context.user_data.get('awaiting_service_search'):
+        set_labels(branch="service_search")
         query_text = text.lower().strip()
         payload = context.user_data.get('awaiting_service_search')
         if not payload:
@@ -1970,17 +1767,11 @@ async def handle_message(update: Update, context: CallbackContext):
             return
         car_id = payload["car_id"]
         page = payload["page"]
-        db_user = DatabaseManager.get_user(user.id)
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
         user_id = db_user['id'] if db_user else None
 
-        matches = []
-        for service_id in get_service_order(user_id):
-            service = SERVICES.get(service_id, {})
-            name = plain_service_name(service.get("name", ""))
-            if query_text in name.lower():
-                matches.append((service_id, service))
-            if len(matches) >= 12:
-                break
+        order = await AsyncDatabaseManager.run(get_service_order, user_id)
+        matches = [(service_id, SERVICES[service_id]) for service_id in SERVICE_INDEX.search(query_text, limit=12, order=order)]
 
         if not matches:
             await update.message.reply_text("Ничего не найдено. Попробуйте другое слово.")
@@ -1989,8 +1780,8 @@ async def handle_message(update: Update, context: CallbackContext):
         keyboard = []
         for service_id, service in matches:
             name = plain_service_name(service["name"])
-            keyboard.append([InlineKeyboardButton(name, callback_data=f"service_{service_id}_{car_id}_{page}")])
-        keyboard.append([InlineKeyboardButton("❌ Отмена поиска", callback_data=f"search_cancel_{car_id}_{page}")])
+            keyboard.append([InlineKeyboardButton(name, callback_data=CALLBACKS.encode("sv", service_id=service_id, car_id=car_id, page=page))])
+        keyboard.append([InlineKeyboardButton("❌ Отмена поиска", callback_data=CALLBACKS.encode("sx", car_id=car_id, page=page))])
 
         await update.message.reply_text(
             "Результаты поиска:",
@@ -2008,10 +1799,12 @@ async def handle_message(update: Update, context: CallbackContext):
         TOOLS_ADMIN,
         TOOLS_BACK,
     }:
-        db_user = DatabaseManager.get_user(user.id)
+        set_labels(branch="tools_menu")
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
         if text == TOOLS_BACK:
             context.user_data.pop("tools_menu_active", None)
-            await update.message.reply_text("Главное меню:", reply_markup=main_menu_for_db_user(db_user, subscription_active))
+            markup = await AsyncDatabaseManager.run(main_menu_for_db_user, db_user, subscription_active)
+            await update.message.reply_text("Главное меню:", reply_markup=markup)
             return
         if text == TOOLS_PRICE:
             await price_message(update, context)
@@ -2055,6 +1848,7 @@ async def handle_message(update: Update, context: CallbackContext):
         MENU_FAQ,
         MENU_ACCOUNT,
     }:
+        set_labels(branch="main_menu")
         context.user_data.pop("tools_menu_active", None)
         if text == MENU_ADD_CAR:
             await add_car_message(update, context)
@@ -2075,6 +1869,7 @@ async def handle_message(update: Update, context: CallbackContext):
         return
 
     if not subscription_active and not is_allowed_when_expired_menu(text):
+        set_labels(branch="subscription_expired")
         await update.message.reply_text(
             get_subscription_expired_text(),
             reply_markup=create_main_reply_keyboard(False, False)
@@ -2082,6 +1877,7 @@ async def handle_message(update: Update, context: CallbackContext):
         return
 
     if context.user_data.get('awaiting_distance'):
+        set_labels(branch="distance")
         raw_value = text.replace(" ", "").replace("км", "")
         if not raw_value.isdigit():
             await update.message.reply_text("❌ Введите километраж цифрами. Например: 45")
@@ -2097,20 +1893,27 @@ async def handle_message(update: Update, context: CallbackContext):
             return
         price = km * service.get("rate_per_km", 0)
         service_name = f"{plain_service_name(service['name'])} — {km} км"
-        DatabaseManager.add_service_to_car(car_id, service_id, service_name, price)
-        car = DatabaseManager.get_car(car_id)
-        db_user = DatabaseManager.get_user(user.id)
+        await AsyncDatabaseManager.add_service_to_car(car_id, service_id, service_name, price)
+        car = await AsyncDatabaseManager.get_car(car_id)
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
         if car:
+            user_id = db_user["id"] if db_user else None
+            mode = await AsyncDatabaseManager.run(get_price_mode, context, user_id)
+            markup = await AsyncDatabaseManager.run(
+                create_services_keyboard, car_id, page, get_edit_mode(context, car_id), mode, user_id
+            )
             await update.message.reply_text(
                 f"✅ Добавлено: {service_name} ({format_money(price)})\n"
                 f"Текущая сумма по машине: {format_money(car['total_amount'])}",
-                reply_markup=create_services_keyboard(car_id, page, get_edit_mode(context, car_id), get_price_mode(context, db_user["id"] if db_user else None), db_user["id"] if db_user else None)
+                reply_markup=markup
             )
         return
     
     if db_user_for_access and await handle_car_number_input(update, context, db_user_for_access, text):
+        set_labels(branch="car_number")
         return
 
+    set_labels(branch="unknown")
     await update.message.reply_text(
         "Используйте кнопки меню для работы с ботом.\n"
         "Напишите /start для начала."
@@ -2119,92 +1922,23 @@ async def handle_message(update: Update, context: CallbackContext):
 
 
 async def safe_handle_message(update: Update, context: CallbackContext):
-    try:
-        await handle_message(update, context)
-    except Exception:
-        logger.exception("handle_message failed")
-        if update.effective_message:
-            await update.effective_message.reply_text("❌ Произошла ошибка. Попробуйте ещё раз.")
+    with Timer(MESSAGE_SECONDS, MESSAGES_TOTAL, branch="other") as timer:
+        try:
+            await handle_message(update, context)
+        except Exception:
+            timer.fail()
+            logger.exception("handle_message failed")
+            if update.effective_message:
+                await update.effective_message.reply_text("❌ Произошла ошибка. Попробуйте ещё раз.")
 
 # ========== ОБРАБОТЧИКИ КНОПОК ==========
 
-async def dispatch_exact_callback(data: str, query, context) -> bool:
-    exact_handlers = {
-        "open_shift": open_shift,
-        "add_car": add_car,
-        "current_shift": current_shift,
-        "refresh_dashboard": current_shift,
-        "history_0": history,
-        "settings": settings,
-        "change_decade_goal": change_decade_goal,
-        "calendar_rebase": calendar_rebase_callback,
-        "leaderboard": leaderboard,
-        "export_csv": export_csv,
-        "backup_db": backup_db,
-        "reset_data": reset_data_prompt,
-        "reset_data_yes": reset_data_confirm_yes,
-        "reset_data_no": reset_data_confirm_no,
-        "toggle_price": toggle_price_mode,
-        "combo_settings": combo_settings_menu,
-        "combo_create_settings": combo_builder_start,
-        "admin_panel": admin_panel,
-        "admin_users": admin_users,
-        "admin_banned_users": admin_banned_users,
-        "admin_subscriptions": admin_subscriptions,
-        "admin_broadcast_menu": admin_broadcast_menu,
-        "admin_broadcast_all": lambda q, c: admin_broadcast_prepare(q, c, "all"),
-        "admin_broadcast_expiring_1d": lambda q, c: admin_broadcast_prepare(q, c, "expiring_1d"),
-        "admin_broadcast_expired": lambda q, c: admin_broadcast_prepare(q, c, "expired"),
-        "admin_broadcast_pick_user": admin_broadcast_pick_user,
-        "admin_broadcast_cancel": admin_broadcast_cancel,
-        "faq": faq_callback,
-        "nav_shift": nav_shift_callback,
-        "nav_navigator": nav_navigator_callback,
-        "nav_history": nav_history_callback,
-        "nav_tools": nav_tools_callback,
-        "nav_help": nav_help_callback,
-        "subscription_info": subscription_info_callback,
-        "subscription_info_photo": subscription_info_photo_callback,
-        "account_info": account_info_callback,
-        "profile_change_name": profile_change_name_callback,
-        "profile_change_rank_prefix": profile_change_rank_prefix_callback,
-        "show_price": show_price_callback,
-        "calendar_open": calendar_callback,
-        "nav:back": nav_back_callback,
-        "admin_faq_menu": admin_faq_menu,
-        "admin_media_menu": admin_media_menu,
-        "admin_media_set_profile": lambda q, c: admin_media_set_target(q, c, "profile"),
-        "admin_media_set_leaderboard": lambda q, c: admin_media_set_target(q, c, "leaderboard"),
-        "admin_media_clear_profile": lambda q, c: admin_media_clear_target(q, c, "profile"),
-        "admin_media_clear_leaderboard": lambda q, c: admin_media_clear_target(q, c, "leaderboard"),
-        "admin_faq_set_text": admin_faq_set_text,
-        "admin_faq_set_video": admin_faq_set_video,
-        "admin_faq_preview": admin_faq_preview,
-        "admin_faq_clear_video": admin_faq_clear_video,
-        "admin_faq_topics": admin_faq_topics,
-        "admin_faq_topic_add": admin_faq_topic_add,
-        "admin_faq_cancel": admin_faq_cancel,
-        "combo_builder_save": combo_builder_save,
-        "history_decades": history_decades,
-        "back": go_back,
-        "cleanup_data": cleanup_data_menu,
-        "cancel_add_car": cancel_add_car_callback,
-        "noop": noop_callback,
-    }
-
-    handler = exact_handlers.get(data)
-    if not handler:
-        return False
-    await handler(query, context)
-    return True
-
-
 async def nav_back_callback(query, context):
     pop_screen(context)
     prev = get_current_screen(context)
     if not prev:
-        db_user = DatabaseManager.get_user(query.from_user.id)
-        has_active = bool(db_user and DatabaseManager.get_active_shift(db_user['id']))
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
+        has_active = bool(db_user and await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']))
         await query.edit_message_text("Главное меню уже внизу 👇")
         await query.message.reply_text("Выбери действие:", reply_markup=create_main_reply_keyboard(has_active))
         return
@@ -2215,10 +1949,10 @@ async def nav_back_callback(query, context):
 async def cancel_add_car_callback(query, context):
     context.user_data.pop('awaiting_car_number', None)
     await query.edit_message_text("Ок, добавление машины отменено.")
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     await query.message.reply_text(
         "Выбери действие:",
-        reply_markup=main_menu_for_db_user(db_user)
+        reply_markup=await AsyncDatabaseManager.run(main_menu_for_db_user, db_user)
     )
 
 
@@ -2236,7 +1970,7 @@ async def handle_callback(update: Update, context: CallbackContext):
 
     logger.info(f"Callback: {data} from {user.id}")
 
-    _, blocked, subscription_active = resolve_user_access(user.id, context)
+    _, blocked, subscription_active = await AsyncDatabaseManager.run(resolve_user_access, user.id, context)
     if blocked:
         await query.edit_message_text("⛔ Доступ к боту закрыт администратором.")
         return
@@ -2249,83 +1983,23 @@ async def handle_callback(update: Update, context: CallbackContext):
         )
         return
 
-    if await dispatch_exact_callback(data, query, context):
-        return
-
-    prefix_handlers = getattr(handle_callback, "_prefix_handlers", None)
-    if prefix_handlers is None:
-        prefix_handlers = [
-            ("service_page_", change_services_page),
-        ("toggle_price_car_", toggle_price_mode_for_car),
-        ("repeat_prev_", repeat_prev_services),
-        ("service_search_", start_service_search),
-        ("search_text_", search_enter_text_mode),
-        ("search_cancel_", search_cancel),
-        ("combo_menu_", show_combo_menu),
-        ("combo_apply_", apply_combo_to_car),
-        ("combo_save_from_car_", save_combo_from_car),
-        ("combo_delete_prompt_", delete_combo_prompt),
-        ("combo_delete_confirm_", delete_combo),
-        ("combo_edit_", combo_edit_menu),
-        ("combo_rename_", combo_start_rename),
-        ("childsvc_", add_group_child_service),
-        ("back_to_services_", back_to_services),
-        ("service_", add_service),
-        ("clear_", clear_services_prompt),
-        ("confirm_clear_", clear_services),
-        ("save_", save_car),
-        ("shift_repeats_", export_shift_repeats),
-        ("combo_builder_toggle_", combo_builder_toggle),
-        ("admin_user_", admin_user_card),
-        ("admin_sub_user_", admin_user_card),
-        ("admin_toggle_block_", admin_toggle_block),
-        ("admin_toggle_leaderboard_", admin_toggle_leaderboard),
-        ("admin_toggle_broadcast_", admin_toggle_broadcast),
-        ("admin_activate_month_", admin_activate_month),
-        ("admin_activate_days_prompt_", admin_activate_days_prompt),
-        ("admin_disable_subscription_", admin_disable_subscription),
-        ("admin_broadcast_user_", lambda q, c, d: admin_broadcast_prepare(q, c, d.replace("admin_broadcast_user_", ""))),
-        ("admin_unban_", admin_unban_user),
-        ("calendar_nav_", calendar_nav_callback),
-        ("calendar_day_", calendar_day_callback),
-        ("calendar_set_", calendar_set_day_type_callback),
-        ("calendar_back_month_", calendar_back_month_callback),
-        ("calendar_setup_pick_", calendar_setup_pick_callback),
-        ("calendar_setup_save_", calendar_setup_save_callback),
-        ("calendar_edit_toggle_", calendar_edit_toggle_callback),
-        ("faq_topic_", faq_topic_callback),
-        ("admin_faq_topic_edit_", admin_faq_topic_edit),
-        ("admin_faq_topic_del_", admin_faq_topic_del),
-        ("history_decades_page_", history_decades_page),
-        ("history_decade_", history_decade_days),
-        ("history_day_", history_day_cars),
-        ("history_edit_car_", history_edit_car),
-        ("cleanup_month_", cleanup_month),
-        ("cleanup_day_", cleanup_day),
-        ("day_repeats_", day_repeats_callback),
-        ("delcar_", delete_car_callback),
-        ("delday_prompt_", delete_day_prompt),
-        ("delday_confirm_", delete_day_callback),
-        ("toggle_edit_", toggle_edit),
-        ("close_confirm_yes_", close_shift_confirm_yes),
-        ("close_confirm_no_", close_shift_confirm_no),
-        ("close_", close_shift_confirm_prompt),
-        ]
-        handle_callback._prefix_handlers = prefix_handlers
-
-    for prefix, handler in prefix_handlers:
-        if data.startswith(prefix):
-            try:
-                if prefix == "close_confirm_no_":
-                    await handler(query, context)
-                else:
-                    await handler(query, context, data)
-            except (ValueError, IndexError) as exc:
-                logger.warning(f"Некорректный callback payload {data}: {exc}")
-                await query.answer("Некорректные данные кнопки", show_alert=True)
-            return
+    try:
+        match = CALLBACKS.match(data)
+    except CallbackDataError as exc:
+        logger.warning(f"Некорректный callback payload {data}: {exc}")
+        await query.answer("Кнопка устарела, откройте экран заново", show_alert=True)
+        return
+    if match is None:
+        await query.edit_message_text("❌ Неизвестная команда")
+        return
 
-    await query.edit_message_text("❌ Неизвестная команда")
+    with Timer(CALLBACK_SECONDS, CALLBACKS_TOTAL, handler=match.name) as timer:
+        try:
+            await CALLBACKS.dispatch(match, query, context)
+        except (ValueError, IndexError) as exc:
+            timer.fail()
+            logger.warning(f"Некорректный callback payload {data}: {exc}")
+            await query.answer("Некорректные данные кнопки", show_alert=True)
 
 
 
@@ -2359,32 +2033,32 @@ def open_shift_core(db_user: dict) -> tuple[bool, str, bool]:
 async def open_shift(query, context):
     """Открытие смены"""
     user = query.from_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
 
     if not db_user:
         await query.edit_message_text("❌ Ошибка: пользователь не найден")
         return
 
-    opened, message, _ = open_shift_core(db_user)
+    opened, message, _ = await AsyncDatabaseManager.write(open_shift_core, db_user)
     await query.edit_message_text(message)
     await query.message.reply_text(
         "Выбери действие:",
-        reply_markup=main_menu_for_db_user(db_user, True)
+        reply_markup=await AsyncDatabaseManager.run(main_menu_for_db_user, db_user, True)
     )
-    if DatabaseManager.is_goal_enabled(db_user["id"]):
+    if await AsyncDatabaseManager.run(SETTINGS_STORE.is_goal_enabled, db_user["id"]):
         await send_goal_status(None, context, db_user['id'], source_message=query.message)
 
 async def add_car(query, context):
     """Добавление машины"""
     user = query.from_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     
     if not db_user:
         await query.edit_message_text("❌ Ошибка: пользователь не найден")
         return
     
     # Проверяем активную смену
-    active_shift = DatabaseManager.get_active_shift(db_user['id'])
+    active_shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])
     if not active_shift:
         await query.edit_message_text(
             "❌ Нет активной смены!\n"
@@ -2402,15 +2076,15 @@ async def add_car(query, context):
 async def current_shift(query, context):
     """Текущая смена"""
     user = query.from_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
 
     if not db_user:
         await query.edit_message_text("❌ Ошибка: пользователь не найден")
         return
 
-    active_shift = DatabaseManager.get_active_shift(db_user['id'])
+    active_shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])
     if not active_shift:
-        text_message = build_decade_progress_dashboard(db_user['id'])
+        text_message = await AsyncDatabaseManager.run(build_decade_progress_dashboard, db_user['id'])
         await query.edit_message_text(text_message, parse_mode="HTML")
         await query.message.reply_text(
             "Выбери действие:",
@@ -2418,9 +2092,9 @@ async def current_shift(query, context):
         )
         return
 
-    cars = DatabaseManager.get_shift_cars(active_shift['id'])
-    total = DatabaseManager.get_shift_total(active_shift['id'])
-    message = build_current_shift_dashboard(db_user['id'], active_shift, cars, total)
+    cars = await AsyncDatabaseManager.get_shift_cars(active_shift['id'])
+    total = await AsyncDatabaseManager.get_shift_total(active_shift['id'])
+    message = await AsyncDatabaseManager.run(build_current_shift_dashboard, db_user['id'], active_shift, cars, total)
     await query.edit_message_text(
         message,
         parse_mode="HTML",
@@ -2437,14 +2111,14 @@ async def history(query, context):
 
 async def settings(query, context):
     """Настройки"""
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     await query.edit_message_text(
         f"⚙️ НАСТРОЙКИ\n\nВерсия: {APP_VERSION}\nОбновлено: {APP_UPDATED_AT}\n\nВыберите параметр:",
-        reply_markup=build_settings_keyboard(db_user, is_admin_telegram(query.from_user.id))
+        reply_markup=await AsyncDatabaseManager.run(build_settings_keyboard, db_user, is_admin_telegram(query.from_user.id))
     )
 
 async def combo_builder_start(query, context):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
@@ -2467,13 +2141,13 @@ async def combo_builder_render(query, context, user_id: int):
     keyboard = []
     for sid in chunk:
         mark = "✅" if sid in selected else "▫️"
-        keyboard.append([InlineKeyboardButton(f"{mark} {plain_service_name(SERVICES[sid]['name'])}", callback_data=f"combo_builder_toggle_{sid}")])
+        keyboard.append([InlineKeyboardButton(f"{mark} {plain_service_name(SERVICES[sid]['name'])}", callback_data=CALLBACKS.encode("bt", service_id=sid))])
 
     nav = [InlineKeyboardButton(f"Стр {page + 1}/{max_page + 1}", callback_data="noop")]
     if page > 0:
-        nav.insert(0, InlineKeyboardButton("⬅️", callback_data="combo_builder_toggle_prev"))
+        nav.insert(0, InlineKeyboardButton("⬅️", callback_data=CALLBACKS.encode("bn", step=-1)))
     if page < max_page:
-        nav.append(InlineKeyboardButton("➡️", callback_data="combo_builder_toggle_next"))
+        nav.append(InlineKeyboardButton("➡️", callback_data=CALLBACKS.encode("bn", step=1)))
     keyboard.append(nav)
     keyboard.append([InlineKeyboardButton("💾 Сохранить комбо", callback_data="combo_builder_save")])
     keyboard.append([InlineKeyboardButton("🔙 В настройки", callback_data="settings")])
@@ -2482,24 +2156,30 @@ async def combo_builder_render(query, context, user_id: int):
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def combo_builder_toggle(query, context, data):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("bt", legacy="combo_builder_toggle_", service_id=int)
+async def combo_builder_toggle(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
-    payload = context.user_data.get("combo_builder", {"selected": [], "page": 0})
-    selected = payload.get("selected", [])
-    if data.endswith("_prev"):
-        payload["page"] = max(payload.get("page", 0) - 1, 0)
-    elif data.endswith("_next"):
-        payload["page"] = payload.get("page", 0) + 1
+    builder = context.user_data.get("combo_builder", {"selected": [], "page": 0})
+    selected = builder.get("selected", [])
+    if payload.service_id in selected:
+        selected.remove(payload.service_id)
     else:
-        sid = int(data.replace("combo_builder_toggle_", ""))
-        if sid in selected:
-            selected.remove(sid)
-        else:
-            selected.append(sid)
-        payload["selected"] = selected
-    context.user_data["combo_builder"] = payload
+        selected.append(payload.service_id)
+    builder["selected"] = selected
+    context.user_data["combo_builder"] = builder
+    await combo_builder_render(query, context, db_user["id"])
+
+
+@CALLBACKS.route("bn", step=int)
+async def combo_builder_page(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
+    if not db_user:
+        return
+    builder = context.user_data.get("combo_builder", {"selected": [], "page": 0})
+    builder["page"] = max(builder.get("page", 0) + payload.step, 0)
+    context.user_data["combo_builder"] = builder
     await combo_builder_render(query, context, db_user["id"])
 
 
@@ -2543,14 +2223,35 @@ async def send_admin_panel_for_message(update: Update):
     await update.message.reply_text("🛡️ Админ-панель\nВыберите раздел:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def admin_users(query, context):
+ADMIN_USERS_PAGE_SIZE = 30
+ADMIN_SUBSCRIPTIONS_PAGE_SIZE = 40
+
+
+def admin_page_nav_row(first_callback: str, page_opcode: str, cursor, next_cursor) -> list:
+    row = []
+    if cursor is not None:
+        row.append(InlineKeyboardButton("⏮ В начало", callback_data=first_callback))
+    if next_cursor is not None:
+        row.append(InlineKeyboardButton("➡️ Дальше", callback_data=CALLBACKS.encode(page_opcode, cursor=next_cursor)))
+    return row
+
+
+@CALLBACKS.route("ua", legacy="admin_users_page_", cursor=int)
+async def admin_users(query, context, payload=None):
     if not is_admin_telegram(query.from_user.id):
         return
-    users = DatabaseManager.get_all_users_with_stats()
+    cursor = payload.cursor if payload else None
+    users, next_cursor = await AsyncDatabaseManager.get_admin_user_page(cursor, ADMIN_USERS_PAGE_SIZE)
     keyboard = []
-    for row in users[:30]:
+    for row in users:
         status = "⛔" if int(row.get("is_blocked", 0)) else "✅"
-        keyboard.append([InlineKeyboardButton(f"{status} {row['name']} ({row['telegram_id']})", callback_data=f"admin_user_{row['id']}")])
+        keyboard.append([InlineKeyboardButton(
+            f"{status} {row['name']} ({row['telegram_id']}) · {format_money(int(row['total_amount'] or 0))}",
+            callback_data=CALLBACKS.encode("au", user_id=row["id"]),
+        )])
+    nav = admin_page_nav_row("admin_users", "ua", cursor, next_cursor)
+    if nav:
+        keyboard.append(nav)
     keyboard.append([InlineKeyboardButton("🔙 В админку", callback_data="admin_panel")])
     await query.edit_message_text("👥 Пользователи:", reply_markup=InlineKeyboardMarkup(keyboard))
 
@@ -2558,13 +2259,13 @@ async def admin_users(query, context):
 async def admin_banned_users(query, context):
     if not is_admin_telegram(query.from_user.id):
         return
-    users = DatabaseManager.get_banned_users()
+    users = await AsyncDatabaseManager.get_banned_users()
     keyboard = []
     for row in users[:40]:
         keyboard.append([
             InlineKeyboardButton(
                 f"⛔ {row['name']} ({row['telegram_id']})",
-                callback_data=f"admin_unban_{row['telegram_id']}"
+                callback_data=CALLBACKS.encode("un", telegram_id=row["telegram_id"]),
             )
         ])
     keyboard.append([InlineKeyboardButton("🔙 В админку", callback_data="admin_panel")])
@@ -2574,24 +2275,24 @@ async def admin_banned_users(query, context):
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def admin_unban_user(query, context, data):
+@CALLBACKS.route("un", legacy="admin_unban_", telegram_id=int)
+async def admin_unban_user(query, context, payload):
     if not is_admin_telegram(query.from_user.id):
         return
-    telegram_id = int(data.replace("admin_unban_", ""))
-    DatabaseManager.unban_telegram_user(telegram_id)
+    await AsyncDatabaseManager.unban_telegram_user(payload.telegram_id)
     await query.answer("✅ Пользователь разбанен")
     await admin_banned_users(query, context)
 
 
-async def admin_subscriptions(query, context):
+@CALLBACKS.route("ub", legacy="admin_subs_page_", cursor=int)
+async def admin_subscriptions(query, context, payload=None):
     if not is_admin_telegram(query.from_user.id):
         return
-    users = DatabaseManager.get_all_users_with_stats()
-    users_sorted = sorted(users, key=lambda u: int(u.get("telegram_id", 0)))
+    cursor = payload.cursor if payload else None
+    users, next_cursor = await AsyncDatabaseManager.get_admin_user_page(cursor, ADMIN_SUBSCRIPTIONS_PAGE_SIZE, order="telegram")
     keyboard = []
-    for row in users_sorted[:40]:
-        target_user = DatabaseManager.get_user_by_id(int(row["id"]))
-        expires = subscription_expires_at_for_user(target_user) if target_user else None
+    for row in users:
+        expires = parse_subscription_expires_at(row["subscription_expires_at"])
         if is_admin_telegram(int(row["telegram_id"])):
             status = "♾️"
         elif expires and now_local() <= expires:
@@ -2601,49 +2302,52 @@ async def admin_subscriptions(query, context):
         keyboard.append([
             InlineKeyboardButton(
                 f"{row['name']} ({row['telegram_id']}) — {status}",
-                callback_data=f"admin_sub_user_{row['id']}",
+                callback_data=CALLBACKS.encode("as", user_id=row["id"]),
             )
         ])
+    nav = admin_page_nav_row("admin_subscriptions", "ub", cursor, next_cursor)
+    if nav:
+        keyboard.append(nav)
     keyboard.append([InlineKeyboardButton("🔙 В админку", callback_data="admin_panel")])
     await query.edit_message_text("💳 Подписки пользователей:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def admin_user_card(query, context, data):
+@CALLBACKS.route("as", legacy="admin_sub_user_", user_id=int)
+async def admin_subscription_user_card(query, context, payload):
+    await admin_user_card(query, context, payload, back_callback="admin_subscriptions")
+
+
+@CALLBACKS.route("au", legacy="admin_user_", user_id=int)
+async def admin_user_card(query, context, payload, back_callback: str = "admin_users"):
     if not is_admin_telegram(query.from_user.id):
         return
-    context.user_data["admin_user_back"] = "admin_users"
-    if data.startswith("admin_sub_user_"):
-        user_id = int(data.replace("admin_sub_user_", ""))
-        context.user_data["admin_user_back"] = "admin_subscriptions"
-    else:
-        user_id = int(data.replace("admin_user_", ""))
-    users = {u["id"]: u for u in DatabaseManager.get_all_users_with_stats()}
-    row = users.get(user_id)
+    context.user_data["admin_user_back"] = back_callback
+    user_id = payload.user_id
+    row = await AsyncDatabaseManager.get_admin_user_row(user_id)
     if not row:
         await query.answer("Пользователь не найден")
         return
     blocked = bool(int(row.get("is_blocked", 0)))
     include_in_leaderboard = bool(int(row.get("include_in_leaderboard", 1)))
     include_in_broadcast = bool(int(row.get("broadcast_enabled", 1)))
-    target_user = DatabaseManager.get_user_by_id(user_id)
-    expires = subscription_expires_at_for_user(target_user) if target_user else None
+    expires = parse_subscription_expires_at(row["subscription_expires_at"])
     sub_status = "♾️ Админ" if is_admin_telegram(int(row["telegram_id"])) else (
         f"до {format_subscription_until(expires)}" if expires and now_local() <= expires else "истекла"
     )
     back_callback = context.user_data.get("admin_user_back", "admin_users")
     keyboard = [
-        [InlineKeyboardButton("🔓 Открыть доступ" if blocked else "⛔ Полный бан (удалить профиль)", callback_data=f"admin_toggle_block_{user_id}")],
+        [InlineKeyboardButton("🔓 Открыть доступ" if blocked else "⛔ Полный бан (удалить профиль)", callback_data=CALLBACKS.encode("ab", user_id=user_id))],
         [InlineKeyboardButton(
             "🏆 Учитывать в лидерборде: ДА" if include_in_leaderboard else "🏆 Учитывать в лидерборде: НЕТ",
-            callback_data=f"admin_toggle_leaderboard_{user_id}",
+            callback_data=CALLBACKS.encode("al", user_id=user_id),
         )],
         [InlineKeyboardButton(
             "📣 Участвует в рассылке: ДА" if include_in_broadcast else "📣 Участвует в рассылке: НЕТ",
-            callback_data=f"admin_toggle_broadcast_{user_id}",
+            callback_data=CALLBACKS.encode("ar", user_id=user_id),
         )],
-        [InlineKeyboardButton("🗓️ Активировать на месяц", callback_data=f"admin_activate_month_{user_id}")],
-        [InlineKeyboardButton("✍️ Активировать на N дней", callback_data=f"admin_activate_days_prompt_{user_id}")],
-        [InlineKeyboardButton("🚫 Отключить подписку", callback_data=f"admin_disable_subscription_{user_id}")],
+        [InlineKeyboardButton("🗓️ Активировать на месяц", callback_data=CALLBACKS.encode("am", user_id=user_id))],
+        [InlineKeyboardButton("✍️ Активировать на N дней", callback_data=CALLBACKS.encode("ad", user_id=user_id))],
+        [InlineKeyboardButton("🚫 Отключить подписку", callback_data=CALLBACKS.encode("ax", user_id=user_id))],
         [InlineKeyboardButton("🔙 Назад", callback_data=back_callback)],
     ]
     await query.edit_message_text(
@@ -2657,23 +2361,23 @@ async def admin_user_card(query, context, data):
     )
 
 
-async def admin_toggle_block(query, context, data):
+@CALLBACKS.route("ab", legacy="admin_toggle_block_", user_id=int)
+async def admin_toggle_block(query, context, payload):
     if not is_admin_telegram(query.from_user.id):
         return
-    user_id = int(data.replace("admin_toggle_block_", ""))
-    users = {u["id"]: u for u in DatabaseManager.get_all_users_with_stats()}
-    row = users.get(user_id)
+    user_id = payload.user_id
+    row = await AsyncDatabaseManager.get_admin_user_row(user_id)
     if not row:
         await query.answer("Пользователь не найден")
         return
     blocked = bool(int(row.get("is_blocked", 0)))
     if blocked:
-        DatabaseManager.set_user_blocked(user_id, False)
-        await admin_user_card(query, context, f"admin_user_{user_id}")
+        await AsyncDatabaseManager.set_user_blocked(user_id, False)
+        await admin_user_card(query, context, CALLBACKS.payload("au", user_id=user_id))
         return
 
     telegram_id = int(row.get("telegram_id") or 0)
-    DatabaseManager.ban_and_delete_user(user_id, reason=f"admin:{query.from_user.id}")
+    await AsyncDatabaseManager.ban_and_delete_user(user_id, reason=f"admin:{query.from_user.id}")
     await query.edit_message_text(
         f"⛔ Профиль {row.get('name', 'пользователь')} полностью удалён и отправлен в бан-лист.",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🚫 Открыть список забаненных", callback_data="admin_banned_users")]])
@@ -2685,43 +2389,44 @@ async def admin_toggle_block(query, context, data):
         pass
 
 
-async def admin_toggle_leaderboard(query, context, data):
+@CALLBACKS.route("al", legacy="admin_toggle_leaderboard_", user_id=int)
+async def admin_toggle_leaderboard(query, context, payload):
     if not is_admin_telegram(query.from_user.id):
         return
-    user_id = int(data.replace("admin_toggle_leaderboard_", ""))
-    users = {u["id"]: u for u in DatabaseManager.get_all_users_with_stats()}
-    row = users.get(user_id)
+    user_id = payload.user_id
+    row = await AsyncDatabaseManager.get_admin_user_row(user_id)
     if not row:
         await query.answer("Пользователь не найден")
         return
     new_state = not bool(int(row.get("include_in_leaderboard", 1)))
-    DatabaseManager.set_user_in_leaderboard(user_id, new_state)
-    await admin_user_card(query, context, f"admin_user_{user_id}")
+    await AsyncDatabaseManager.set_user_in_leaderboard(user_id, new_state)
+    await admin_user_card(query, context, CALLBACKS.payload("au", user_id=user_id))
 
 
-async def admin_toggle_broadcast(query, context, data):
+@CALLBACKS.route("ar", legacy="admin_toggle_broadcast_", user_id=int)
+async def admin_toggle_broadcast(query, context, payload):
     if not is_admin_telegram(query.from_user.id):
         return
-    user_id = int(data.replace("admin_toggle_broadcast_", ""))
-    users = {u["id"]: u for u in DatabaseManager.get_all_users_with_stats()}
-    row = users.get(user_id)
+    user_id = payload.user_id
+    row = await AsyncDatabaseManager.get_admin_user_row(user_id)
     if not row:
         await query.answer("Пользователь не найден")
         return
     new_state = not bool(int(row.get("broadcast_enabled", 1)))
-    DatabaseManager.set_user_in_broadcast(user_id, new_state)
-    await admin_user_card(query, context, f"admin_user_{user_id}")
+    await AsyncDatabaseManager.set_user_in_broadcast(user_id, new_state)
+    await admin_user_card(query, context, CALLBACKS.payload("au", user_id=user_id))
 
 
-async def admin_activate_month(query, context, data):
+@CALLBACKS.route("am", legacy="admin_activate_month_", user_id=int)
+async def admin_activate_month(query, context, payload):
     if not is_admin_telegram(query.from_user.id):
         return
-    user_id = int(data.replace("admin_activate_month_", ""))
-    target_user = DatabaseManager.get_user_by_id(user_id)
+    user_id = payload.user_id
+    target_user = await AsyncDatabaseManager.get_user_by_id(user_id)
     if not target_user:
         await query.answer("Пользователь не найден")
         return
-    expires = activate_subscription_days(user_id, 30)
+    expires = await AsyncDatabaseManager.write(activate_subscription_days, user_id, 30)
     await query.answer("Подписка на 30 дней активирована")
     try:
         await context.bot.send_message(
@@ -2734,29 +2439,31 @@ async def admin_activate_month(query, context, data):
         )
     except Exception:
         pass
-    await admin_user_card(query, context, f"admin_user_{user_id}")
+    await admin_user_card(query, context, CALLBACKS.payload("au", user_id=user_id))
 
 
-async def admin_activate_days_prompt(query, context, data):
+@CALLBACKS.route("ad", legacy="admin_activate_days_prompt_", user_id=int)
+async def admin_activate_days_prompt(query, context, payload):
     if not is_admin_telegram(query.from_user.id):
         return
-    user_id = int(data.replace("admin_activate_days_prompt_", ""))
+    user_id = payload.user_id
     context.user_data["awaiting_admin_subscription_days"] = user_id
     await query.edit_message_text(
         "Введите количество дней для активации (например, 45)."
     )
 
 
-async def admin_disable_subscription(query, context, data):
+@CALLBACKS.route("ax", legacy="admin_disable_subscription_", user_id=int)
+async def admin_disable_subscription(query, context, payload):
     if not is_admin_telegram(query.from_user.id):
         return
-    user_id = int(data.replace("admin_disable_subscription_", ""))
-    target_user = DatabaseManager.get_user_by_id(user_id)
+    user_id = payload.user_id
+    target_user = await AsyncDatabaseManager.get_user_by_id(user_id)
     if not target_user:
         await query.answer("Пользователь не найден")
         return
     disabled_at = now_local() - timedelta(seconds=1)
-    DatabaseManager.set_subscription_expires_at(user_id, disabled_at.isoformat())
+    await AsyncDatabaseManager.set_subscription_expires_at(user_id, disabled_at.isoformat())
     await query.answer("Подписка отключена")
     try:
         await context.bot.send_message(
@@ -2768,25 +2475,21 @@ async def admin_disable_subscription(query, context, data):
         )
     except Exception:
         pass
-    await admin_user_card(query, context, f"admin_user_{user_id}")
+    await admin_user_card(query, context, CALLBACKS.payload("au", user_id=user_id))
 
 
 def get_broadcast_recipients(target: str, admin_db_user: dict) -> list[int]:
-    users = DatabaseManager.get_all_users_with_stats()
     now_dt = now_local()
     recipients: list[int] = []
 
-    for row in users:
+    for row in DatabaseManager.get_broadcast_recipient_rows():
         telegram_id = int(row["telegram_id"])
         if telegram_id == admin_db_user["telegram_id"]:
             continue
-        if int(row.get("is_blocked", 0)) == 1:
-            continue
-        if int(row.get("broadcast_enabled", 1)) == 0:
-            continue
 
-        user_db = DatabaseManager.get_user_by_id(int(row["id"]))
-        expires_at = subscription_expires_at_for_user(user_db) if user_db else None
+        expires_at = None
+        if not is_admin_telegram(telegram_id):
+            expires_at = parse_subscription_expires_at(row["subscription_expires_at"])
 
         if target == "all":
             recipients.append(telegram_id)
@@ -2823,10 +2526,10 @@ async def admin_broadcast_menu(query, context):
 async def admin_broadcast_pick_user(query, context):
     if not is_admin_telegram(query.from_user.id):
         return
-    users = DatabaseManager.get_all_users_with_stats()
+    users, _ = await AsyncDatabaseManager.get_admin_user_page(limit=ADMIN_USERS_PAGE_SIZE)
     keyboard = []
-    for row in users[:30]:
-        keyboard.append([InlineKeyboardButton(f"{row['name']} ({row['telegram_id']})", callback_data=f"admin_broadcast_user_{row['telegram_id']}")])
+    for row in users:
+        keyboard.append([InlineKeyboardButton(f"{row['name']} ({row['telegram_id']})", callback_data=CALLBACKS.encode("bu", telegram_id=row["telegram_id"]))])
     keyboard.append([InlineKeyboardButton("🔙 К рассылке", callback_data="admin_broadcast_menu")])
     await query.edit_message_text("Выбери пользователя:", reply_markup=InlineKeyboardMarkup(keyboard))
 
@@ -2841,6 +2544,11 @@ async def admin_broadcast_prepare(query, context, target: str):
     )
 
 
+@CALLBACKS.route("bu", legacy="admin_broadcast_user_", telegram_id=int)
+async def admin_broadcast_user(query, context, payload):
+    await admin_broadcast_prepare(query, context, str(payload.telegram_id))
+
+
 async def admin_broadcast_cancel(query, context):
     if not is_admin_telegram(query.from_user.id):
         return
@@ -2848,28 +2556,76 @@ async def admin_broadcast_cancel(query, context):
     await admin_broadcast_menu(query, context)
 
 
+def format_broadcast_progress(progress: BroadcastProgress) -> str:
+    if progress.done:
+        return f"📣 Рассылка завершена.\nОтправлено: {progress.sent}\nОшибок: {progress.failed}"
+    return (
+        f"📣 Рассылка идёт: {progress.processed}/{progress.total}\n"
+        f"Отправлено: {progress.sent}\nОшибок: {progress.failed}"
+    )
+
+
+async def run_broadcast_job(application: Application, job_id: int) -> None:
+    job = await AsyncDatabaseManager.get_broadcast_job(job_id)
+    if not job:
+        return
+    chat_id = int(job["progress_chat_id"] or 0)
+    message_id = int(job["progress_message_id"] or 0)
+
+    async def on_progress(progress: BroadcastProgress) -> None:
+        if not chat_id or not message_id:
+            return
+        try:
+            await application.bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id, text=format_broadcast_progress(progress)
+            )
+        except BadRequest as exc:
+            # текст не изменился — не ошибка
+            if "not modified" not in str(exc).lower():
+                raise
+
+    runner = BroadcastRunner(application.bot, limiter=JOB_RATE_LIMITER)
+    try:
+        await runner.run(job_id, on_progress)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("broadcast job failed job_id=%s", job_id)
+    finally:
+        BROADCAST_TASKS.pop(job_id, None)
+
+
+def start_broadcast_job(application: Application, job_id: int) -> None:
+    if job_id in BROADCAST_TASKS:
+        return
+    # не application.create_task: Application.stop() ждал бы конца рассылки,
+    # а её можно прервать и продолжить после рестарта
+    BROADCAST_TASKS[job_id] = asyncio.get_running_loop().create_task(run_broadcast_job(application, job_id))
+
+
+async def stop_broadcast_jobs() -> None:
+    tasks = list(BROADCAST_TASKS.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
 async def process_admin_broadcast(update: Update, context: CallbackContext, admin_db_user: dict):
     target = context.user_data.pop("awaiting_admin_broadcast", None)
     if not target:
         return False
 
     text = (update.message.text or "").strip()
-    recipients = get_broadcast_recipients(target, admin_db_user)
-
-    sent = 0
-    failed = 0
-    for telegram_id in recipients:
-        if telegram_id == admin_db_user["telegram_id"]:
-            continue
-        try:
-            await context.bot.send_message(chat_id=telegram_id, text=text)
-            sent += 1
-        except Exception:
-            failed += 1
-
-    has_active = DatabaseManager.get_active_shift(admin_db_user['id']) is not None
+    recipients = await AsyncDatabaseManager.run(get_broadcast_recipients, target, admin_db_user)
+    job_id = await AsyncDatabaseManager.create_broadcast_job(admin_db_user["telegram_id"], target, text, recipients)
+
+    status = await update.message.reply_text(f"📣 Рассылка запущена: 0/{len(recipients)}")
+    await AsyncDatabaseManager.set_broadcast_progress_message(job_id, status.chat_id, status.message_id)
+    start_broadcast_job(context.application, job_id)
+    # статус дальше редактируется прогрессом, поэтому меню — отдельным сообщением
+    has_active = await AsyncDatabaseManager.get_active_shift(admin_db_user['id']) is not None
     await update.message.reply_text(
-        f"📣 Рассылка завершена.\nОтправлено: {sent}\nОшибок: {failed}",
+        "Выбери действие:",
         reply_markup=create_main_reply_keyboard(has_active)
     )
     return True
@@ -2883,34 +2639,34 @@ async def show_price_callback(query, context):
 
 
 async def price_message(update: Update, context: CallbackContext):
-    db_user = DatabaseManager.get_user(update.effective_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
     if not db_user:
         await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
         return
     await update.message.reply_text(
         build_price_text(),
         reply_markup=create_main_reply_keyboard(
-            bool(DatabaseManager.get_active_shift(db_user['id'])),
-            is_subscription_active(db_user),
+            bool(await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])),
+            await AsyncDatabaseManager.run(is_subscription_active, db_user),
         )
     )
 
 
 async def calendar_message(update: Update, context: CallbackContext):
-    db_user = DatabaseManager.get_user(update.effective_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
     if not db_user:
         await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
         return
     today = now_local().date()
     year, month = today.year, today.month
-    anchor_set = bool(DatabaseManager.get_work_anchor_date(db_user["id"]))
+    anchor_set = bool(await AsyncDatabaseManager.get_work_anchor_date(db_user["id"]))
     context.user_data["calendar_month"] = (year, month)
     context.user_data.setdefault("calendar_edit_mode", False)
     context.user_data.setdefault("calendar_setup_days", [])
 
     await update.message.reply_text(
         build_work_calendar_text(db_user, year, month, setup_mode=not anchor_set, edit_mode=context.user_data.get("calendar_edit_mode", False)),
-        reply_markup=build_work_calendar_keyboard(
+        reply_markup=await AsyncDatabaseManager.run(build_work_calendar_keyboard,
             db_user,
             year,
             month,
@@ -2922,17 +2678,17 @@ async def calendar_message(update: Update, context: CallbackContext):
 
 
 async def calendar_callback(query, context):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
     today = now_local().date()
     year, month = context.user_data.get("calendar_month", (today.year, today.month))
-    anchor_set = bool(DatabaseManager.get_work_anchor_date(db_user["id"]))
+    anchor_set = bool(await AsyncDatabaseManager.get_work_anchor_date(db_user["id"]))
     setup_mode = not anchor_set
     await query.edit_message_text(
         build_work_calendar_text(db_user, year, month, setup_mode=setup_mode, edit_mode=context.user_data.get("calendar_edit_mode", False)),
-        reply_markup=build_work_calendar_keyboard(
+        reply_markup=await AsyncDatabaseManager.run(build_work_calendar_keyboard,
             db_user,
             year,
             month,
@@ -2943,13 +2699,13 @@ async def calendar_callback(query, context):
     )
 
 
-async def calendar_nav_callback(query, context, data):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("kn", legacy="calendar_nav_", year=int, month=int, direction=str)
+async def calendar_nav_callback(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
-    _, _, y, m, direction = data.split("_")
-    year, month = int(y), int(m)
-    if direction == "prev":
+    year, month = payload.year, payload.month
+    if payload.direction == "prev":
         if month == 1:
             year -= 1
             month = 12
@@ -2963,11 +2719,11 @@ async def calendar_nav_callback(query, context, data):
             month += 1
 
     context.user_data["calendar_month"] = (year, month)
-    anchor_set = bool(DatabaseManager.get_work_anchor_date(db_user["id"]))
+    anchor_set = bool(await AsyncDatabaseManager.get_work_anchor_date(db_user["id"]))
     setup_mode = not anchor_set
     await query.edit_message_text(
         build_work_calendar_text(db_user, year, month, setup_mode=setup_mode, edit_mode=context.user_data.get("calendar_edit_mode", False)),
-        reply_markup=build_work_calendar_keyboard(
+        reply_markup=await AsyncDatabaseManager.run(build_work_calendar_keyboard,
             db_user,
             year,
             month,
@@ -2978,8 +2734,9 @@ async def calendar_nav_callback(query, context, data):
     )
 
 
-async def calendar_setup_pick_callback(query, context, data):
-    day = data.replace("calendar_setup_pick_", "")
+@CALLBACKS.route("kp", legacy="calendar_setup_pick_", day=str)
+async def calendar_setup_pick_callback(query, context, payload):
+    day = payload.day
     selected = context.user_data.get("calendar_setup_days", [])
     if day in selected:
         selected.remove(day)
@@ -2989,13 +2746,13 @@ async def calendar_setup_pick_callback(query, context, data):
         selected.append(day)
     context.user_data["calendar_setup_days"] = selected
 
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
     year, month = context.user_data.get("calendar_month", (now_local().year, now_local().month))
     await query.edit_message_text(
         build_work_calendar_text(db_user, year, month, setup_mode=True),
-        reply_markup=build_work_calendar_keyboard(
+        reply_markup=await AsyncDatabaseManager.run(build_work_calendar_keyboard,
             db_user,
             year,
             month,
@@ -3006,8 +2763,9 @@ async def calendar_setup_pick_callback(query, context, data):
     )
 
 
-async def calendar_setup_save_callback(query, context, data):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("kv", legacy="calendar_setup_save_", year=int, month=int)
+async def calendar_setup_save_callback(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
     selected = sorted(context.user_data.get("calendar_setup_days", []))
@@ -3022,12 +2780,12 @@ async def calendar_setup_save_callback(query, context, data):
         return
 
     anchor = min(d1, d2).isoformat()
-    DatabaseManager.set_work_anchor_date(db_user["id"], anchor)
+    await AsyncDatabaseManager.set_work_anchor_date(db_user["id"], anchor)
     context.user_data["calendar_setup_days"] = []
     year, month = context.user_data.get("calendar_month", (now_local().year, now_local().month))
     await query.edit_message_text(
         build_work_calendar_text(db_user, year, month, setup_mode=False, edit_mode=context.user_data.get("calendar_edit_mode", False)),
-        reply_markup=build_work_calendar_keyboard(
+        reply_markup=await AsyncDatabaseManager.run(build_work_calendar_keyboard,
             db_user,
             year,
             month,
@@ -3038,17 +2796,17 @@ async def calendar_setup_save_callback(query, context, data):
     )
 
 
-async def calendar_edit_toggle_callback(query, context, data):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("ke", legacy="calendar_edit_toggle_", year=int, month=int)
+async def calendar_edit_toggle_callback(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
     context.user_data["calendar_edit_mode"] = not context.user_data.get("calendar_edit_mode", False)
-    _, _, _, y, m = data.split("_")
-    year, month = int(y), int(m)
+    year, month = payload.year, payload.month
     context.user_data["calendar_month"] = (year, month)
     await query.edit_message_text(
         build_work_calendar_text(db_user, year, month, setup_mode=False, edit_mode=context.user_data.get("calendar_edit_mode", False)),
-        reply_markup=build_work_calendar_keyboard(
+        reply_markup=await AsyncDatabaseManager.run(build_work_calendar_keyboard,
             db_user,
             year,
             month,
@@ -3065,12 +2823,12 @@ async def render_calendar_day_card(query, context, db_user: dict, day: str):
         await query.answer("Некорректная дата")
         return
 
-    day_type = get_work_day_type(db_user, target)
-    overrides = DatabaseManager.get_calendar_overrides(db_user["id"])
+    day_type = await AsyncDatabaseManager.run(get_work_day_type, db_user, target)
+    overrides = await AsyncDatabaseManager.get_calendar_overrides(db_user["id"])
     current_override = overrides.get(day)
 
     month_key = day[:7]
-    month_days = DatabaseManager.get_days_for_month(db_user["id"], month_key)
+    month_days = await AsyncDatabaseManager.get_days_for_month(db_user["id"], month_key)
     has_day = any(row.get("day") == day and int(row.get("shifts_count", 0)) > 0 for row in month_days)
     # Факт смены превращает день в "доп. смену" только если нет ручного off.
     if has_day and day_type == "off" and current_override != "off":
@@ -3089,34 +2847,31 @@ async def render_calendar_day_card(query, context, db_user: dict, day: str):
     )
     keyboard = []
     if has_day:
-        keyboard.append([InlineKeyboardButton("📂 Открыть историю дня", callback_data=f"history_day_{day}")])
+        keyboard.append([InlineKeyboardButton("📂 Открыть историю дня", callback_data=CALLBACKS.encode("hy", day=day))])
     keyboard.append([
-        InlineKeyboardButton("✅ Сделать рабочим", callback_data=f"calendar_set_planned_{day}"),
-        InlineKeyboardButton("🚫 Сделать выходным", callback_data=f"calendar_set_off_{day}"),
+        InlineKeyboardButton("✅ Сделать рабочим", callback_data=CALLBACKS.encode("ks", mode="planned", day=day)),
+        InlineKeyboardButton("🚫 Сделать выходным", callback_data=CALLBACKS.encode("ks", mode="off", day=day)),
     ])
-    keyboard.append([InlineKeyboardButton("➕ Сделать доп. сменой", callback_data=f"calendar_set_extra_{day}")])
-    keyboard.append([InlineKeyboardButton("♻️ Сбросить ручную правку", callback_data=f"calendar_set_reset_{day}")])
-    keyboard.append([InlineKeyboardButton("🔙 К месяцу", callback_data=f"calendar_back_month_{day[:7]}")])
+    keyboard.append([InlineKeyboardButton("➕ Сделать доп. сменой", callback_data=CALLBACKS.encode("ks", mode="extra", day=day))])
+    keyboard.append([InlineKeyboardButton("♻️ Сбросить ручную правку", callback_data=CALLBACKS.encode("ks", mode="reset", day=day))])
+    keyboard.append([InlineKeyboardButton("🔙 К месяцу", callback_data=CALLBACKS.encode("kb", month=day[:7]))])
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def calendar_set_day_type_callback(query, context, data):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("ks", legacy="calendar_set_", mode=str, day=str)
+async def calendar_set_day_type_callback(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
-    body = data.replace("calendar_set_", "")
-    if "_" not in body:
-        await query.answer("Некорректные данные дня", show_alert=True)
-        return
-    mode, day = body.split("_", 1)
+    mode, day = payload.mode, payload.day
     if mode == "planned":
-        DatabaseManager.set_calendar_override(db_user["id"], day, "planned")
+        await AsyncDatabaseManager.set_calendar_override(db_user["id"], day, "planned")
     elif mode == "off":
-        DatabaseManager.set_calendar_override(db_user["id"], day, "off")
+        await AsyncDatabaseManager.set_calendar_override(db_user["id"], day, "off")
     elif mode == "extra":
-        DatabaseManager.set_calendar_override(db_user["id"], day, "extra")
+        await AsyncDatabaseManager.set_calendar_override(db_user["id"], day, "extra")
     else:
-        DatabaseManager.set_calendar_override(db_user["id"], day, "")
+        await AsyncDatabaseManager.set_calendar_override(db_user["id"], day, "")
 
     try:
         await render_calendar_day_card(query, context, db_user, day)
@@ -3126,22 +2881,22 @@ async def calendar_set_day_type_callback(query, context, data):
             return
         raise
 
-    if DatabaseManager.is_goal_enabled(db_user["id"]):
+    if await AsyncDatabaseManager.run(SETTINGS_STORE.is_goal_enabled, db_user["id"]):
         await send_goal_status(None, context, db_user["id"], source_message=query.message)
 
 
-async def calendar_back_month_callback(query, context, data):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("kb", legacy="calendar_back_month_", month=str)
+async def calendar_back_month_callback(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
-    ym = data.replace("calendar_back_month_", "")
-    year_s, month_s = ym.split("-")
+    year_s, month_s = payload.month.split("-")
     year, month = int(year_s), int(month_s)
     context.user_data["calendar_month"] = (year, month)
-    anchor_set = bool(DatabaseManager.get_work_anchor_date(db_user["id"]))
+    anchor_set = bool(await AsyncDatabaseManager.get_work_anchor_date(db_user["id"]))
     await query.edit_message_text(
         build_work_calendar_text(db_user, year, month, setup_mode=not anchor_set, edit_mode=context.user_data.get("calendar_edit_mode", False)),
-        reply_markup=build_work_calendar_keyboard(
+        reply_markup=await AsyncDatabaseManager.run(build_work_calendar_keyboard,
             db_user,
             year,
             month,
@@ -3152,11 +2907,12 @@ async def calendar_back_month_callback(query, context, data):
     )
 
 
-async def calendar_day_callback(query, context, data):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("kd", legacy="calendar_day_", day=str)
+async def calendar_day_callback(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
-    day = data.replace("calendar_day_", "")
+    day = payload.day
 
     if context.user_data.get("calendar_edit_mode", False):
         await render_calendar_day_card(query, context, db_user, day)
@@ -3166,15 +2922,15 @@ async def calendar_day_callback(query, context, data):
 
 
 async def subscription_message(update: Update, context: CallbackContext):
-    db_user = DatabaseManager.get_user(update.effective_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
     if not db_user:
         await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
         return
 
-    expires_at = subscription_expires_at_for_user(db_user)
+    expires_at = await AsyncDatabaseManager.run(subscription_expires_at_for_user, db_user)
     if is_admin_telegram(update.effective_user.id):
         status = "♾️ Бессрочный доступ (админ)"
-    elif is_subscription_active(db_user):
+    elif await AsyncDatabaseManager.run(is_subscription_active, db_user):
         status = f"✅ Подписка активна до {format_subscription_until(expires_at)}"
     else:
         status = "⛔ Подписка истекла"
@@ -3185,8 +2941,8 @@ async def subscription_message(update: Update, context: CallbackContext):
         f"Стоимость: {SUBSCRIPTION_PRICE_TEXT}\n\n"
         f"Для продления напишите: {SUBSCRIPTION_CONTACT}",
         reply_markup=create_main_reply_keyboard(
-            bool(DatabaseManager.get_active_shift(db_user['id'])),
-            is_subscription_active(db_user),
+            bool(await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])),
+            await AsyncDatabaseManager.run(is_subscription_active, db_user),
         )
     )
 
@@ -3198,15 +2954,15 @@ def _clear_profile_waiting_flags(context: CallbackContext) -> None:
 
 async def _render_profile_view(message, context: CallbackContext, db_user: dict, telegram_id: int, notice: str = "") -> None:
     logger.info("profile renderer selected=unified user_id=%s", db_user.get("id"))
-    profile_text = build_profile_text(db_user, telegram_id)
+    profile_text = await AsyncDatabaseManager.run(build_profile_text, db_user, telegram_id)
     if notice:
         profile_text = f"{profile_text}\n\n{notice}"
-    profile_keyboard = build_profile_keyboard(db_user, telegram_id)
+    profile_keyboard = await AsyncDatabaseManager.run(build_profile_keyboard, db_user, telegram_id)
     await send_text_with_optional_photo(message, context, profile_text, reply_markup=profile_keyboard, section="profile")
 
 
 async def _show_unified_profile_from_callback(query, context: CallbackContext, notice: str = "") -> None:
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
@@ -3263,7 +3019,7 @@ def build_profile_keyboard(db_user: dict, telegram_id: int) -> InlineKeyboardMar
 
 async def profile_change_name_callback(query, context):
     logger.info("profile callback invoked action=profile_change_name user_id=%s", query.from_user.id)
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
@@ -3279,7 +3035,7 @@ async def profile_change_name_callback(query, context):
 
 async def profile_change_rank_prefix_callback(query, context):
     logger.info("profile callback invoked action=profile_change_rank_prefix user_id=%s", query.from_user.id)
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
@@ -3312,7 +3068,7 @@ def set_section_photo_file_id(section: str, file_id: str) -> None:
 
 
 async def send_text_with_optional_photo(chat_target, context: CallbackContext, text: str, reply_markup=None, section: str = ""):
-    file_id = get_section_photo_file_id(section) if section else ""
+    file_id = await AsyncDatabaseManager.run(get_section_photo_file_id, section) if section else ""
     if file_id:
         await context.bot.send_photo(
             chat_id=chat_target.chat_id,
@@ -3325,7 +3081,7 @@ async def send_text_with_optional_photo(chat_target, context: CallbackContext, t
 
 
 async def account_message(update: Update, context: CallbackContext):
-    db_user = DatabaseManager.get_user(update.effective_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
     if not db_user:
         await update.message.reply_text("❌ Пользователь не найден. Напишите /start")
         return
@@ -3439,7 +3195,7 @@ def create_faq_topics_keyboard(topics: list[dict], is_admin: bool = False) -> In
         "support": "🆘",
     }
     keyboard = [
-        [InlineKeyboardButton(f"{icon_map.get(topic.get('id'), '📘')} {topic['title']}", callback_data=f"faq_topic_{topic['id']}")]
+        [InlineKeyboardButton(f"{icon_map.get(topic.get('id'), '📘')} {topic['title']}", callback_data=CALLBACKS.encode("ft", topic_id=topic["id"]))]
         for topic in topics
     ]
     if is_admin:
@@ -3448,11 +3204,11 @@ def create_faq_topics_keyboard(topics: list[dict], is_admin: bool = False) -> In
 
 
 async def send_faq(chat_target, context: CallbackContext):
-    faq_text = DatabaseManager.get_app_content("faq_text", "")
-    faq_video = DatabaseManager.get_app_content("faq_video_file_id", "")
-    source_chat_id = DatabaseManager.get_app_content("faq_video_source_chat_id", "")
-    source_message_id = DatabaseManager.get_app_content("faq_video_source_message_id", "")
-    topics = get_faq_topics()
+    faq_text = await AsyncDatabaseManager.get_app_content("faq_text", "")
+    faq_video = await AsyncDatabaseManager.get_app_content("faq_video_file_id", "")
+    source_chat_id = await AsyncDatabaseManager.get_app_content("faq_video_source_chat_id", "")
+    source_message_id = await AsyncDatabaseManager.get_app_content("faq_video_source_message_id", "")
+    topics = await AsyncDatabaseManager.run(get_faq_topics)
 
     header = faq_text or (
         "❓ FAQ\n"
@@ -3493,7 +3249,7 @@ async def faq_message(update: Update, context: CallbackContext):
 async def faq_callback(query, context):
     await query.edit_message_text(
         "❓ FAQ\nВыбери раздел:",
-        reply_markup=create_faq_topics_keyboard(get_faq_topics(), is_admin=is_admin_telegram(query.from_user.id)),
+        reply_markup=create_faq_topics_keyboard(await AsyncDatabaseManager.run(get_faq_topics), is_admin=is_admin_telegram(query.from_user.id)),
     )
 
 
@@ -3529,7 +3285,7 @@ async def admin_media_set_target(query, context, section: str):
 async def admin_media_clear_target(query, context, section: str):
     if not is_admin_telegram(query.from_user.id):
         return
-    set_section_photo_file_id(section, "")
+    await AsyncDatabaseManager.write(set_section_photo_file_id, section, "")
     context.user_data.pop("awaiting_admin_section_photo", None)
     await query.answer("Фото удалено")
     await admin_media_menu(query, context)
@@ -3579,18 +3335,19 @@ async def admin_faq_preview(query, context):
 async def admin_faq_clear_video(query, context):
     if not is_admin_telegram(query.from_user.id):
         return
-    DatabaseManager.set_app_content("faq_video_file_id", "")
-    DatabaseManager.set_app_content("faq_video_source_chat_id", "")
-    DatabaseManager.set_app_content("faq_video_source_message_id", "")
+    await AsyncDatabaseManager.set_app_content("faq_video_file_id", "")
+    await AsyncDatabaseManager.set_app_content("faq_video_source_chat_id", "")
+    await AsyncDatabaseManager.set_app_content("faq_video_source_message_id", "")
     await query.edit_message_text(
         "✅ Видео FAQ удалено.",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 В админку", callback_data="admin_panel")]])
     )
 
 
-async def faq_topic_callback(query, context, data):
-    topic_id = data.replace("faq_topic_", "")
-    topics = get_faq_topics()
+@CALLBACKS.route("ft", legacy="faq_topic_", topic_id=str)
+async def faq_topic_callback(query, context, payload):
+    topic_id = payload.topic_id
+    topics = await AsyncDatabaseManager.run(get_faq_topics)
     topic = next((t for t in topics if t["id"] == topic_id), None)
     if not topic:
         await query.edit_message_text("❌ Тема FAQ не найдена.")
@@ -3604,11 +3361,11 @@ async def faq_topic_callback(query, context, data):
 async def admin_faq_topics(query, context):
     if not is_admin_telegram(query.from_user.id):
         return
-    topics = get_faq_topics()
+    topics = await AsyncDatabaseManager.run(get_faq_topics)
     keyboard = []
     for topic in topics:
-        keyboard.append([InlineKeyboardButton(f"✏️ {topic['title']}", callback_data=f"admin_faq_topic_edit_{topic['id']}")])
-        keyboard.append([InlineKeyboardButton(f"🗑️ Удалить: {topic['title']}", callback_data=f"admin_faq_topic_del_{topic['id']}")])
+        keyboard.append([InlineKeyboardButton(f"✏️ {topic['title']}", callback_data=CALLBACKS.encode("fe", topic_id=topic["id"]))])
+        keyboard.append([InlineKeyboardButton(f"🗑️ Удалить: {topic['title']}", callback_data=CALLBACKS.encode("fd", topic_id=topic["id"]))])
     keyboard.append([InlineKeyboardButton("➕ Добавить тему", callback_data="admin_faq_topic_add")])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_faq_menu")])
     await query.edit_message_text("Темы FAQ:", reply_markup=InlineKeyboardMarkup(keyboard))
@@ -3624,10 +3381,11 @@ async def admin_faq_topic_add(query, context):
     )
 
 
-async def admin_faq_topic_edit(query, context, data):
+@CALLBACKS.route("fe", legacy="admin_faq_topic_edit_", topic_id=str)
+async def admin_faq_topic_edit(query, context, payload):
     if not is_admin_telegram(query.from_user.id):
         return
-    topic_id = data.replace("admin_faq_topic_edit_", "")
+    topic_id = payload.topic_id
     context.user_data["awaiting_admin_faq_topic_edit"] = topic_id
     await query.edit_message_text(
         "Отправьте новый текст для темы в формате:\nНовое название | Новый текст",
@@ -3645,16 +3403,17 @@ async def admin_faq_cancel(query, context):
     await admin_faq_menu(query, context)
 
 
-async def admin_faq_topic_del(query, context, data):
+@CALLBACKS.route("fd", legacy="admin_faq_topic_del_", topic_id=str)
+async def admin_faq_topic_del(query, context, payload):
     if not is_admin_telegram(query.from_user.id):
         return
-    topic_id = data.replace("admin_faq_topic_del_", "")
-    topics = get_faq_topics()
+    topic_id = payload.topic_id
+    topics = await AsyncDatabaseManager.run(get_faq_topics)
     filtered = [t for t in topics if t["id"] != topic_id]
     if len(filtered) == len(topics):
         await query.answer("Тема не найдена", show_alert=True)
         return
-    save_faq_topics(filtered)
+    await AsyncDatabaseManager.write(save_faq_topics, filtered)
     await query.answer("✅ Тема удалена")
     await admin_faq_topics(query, context)
 
@@ -3685,15 +3444,15 @@ def build_history_decades_page(db_user: dict, page: int = 0) -> tuple[str, Inlin
     for d in chunk:
         title = format_decade_title(int(d["year"]), int(d["month"]), int(d["decade_index"]))
         message += f"• {title}: {format_money(int(d['total_amount']))} (машин: {d['cars_count']})\n"
-        keyboard.append([InlineKeyboardButton(title, callback_data=f"history_decade_{d['year']}_{d['month']}_{d['decade_index']}")])
+        keyboard.append([InlineKeyboardButton(title, callback_data=CALLBACKS.encode("hd", year=d["year"], month=d["month"], decade=d["decade_index"]))])
 
     if max_page > 0:
         nav = []
         if page < max_page:
-            nav.append(InlineKeyboardButton("⬅️ Старее", callback_data=f"history_decades_page_{page + 1}"))
+            nav.append(InlineKeyboardButton("⬅️ Старее", callback_data=CALLBACKS.encode("hp", page=page + 1)))
         nav.append(InlineKeyboardButton(f"{page + 1}/{max_page + 1}", callback_data="noop"))
         if page > 0:
-            nav.append(InlineKeyboardButton("Новее ➡️", callback_data=f"history_decades_page_{page - 1}"))
+            nav.append(InlineKeyboardButton("Новее ➡️", callback_data=CALLBACKS.encode("hp", page=page - 1)))
         keyboard.append(nav)
 
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
@@ -3701,41 +3460,36 @@ def build_history_decades_page(db_user: dict, page: int = 0) -> tuple[str, Inlin
 
 
 async def history_decades(query, context):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
     if "history_decades_page" not in context.user_data:
-        decades = DatabaseManager.get_decades_with_data(db_user["id"], limit=120)
+        decades = await AsyncDatabaseManager.get_decades_with_data(db_user["id"], limit=120)
         context.user_data["history_decades_page"] = resolve_history_page_for_current_decade(decades)
     page = int(context.user_data.get("history_decades_page", 0))
-    message, markup = build_history_decades_page(db_user, page)
+    message, markup = await AsyncDatabaseManager.run(build_history_decades_page, db_user, page)
     if not message or not markup:
         await query.edit_message_text("📜 История пуста")
         return
     await query.edit_message_text(message, reply_markup=markup)
 
 
-async def history_decades_page(query, context, data):
-    try:
-        page = int(data.replace("history_decades_page_", ""))
-    except ValueError:
-        page = 0
-    context.user_data["history_decades_page"] = max(page, 0)
+@CALLBACKS.route("hp", legacy="history_decades_page_", page=int)
+async def history_decades_page(query, context, payload):
+    context.user_data["history_decades_page"] = max(payload.page, 0)
     await history_decades(query, context)
 
 
-async def history_decade_days(query, context, data):
-    _, _, year_s, month_s, decade_s = data.split("_")
-    year = int(year_s)
-    month = int(month_s)
-    decade_index = int(decade_s)
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("hd", legacy="history_decade_", year=int, month=int, decade=int)
+async def history_decade_days(query, context, payload):
+    year, month, decade_index = payload.year, payload.month, payload.decade
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    days = DatabaseManager.get_days_for_decade(db_user["id"], year, month, decade_index)
+    days = await AsyncDatabaseManager.get_days_for_decade(db_user["id"], year, month, decade_index)
     title = format_decade_title(year, month, decade_index)
     total = sum(int(d["total_amount"] or 0) for d in days)
     message = f"📆 {title}\nИтого: {format_money(total)}\n\n"
@@ -3745,17 +3499,18 @@ async def history_decade_days(query, context, data):
     for d in days:
         day = d["day"]
         message += f"• {day}: {format_money(int(d['total_amount']))} (машин: {d['cars_count']})\n"
-        keyboard.append([InlineKeyboardButton(f"{day} — {format_money(int(d['total_amount']))}", callback_data=f"history_day_{day}")])
+        keyboard.append([InlineKeyboardButton(f"{day} — {format_money(int(d['total_amount']))}", callback_data=CALLBACKS.encode("hy", day=day))])
     keyboard.append([InlineKeyboardButton("🔙 К декадам", callback_data="history_decades")])
     await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def history_day_cars(query, context, data):
-    day = data.replace("history_day_", "")
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("hy", legacy="history_day_", day=str)
+async def history_day_cars(query, context, payload):
+    day = payload.day
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
-    cars = DatabaseManager.get_cars_for_day(db_user["id"], day)
+    cars = await AsyncDatabaseManager.get_cars_for_day(db_user["id"], day)
     if not cars:
         back_callback = context.user_data.pop("history_back_callback", "history_decades")
         back_title = "🔙 К календарю" if back_callback.startswith("calendar_back_month_") else "🔙 К декадам"
@@ -3766,7 +3521,7 @@ async def history_day_cars(query, context, data):
         return
     message = f"🚗 Машины за {day}\n\n"
     keyboard = []
-    subscription_active = is_subscription_active(db_user)
+    subscription_active = await AsyncDatabaseManager.run(is_subscription_active, db_user)
     for car in cars:
         shift_label = build_shift_number_label(int(car.get("shift_id") or 0))
         message += f"• {shift_label}: #{car['id']} {car['car_number']} — {format_money(int(car['total_amount']))}\n"
@@ -3774,11 +3529,11 @@ async def history_day_cars(query, context, data):
             keyboard.append([
                 InlineKeyboardButton(
                     f"✏️ Редактировать {car['car_number']}",
-                    callback_data=f"history_edit_car_{car['id']}_{day}",
+                    callback_data=CALLBACKS.encode("he", car_id=car["id"], day=day),
                 )
             ])
     if subscription_active:
-        keyboard.append([InlineKeyboardButton("🧹 Редактировать этот день", callback_data=f"cleanup_day_{day}")])
+        keyboard.append([InlineKeyboardButton("🧹 Редактировать этот день", callback_data=CALLBACKS.encode("ud", day=day))])
     else:
         message += "\nℹ️ Режим чтения: редактирование доступно после продления подписки.\n"
         keyboard.append([InlineKeyboardButton("💳 Продлить подписку", callback_data="subscription_info")])
@@ -3787,25 +3542,24 @@ async def history_day_cars(query, context, data):
     keyboard.append([InlineKeyboardButton(back_title, callback_data=back_callback)])
     await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def history_edit_car(query, context, data):
-    body = data.replace("history_edit_car_", "")
-    car_id_s, day = body.split("_", 1)
-    car_id = int(car_id_s)
+@CALLBACKS.route("he", legacy="history_edit_car_", car_id=int, day=str)
+async def history_edit_car(query, context, payload):
+    car_id, day = payload.car_id, payload.day
 
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
-    if not is_subscription_active(db_user):
+    if not await AsyncDatabaseManager.run(is_subscription_active, db_user):
         await query.edit_message_text(get_subscription_expired_text())
         return
 
-    car = DatabaseManager.get_car(car_id)
+    car = await AsyncDatabaseManager.get_car(car_id)
     if not car:
         await query.edit_message_text("❌ Машина не найдена")
         return
 
-    cars_for_day = DatabaseManager.get_cars_for_day(db_user["id"], day)
+    cars_for_day = await AsyncDatabaseManager.get_cars_for_day(db_user["id"], day)
     if not any(item["id"] == car_id for item in cars_for_day):
         await query.edit_message_text("❌ Машина не найдена в выбранном дне")
         return
@@ -3813,16 +3567,11 @@ async def history_edit_car(query, context, data):
     context.user_data[f"history_day_for_car_{car_id}"] = day
     await show_car_services(query, context, car_id, page=0, history_day=day)
 
-async def add_service(query, context, data):
+@CALLBACKS.route("sv", legacy="service_", service_id=int, car_id=int, page=int)
+async def add_service(query, context, payload):
     """Добавление услуги"""
     context.user_data.pop('awaiting_service_search', None)
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-
-    service_id = int(parts[1])
-    car_id = int(parts[2])
-    page = int(parts[3])
+    service_id, car_id, page = payload.service_id, payload.car_id, payload.page
 
     service = SERVICES.get(service_id)
     if not service:
@@ -3844,14 +3593,14 @@ async def add_service(query, context, data):
         )
         return
 
-    db_user = DatabaseManager.get_user(query.from_user.id)
-    price = get_current_price(service_id, get_price_mode(context, db_user["id"] if db_user else None))
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
+    price = get_current_price(service_id, await AsyncDatabaseManager.run(get_price_mode, context, db_user["id"] if db_user else None))
 
     if get_edit_mode(context, car_id):
-        DatabaseManager.remove_service_from_car(car_id, service_id)
+        await AsyncDatabaseManager.remove_service_from_car(car_id, service_id)
     else:
         clean_name = plain_service_name(service['name'])
-        DatabaseManager.add_service_to_car(car_id, service_id, clean_name, price)
+        await AsyncDatabaseManager.add_service_to_car(car_id, service_id, clean_name, price)
 
 
     await show_car_services(query, context, car_id, page)
@@ -3863,8 +3612,8 @@ async def show_group_service_options(query, context, group_service_id: int, car_
         return
 
     children = group_service.get("children", [])
-    db_user = DatabaseManager.get_user(query.from_user.id)
-    mode = get_price_mode(context, db_user["id"] if db_user else None)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
+    mode = await AsyncDatabaseManager.run(get_price_mode, context, db_user["id"] if db_user else None)
     keyboard = []
     for child_id in children:
         child = SERVICES.get(child_id)
@@ -3875,82 +3624,68 @@ async def show_group_service_options(query, context, group_service_id: int, car_
         keyboard.append([
             InlineKeyboardButton(
                 f"{child_name} ({child_price}₽)",
-                callback_data=f"childsvc_{child_id}_{car_id}_{page}"
+                callback_data=CALLBACKS.encode("cs", service_id=child_id, car_id=car_id, page=page)
             )
         ])
 
-    keyboard.append([InlineKeyboardButton("⬅️ К услугам", callback_data=f"back_to_services_{car_id}_{page}")])
+    keyboard.append([InlineKeyboardButton("⬅️ К услугам", callback_data=CALLBACKS.encode("bs", car_id=car_id, page=page))])
     await query.edit_message_text(
         f"Выберите вариант: {plain_service_name(group_service['name'])}",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
 
-async def add_group_child_service(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-    service_id = int(parts[1])
-    car_id = int(parts[2])
-    page = int(parts[3])
+@CALLBACKS.route("cs", legacy="childsvc_", service_id=int, car_id=int, page=int)
+async def add_group_child_service(query, context, payload):
+    service_id, car_id, page = payload.service_id, payload.car_id, payload.page
 
     service = SERVICES.get(service_id)
     if not service:
         return
 
     if get_edit_mode(context, car_id):
-        DatabaseManager.remove_service_from_car(car_id, service_id)
+        await AsyncDatabaseManager.remove_service_from_car(car_id, service_id)
     else:
-        db_user = DatabaseManager.get_user(query.from_user.id)
-        price = get_current_price(service_id, get_price_mode(context, db_user["id"] if db_user else None))
-        DatabaseManager.add_service_to_car(car_id, service_id, plain_service_name(service['name']), price)
+        db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
+        price = get_current_price(service_id, await AsyncDatabaseManager.run(get_price_mode, context, db_user["id"] if db_user else None))
+        await AsyncDatabaseManager.add_service_to_car(car_id, service_id, plain_service_name(service['name']), price)
 
     await show_car_services(query, context, car_id, page)
 
 
-async def back_to_services(query, context, data):
+@CALLBACKS.route("bs", legacy="back_to_services_", car_id=int, page=int)
+async def back_to_services(query, context, payload):
     context.user_data.pop('awaiting_service_search', None)
-    parts = data.split('_')
-    if len(parts) < 5:
-        return
-    car_id = int(parts[3])
-    page = int(parts[4])
-    await show_car_services(query, context, car_id, page)
+    await show_car_services(query, context, payload.car_id, payload.page)
 
 
 
 
-async def toggle_price_mode_for_car(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 5:
-        return
-    car_id = int(parts[3])
-    page = int(parts[4])
+@CALLBACKS.route("pc", legacy="toggle_price_car_", car_id=int, page=int)
+async def toggle_price_mode_for_car(query, context, payload):
+    car_id, page = payload.car_id, payload.page
 
     user = query.from_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         return
 
-    current = get_price_mode(context, db_user['id'])
+    current = await AsyncDatabaseManager.run(get_price_mode, context, db_user['id'])
     new_mode = "night" if current == "day" else "day"
-    set_manual_price_mode(context, db_user['id'], new_mode)
+    await AsyncDatabaseManager.run(set_manual_price_mode, context, db_user['id'], new_mode)
     await show_car_services(query, context, car_id, page)
 
 
-async def start_service_search(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-    car_id = int(parts[2])
-    page = int(parts[3])
+@CALLBACKS.route("ss", legacy="service_search_", car_id=int, page=int)
+async def start_service_search(query, context, payload):
+    car_id, page = payload.car_id, payload.page
 
     context.user_data['awaiting_service_search'] = {"car_id": car_id, "page": page}
     context.user_data["search_message_id"] = query.message.message_id
     context.user_data["search_chat_id"] = query.message.chat_id
 
     keyboard = [
-        [InlineKeyboardButton("❌ Отмена поиска", callback_data=f"search_cancel_{car_id}_{page}")],
+        [InlineKeyboardButton("❌ Отмена поиска", callback_data=CALLBACKS.encode("sx", car_id=car_id, page=page))],
     ]
 
     await query.edit_message_text(
@@ -3959,86 +3694,58 @@ async def start_service_search(query, context, data):
     )
 
 
-async def apply_search_pick(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 5:
-        return
-    service_id = int(parts[2])
-    car_id = int(parts[3])
-    page = int(parts[4])
-    await add_service(query, context, f"service_{service_id}_{car_id}_{page}")
-
-
-async def search_enter_text_mode(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-    car_id = int(parts[2])
-    page = int(parts[3])
+@CALLBACKS.route("st", legacy="search_text_", car_id=int, page=int)
+async def search_enter_text_mode(query, context, payload):
+    car_id, page = payload.car_id, payload.page
     context.user_data['awaiting_service_search'] = {"car_id": car_id, "page": page}
     context.user_data["search_message_id"] = query.message.message_id
     context.user_data["search_chat_id"] = query.message.chat_id
     await query.edit_message_text(
         "🔎 Поиск услуг\n\nВведите в чат часть названия услуги.",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("❌ Отмена поиска", callback_data=f"search_cancel_{car_id}_{page}")],
+            [InlineKeyboardButton("❌ Отмена поиска", callback_data=CALLBACKS.encode("sx", car_id=car_id, page=page))],
         ])
     )
 
 
-async def repeat_prev_services(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-    car_id = int(parts[2])
-    page = int(parts[3])
+@CALLBACKS.route("rp", legacy="repeat_prev_", car_id=int, page=int)
+async def repeat_prev_services(query, context, payload):
+    car_id, page = payload.car_id, payload.page
 
-    car = DatabaseManager.get_car(car_id)
+    car = await AsyncDatabaseManager.get_car(car_id)
     if not car:
         return
-    prev_car = DatabaseManager.get_previous_car_with_services(car["shift_id"], car_id)
+    prev_car = await AsyncDatabaseManager.get_previous_car_with_services(car["shift_id"], car_id)
     if not prev_car:
         await query.answer("Нет предыдущей машины с услугами", show_alert=True)
         return
 
-    services = DatabaseManager.get_car_services(prev_car["id"])
-    DatabaseManager.clear_car_services(car_id)
-    for service in services:
-        qty = int(service.get("quantity", 1) or 1)
-        for _ in range(max(1, qty)):
-            DatabaseManager.add_service_to_car(
-                car_id,
-                int(service["service_id"]),
-                str(service["service_name"]),
-                int(service["price"]),
-            )
+    services = await AsyncDatabaseManager.get_car_services(prev_car["id"])
+    await AsyncDatabaseManager.clear_car_services(car_id)
+    await AsyncDatabaseManager.add_services_to_car(car_id, [
+        (int(service["service_id"]), str(service["service_name"]), int(service["price"]), max(1, int(service.get("quantity", 1) or 1)))
+        for service in services
+    ])
     await show_car_services(query, context, car_id, page)
 
 
-async def search_cancel(query, context, data):
-    parts = data.split("_")
-    if len(parts) < 4:
-        return
-    car_id = int(parts[2])
-    page = int(parts[3])
+@CALLBACKS.route("sx", legacy="search_cancel_", car_id=int, page=int)
+async def search_cancel(query, context, payload):
+    car_id, page = payload.car_id, payload.page
     context.user_data.pop("awaiting_service_search", None)
     await show_car_services(query, context, car_id, page)
 
 
-async def show_combo_menu(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-    car_id = int(parts[2])
-    page = int(parts[3])
-    combo_page = int(parts[4]) if len(parts) > 4 else 0
+@CALLBACKS.route("cm", legacy="combo_menu_", car_id=int, page=int, combo_page=(int, 0))
+async def show_combo_menu(query, context, payload):
+    car_id, page, combo_page = payload.car_id, payload.page, payload.combo_page
 
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    all_combos = DatabaseManager.get_user_combos(db_user['id'])
+    all_combos = await AsyncDatabaseManager.get_user_combos(db_user['id'])
     combos = []
     for combo in all_combos:
         try:
@@ -4058,131 +3765,127 @@ async def show_combo_menu(query, context, data):
         keyboard.append([
             InlineKeyboardButton(
                 f"▶️ {combo['name'][:24]}{alias}",
-                callback_data=f"combo_apply_{combo['id']}_{car_id}_{page}",
+                callback_data=CALLBACKS.encode("ca", combo_id=combo["id"], car_id=car_id, page=page),
             ),
             InlineKeyboardButton(
                 "✏️",
-                callback_data=f"combo_edit_{combo['id']}_{car_id}_{page}",
+                callback_data=CALLBACKS.encode("ce", combo_id=combo["id"], car_id=car_id, page=page),
             ),
         ])
 
     nav = []
     if combo_page > 0:
-        nav.append(InlineKeyboardButton("⬅️", callback_data=f"combo_menu_{car_id}_{page}_{combo_page-1}"))
+        nav.append(InlineKeyboardButton("⬅️", callback_data=CALLBACKS.encode("cm", car_id=car_id, page=page, combo_page=combo_page - 1)))
     nav.append(InlineKeyboardButton(f"{combo_page+1}/{max_page+1}", callback_data="noop"))
     if combo_page < max_page:
-        nav.append(InlineKeyboardButton("➡️", callback_data=f"combo_menu_{car_id}_{page}_{combo_page+1}"))
+        nav.append(InlineKeyboardButton("➡️", callback_data=CALLBACKS.encode("cm", car_id=car_id, page=page, combo_page=combo_page + 1)))
     if nav:
         keyboard.append(nav)
 
-    keyboard.append([InlineKeyboardButton("⬅️ К услугам", callback_data=f"back_to_services_{car_id}_{page}")])
+    keyboard.append([InlineKeyboardButton("⬅️ К услугам", callback_data=CALLBACKS.encode("bs", car_id=car_id, page=page))])
     text_msg = "🧩 У вас пока нет сохранённых комбо.\nСоздайте их в настройках: «Мои комбинации»." if not combos else f"🧩 Выберите комбинацию для применения (всего: {len(combos)}):"
     logger.info("combo list user_id=%s total=%s page=%s", db_user['id'], len(combos), combo_page)
     await query.edit_message_text(text_msg, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def apply_combo_to_car(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 5:
-        return
-    combo_id = int(parts[2])
-    car_id = int(parts[3])
-    page = int(parts[4])
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("ca", legacy="combo_apply_", combo_id=int, car_id=int, page=int)
+async def apply_combo_to_car(query, context, payload):
+    combo_id, car_id, page = payload.combo_id, payload.car_id, payload.page
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
-    combo = DatabaseManager.get_combo(combo_id, db_user['id'])
+    combo = await AsyncDatabaseManager.get_combo(combo_id, db_user['id'])
     if not combo:
         await query.answer("Комбо не найдено", show_alert=True)
         return
 
-    mode = get_price_mode(context, db_user['id'])
+    mode = await AsyncDatabaseManager.run(get_price_mode, context, db_user['id'])
+    items = []
     for sid in combo.get('service_ids', []):
         service = SERVICES.get(int(sid))
         if not service or service.get('kind') in {'group', 'distance'}:
             continue
-        DatabaseManager.add_service_to_car(car_id, int(sid), service['name'], get_current_price(int(sid), mode))
+        items.append((int(sid), service['name'], get_current_price(int(sid), mode), 1))
+    await AsyncDatabaseManager.add_services_to_car(car_id, items)
 
     await show_car_services(query, context, car_id, page)
 
 
-async def save_combo_from_car(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-    car_id = int(parts[3])
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("cf", legacy="combo_save_from_car_", car_id=int)
+async def save_combo_from_car(query, context, payload):
+    car_id = payload.car_id
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
-    services = DatabaseManager.get_car_services(car_id)
+    services = await AsyncDatabaseManager.get_car_services(car_id)
     service_ids = [int(s['service_id']) for s in services if int(s.get('service_id', 0)) in SERVICES]
     service_ids = sorted(set(service_ids))
     if not service_ids:
         await query.answer("Сначала добавьте услуги машине", show_alert=True)
         return
     name = f"Комбо {now_local().strftime('%d.%m %H:%M')}"
-    DatabaseManager.save_user_combo(db_user['id'], name, service_ids)
+    await AsyncDatabaseManager.save_user_combo(db_user['id'], name, service_ids)
     await query.answer("✅ Комбо сохранено", show_alert=True)
 
 
-async def delete_combo_prompt(query, context, data):
-    combo_id = int(data.replace('combo_delete_prompt_', '').split('_')[0])
+@CALLBACKS.route("dp", legacy="combo_delete_prompt_", combo_id=int)
+async def delete_combo_prompt(query, context, payload):
+    combo_id = payload.combo_id
     await query.edit_message_text(
         "Удалить это комбо?",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Да, удалить", callback_data=f"combo_delete_confirm_{combo_id}")],
+            [InlineKeyboardButton("✅ Да, удалить", callback_data=CALLBACKS.encode("dc", combo_id=combo_id))],
             [InlineKeyboardButton("🔙 Назад", callback_data="combo_settings")],
         ])
     )
 
 
-async def delete_combo(query, context, data):
-    combo_id = int(data.replace('combo_delete_confirm_', '').split('_')[0])
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("dc", legacy="combo_delete_confirm_", combo_id=int)
+async def delete_combo(query, context, payload):
+    combo_id = payload.combo_id
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
-    DatabaseManager.delete_combo(combo_id, db_user['id'])
+    await AsyncDatabaseManager.delete_combo(combo_id, db_user['id'])
     await combo_settings_menu(query, context)
 
 
-async def combo_edit_menu(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 3:
-        return
-    combo_id = int(parts[2])
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("ce", legacy="combo_edit_", combo_id=int, car_id=(int, 0), page=(int, 0))
+async def combo_edit_menu(query, context, payload):
+    combo_id = payload.combo_id
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
-    combo = DatabaseManager.get_combo(combo_id, db_user['id'])
+    combo = await AsyncDatabaseManager.get_combo(combo_id, db_user['id'])
     if not combo:
         await query.edit_message_text("❌ Комбо не найдено")
         return
     await query.edit_message_text(
         f"🧩 {combo['name']}\nУслуг: {len(combo.get('service_ids', []))}",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("✏️ Переименовать", callback_data=f"combo_rename_{combo_id}")],
-            [InlineKeyboardButton("🗑️ Удалить", callback_data=f"combo_delete_prompt_{combo_id}")],
+            [InlineKeyboardButton("✏️ Переименовать", callback_data=CALLBACKS.encode("cr", combo_id=combo_id))],
+            [InlineKeyboardButton("🗑️ Удалить", callback_data=CALLBACKS.encode("dp", combo_id=combo_id))],
             [InlineKeyboardButton("🔙 Назад", callback_data="combo_settings")],
         ])
     )
 
 
-async def combo_start_rename(query, context, data):
-    combo_id = int(data.replace('combo_rename_', '').split('_')[0])
-    context.user_data['awaiting_combo_rename'] = combo_id
+@CALLBACKS.route("cr", legacy="combo_rename_", combo_id=int)
+async def combo_start_rename(query, context, payload):
+    context.user_data['awaiting_combo_rename'] = payload.combo_id
     await query.edit_message_text("Введите новое название комбо (или Название | alias).")
 
 
 async def combo_settings_menu(query, context):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
-    combos = DatabaseManager.get_user_combos(db_user['id'])
+    combos = await AsyncDatabaseManager.get_user_combos(db_user['id'])
     if not combos:
         await query.edit_message_text(
             "🧩 Комбо\n"
@@ -4197,7 +3900,7 @@ async def combo_settings_menu(query, context):
     keyboard = []
     for combo in combos:
         keyboard.append([
-            InlineKeyboardButton(f"{combo['name']}" + (f" ({combo.get('alias')})" if combo.get('alias') else ""), callback_data=f"combo_edit_{combo['id']}_0_0"),
+            InlineKeyboardButton(f"{combo['name']}" + (f" ({combo.get('alias')})" if combo.get('alias') else ""), callback_data=CALLBACKS.encode("ce", combo_id=combo["id"])),
         ])
     keyboard.append([InlineKeyboardButton("➕ Создать комбо", callback_data="combo_create_settings")])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
@@ -4210,7 +3913,7 @@ async def combo_settings_menu(query, context):
 
 
 async def combo_settings_menu_for_message(update: Update, context: CallbackContext):
-    db_user = DatabaseManager.get_user(update.effective_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
     if not db_user:
         await update.message.reply_text("❌ Пользователь не найден")
         return
@@ -4218,7 +3921,7 @@ async def combo_settings_menu_for_message(update: Update, context: CallbackConte
         "Здесь вы можете создать любую комбинацию из услуг для быстрого ввода.\n\n"
         "После создания первого комбо при добавлении услуг в машину появится кнопка с названием вашего комбо."
     )
-    combos = DatabaseManager.get_user_combos(db_user['id'])
+    combos = await AsyncDatabaseManager.get_user_combos(db_user['id'])
     if not combos:
         await update.message.reply_text(
             f"{combo_intro}\n\n🧩 У вас пока нет сохранённых комбо.",
@@ -4230,96 +3933,105 @@ async def combo_settings_menu_for_message(update: Update, context: CallbackConte
         return
     keyboard = []
     for combo in combos:
-        keyboard.append([InlineKeyboardButton(f"{combo['name']}" + (f" ({combo.get('alias')})" if combo.get('alias') else ""), callback_data=f"combo_edit_{combo['id']}_0_0")])
+        keyboard.append([InlineKeyboardButton(f"{combo['name']}" + (f" ({combo.get('alias')})" if combo.get('alias') else ""), callback_data=CALLBACKS.encode("ce", combo_id=combo["id"]))])
     keyboard.append([InlineKeyboardButton("➕ Создать комбо", callback_data="combo_create_settings")])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
     await update.message.reply_text(f"{combo_intro}\n\n🧩 Мои комбинации ({len(combos)}):", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
+async def run_report_job(query, context, key, func, *args, caption: str, empty_text: str = "❌ Нет данных для отчёта") -> None:
+    """Готовит файл в пуле отчётов и держит пользователя в курсе через статус-сообщение."""
+    job, deduped = REPORT_JOBS.submit(key, func, *args)
+    ahead = REPORT_JOBS.queued_ahead(job)
+    if deduped:
+        text = "⏳ Этот отчёт уже готовится, пришлю его, как только он будет готов."
+    elif ahead:
+        text = f"⏳ Отчёт в очереди, перед вами: {ahead}."
+    else:
+        text = "⏳ Формирую отчёт…"
+    status = await send_status(query, context, text)
+    if ahead and not deduped:
+        await job.started.wait()
+        await edit_status(status, "⏳ Формирую отчёт…")
+    try:
+        path = await job.result()
+    except Exception:
+        # ошибку с трейсом один раз на задачу пишет REPORT_JOBS
+        await done_status(status, "❌ Не удалось сформировать отчёт. Попробуйте позже.")
+        return
+    if not path:
+        await done_status(status, empty_text)
+        return
+    await done_status_document(status, path, caption=caption)
+
+
 async def export_csv(query, context):
     await query.edit_message_text("Экспорт CSV временно недоступен.")
 
 
 async def backup_db(query, context):
-    path = create_db_backup()
-    if not path:
-        await query.edit_message_text("❌ Бэкап недоступен")
+    if not is_admin_telegram(query.from_user.id):
+        await query.edit_message_text("⛔ Доступно только администратору")
         return
-    with open(path, 'rb') as f:
-        await query.message.reply_document(document=f, filename=os.path.basename(path), caption='Бэкап базы')
+    await run_report_job(query, context, ("backup_db",), create_db_backup, caption="Бэкап базы", empty_text="❌ Бэкап недоступен")
 
 
-async def export_decade_pdf(query, context, data):
-    _, _, _, y, m, d = data.split('_')
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("xp", legacy="export_decade_pdf_", year=int, month=int, decade=int)
+async def export_decade_pdf(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
-    path = create_decade_pdf(db_user['id'], int(y), int(m), int(d))
-    with open(path, 'rb') as f:
-        await query.message.reply_document(document=f, filename=os.path.basename(path), caption='PDF отчёт')
+    y, m, d = payload.year, payload.month, payload.decade
+    key = ("decade_pdf", db_user["id"], y, m, d)
+    await run_report_job(query, context, key, create_decade_pdf, db_user['id'], y, m, d, caption="PDF отчёт")
 
 
-async def export_decade_xlsx(query, context, data):
-    _, _, _, y, m, d = data.split('_')
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("xx", legacy="export_decade_xlsx_", year=int, month=int, decade=int)
+async def export_decade_xlsx(query, context, payload):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
-    path = create_decade_xlsx(db_user['id'], int(y), int(m), int(d))
-    with open(path, 'rb') as f:
-        await query.message.reply_document(document=f, filename=os.path.basename(path), caption='XLSX отчёт')
+    y, m, d = payload.year, payload.month, payload.decade
+    key = ("decade_xlsx", db_user["id"], y, m, d)
+    await run_report_job(query, context, key, create_decade_xlsx, db_user['id'], y, m, d, caption="XLSX отчёт")
 
 
-async def clear_services_prompt(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 3:
-        return
-    car_id = int(parts[1])
-    page = int(parts[2])
+@CALLBACKS.route("cl", legacy="clear_", car_id=int, page=int)
+async def clear_services_prompt(query, context, payload):
+    car_id, page = payload.car_id, payload.page
     keyboard = [
-        [InlineKeyboardButton("✅ Да, очистить", callback_data=f"confirm_clear_{car_id}_{page}")],
-        [InlineKeyboardButton("⬅️ Отмена", callback_data=f"back_to_services_{car_id}_{page}")],
+        [InlineKeyboardButton("✅ Да, очистить", callback_data=CALLBACKS.encode("cc", car_id=car_id, page=page))],
+        [InlineKeyboardButton("⬅️ Отмена", callback_data=CALLBACKS.encode("bs", car_id=car_id, page=page))],
     ]
     await query.edit_message_text("Подтвердите очистку всех услуг у этой машины", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def clear_services(query, context, data):
+@CALLBACKS.route("cc", legacy="confirm_clear_", car_id=int, page=int)
+async def clear_services(query, context, payload):
     """Очистка услуг"""
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-
-    car_id = int(parts[2])
-    page = int(parts[3])
-
-    DatabaseManager.clear_car_services(car_id)
+    car_id, page = payload.car_id, payload.page
+    await AsyncDatabaseManager.clear_car_services(car_id)
     context.user_data.pop(f"edit_mode_{car_id}", None)
     await show_car_services(query, context, car_id, page)
 
-async def change_services_page(query, context, data):
+@CALLBACKS.route("sp", legacy="service_page_", car_id=int, page=int)
+async def change_services_page(query, context, payload):
     """Перелистывание услуг"""
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-    car_id = int(parts[2])
-    page = int(parts[3])
-    await show_car_services(query, context, car_id, page)
+    await show_car_services(query, context, payload.car_id, payload.page)
 
-async def toggle_edit(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-    car_id = int(parts[2])
-    page = int(parts[3])
+@CALLBACKS.route("te", legacy="toggle_edit_", car_id=int, page=int)
+async def toggle_edit(query, context, payload):
+    car_id, page = payload.car_id, payload.page
     toggle_edit_mode(context, car_id)
     await show_car_services(query, context, car_id, page)
 
 async def save_car_by_id(query, context, car_id: int):
-    car = DatabaseManager.get_car(car_id)
+    car = await AsyncDatabaseManager.get_car(car_id)
     if not car:
         await query.edit_message_text("❌ Машина не найдена")
         return
 
-    services = DatabaseManager.get_car_services(car_id)
+    services = await AsyncDatabaseManager.get_car_services(car_id)
     if not services:
         await query.edit_message_text(
             f"❌ Машина {car['car_number']} не сохранена.\n"
@@ -4335,45 +4047,34 @@ async def save_car_by_id(query, context, car_id: int):
     )
     context.user_data.pop(f"edit_mode_{car_id}", None)
     context.user_data.pop(f"history_day_for_car_{car_id}", None)
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if db_user:
         await send_goal_status(None, context, db_user['id'], source_message=query.message)
 
 
 
 
-async def save_car(query, context, data):
+@CALLBACKS.route("sa", legacy="save_", car_id=int)
+async def save_car(query, context, payload):
     """Сохранение машины"""
-    parts = data.split('_')
-    if len(parts) < 2:
-        return
-    car_id = int(parts[1])
-    await save_car_by_id(query, context, car_id)
+    await save_car_by_id(query, context, payload.car_id)
     await query.message.reply_text(
         "Выбери действие:",
         reply_markup=create_main_reply_keyboard(True)
     )
 
-async def close_shift(query, context, data):
-    """Старая точка входа: теперь только подтверждение"""
-    await close_shift_confirm_prompt(query, context, data)
-
-
-async def close_shift_confirm_prompt(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 2:
-        return
-
+@CALLBACKS.route("sc", legacy="close_", shift_id=int)
+async def close_shift_confirm_prompt(query, context, payload):
     user = query.from_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         await query.edit_message_text("❌ Ошибка: пользователь не найден")
         return
 
-    shift_id = int(parts[1])
-    shift = DatabaseManager.get_shift(shift_id) if shift_id > 0 else None
+    shift_id = payload.shift_id
+    shift = await AsyncDatabaseManager.get_shift(shift_id) if shift_id > 0 else None
     if not shift:
-        shift = DatabaseManager.get_active_shift(db_user['id'])
+        shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])
     if not shift or shift['user_id'] != db_user['id']:
         await query.edit_message_text("❌ Смена не найдена")
         return
@@ -4385,8 +4086,8 @@ async def close_shift_confirm_prompt(query, context, data):
         return
 
     keyboard = [
-        [InlineKeyboardButton("✅ Да, закрыть", callback_data=f"close_confirm_yes_{shift_id}")],
-        [InlineKeyboardButton("❌ Нет, оставить открытой", callback_data=f"close_confirm_no_{shift_id}")],
+        [InlineKeyboardButton("✅ Да, закрыть", callback_data=CALLBACKS.encode("cy", shift_id=shift_id))],
+        [InlineKeyboardButton("❌ Нет, оставить открытой", callback_data=CALLBACKS.encode("cn", shift_id=shift_id))],
     ]
     await query.edit_message_text(
         "Вы точно хотите закрыть смену?",
@@ -4394,19 +4095,17 @@ async def close_shift_confirm_prompt(query, context, data):
     )
 
 
-async def close_shift_confirm_yes(query, context, data):
-    parts = data.split('_')
-    if len(parts) < 4:
-        return
-    shift_id = int(parts[3])
+@CALLBACKS.route("cy", legacy="close_confirm_yes_", shift_id=int)
+async def close_shift_confirm_yes(query, context, payload):
+    shift_id = payload.shift_id
 
     user = query.from_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         await query.edit_message_text("❌ Ошибка: пользователь не найден")
         return
 
-    shift = DatabaseManager.get_shift(shift_id)
+    shift = await AsyncDatabaseManager.get_shift(shift_id)
     if not shift or shift['user_id'] != db_user['id']:
         await query.edit_message_text("❌ Смена не найдена")
         return
@@ -4414,11 +4113,11 @@ async def close_shift_confirm_yes(query, context, data):
         await query.edit_message_text("ℹ️ Эта смена уже закрыта.")
         return
 
-    total = DatabaseManager.get_shift_total(shift_id)
-    cars = DatabaseManager.get_shift_cars(shift_id)
+    total = await AsyncDatabaseManager.get_shift_total(shift_id)
+    cars = await AsyncDatabaseManager.get_shift_cars(shift_id)
     if not cars:
-        DatabaseManager.delete_shift(shift_id)
-        if DatabaseManager.is_goal_enabled(db_user["id"]):
+        await AsyncDatabaseManager.delete_shift(shift_id)
+        if await AsyncDatabaseManager.run(SETTINGS_STORE.is_goal_enabled, db_user["id"]):
             await send_goal_status(None, context, db_user["id"], source_message=query.message)
         await query.edit_message_text("🗑️ Пустая смена удалена и не сохранена в истории.")
         await query.message.reply_text(
@@ -4427,24 +4126,25 @@ async def close_shift_confirm_yes(query, context, data):
         )
         return
 
-    DatabaseManager.close_shift(shift_id)
-    if DatabaseManager.is_goal_enabled(db_user["id"]):
+    await AsyncDatabaseManager.close_shift(shift_id)
+    if await AsyncDatabaseManager.run(SETTINGS_STORE.is_goal_enabled, db_user["id"]):
         await send_goal_status(None, context, db_user["id"], source_message=query.message)
-    closed_shift = DatabaseManager.get_shift(shift_id) or shift
-    message = build_closed_shift_dashboard(closed_shift, cars, total)
+    closed_shift = await AsyncDatabaseManager.get_shift(shift_id) or shift
+    message = await AsyncDatabaseManager.run(build_closed_shift_dashboard, closed_shift, cars, total)
     await query.edit_message_text(
         message,
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 В меню", callback_data="back")]]),
     )
-    await query.message.reply_text(build_shift_repeat_report_text(shift_id))
+    await query.message.reply_text(await AsyncDatabaseManager.run(build_shift_repeat_report_text, shift_id))
     await query.message.reply_text(
         "Выбери действие:",
         reply_markup=create_main_reply_keyboard(False)
     )
 
 
-async def close_shift_confirm_no(query, context):
+@CALLBACKS.route("cn", legacy="close_confirm_no_", shift_id=int)
+async def close_shift_confirm_no(query, context, payload):
     await query.edit_message_text("Ок, смена остаётся открытой ✅")
     await query.message.reply_text(
         "Выбери действие:",
@@ -4454,13 +4154,13 @@ async def close_shift_confirm_no(query, context):
 async def go_back(query, context):
     """Возврат в главное меню"""
     user = query.from_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     has_active = False
     subscription_active = False
 
     if db_user:
-        has_active = DatabaseManager.get_active_shift(db_user['id']) is not None
-        subscription_active = is_subscription_active(db_user)
+        has_active = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']) is not None
+        subscription_active = await AsyncDatabaseManager.run(is_subscription_active, db_user)
 
     await query.edit_message_text("↩️ Возврат в главное меню")
     await query.message.reply_text(
@@ -4470,8 +4170,8 @@ async def go_back(query, context):
 
 async def change_goal(query, context):
     """Запрос цели смены"""
-    db_user = DatabaseManager.get_user(query.from_user.id)
-    if not db_user or not DatabaseManager.get_active_shift(db_user['id']):
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
+    if not db_user or not await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']):
         await query.edit_message_text("🎯 Цель смены доступна только при открытой смене.")
         return
     context.user_data['awaiting_goal'] = True
@@ -4481,18 +4181,18 @@ async def change_goal(query, context):
 
 async def change_decade_goal(query, context):
     """Тоггл цели декады: если включена — выключаем, иначе просим сумму."""
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    if DatabaseManager.is_goal_enabled(db_user["id"]):
-        DatabaseManager.set_goal_enabled(db_user["id"], False)
-        DatabaseManager.set_shift_goal(db_user["id"], 0)
+    if await AsyncDatabaseManager.run(SETTINGS_STORE.is_goal_enabled, db_user["id"]):
+        await AsyncDatabaseManager.run(SETTINGS_STORE.set_goal_enabled, db_user["id"], False)
+        await AsyncDatabaseManager.set_shift_goal(db_user["id"], 0)
         await disable_goal_status(context, db_user["id"])
         await query.edit_message_text(
             "✅ Цель декады выключена.",
-            reply_markup=build_settings_keyboard(db_user, is_admin_telegram(query.from_user.id))
+            reply_markup=await AsyncDatabaseManager.run(build_settings_keyboard, db_user, is_admin_telegram(query.from_user.id))
         )
         return
 
@@ -4501,21 +4201,21 @@ async def change_decade_goal(query, context):
 
 
 async def calendar_rebase_callback(query, context):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
     today = now_local().date()
     context.user_data["calendar_month"] = (today.year, today.month)
     context.user_data["calendar_setup_days"] = []
-    DatabaseManager.set_work_anchor_date(db_user["id"], "")
+    await AsyncDatabaseManager.set_work_anchor_date(db_user["id"], "")
     await query.edit_message_text(
         (
             f"📅 Календарь — {month_title(today.year, today.month)}\n\n"
             "Выберите 2 подряд идущих основных рабочих дня.\n"
             "Это обновит базовый график 2/2."
         ),
-        reply_markup=build_work_calendar_keyboard(
+        reply_markup=await AsyncDatabaseManager.run(build_work_calendar_keyboard,
             db_user,
             today.year,
             today.month,
@@ -4546,10 +4246,10 @@ async def leaderboard(query, context):
     """Топ героев: лидеры текущей декады"""
     today = now_local().date()
     idx, _, _, _, decade_title = get_decade_period(today)
-    decade_leaders = await asyncio.to_thread(get_cached_decade_leaderboard, today.year, today.month, idx)
+    decade_leaders = await AsyncDatabaseManager.run(LEADERBOARD_ENGINE.top, today.year, today.month, idx)
 
-    db_user = DatabaseManager.get_user(query.from_user.id)
-    has_active = bool(db_user and DatabaseManager.get_active_shift(db_user['id']))
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
+    has_active = bool(db_user and await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']))
     highlight_name = db_user["name"] if db_user else (query.from_user.first_name or "")
     await query.edit_message_text("🏆 Формирую рейтинг...")
     await send_leaderboard_output(
@@ -4576,11 +4276,11 @@ async def reset_data_prompt(query, context):
 
 
 async def reset_data_confirm_yes(query, context):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
-    DatabaseManager.reset_user_data(db_user['id'])
+    await AsyncDatabaseManager.reset_user_data(db_user['id'])
     context.user_data.clear()
     await query.edit_message_text("✅ Все ваши данные удалены.")
     await query.message.reply_text("Выбери действие:", reply_markup=create_main_reply_keyboard(False))
@@ -4591,29 +4291,29 @@ async def reset_data_confirm_no(query, context):
 
 
 async def toggle_shift_message(update: Update, context: CallbackContext):
-    db_user = DatabaseManager.get_user(update.effective_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
     if not db_user:
         await update.message.reply_text("❌ Пользователь не найден. Напиши /start")
         return
-    if DatabaseManager.get_active_shift(db_user['id']):
+    if await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']):
         await close_shift_message(update, context)
     else:
         await open_shift_message(update, context)
 
 
 async def toggle_lunch_message(update: Update, context: CallbackContext):
-    db_user = DatabaseManager.get_user(update.effective_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
     if not db_user:
         await update.message.reply_text("❌ Пользователь не найден. Напиши /start")
         return
 
-    active_shift = DatabaseManager.get_active_shift(db_user['id'])
+    active_shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])
     if not active_shift:
         await update.message.reply_text("📭 Нет активной смены.", reply_markup=create_main_reply_keyboard(False))
         return
 
-    paused_now = DatabaseManager.toggle_shift_pause(int(active_shift['id']))
-    refreshed = DatabaseManager.get_active_shift(db_user['id'])
+    paused_now = await AsyncDatabaseManager.toggle_shift_pause(int(active_shift['id']))
+    refreshed = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])
     if paused_now:
         await update.message.reply_text("🍱 Смена поставлена на паузу (обед).", reply_markup=create_main_reply_keyboard(True, True, True))
     else:
@@ -4622,25 +4322,25 @@ async def toggle_lunch_message(update: Update, context: CallbackContext):
 
 async def open_shift_message(update: Update, context: CallbackContext):
     user = update.effective_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         await update.message.reply_text("❌ Ошибка: пользователь не найден")
         return
 
-    _, message, _ = open_shift_core(db_user)
+    _, message, _ = await AsyncDatabaseManager.write(open_shift_core, db_user)
     await update.message.reply_text(
         message + "\n\n💡 Теперь просто отправляйте номер авто в чат в любой момент — машина добавится автоматически.",
-        reply_markup=main_menu_for_db_user(db_user, True)
+        reply_markup=await AsyncDatabaseManager.run(main_menu_for_db_user, db_user, True)
     )
 
 async def add_car_message(update: Update, context: CallbackContext):
     user = update.effective_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         await update.message.reply_text("❌ Ошибка: пользователь не найден")
         return
 
-    active_shift = DatabaseManager.get_active_shift(db_user['id'])
+    active_shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])
     if not active_shift:
         await update.message.reply_text(
             "❌ Нет активной смены!\nСначала откройте смену.",
@@ -4656,12 +4356,12 @@ async def add_car_message(update: Update, context: CallbackContext):
 
 async def history_message(update: Update, context: CallbackContext):
     user = update.effective_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         await update.message.reply_text("❌ Ошибка: пользователь не найден")
         return
 
-    shifts = DatabaseManager.get_user_shifts(db_user['id'], limit=10)
+    shifts = await AsyncDatabaseManager.get_user_shifts(db_user['id'], limit=10)
     if not shifts:
         await update.message.reply_text(
             "📜 У вас ещё нет смен.\nОткройте первую смену!",
@@ -4672,7 +4372,7 @@ async def history_message(update: Update, context: CallbackContext):
     today = now_local().date()
     idx, _, _, _, _ = get_decade_period(today)
     context.user_data["history_decades_page"] = max((idx - 1), 0)
-    message, markup = build_history_decades_page(db_user, context.user_data["history_decades_page"])
+    message, markup = await AsyncDatabaseManager.run(build_history_decades_page, db_user, context.user_data["history_decades_page"])
     if not message or not markup:
         await update.message.reply_text("📜 История пуста")
         return
@@ -4681,14 +4381,14 @@ async def history_message(update: Update, context: CallbackContext):
 
 async def current_shift_message(update: Update, context: CallbackContext):
     user = update.effective_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         await update.message.reply_text("❌ Ошибка: пользователь не найден")
         return
 
-    active_shift = DatabaseManager.get_active_shift(db_user['id'])
+    active_shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])
     if not active_shift:
-        message = build_decade_progress_dashboard(db_user['id'])
+        message = await AsyncDatabaseManager.run(build_decade_progress_dashboard, db_user['id'])
         await update.message.reply_text(
             message,
             parse_mode="HTML",
@@ -4696,9 +4396,9 @@ async def current_shift_message(update: Update, context: CallbackContext):
         )
         return
 
-    cars = DatabaseManager.get_shift_cars(active_shift['id'])
-    total = DatabaseManager.get_shift_total(active_shift['id'])
-    message = build_current_shift_dashboard(db_user['id'], active_shift, cars, total)
+    cars = await AsyncDatabaseManager.get_shift_cars(active_shift['id'])
+    total = await AsyncDatabaseManager.get_shift_total(active_shift['id'])
+    message = await AsyncDatabaseManager.run(build_current_shift_dashboard, db_user['id'], active_shift, cars, total)
     await update.message.reply_text(
             message,
             parse_mode="HTML",
@@ -4710,12 +4410,12 @@ async def current_shift_message(update: Update, context: CallbackContext):
 
 async def close_shift_message(update: Update, context: CallbackContext):
     user = update.effective_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         await update.message.reply_text("❌ Ошибка: пользователь не найден")
         return
 
-    active_shift = DatabaseManager.get_active_shift(db_user['id'])
+    active_shift = await AsyncDatabaseManager.run(get_current_shift, context, db_user['id'])
     if not active_shift:
         await update.message.reply_text(
             "📭 Нет активной смены для закрытия.",
@@ -4726,25 +4426,25 @@ async def close_shift_message(update: Update, context: CallbackContext):
     await update.message.reply_text(
         "Вы точно хотите закрыть смену?",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Да, закрыть", callback_data=f"close_confirm_yes_{active_shift['id']}")],
-            [InlineKeyboardButton("❌ Нет, оставить открытой", callback_data=f"close_confirm_no_{active_shift['id']}")],
+            [InlineKeyboardButton("✅ Да, закрыть", callback_data=CALLBACKS.encode("cy", shift_id=active_shift["id"]))],
+            [InlineKeyboardButton("❌ Нет, оставить открытой", callback_data=CALLBACKS.encode("cn", shift_id=active_shift["id"]))],
         ]),
     )
 
 async def settings_message(update: Update, context: CallbackContext):
-    db_user = DatabaseManager.get_user(update.effective_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
     await update.message.reply_text(
         f"⚙️ НАСТРОЙКИ\n\nВерсия: {APP_VERSION}\nОбновлено: {APP_UPDATED_AT}\n\nВыберите параметр:",
-        reply_markup=build_settings_keyboard(db_user, is_admin_telegram(update.effective_user.id))
+        reply_markup=await AsyncDatabaseManager.run(build_settings_keyboard, db_user, is_admin_telegram(update.effective_user.id))
     )
 
 async def leaderboard_message(update: Update, context: CallbackContext):
     today = now_local().date()
     idx, _, _, _, decade_title = get_decade_period(today)
-    decade_leaders = await asyncio.to_thread(get_cached_decade_leaderboard, today.year, today.month, idx)
+    decade_leaders = await AsyncDatabaseManager.run(LEADERBOARD_ENGINE.top, today.year, today.month, idx)
 
-    db_user = DatabaseManager.get_user(update.effective_user.id)
-    has_active = bool(db_user and DatabaseManager.get_active_shift(db_user['id']))
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, update.effective_user.id)
+    has_active = bool(db_user and await AsyncDatabaseManager.run(get_current_shift, context, db_user['id']))
     highlight_name = db_user["name"] if db_user else (update.effective_user.first_name or "")
     await send_leaderboard_output(
         update.message,
@@ -4759,11 +4459,11 @@ async def leaderboard_message(update: Update, context: CallbackContext):
 
 async def decade_message(update: Update, context: CallbackContext):
     user = update.effective_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         await update.message.reply_text("❌ Ошибка: пользователь не найден")
         return
-    message = build_decade_summary(db_user['id'])
+    message = await AsyncDatabaseManager.run(build_decade_summary, db_user['id'])
     await update.message.reply_text(
         message,
         parse_mode="HTML",
@@ -4778,14 +4478,14 @@ async def show_car_services(
     history_day: str | None = None,
 ):
     """Показать услуги машины"""
-    car = DatabaseManager.get_car(car_id)
+    car = await AsyncDatabaseManager.get_car(car_id)
     if not car:
         return None, None
 
     if not history_day:
         history_day = context.user_data.get(f"history_day_for_car_{car_id}")
 
-    services = DatabaseManager.get_car_services(car_id)
+    services = await AsyncDatabaseManager.get_car_services(car_id)
     services_text = ""
     for service in services:
         services_text += f"• {plain_service_name(service['service_name'])} ({service['price']}₽) ×{service['quantity']}\n"
@@ -4796,8 +4496,8 @@ async def show_car_services(
     edit_mode = get_edit_mode(context, car_id)
     mode_text = "✏️ Режим: удаление" if edit_mode else "➕ Режим: добавление"
 
-    db_user = DatabaseManager.get_user(query.from_user.id)
-    current_mode = get_price_mode(context, db_user["id"] if db_user else None)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
+    current_mode = await AsyncDatabaseManager.run(get_price_mode, context, db_user["id"] if db_user else None)
     price_text = "🌞 Прайс: день" if current_mode == "day" else "🌙 Прайс: ночь"
 
     header = f"🚗 Машина: {car['car_number']}\n"
@@ -4825,20 +4525,21 @@ async def show_car_services(
     )
 
 
-async def export_shift_repeats(query, context, data):
-    shift_id = int(data.replace("shift_repeats_", ""))
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("sr", legacy="shift_repeats_", shift_id=int)
+async def export_shift_repeats(query, context, payload):
+    shift_id = payload.shift_id
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    shift = DatabaseManager.get_shift(shift_id)
+    shift = await AsyncDatabaseManager.get_shift(shift_id)
     if not shift or shift["user_id"] != db_user["id"]:
         await query.edit_message_text("❌ Смена не найдена")
         return
 
     await query.edit_message_text(
-        build_shift_repeat_report_text(shift_id),
+        await AsyncDatabaseManager.run(build_shift_repeat_report_text, shift_id),
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 В меню", callback_data="back")]])
     )
@@ -4858,19 +4559,21 @@ def get_previous_decade_period(target_day: date | None = None) -> tuple[date, da
 
 async def notify_decade_change_if_needed(application: Application, db_user: dict):
     _, _, _, current_key, _ = get_decade_period(now_local().date())
-    last_key = DatabaseManager.get_last_decade_notified(db_user["id"])
+    last_key = await AsyncDatabaseManager.run(SETTINGS_STORE.get_last_decade_notified, db_user["id"])
     if not last_key:
-        DatabaseManager.set_last_decade_notified(db_user["id"], current_key)
+        await AsyncDatabaseManager.run(SETTINGS_STORE.set_last_decade_notified, db_user["id"], current_key)
         return
     if last_key == current_key:
         return
 
     prev_start, prev_end, year, month, idx = get_previous_decade_period(now_local().date())
-    text = build_period_summary_text(
+    text = await AsyncDatabaseManager.run(
+        build_period_summary_text,
         db_user["id"], prev_start, prev_end, f"Итог {idx}-й декады {MONTH_NAMES[month]} {year}"
     )
     try:
-        await application.bot.send_message(
+        await send_job_message(
+            application,
             chat_id=db_user["telegram_id"],
             text="🔔 Декада завершилась!\n\n" + text,
             parse_mode="HTML",
@@ -4878,23 +4581,25 @@ async def notify_decade_change_if_needed(application: Application, db_user: dict
     except Exception as exc:
         logger.warning(f"Не удалось отправить декадный отчёт {db_user['telegram_id']}: {exc}")
     finally:
-        DatabaseManager.set_last_decade_notified(db_user["id"], current_key)
+        await AsyncDatabaseManager.run(SETTINGS_STORE.set_last_decade_notified, db_user["id"], current_key)
 
 
-async def export_month_xlsx_callback(query, context, data):
-    body = data.replace("export_month_xlsx_", "")
-    year_s, month_s = body.split("_")
-    year, month = int(year_s), int(month_s)
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("xm", legacy="export_month_xlsx_", year=int, month=int)
+async def export_month_xlsx_callback(query, context, payload):
+    year, month = payload.year, payload.month
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         return
-    path = create_month_xlsx(db_user["id"], year, month)
-    with open(path, "rb") as file:
-        await query.message.reply_document(
-            document=file,
-            filename=os.path.basename(path),
-            caption=f"XLSX отчёт за {MONTH_NAMES[month].capitalize()} {year}",
-        )
+    await run_report_job(
+        query,
+        context,
+        ("month_xlsx", db_user["id"], year, month),
+        create_month_xlsx,
+        db_user["id"],
+        year,
+        month,
+        caption=f"XLSX отчёт за {MONTH_NAMES[month].capitalize()} {year}",
+    )
 
 
 async def notify_month_end_if_needed(application: Application, db_user: dict):
@@ -4904,18 +4609,20 @@ async def notify_month_end_if_needed(application: Application, db_user: dict):
     prev_day = now_dt.date() - timedelta(days=1)
     month_key = f"{prev_day.year:04d}-{prev_day.month:02d}"
     sent_key = f"month_report_sent_{db_user['id']}"
-    if DatabaseManager.get_app_content(sent_key, "") == month_key:
+    if await AsyncDatabaseManager.get_app_content(sent_key, "") == month_key:
         return
 
     start_d = date(prev_day.year, prev_day.month, 1)
-    text = build_period_summary_text(
+    text = await AsyncDatabaseManager.run(
+        build_period_summary_text,
         db_user["id"],
         start_d,
         prev_day,
         f"Итог месяца: {MONTH_NAMES[prev_day.month].capitalize()} {prev_day.year}",
     )
     try:
-        await application.bot.send_message(
+        await send_job_message(
+            application,
             chat_id=db_user["telegram_id"],
             text="🗓 Месяц завершён!\n\n" + text,
             parse_mode="HTML",
@@ -4923,7 +4630,7 @@ async def notify_month_end_if_needed(application: Application, db_user: dict):
     except Exception as exc:
         logger.warning(f"Не удалось отправить месячный отчёт {db_user['telegram_id']}: {exc}")
     finally:
-        DatabaseManager.set_app_content(sent_key, month_key)
+        await AsyncDatabaseManager.set_app_content(sent_key, month_key)
 
 
 async def send_period_reports_for_user(application: Application, db_user: dict):
@@ -4931,113 +4638,140 @@ async def send_period_reports_for_user(application: Application, db_user: dict):
     await notify_month_end_if_needed(application, db_user)
 
 
+async def send_job_message(application: Application, **kwargs):
+    """send_message для фоновых рассылок — под общим ограничителем скорости."""
+    await JOB_RATE_LIMITER.acquire()
+    return await application.bot.send_message(**kwargs)
+
+
 async def notify_subscription_events(application: Application):
     today = now_local().date()
-    users = DatabaseManager.get_all_users_with_stats()
-    for row in users:
+    # Окно с запасом в день с каждой стороны: в БД строка ISO, точное число дней
+    # считается ниже. Уведомления об окончании — за последние пару суток.
+    rows = await AsyncDatabaseManager.get_expiring_subscriptions(
+        (today - timedelta(days=3)).isoformat(),
+        (today + timedelta(days=3)).isoformat(),
+    )
+    notices = []
+    for row in rows:
         telegram_id = int(row["telegram_id"])
-        if is_admin_telegram(telegram_id) or int(row.get("is_blocked", 0)) == 1:
+        if is_admin_telegram(telegram_id):
             continue
-
-        db_user = DatabaseManager.get_user_by_id(int(row["id"]))
-        expires_at = subscription_expires_at_for_user(db_user) if db_user else None
+        expires_at = parse_subscription_expires_at(row["subscription_expires_at"])
         if not expires_at:
             continue
-
         expires_date = expires_at.astimezone(LOCAL_TZ).date()
         days_left = (expires_date - today).days
-
         if days_left == 1:
             key = f"sub_notice_1d_{row['id']}_{expires_date.isoformat()}"
-            if DatabaseManager.get_app_content(key, "") != "1":
-                try:
-                    await application.bot.send_message(
-                        chat_id=telegram_id,
-                        text=(
-                            "⏳ До окончания подписки остался 1 день.\n"
-                            f"Доступ до: {format_subscription_until(expires_at)}\n\n"
-                            f"Продление: {SUBSCRIPTION_PRICE_TEXT}. Напишите: {SUBSCRIPTION_CONTACT}"
-                        ),
-                    )
-                except Exception:
-                    pass
-                DatabaseManager.set_app_content(key, "1")
-
-        if days_left <= 0:
+            text = (
+                "⏳ До окончания подписки остался 1 день.\n"
+                f"Доступ до: {format_subscription_until(expires_at)}\n\n"
+                f"Продление: {SUBSCRIPTION_PRICE_TEXT}. Напишите: {SUBSCRIPTION_CONTACT}"
+            )
+        elif days_left <= 0:
             key = f"sub_notice_expired_{row['id']}_{expires_date.isoformat()}"
-            if DatabaseManager.get_app_content(key, "") != "1":
-                try:
-                    await application.bot.send_message(
-                        chat_id=telegram_id,
-                        text=(
-                            "⛔ Подписка закончилась.\n"
-                            "Аккаунт деактивирован, доступен только раздел «👤 Профиль».\n\n"
-                            f"Чтобы продлить ({SUBSCRIPTION_PRICE_TEXT}), напишите: {SUBSCRIPTION_CONTACT}"
-                        ),
-                    )
-                except Exception:
-                    pass
-                DatabaseManager.set_app_content(key, "1")
+            text = (
+                "⛔ Подписка закончилась.\n"
+                "Аккаунт деактивирован, доступен только раздел «👤 Профиль».\n\n"
+                f"Чтобы продлить ({SUBSCRIPTION_PRICE_TEXT}), напишите: {SUBSCRIPTION_CONTACT}"
+            )
+        else:
+            continue
+        notices.append((key, telegram_id, text))
+
+    sent = await AsyncDatabaseManager.get_app_content_many([key for key, _, _ in notices])
+    notices = [notice for notice in notices if sent.get(notice[0]) != "1"]
 
+    async def send(notice):
+        _, telegram_id, text = notice
+        try:
+            await send_job_message(application, chat_id=telegram_id, text=text)
+        except Exception:
+            pass
 
+    await fan_out(notices, send)
+    await AsyncDatabaseManager.set_app_content_many({key: "1" for key, _, _ in notices})
+
+
+@track_job
 async def scheduled_subscription_notifications_job(context: CallbackContext):
     await notify_subscription_events(context.application)
 
 
 async def notify_shift_close_prompts(application: Application):
     now_dt = now_local()
-    users = DatabaseManager.get_all_users_with_stats()
-    for row in users:
-        db_user = DatabaseManager.get_user_by_id(int(row["id"]))
-        if not db_user:
-            continue
-        active_shift = DatabaseManager.get_active_shift(db_user["id"])
-        if not active_shift:
-            continue
-
-        start_dt = parse_datetime(active_shift.get("start_time"))
+    candidates = []
+    for shift in await AsyncDatabaseManager.get_long_open_shifts(now_dt - timedelta(hours=12)):
+        start_dt = parse_datetime(shift.get("start_time"))
         if not start_dt:
             continue
         if start_dt.tzinfo is None:
             start_dt = start_dt.replace(tzinfo=LOCAL_TZ)
-
-        hours_open = (now_dt - start_dt).total_seconds() / 3600
-        if hours_open < 12:
+        if (now_dt - start_dt).total_seconds() / 3600 < 12:
             continue
+        candidates.append((f"shift_close_prompt_{shift['id']}", shift))
 
-        key = f"shift_close_prompt_{active_shift['id']}"
-        if DatabaseManager.get_app_content(key, "") == "1":
-            continue
+    sent = await AsyncDatabaseManager.get_app_content_many([key for key, _ in candidates])
+    candidates = [(key, shift) for key, shift in candidates if sent.get(key) != "1"]
 
+    async def send(candidate):
+        key, shift = candidate
         try:
-            await application.bot.send_message(
-                chat_id=db_user["telegram_id"],
+            await send_job_message(
+                application,
+                chat_id=shift["telegram_id"],
                 text=(
                     "⏱ Смена открыта уже 12+ часов.\nЗакрыть её сейчас?"
                 ),
                 reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("✅ Закрыть смену", callback_data=f"close_confirm_yes_{active_shift['id']}")],
-                    [InlineKeyboardButton("❌ Оставить открытой", callback_data=f"close_confirm_no_{active_shift['id']}")],
+                    [InlineKeyboardButton("✅ Закрыть смену", callback_data=CALLBACKS.encode("cy", shift_id=shift["id"]))],
+                    [InlineKeyboardButton("❌ Оставить открытой", callback_data=CALLBACKS.encode("cn", shift_id=shift["id"]))],
                 ]),
             )
-            DatabaseManager.set_app_content(key, "1")
         except Exception:
-            continue
+            return None
+        return key
 
+    delivered = await fan_out(candidates, send)
+    await AsyncDatabaseManager.set_app_content_many({key: "1" for key in delivered if key})
 
+
+@track_job
 async def scheduled_shift_close_prompts_job(context: CallbackContext):
     await notify_shift_close_prompts(context.application)
 
 
-async def scheduled_period_reports(application: Application):
-    users = DatabaseManager.get_all_users_with_stats()
-    for row in users:
-        db_user = DatabaseManager.get_user_by_id(int(row["id"]))
-        if not db_user or is_user_blocked(db_user):
-            continue
-        await send_period_reports_for_user(application, db_user)
+@track_job
+async def flush_user_settings_job(context: CallbackContext):
+    await AsyncDatabaseManager.run(SETTINGS_STORE.flush)
+
+
+@track_job
+async def scheduled_backup_job(context: CallbackContext):
+    # тот же ключ, что у кнопки админа: одновременно идёт не больше одного бэкапа
+    job, _ = REPORT_JOBS.submit(("backup_db",), create_db_backup)
+    try:
+        await job.result()
+    except Exception:
+        # ошибку уже записал REPORT_JOBS
+        pass
 
 
+async def scheduled_period_reports(application: Application):
+    today = now_local().date()
+    _, _, _, decade_key, _ = get_decade_period(today)
+    month_key = ""
+    if today.day == 1:
+        prev_day = today - timedelta(days=1)
+        month_key = f"{prev_day.year:04d}-{prev_day.month:02d}"
+    # last_decade_notified пишется через кэш настроек — сначала сбрасываем его в БД.
+    await AsyncDatabaseManager.run(SETTINGS_STORE.flush)
+    users = await AsyncDatabaseManager.get_period_report_candidates(decade_key, month_key)
+    await fan_out(users, lambda db_user: send_period_reports_for_user(application, db_user))
+
+
+@track_job
 async def scheduled_period_reports_job(context: CallbackContext):
     await scheduled_period_reports(context.application)
 
@@ -5045,14 +4779,14 @@ async def scheduled_period_reports_job(context: CallbackContext):
 
 async def toggle_price_mode(query, context):
     user = query.from_user
-    db_user = DatabaseManager.get_user(user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    current = get_price_mode(context, db_user['id'])
+    current = await AsyncDatabaseManager.run(get_price_mode, context, db_user['id'])
     new_mode = "night" if current == "day" else "day"
-    set_manual_price_mode(context, db_user['id'], new_mode)
+    await AsyncDatabaseManager.run(set_manual_price_mode, context, db_user['id'], new_mode)
     label = "🌙 Ночной" if new_mode == "night" else "☀️ Дневной"
     await query.edit_message_text(
         f"✅ Прайс переключен: {label}\n"
@@ -5061,12 +4795,12 @@ async def toggle_price_mode(query, context):
 
 
 async def cleanup_data_menu(query, context):
-    db_user = DatabaseManager.get_user(query.from_user.id)
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    months = DatabaseManager.get_user_months_with_data(db_user["id"], limit=18)
+    months = await AsyncDatabaseManager.get_user_months_with_data(db_user["id"], limit=18)
     if not months:
         await query.edit_message_text("🧹 Нет данных для очистки.")
         return
@@ -5078,7 +4812,7 @@ async def cleanup_data_menu(query, context):
         keyboard.append([
             InlineKeyboardButton(
                 f"{MONTH_NAMES[month_i].capitalize()} {year}",
-                callback_data=f"cleanup_month_{ym}",
+                callback_data=CALLBACKS.encode("um", month=ym),
             )
         ])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="settings")])
@@ -5088,15 +4822,15 @@ async def cleanup_data_menu(query, context):
     )
 
 
-async def cleanup_month(query, context, data):
-    ym = data.replace("cleanup_month_", "")
-    year, month = ym.split('-')
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("um", legacy="cleanup_month_", month=str)
+async def cleanup_month(query, context, payload):
+    year, month = payload.month.split('-')
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    days = DatabaseManager.get_month_days_with_totals(db_user['id'], int(year), int(month))
+    days = await AsyncDatabaseManager.get_month_days_with_totals(db_user['id'], int(year), int(month))
     if not days:
         await query.edit_message_text("В этом месяце нет данных.")
         return
@@ -5107,21 +4841,22 @@ async def cleanup_month(query, context, data):
         keyboard.append([
             InlineKeyboardButton(
                 f"{day_value} • машин: {day_info['cars_count']} • {format_money(day_info['total_amount'])}",
-                callback_data=f"cleanup_day_{day_value}",
+                callback_data=CALLBACKS.encode("ud", day=day_value),
             )
         ])
     keyboard.append([InlineKeyboardButton("🔙 К месяцам", callback_data="cleanup_data")])
     await query.edit_message_text("Выберите день:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def cleanup_day(query, context, data):
-    day = data.replace("cleanup_day_", "")
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("ud", legacy="cleanup_day_", day=str)
+async def cleanup_day(query, context, payload):
+    day = payload.day
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    cars = DatabaseManager.get_cars_for_day(db_user['id'], day)
+    cars = await AsyncDatabaseManager.get_cars_for_day(db_user['id'], day)
     if not cars:
         await query.edit_message_text("За этот день машин нет.")
         return
@@ -5133,13 +4868,13 @@ async def cleanup_day(query, context, data):
         keyboard.append([
             InlineKeyboardButton(
                 f"🗑️ Удалить {car['car_number']}",
-                callback_data=f"delcar_{car['id']}_{day}",
+                callback_data=CALLBACKS.encode("dx", car_id=car["id"], day=day),
             )
         ])
 
-    keyboard.append([InlineKeyboardButton("📋 Отчёт повторок", callback_data=f"day_repeats_{day}")])
-    keyboard.append([InlineKeyboardButton("⚠️ Удалить весь день", callback_data=f"delday_prompt_{day}")])
-    keyboard.append([InlineKeyboardButton("🔙 К дням", callback_data=f"cleanup_month_{day[:7]}")])
+    keyboard.append([InlineKeyboardButton("📋 Отчёт повторок", callback_data=CALLBACKS.encode("dr", day=day))])
+    keyboard.append([InlineKeyboardButton("⚠️ Удалить весь день", callback_data=CALLBACKS.encode("yp", day=day))])
+    keyboard.append([InlineKeyboardButton("🔙 К дням", callback_data=CALLBACKS.encode("um", month=day[:7]))])
     await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
@@ -5163,37 +4898,38 @@ def build_day_repeat_report_text(user_id: int, day: str) -> str:
     return f"📋 Отчёт повторок за {day}\n\n" + "\n".join(lines)
 
 
-async def day_repeats_callback(query, context, data):
-    day = data.replace("day_repeats_", "")
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("dr", legacy="day_repeats_", day=str)
+async def day_repeats_callback(query, context, payload):
+    day = payload.day
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
     await query.answer()
-    await query.message.reply_text(build_day_repeat_report_text(db_user['id'], day))
+    await query.message.reply_text(await AsyncDatabaseManager.run(build_day_repeat_report_text, db_user['id'], day))
 
 
-async def delete_car_callback(query, context, data):
-    body = data.replace("delcar_", "")
-    car_id_s, day = body.split("_", 1)
-    car_id = int(car_id_s)
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("dx", legacy="delcar_", car_id=int, day=str)
+async def delete_car_callback(query, context, payload):
+    car_id, day = payload.car_id, payload.day
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    ok = DatabaseManager.delete_car_for_user(db_user['id'], car_id)
-    DatabaseManager.prune_empty_shifts_for_user(db_user['id'])
+    ok = await AsyncDatabaseManager.delete_car_for_user(db_user['id'], car_id)
+    await AsyncDatabaseManager.prune_empty_shifts_for_user(db_user['id'])
     if ok:
         await query.answer("Машина удалена")
-    await cleanup_day(query, context, f"cleanup_day_{day}")
+    await cleanup_day(query, context, CALLBACKS.payload("ud", day=day))
 
 
-async def delete_day_prompt(query, context, data):
-    day = data.replace("delday_prompt_", "")
+@CALLBACKS.route("yp", legacy="delday_prompt_", day=str)
+async def delete_day_prompt(query, context, payload):
+    day = payload.day
     keyboard = [
-        [InlineKeyboardButton("✅ Да, удалить день", callback_data=f"delday_confirm_{day}")],
-        [InlineKeyboardButton("⬅️ Отмена", callback_data=f"cleanup_month_{day[:7]}")],
+        [InlineKeyboardButton("✅ Да, удалить день", callback_data=CALLBACKS.encode("yc", day=day))],
+        [InlineKeyboardButton("⬅️ Отмена", callback_data=CALLBACKS.encode("um", month=day[:7]))],
     ]
     await query.edit_message_text(
         f"Удалить все машины за {day}?",
@@ -5201,20 +4937,21 @@ async def delete_day_prompt(query, context, data):
     )
 
 
-async def delete_day_callback(query, context, data):
-    day = data.replace("delday_confirm_", "")
-    db_user = DatabaseManager.get_user(query.from_user.id)
+@CALLBACKS.route("yc", legacy="delday_confirm_", day=str)
+async def delete_day_callback(query, context, payload):
+    day = payload.day
+    db_user = await AsyncDatabaseManager.run(get_db_user, context, query.from_user.id)
     if not db_user:
         await query.edit_message_text("❌ Пользователь не найден")
         return
 
-    deleted = DatabaseManager.delete_day_data(db_user['id'], day)
-    removed_shifts = DatabaseManager.prune_empty_shifts_for_user(db_user['id'])
+    deleted = await AsyncDatabaseManager.delete_day_data(db_user['id'], day)
+    removed_shifts = await AsyncDatabaseManager.prune_empty_shifts_for_user(db_user['id'])
     await query.edit_message_text(
         f"✅ Удалено машин за день {day}: {deleted}\n"
         f"Пустых смен удалено: {removed_shifts}"
     )
-    await cleanup_month(query, context, f"cleanup_month_{day[:7]}")
+    await cleanup_month(query, context, CALLBACKS.payload("um", month=day[:7]))
 
 
 # ========== ОБРАБОТЧИК ОШИБОК ==========
@@ -5230,6 +4967,8 @@ async def error_handler(update: Update, context: CallbackContext):
             pass
 
 async def on_startup(application: Application):
+    start_db_writer()
+    application.bot_data["metrics_server"] = start_metrics_server()
     if application.job_queue:
         application.job_queue.run_daily(
             scheduled_period_reports_job,
@@ -5248,17 +4987,35 @@ async def on_startup(application: Application):
             first=60,
             name="shift_close_prompts_hourly",
         )
+        application.job_queue.run_repeating(
+            flush_user_settings_job,
+            interval=SETTINGS_FLUSH_SECONDS,
+            first=SETTINGS_FLUSH_SECONDS,
+            name="user_settings_flush",
+        )
+        if BACKUP_INTERVAL_HOURS > 0:
+            application.job_queue.run_repeating(
+                scheduled_backup_job,
+                interval=BACKUP_INTERVAL_HOURS * 3600,
+                first=300,
+                name="db_backup",
+            )
+
+    # незавершённые после рестарта рассылки продолжаются с непройденных адресатов
+    for job_id in await AsyncDatabaseManager.get_unfinished_broadcast_jobs():
+        start_broadcast_job(application, job_id)
 
-    rollout_done = DatabaseManager.get_app_content("trial_rollout_done", "")
+    rollout_done = await AsyncDatabaseManager.get_app_content("trial_rollout_done", "")
     if rollout_done == APP_VERSION:
         await notify_subscription_events(application)
         await notify_shift_close_prompts(application)
         return
 
-    activated = ensure_trial_for_existing_users()
+    activated = await AsyncDatabaseManager.run(ensure_trial_for_existing_users)
     for row in activated:
         try:
-            await application.bot.send_message(
+            await send_job_message(
+                application,
                 chat_id=row["telegram_id"],
                 text=(
                     "🎉 Ваш аккаунт активирован на 7 дней!\n"
@@ -5269,16 +5026,115 @@ async def on_startup(application: Application):
         except Exception:
             continue
 
-    DatabaseManager.set_app_content("trial_rollout_done", APP_VERSION)
+    await AsyncDatabaseManager.set_app_content("trial_rollout_done", APP_VERSION)
     await notify_subscription_events(application)
     await notify_shift_close_prompts(application)
 
 
+async def on_shutdown(application: Application):
+    await stop_broadcast_jobs()
+    try:
+        SETTINGS_STORE.flush()
+    except Exception:
+        logger.exception("final user settings flush failed")
+    REPORT_JOBS.shutdown()
+    # внутри API пул и писатель БД общие с его запросами — их останавливает api.on_shutdown
+    if not application.bot_data.get(EMBEDDED_BOT_DATA_KEY):
+        shutdown_db_executor()
+    metrics_server = application.bot_data.pop("metrics_server", None)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
+
+# ========== МАРШРУТЫ CALLBACK ==========
+# Здесь только кнопки с фиксированной строкой. Кнопки с параметрами — типизированные
+# маршруты @CALLBACKS.route рядом с обработчиком; старый формат "prefix_a_b" уже
+# отправленных сообщений разбирается через legacy= того же маршрута.
+def register_legacy_callbacks(router: CallbackRouter) -> None:
+    exact_handlers = {
+        "open_shift": open_shift,
+        "add_car": add_car,
+        "current_shift": current_shift,
+        "refresh_dashboard": current_shift,
+        "history_0": history,
+        "settings": settings,
+        "change_decade_goal": change_decade_goal,
+        "calendar_rebase": calendar_rebase_callback,
+        "leaderboard": leaderboard,
+        "export_csv": export_csv,
+        "backup_db": backup_db,
+        "reset_data": reset_data_prompt,
+        "reset_data_yes": reset_data_confirm_yes,
+        "reset_data_no": reset_data_confirm_no,
+        "toggle_price": toggle_price_mode,
+        "combo_settings": combo_settings_menu,
+        "combo_create_settings": combo_builder_start,
+        "admin_panel": admin_panel,
+        "admin_users": admin_users,
+        "admin_banned_users": admin_banned_users,
+        "admin_subscriptions": admin_subscriptions,
+        "admin_broadcast_menu": admin_broadcast_menu,
+        "admin_broadcast_all": lambda q, c: admin_broadcast_prepare(q, c, "all"),
+        "admin_broadcast_expiring_1d": lambda q, c: admin_broadcast_prepare(q, c, "expiring_1d"),
+        "admin_broadcast_expired": lambda q, c: admin_broadcast_prepare(q, c, "expired"),
+        "admin_broadcast_pick_user": admin_broadcast_pick_user,
+        "admin_broadcast_cancel": admin_broadcast_cancel,
+        "faq": faq_callback,
+        "nav_shift": nav_shift_callback,
+        "nav_navigator": nav_navigator_callback,
+        "nav_history": nav_history_callback,
+        "nav_tools": nav_tools_callback,
+        "nav_help": nav_help_callback,
+        "subscription_info": subscription_info_callback,
+        "subscription_info_photo": subscription_info_photo_callback,
+        "account_info": account_info_callback,
+        "profile_change_name": profile_change_name_callback,
+        "profile_change_rank_prefix": profile_change_rank_prefix_callback,
+        "show_price": show_price_callback,
+        "calendar_open": calendar_callback,
+        "nav:back": nav_back_callback,
+        "admin_faq_menu": admin_faq_menu,
+        "admin_media_menu": admin_media_menu,
+        "admin_media_set_profile": lambda q, c: admin_media_set_target(q, c, "profile"),
+        "admin_media_set_leaderboard": lambda q, c: admin_media_set_target(q, c, "leaderboard"),
+        "admin_media_clear_profile": lambda q, c: admin_media_clear_target(q, c, "profile"),
+        "admin_media_clear_leaderboard": lambda q, c: admin_media_clear_target(q, c, "leaderboard"),
+        "admin_faq_set_text": admin_faq_set_text,
+        "admin_faq_set_video": admin_faq_set_video,
+        "admin_faq_preview": admin_faq_preview,
+        "admin_faq_clear_video": admin_faq_clear_video,
+        "admin_faq_topics": admin_faq_topics,
+        "admin_faq_topic_add": admin_faq_topic_add,
+        "admin_faq_cancel": admin_faq_cancel,
+        "combo_builder_save": combo_builder_save,
+        "combo_builder_toggle_prev": lambda q, c: combo_builder_page(q, c, router.payload("bn", step=-1)),
+        "combo_builder_toggle_next": lambda q, c: combo_builder_page(q, c, router.payload("bn", step=1)),
+        "history_decades": history_decades,
+        "back": go_back,
+        "cleanup_data": cleanup_data_menu,
+        "cancel_add_car": cancel_add_car_callback,
+        "noop": noop_callback,
+    }
+    for data, handler in exact_handlers.items():
+        router.exact(data, handler)
+
+
+register_legacy_callbacks(CALLBACKS)
+
+
 # ========== ГЛАВНАЯ ФУНКЦИЯ ==========
 
-def main():
-    """Запуск бота"""
-    application = Application.builder().token(BOT_TOKEN).post_init(on_startup).build()
+# обновления, на которые есть обработчики; остальные Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+
+def build_application() -> Application:
+    """Собирает Application со всеми обработчиками (для polling и для webhook в api.py)."""
+    builder = Application.builder().token(BOT_TOKEN).post_init(on_startup).post_shutdown(on_shutdown)
+    if UPDATE_CONCURRENCY > 1:
+        # разные пользователи обрабатываются параллельно, обновления одного — по очереди
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+    application = builder.build()
     
     # Регистрация команд
     application.add_handler(CommandHandler("start", start_command))
@@ -5293,6 +5149,12 @@ def main():
     
     # Обработчик ошибок
     application.add_error_handler(error_handler)
+    return application
+
+
+def main():
+    """Запуск бота (long polling)"""
+    application = build_application()
     
     # Запуск бота
     logger.info(f"🤖 Бот запускается... Версия: {APP_VERSION}")
@@ -5304,7 +5166,7 @@ def main():
     print("✅ Просто работает")
     print("=" * 60)
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
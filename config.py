@@ -81,6 +81,14 @@ SERVICES = {
     47: {"name": "🔧 Удалённая заправка", "day_price": 545, "night_price": 433, "priority": 4, "order": 17},
 }
 
+# Короткие названия услуг для быстрого ввода ("А123ВС пров запр2"), поиска в боте и API
+FAST_SERVICE_ALIASES = {
+    1: ["проверка", "пров", "провер", "чек"],
+    2: ["заправка", "запр", "топливо", "бенз"],
+    3: ["омыв", "омывка", "омывайка", "зали", "зо", "заливка"],
+    14: ["перепарковка", "перепарк", "парковка", "некорректная", "некк", "нек", "некорр"],
+}
+
 # ========== ФУНКЦИИ НОРМАЛИЗАЦИИ ==========
 
 def normalize_car_number(text: str) -> str:
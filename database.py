@@ -1,508 +1,1240 @@
 import sqlite3
+import asyncio
+import functools
 import json
 import calendar
-from datetime import datetime
+import logging
+import inspect
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterator, List, Optional
+
+from config import normalize_car_number
+from services.metrics import DB_QUERY_ROWS, DB_QUERY_SECONDS
 
 DB_PATH = "service_bot.db"
 DB_TIMEZONE = "Europe/Moscow"
 LOCAL_TZ = ZoneInfo(DB_TIMEZONE)
-SHIFT_WORK_DAY_EXPR = "COALESCE(NULLIF(s.work_date, ''), date(s.start_time, '+3 hours'))"
+# Рабочий день смены материализован в shifts.work_date (заполняется при записи и триггером),
+# поэтому фильтры по дню идут через индекс (user_id, work_date).
+SHIFT_WORK_DAY_EXPR = "s.work_date"
+DB_EXECUTOR_WORKERS = max(1, int(os.getenv("DB_EXECUTOR_WORKERS", "4")))
+DB_BUSY_TIMEOUT_MS = max(0, int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")))
+# Запись через один поток-писатель с групповым commit (см. DatabaseWriter)
+DB_SINGLE_WRITER = os.getenv("DB_SINGLE_WRITER", "0") == "1"
+DB_WRITE_BATCH = max(1, int(os.getenv("DB_WRITE_BATCH", "64")))
+
+logger = logging.getLogger(__name__)
 
 
 def now_local() -> datetime:
     return datetime.now(LOCAL_TZ)
 
+
+# ========== РЕЖИМ ЦЕН ==========
+# Дневной тариф с 09:00 до 21:00. Ручной выбор действует до ближайшей границы
+# (price_mode_lock_until), после неё режим снова вычисляется по времени и в БД не пишется.
+def get_mode_by_time(current_dt: datetime | None = None) -> str:
+    current = current_dt or now_local()
+    hour = current.hour
+    return "night" if hour >= 21 or hour < 9 else "day"
+
+
+def get_next_price_boundary(current_dt: datetime | None = None) -> datetime:
+    current = current_dt or now_local()
+    today_9 = current.replace(hour=9, minute=0, second=0, microsecond=0)
+    today_21 = current.replace(hour=21, minute=0, second=0, microsecond=0)
+
+    if current < today_9:
+        return today_9
+    if current < today_21:
+        return today_21
+    return (current + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+
+
+def effective_price_mode(stored_mode: str, lock_until_raw: str, current_dt: datetime | None = None) -> str:
+    current = current_dt or now_local()
+    if lock_until_raw:
+        try:
+            lock_until = datetime.fromisoformat(lock_until_raw)
+        except ValueError:
+            lock_until = None
+        if lock_until is not None:
+            if lock_until.tzinfo is None:
+                lock_until = lock_until.replace(tzinfo=LOCAL_TZ)
+            if current < lock_until:
+                return "night" if stored_mode == "night" else "day"
+    return get_mode_by_time(current)
+
+
+def car_number_key(car_number: str) -> str:
+    """Ключ поиска машины: номер без пробелов, заглавными, латиница заменена кириллицей."""
+    return normalize_car_number(car_number) or str(car_number or "").strip().upper()
+
+
+def _month_bounds(year: int, month: int) -> tuple[str, str]:
+    last_day = calendar.monthrange(year, month)[1]
+    return f"{year:04d}-{month:02d}-01", f"{year:04d}-{month:02d}-{last_day:02d}"
+
+
 def get_connection():
-    conn = sqlite3.connect(DB_PATH, timeout=30)
+    """Открывает отдельное соединение (для пула и разовых служебных задач)."""
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
-    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
     return conn
 
+
+class ConnectionManager:
+    """Пул соединений SQLite с привязкой к потоку.
+
+    Каждый поток (а значит, и event loop, живущий в нём) держит одно
+    соединение: PRAGMA выполняются один раз при открытии. Вложенные
+    session() переиспользуют транзакцию внешней сессии.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[int, sqlite3.Connection] = {}
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.path == DB_PATH:
+            return conn
+        if conn is not None:
+            self._discard_current()
+        conn = get_connection()
+        self._local.conn = conn
+        self._local.path = DB_PATH
+        self._local.depth = 0
+        self._local.pending = []
+        with self._lock:
+            self._connections[threading.get_ident()] = conn
+        return conn
+
+    @contextmanager
+    def session(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        """immediate=True сразу берёт блокировку записи (BEGIN IMMEDIATE):
+        чтение и запись внутри сессии не пересекутся с другим писателем."""
+        conn = self.connection()
+        depth = self._local.depth
+        self._local.depth = depth + 1
+        callbacks = []
+        try:
+            if immediate and not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+        except BaseException:
+            if depth == 0:
+                conn.rollback()
+                self._local.pending = []
+            raise
+        else:
+            if depth == 0:
+                conn.commit()
+                callbacks, self._local.pending = self._local.pending, []
+        finally:
+            self._local.depth = depth
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("after-commit callback failed")
+
+    @contextmanager
+    def savepoint(self, name: str = "sp") -> Iterator[sqlite3.Connection]:
+        """Точка отката внутри открытой транзакции: ошибка отменяет только
+        изменения блока и его отложенные after_commit-callback'и."""
+        conn = self.connection()
+        mark = len(self._local.pending)
+        conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            del self._local.pending[mark:]
+            raise
+        else:
+            conn.execute(f"RELEASE {name}")
+
+    def in_session(self) -> bool:
+        """Открыта ли в этом потоке сессия (а значит, и транзакция)."""
+        return getattr(self._local, "depth", 0) > 0
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """Откладывает callback до фиксации внешней транзакции; при откате он отбрасывается."""
+        self.connection()
+        if self._local.depth == 0:
+            callback()
+            return
+        self._local.pending.append(callback)
+
+    def _discard_current(self) -> None:
+        conn = self._local.conn
+        self._local.conn = None
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self) -> None:
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+db = ConnectionManager()
+
+# Подписчики на изменения данных: topic -> callbacks. Вызываются после commit.
+_change_listeners: Dict[str, List[Callable]] = {}
+
+
+def add_change_listener(topic: str, callback: Callable) -> None:
+    _change_listeners.setdefault(topic, []).append(callback)
+
+
+def remove_change_listener(topic: str, callback: Callable) -> None:
+    listeners = _change_listeners.get(topic, [])
+    if callback in listeners:
+        listeners.remove(callback)
+
+
+def _publish(topic: str, *args) -> None:
+    listeners = list(_change_listeners.get(topic, ()))
+    if not listeners:
+        return
+
+    def deliver():
+        for listener in listeners:
+            listener(*args)
+
+    db.after_commit(deliver)
+
 def init_database():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("PRAGMA journal_mode = WAL")
-    cur.execute("PRAGMA synchronous = NORMAL")
-    cur.execute("PRAGMA temp_store = MEMORY")
+    with db.session() as conn:
+        cur = conn.cursor()
+        cur.execute("PRAGMA journal_mode = WAL")
+        cur.execute("PRAGMA synchronous = NORMAL")
+        cur.execute("PRAGMA temp_store = MEMORY")
     
-    # Таблица пользователей
-    cur.execute("""CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        telegram_id BIGINT UNIQUE NOT NULL,
-        name TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )""")
+        # Таблица пользователей
+        cur.execute("""CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id BIGINT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
     
-    # Таблица смен
-    cur.execute("""CREATE TABLE IF NOT EXISTS shifts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        start_time TIMESTAMP NOT NULL,
-        end_time TIMESTAMP,
-        status TEXT DEFAULT 'active',
-        shift_target INTEGER DEFAULT 0,
-        work_date TEXT DEFAULT '',
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-    )""")
+        # Таблица смен
+        cur.execute("""CREATE TABLE IF NOT EXISTS shifts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            shift_target INTEGER DEFAULT 0,
+            work_date TEXT DEFAULT '',
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )""")
     
-    # Таблица машин
-    cur.execute("""CREATE TABLE IF NOT EXISTS cars (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        shift_id INTEGER NOT NULL,
-        car_number TEXT NOT NULL,
-        total_amount INTEGER DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (shift_id) REFERENCES shifts(id) ON DELETE CASCADE
-    )""")
+        # Таблица машин
+        cur.execute("""CREATE TABLE IF NOT EXISTS cars (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            shift_id INTEGER NOT NULL,
+            car_number TEXT NOT NULL,
+            total_amount INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (shift_id) REFERENCES shifts(id) ON DELETE CASCADE
+        )""")
     
-    # Таблица услуг
-    cur.execute("""CREATE TABLE IF NOT EXISTS car_services (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        car_id INTEGER NOT NULL,
-        service_id INTEGER NOT NULL,
-        service_name TEXT NOT NULL,
-        price INTEGER NOT NULL,
-        quantity INTEGER DEFAULT 1,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (car_id) REFERENCES cars(id) ON DELETE CASCADE
-    )""")
-
-    # Таблица настроек пользователя
-    cur.execute("""CREATE TABLE IF NOT EXISTS user_settings (
-        user_id INTEGER PRIMARY KEY,
-        daily_goal INTEGER DEFAULT 0,
-        decade_goal INTEGER DEFAULT 0,
-        price_mode TEXT DEFAULT 'day',
-        last_decade_notified TEXT DEFAULT '',
-        is_blocked INTEGER DEFAULT 0,
-        include_in_leaderboard INTEGER DEFAULT 1,
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-    )""")
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS app_content (
-        key TEXT PRIMARY KEY,
-        value TEXT DEFAULT ''
-    )""")
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS banned_users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        telegram_id BIGINT UNIQUE NOT NULL,
-        name TEXT NOT NULL,
-        banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        reason TEXT DEFAULT ''
-    )""")
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS user_calendar_overrides (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        day TEXT NOT NULL,
-        day_type TEXT NOT NULL,
-        UNIQUE(user_id, day),
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-    )""")
-
-    # Таблица пользовательских комбинаций услуг
-    cur.execute("""CREATE TABLE IF NOT EXISTS user_combos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        name TEXT NOT NULL,
-        alias TEXT DEFAULT '',
-        service_ids TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-    )""")
-
-    # Миграции для уже существующей таблицы user_settings
-    cur.execute("PRAGMA table_info(user_settings)")
-    columns = {row[1] for row in cur.fetchall()}
-    if "price_mode" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN price_mode TEXT DEFAULT 'day'")
-    if "last_decade_notified" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN last_decade_notified TEXT DEFAULT ''")
-    if "is_blocked" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN is_blocked INTEGER DEFAULT 0")
-    if "include_in_leaderboard" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN include_in_leaderboard INTEGER DEFAULT 1")
-    if "goal_enabled" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN goal_enabled INTEGER DEFAULT 0")
-    if "goal_chat_id" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN goal_chat_id BIGINT DEFAULT 0")
-    if "goal_message_id" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN goal_message_id BIGINT DEFAULT 0")
-    if "price_mode_lock_until" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN price_mode_lock_until TEXT DEFAULT ''")
-    if "subscription_expires_at" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN subscription_expires_at TEXT DEFAULT ''")
-    if "work_anchor_date" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN work_anchor_date TEXT DEFAULT ''")
-    if "decade_goal" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN decade_goal INTEGER DEFAULT 0")
-    if "shift_goal" not in columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN shift_goal INTEGER DEFAULT 0")
-
-    cur.execute("PRAGMA table_info(shifts)")
-    shift_columns = {row[1] for row in cur.fetchall()}
-    if "shift_target" not in shift_columns:
-        cur.execute("ALTER TABLE shifts ADD COLUMN shift_target INTEGER DEFAULT 0")
-    if "pause_started_at" not in shift_columns:
-        cur.execute("ALTER TABLE shifts ADD COLUMN pause_started_at TEXT DEFAULT ''")
-    if "paused_seconds" not in shift_columns:
-        cur.execute("ALTER TABLE shifts ADD COLUMN paused_seconds INTEGER DEFAULT 0")
-    if "work_date" not in shift_columns:
-        cur.execute("ALTER TABLE shifts ADD COLUMN work_date TEXT DEFAULT ''")
+        # Таблица услуг
+        cur.execute("""CREATE TABLE IF NOT EXISTS car_services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            car_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            service_name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            quantity INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (car_id) REFERENCES cars(id) ON DELETE CASCADE
+        )""")
+
+        # Таблица настроек пользователя
+        cur.execute("""CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            daily_goal INTEGER DEFAULT 0,
+            decade_goal INTEGER DEFAULT 0,
+            price_mode TEXT DEFAULT 'day',
+            last_decade_notified TEXT DEFAULT '',
+            is_blocked INTEGER DEFAULT 0,
+            include_in_leaderboard INTEGER DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS app_content (
+            key TEXT PRIMARY KEY,
+            value TEXT DEFAULT ''
+        )""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS banned_users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id BIGINT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reason TEXT DEFAULT ''
+        )""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS user_calendar_overrides (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            day_type TEXT NOT NULL,
+            UNIQUE(user_id, day),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )""")
+
+        # Таблица пользовательских комбинаций услуг
+        cur.execute("""CREATE TABLE IF NOT EXISTS user_combos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            alias TEXT DEFAULT '',
+            service_ids TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )""")
+
+        # Дневные агрегаты пользователя (поддерживаются при каждой записи машин/услуг/смен)
+        stats_table_exists = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_day_stats'"
+        ).fetchone() is not None
+        cur.execute("""CREATE TABLE IF NOT EXISTS user_day_stats (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            revenue INTEGER DEFAULT 0,
+            cars INTEGER DEFAULT 0,
+            shifts INTEGER DEFAULT 0,
+            hours REAL DEFAULT 0,
+            PRIMARY KEY (user_id, day),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )""")
+
+        # Итоги за всё время: ведутся триггерами по user_day_stats
+        totals_table_exists = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_totals'"
+        ).fetchone() is not None
+        cur.execute("""CREATE TABLE IF NOT EXISTS user_totals (
+            user_id INTEGER PRIMARY KEY,
+            revenue INTEGER DEFAULT 0,
+            cars INTEGER DEFAULT 0,
+            shifts INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )""")
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_user_day_stats_totals_insert
+            AFTER INSERT ON user_day_stats
+            BEGIN
+                INSERT INTO user_totals (user_id, revenue, cars, shifts)
+                VALUES (NEW.user_id, NEW.revenue, NEW.cars, NEW.shifts)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    revenue = revenue + excluded.revenue,
+                    cars = cars + excluded.cars,
+                    shifts = shifts + excluded.shifts;
+            END"""
+        )
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_user_day_stats_totals_update
+            AFTER UPDATE ON user_day_stats
+            BEGIN
+                UPDATE user_totals SET
+                    revenue = revenue + NEW.revenue - OLD.revenue,
+                    cars = cars + NEW.cars - OLD.cars,
+                    shifts = shifts + NEW.shifts - OLD.shifts
+                WHERE user_id = NEW.user_id;
+            END"""
+        )
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_user_day_stats_totals_delete
+            AFTER DELETE ON user_day_stats
+            BEGIN
+                UPDATE user_totals SET
+                    revenue = revenue - OLD.revenue,
+                    cars = cars - OLD.cars,
+                    shifts = shifts - OLD.shifts
+                WHERE user_id = OLD.user_id;
+            END"""
+        )
+        if not totals_table_exists:
+            cur.execute(
+                """INSERT INTO user_totals (user_id, revenue, cars, shifts)
+                SELECT user_id, SUM(revenue), SUM(cars), SUM(shifts)
+                FROM user_day_stats
+                GROUP BY user_id"""
+            )
+
+        # Сколько раз пользователь выбирал каждую услугу: ведётся триггерами по car_services.
+        # При каскадном удалении родитель уже не виден, поэтому уменьшает счётчик
+        # триггер той таблицы, из которой удаляют напрямую (услуга, машина или смена).
+        usage_table_exists = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_service_usage'"
+        ).fetchone() is not None
+        cur.execute("""CREATE TABLE IF NOT EXISTS user_service_usage (
+            user_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            qty INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, service_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        ) WITHOUT ROWID""")
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_car_services_usage_insert
+            AFTER INSERT ON car_services
+            BEGIN
+                INSERT INTO user_service_usage (user_id, service_id, qty)
+                SELECT s.user_id, NEW.service_id, NEW.quantity
+                FROM cars c JOIN shifts s ON s.id = c.shift_id
+                WHERE c.id = NEW.car_id
+                ON CONFLICT(user_id, service_id) DO UPDATE SET qty = qty + excluded.qty;
+            END"""
+        )
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_car_services_usage_update
+            AFTER UPDATE OF quantity, service_id, car_id ON car_services
+            BEGIN
+                UPDATE user_service_usage SET qty = qty - OLD.quantity
+                WHERE service_id = OLD.service_id AND user_id = (
+                    SELECT s.user_id FROM cars c JOIN shifts s ON s.id = c.shift_id WHERE c.id = OLD.car_id
+                );
+                INSERT INTO user_service_usage (user_id, service_id, qty)
+                SELECT s.user_id, NEW.service_id, NEW.quantity
+                FROM cars c JOIN shifts s ON s.id = c.shift_id
+                WHERE c.id = NEW.car_id
+                ON CONFLICT(user_id, service_id) DO UPDATE SET qty = qty + excluded.qty;
+            END"""
+        )
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_car_services_usage_delete
+            AFTER DELETE ON car_services
+            BEGIN
+                UPDATE user_service_usage SET qty = qty - OLD.quantity
+                WHERE service_id = OLD.service_id AND user_id = (
+                    SELECT s.user_id FROM cars c JOIN shifts s ON s.id = c.shift_id WHERE c.id = OLD.car_id
+                );
+            END"""
+        )
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_cars_usage_delete
+            BEFORE DELETE ON cars
+            BEGIN
+                UPDATE user_service_usage SET qty = qty - (
+                    SELECT COALESCE(SUM(cs.quantity), 0) FROM car_services cs
+                    WHERE cs.car_id = OLD.id AND cs.service_id = user_service_usage.service_id
+                )
+                WHERE user_id = (SELECT user_id FROM shifts WHERE id = OLD.shift_id)
+                AND service_id IN (SELECT service_id FROM car_services WHERE car_id = OLD.id);
+            END"""
+        )
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_shifts_usage_delete
+            BEFORE DELETE ON shifts
+            BEGIN
+                UPDATE user_service_usage SET qty = qty - (
+                    SELECT COALESCE(SUM(cs.quantity), 0)
+                    FROM cars c JOIN car_services cs ON cs.car_id = c.id
+                    WHERE c.shift_id = OLD.id AND cs.service_id = user_service_usage.service_id
+                )
+                WHERE user_id = OLD.user_id
+                AND service_id IN (
+                    SELECT cs.service_id FROM cars c JOIN car_services cs ON cs.car_id = c.id
+                    WHERE c.shift_id = OLD.id
+                );
+            END"""
+        )
+        if not usage_table_exists:
+            cur.execute(
+                """INSERT INTO user_service_usage (user_id, service_id, qty)
+                SELECT s.user_id, cs.service_id, SUM(cs.quantity)
+                FROM car_services cs
+                JOIN cars c ON c.id = cs.car_id
+                JOIN shifts s ON s.id = c.shift_id
+                GROUP BY s.user_id, cs.service_id"""
+            )
+
+        # Журнал задач API: дедупликация повторов и ключи идемпотентности (ts — epoch, UTC)
+        cur.execute("""CREATE TABLE IF NOT EXISTS api_task_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_key TEXT DEFAULT '',
+            chat_id BIGINT NOT NULL,
+            car TEXT NOT NULL,
+            service INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            idem_key TEXT,
+            shift_id INTEGER
+        )""")
+        cur.execute("PRAGMA table_info(api_task_log)")
+        if "shift_id" not in {row[1] for row in cur.fetchall()}:
+            cur.execute("ALTER TABLE api_task_log ADD COLUMN shift_id INTEGER")
+
+        # Входящие обновления webhook: их принимает любой воркер API, обрабатывает один.
+        # Обработанные строки живут до очистки по TTL — повтор update_id от Telegram отбрасывается.
+        cur.execute("""CREATE TABLE IF NOT EXISTS telegram_update_inbox (
+            update_id INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL,
+            received_at INTEGER NOT NULL,
+            taken_at INTEGER,
+            processed_at INTEGER
+        )""")
+        cur.execute("PRAGMA table_info(telegram_update_inbox)")
+        inbox_columns = {row[1] for row in cur.fetchall()}
+        if "taken_at" not in inbox_columns:
+            cur.execute("ALTER TABLE telegram_update_inbox ADD COLUMN taken_at INTEGER")
+        if "processed_at" not in inbox_columns:
+            cur.execute("ALTER TABLE telegram_update_inbox ADD COLUMN processed_at INTEGER")
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_telegram_update_inbox_pending ON telegram_update_inbox(update_id) "
+            "WHERE processed_at IS NULL"
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_telegram_update_inbox_processed ON telegram_update_inbox(processed_at)"
+        )
+
+        # Рассылки: задание и очередь доставки, чтобы после рестарта продолжить
+        cur.execute("""CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_telegram_id BIGINT NOT NULL,
+            target TEXT NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT DEFAULT 'running',
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            progress_chat_id BIGINT DEFAULT 0,
+            progress_message_id BIGINT DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )""")
+        cur.execute("""CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER NOT NULL,
+            telegram_id BIGINT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            error TEXT DEFAULT '',
+            PRIMARY KEY (job_id, telegram_id),
+            FOREIGN KEY (job_id) REFERENCES broadcast_jobs(id) ON DELETE CASCADE
+        )""")
+
+        # Миграции для уже существующей таблицы user_settings
+        cur.execute("PRAGMA table_info(user_settings)")
+        columns = {row[1] for row in cur.fetchall()}
+        if "price_mode" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN price_mode TEXT DEFAULT 'day'")
+        if "last_decade_notified" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN last_decade_notified TEXT DEFAULT ''")
+        if "is_blocked" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN is_blocked INTEGER DEFAULT 0")
+        if "include_in_leaderboard" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN include_in_leaderboard INTEGER DEFAULT 1")
+        if "goal_enabled" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN goal_enabled INTEGER DEFAULT 0")
+        if "goal_chat_id" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN goal_chat_id BIGINT DEFAULT 0")
+        if "goal_message_id" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN goal_message_id BIGINT DEFAULT 0")
+        if "price_mode_lock_until" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN price_mode_lock_until TEXT DEFAULT ''")
+        if "subscription_expires_at" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN subscription_expires_at TEXT DEFAULT ''")
+        if "work_anchor_date" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN work_anchor_date TEXT DEFAULT ''")
+        if "decade_goal" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN decade_goal INTEGER DEFAULT 0")
+        if "shift_goal" not in columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN shift_goal INTEGER DEFAULT 0")
+
+        cur.execute("PRAGMA table_info(shifts)")
+        shift_columns = {row[1] for row in cur.fetchall()}
+        if "shift_target" not in shift_columns:
+            cur.execute("ALTER TABLE shifts ADD COLUMN shift_target INTEGER DEFAULT 0")
+        if "pause_started_at" not in shift_columns:
+            cur.execute("ALTER TABLE shifts ADD COLUMN pause_started_at TEXT DEFAULT ''")
+        if "paused_seconds" not in shift_columns:
+            cur.execute("ALTER TABLE shifts ADD COLUMN paused_seconds INTEGER DEFAULT 0")
+        if "work_date" not in shift_columns:
+            cur.execute("ALTER TABLE shifts ADD COLUMN work_date TEXT DEFAULT ''")
+        cur.execute(
+            """UPDATE shifts
+            SET work_date = date(start_time, '+3 hours')
+            WHERE COALESCE(work_date, '') = ''"""
+        )
+        cur.execute(
+            """UPDATE shifts
+            SET work_date = date(start_time, '+3 hours')
+            WHERE date(work_date) <> date(start_time, '+3 hours')"""
+        )
+        work_dates_moved = cur.rowcount > 0
+
+        cur.execute("PRAGMA table_info(cars)")
+        car_columns = {row[1] for row in cur.fetchall()}
+        if "car_number_norm" not in car_columns:
+            cur.execute("ALTER TABLE cars ADD COLUMN car_number_norm TEXT DEFAULT ''")
+        cur.execute("SELECT id, car_number FROM cars WHERE COALESCE(car_number_norm, '') = ''")
+        cur.executemany(
+            "UPDATE cars SET car_number_norm = ? WHERE id = ?",
+            [(car_number_key(row["car_number"]), row["id"]) for row in cur.fetchall()],
+        )
+
+        cur.execute("PRAGMA table_info(user_combos)")
+        combo_columns = {row[1] for row in cur.fetchall()}
+        if "alias" not in combo_columns:
+            cur.execute("ALTER TABLE user_combos ADD COLUMN alias TEXT DEFAULT ''")
+
+        cur.execute("PRAGMA table_info(user_settings)")
+        settings_columns = {row[1] for row in cur.fetchall()}
+        if "broadcast_enabled" not in settings_columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN broadcast_enabled INTEGER DEFAULT 1")
+        if "images_enabled" not in settings_columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN images_enabled INTEGER DEFAULT 1")
+        if "avatar_source" not in settings_columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN avatar_source TEXT DEFAULT 'telegram'")
+        if "custom_avatar_path" not in settings_columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN custom_avatar_path TEXT DEFAULT ''")
+        if "telegram_avatar_path" not in settings_columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN telegram_avatar_path TEXT DEFAULT ''")
+        if "rank_prefix" not in settings_columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN rank_prefix TEXT DEFAULT ''")
+        if "is_admin" not in settings_columns:
+            cur.execute("ALTER TABLE user_settings ADD COLUMN is_admin INTEGER DEFAULT 0")
+
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_shifts_work_date_insert
+            AFTER INSERT ON shifts
+            WHEN COALESCE(NEW.work_date, '') = ''
+            BEGIN
+                UPDATE shifts SET work_date = date(NEW.start_time, '+3 hours') WHERE id = NEW.id;
+            END"""
+        )
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_shifts_work_date_update
+            AFTER UPDATE OF work_date ON shifts
+            WHEN COALESCE(NEW.work_date, '') = ''
+            BEGIN
+                UPDATE shifts SET work_date = date(NEW.start_time, '+3 hours') WHERE id = NEW.id;
+            END"""
+        )
+
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_shifts_user_status_start ON shifts(user_id, status, start_time)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_shifts_work_date_user ON shifts(work_date, user_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_shifts_user_work_date ON shifts(user_id, work_date)")
+        cur.execute("DROP INDEX IF EXISTS idx_cars_shift_id")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_cars_shift_total ON cars(shift_id, total_amount)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_cars_shift_number ON cars(shift_id, car_number_norm)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_day_stats_day ON user_day_stats(day, user_id)")
+
+        if not stats_table_exists or work_dates_moved:
+            _rebuild_user_day_stats(cur)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_car_services_car_id ON car_services(car_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_settings_user_id ON user_settings(user_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_settings_sub_expires ON user_settings(subscription_expires_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_shifts_status_start ON shifts(status, start_time)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_status ON broadcast_deliveries(job_id, status)")
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_api_task_log_idem ON api_task_log(idem_key)")
+        cur.execute("DROP INDEX IF EXISTS idx_api_task_log_task")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_api_task_log_shift ON api_task_log(shift_id, car, service, ts)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_api_task_log_ts ON api_task_log(ts)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_combos_user_alias ON user_combos(user_id, alias)")
+
+        print("✅ База данных создана")
+
+# ========== ДНЕВНЫЕ АГРЕГАТЫ ==========
+# Часы считаются только по закрытым сменам: у активной смены они ещё растут.
+_USER_DAY_STATS_SELECT = """WITH shift_totals AS (
+    SELECT s.user_id, s.work_date AS day, s.status, s.start_time, s.end_time, s.paused_seconds,
+    SUM(c.total_amount) AS revenue,
+    COUNT(c.id) AS cars
+    FROM shifts s
+    JOIN cars c ON c.shift_id = s.id
+    WHERE {where}
+    GROUP BY s.id
+)
+SELECT user_id, day,
+COALESCE(SUM(revenue), 0) AS revenue,
+COALESCE(SUM(cars), 0) AS cars,
+COUNT(*) AS shifts,
+COALESCE(SUM(CASE WHEN status = 'closed' AND end_time IS NOT NULL THEN MAX(0,
+    (julianday(end_time) - julianday(start_time)) * 24.0 - COALESCE(paused_seconds, 0) / 3600.0
+) ELSE 0 END), 0) AS hours
+FROM shift_totals
+GROUP BY user_id, day"""
+
+
+def _publish_shift_owner(cur: sqlite3.Cursor, shift_id: int) -> None:
+    cur.execute("SELECT user_id FROM shifts WHERE id = ?", (shift_id,))
+    row = cur.fetchone()
+    if row:
+        _publish("user_context", row["user_id"])
+
+
+def _refresh_user_day_stats(cur: sqlite3.Cursor, user_id: int, day: str) -> None:
+    """Пересчитывает одну строку user_day_stats в текущей транзакции."""
+    if not day:
+        return
+    cur.execute(_USER_DAY_STATS_SELECT.format(where="s.user_id = ? AND s.work_date = ?"), (user_id, day))
+    row = cur.fetchone()
+    if not row:
+        cur.execute("DELETE FROM user_day_stats WHERE user_id = ? AND day = ?", (user_id, day))
+        _publish("day_stats", user_id, day, None)
+        return
+    stats = {
+        "revenue": int(row["revenue"]),
+        "cars": int(row["cars"]),
+        "shifts": int(row["shifts"]),
+        "hours": float(row["hours"]),
+    }
+    cur.execute(
+        """INSERT INTO user_day_stats (user_id, day, revenue, cars, shifts, hours)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            revenue = excluded.revenue,
+            cars = excluded.cars,
+            shifts = excluded.shifts,
+            hours = excluded.hours""",
+        (user_id, day, stats["revenue"], stats["cars"], stats["shifts"], stats["hours"]),
+    )
+    _publish("day_stats", user_id, day, stats)
+
+
+def _day_keys_for_cars(cur: sqlite3.Cursor, car_ids: List[int]) -> set:
+    if not car_ids:
+        return set()
+    placeholders = ",".join("?" for _ in car_ids)
+    cur.execute(
+        f"""SELECT DISTINCT s.user_id, s.work_date
+        FROM cars c
+        JOIN shifts s ON s.id = c.shift_id
+        WHERE c.id IN ({placeholders})""",
+        list(car_ids),
+    )
+    return {(int(row[0]), str(row[1] or "")) for row in cur.fetchall()}
+
+
+def _day_key_for_shift(cur: sqlite3.Cursor, shift_id: int) -> set:
+    cur.execute("SELECT user_id, work_date FROM shifts WHERE id = ?", (shift_id,))
+    row = cur.fetchone()
+    return {(int(row[0]), str(row[1] or ""))} if row else set()
+
+
+def _refresh_day_keys(cur: sqlite3.Cursor, keys: set) -> None:
+    for user_id, day in keys:
+        _refresh_user_day_stats(cur, user_id, day)
+
+
+def _add_services_to_car(cur: sqlite3.Cursor, car_id: int, services: List[tuple], day_keys: Optional[set] = None) -> int:
+    """Увеличивает количество или добавляет строки услуг и один раз пересчитывает сумму машины."""
+    for service_id, service_name, price, quantity in services:
+        quantity = int(quantity)
+        if quantity <= 0:
+            continue
+        # Проверяем, есть ли уже такая услуга
+        cur.execute(
+            f"""SELECT id FROM car_services
+            WHERE car_id = ? AND service_id = ? AND price = ?""",
+            (car_id, service_id, price)
+        )
+        existing = cur.fetchone()
+        if existing:
+            cur.execute(
+                "UPDATE car_services SET quantity = quantity + ? WHERE id = ?",
+                (quantity, existing["id"])
+            )
+        else:
+            cur.execute(
+                """INSERT INTO car_services (car_id, service_id, service_name, price, quantity)
+                VALUES (?, ?, ?, ?, ?)""",
+                (car_id, service_id, service_name, price, quantity)
+            )
+
+    # Обновляем общую сумму машины
     cur.execute(
-        """UPDATE shifts
-        SET work_date = date(start_time, '+3 hours')
-        WHERE COALESCE(work_date, '') = ''"""
+        f"""UPDATE cars
+        SET total_amount = (
+            SELECT COALESCE(SUM(price * quantity), 0)
+            FROM car_services
+            WHERE car_id = ?
+        ) WHERE id = ?""",
+        (car_id, car_id)
     )
+    cur.execute("SELECT total_amount FROM cars WHERE id = ?", (car_id,))
+    row = cur.fetchone()
+    _refresh_day_keys(cur, day_keys if day_keys is not None else _day_keys_for_cars(cur, [car_id]))
+    return int(row["total_amount"] or 0) if row else 0
+
+
+def _rebuild_user_day_stats(cur: sqlite3.Cursor, user_id: Optional[int] = None) -> int:
+    if user_id is None:
+        cur.execute("DELETE FROM user_day_stats")
+        where, params = "1 = 1", ()
+    else:
+        cur.execute("DELETE FROM user_day_stats WHERE user_id = ?", (user_id,))
+        where, params = "s.user_id = ?", (user_id,)
     cur.execute(
-        """UPDATE shifts
-        SET work_date = date(start_time, '+3 hours')
-        WHERE date(work_date) <> date(start_time, '+3 hours')"""
+        "INSERT INTO user_day_stats (user_id, day, revenue, cars, shifts, hours) "
+        + _USER_DAY_STATS_SELECT.format(where=where),
+        params,
     )
+    _publish("day_stats_reset", user_id)
+    return cur.rowcount
+
+
+# Проекция пользователя для экранов админки: флаги, подписка и итоги без истории
+_ADMIN_USER_COLUMNS = """u.id, u.telegram_id, u.name, u.created_at,
+    COALESCE(us.is_blocked, 0) as is_blocked,
+    COALESCE(us.include_in_leaderboard, 1) as include_in_leaderboard,
+    COALESCE(us.broadcast_enabled, 1) as broadcast_enabled,
+    COALESCE(us.subscription_expires_at, '') as subscription_expires_at,
+    COALESCE(t.shifts, 0) as shifts_count,
+    COALESCE(t.revenue, 0) as total_amount"""
 
-    cur.execute("PRAGMA table_info(user_combos)")
-    combo_columns = {row[1] for row in cur.fetchall()}
-    if "alias" not in combo_columns:
-        cur.execute("ALTER TABLE user_combos ADD COLUMN alias TEXT DEFAULT ''")
-
-    cur.execute("PRAGMA table_info(user_settings)")
-    settings_columns = {row[1] for row in cur.fetchall()}
-    if "broadcast_enabled" not in settings_columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN broadcast_enabled INTEGER DEFAULT 1")
-    if "images_enabled" not in settings_columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN images_enabled INTEGER DEFAULT 1")
-    if "avatar_source" not in settings_columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN avatar_source TEXT DEFAULT 'telegram'")
-    if "custom_avatar_path" not in settings_columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN custom_avatar_path TEXT DEFAULT ''")
-    if "telegram_avatar_path" not in settings_columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN telegram_avatar_path TEXT DEFAULT ''")
-    if "rank_prefix" not in settings_columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN rank_prefix TEXT DEFAULT ''")
-    if "is_admin" not in settings_columns:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN is_admin INTEGER DEFAULT 0")
-
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_shifts_user_status_start ON shifts(user_id, status, start_time)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_shifts_work_date_user ON shifts(work_date, user_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_cars_shift_id ON cars(shift_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_car_services_car_id ON car_services(car_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_settings_user_id ON user_settings(user_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_combos_user_alias ON user_combos(user_id, alias)")
-
-    conn.commit()
-    conn.close()
-    print("✅ База данных создана")
 
 class DatabaseManager:
     # ========== ПОЛЬЗОВАТЕЛИ ==========
     @staticmethod
     def get_user(telegram_id: int) -> Optional[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
-        row = cur.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_user_context(telegram_id: int) -> Dict:
+        """Пользователь, настройки, бан и активная смена одним запросом."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT t.telegram_id,
+                EXISTS (SELECT 1 FROM banned_users b WHERE b.telegram_id = t.telegram_id) as banned,
+                u.id as user_id, u.name, u.created_at,
+                COALESCE(us.is_blocked, 0) as is_blocked,
+                COALESCE(us.subscription_expires_at, '') as subscription_expires_at,
+                s.id as shift_id, s.start_time as shift_start_time, s.end_time as shift_end_time,
+                s.status as shift_status, s.shift_target as shift_shift_target,
+                s.work_date as shift_work_date, s.pause_started_at as shift_pause_started_at,
+                s.paused_seconds as shift_paused_seconds
+                FROM (SELECT ? as telegram_id) t
+                LEFT JOIN users u ON u.telegram_id = t.telegram_id
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                LEFT JOIN shifts s ON s.id = (
+                    SELECT id FROM shifts
+                    WHERE user_id = u.id AND status = 'active'
+                    ORDER BY start_time DESC LIMIT 1
+                )""",
+                (telegram_id,)
+            )
+            return dict(cur.fetchone())
+
+    @staticmethod
+    def get_task_batch_context(telegram_ids: List[int]) -> Dict[int, Dict]:
+        """Пользователь, режим цен и активная смена для набора telegram_id одним запросом."""
+        telegram_ids = list(dict.fromkeys(int(telegram_id) for telegram_id in telegram_ids))
+        if not telegram_ids:
+            return {}
+        placeholders = ",".join("?" for _ in telegram_ids)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT u.telegram_id, u.id as user_id,
+                COALESCE(us.price_mode, 'day') as price_mode,
+                COALESCE(us.price_mode_lock_until, '') as price_mode_lock_until,
+                (
+                    SELECT id FROM shifts
+                    WHERE user_id = u.id AND status = 'active'
+                    ORDER BY start_time DESC LIMIT 1
+                ) as shift_id
+                FROM users u
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                WHERE u.telegram_id IN ({placeholders})""",
+                telegram_ids
+            )
+            return {int(row["telegram_id"]): dict(row) for row in cur.fetchall()}
 
     @staticmethod
     def register_user(telegram_id: int, name: str):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT OR IGNORE INTO users (telegram_id, name) VALUES (?, ?)",
-            (telegram_id, name)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT OR IGNORE INTO users (telegram_id, name) VALUES (?, ?)",
+                (telegram_id, name)
+            )
+            _publish("user_context", None)
 
     @staticmethod
     def update_user_name(user_id: int, name: str) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("UPDATE users SET name = ? WHERE id = ?", (str(name).strip(), user_id))
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE users SET name = ? WHERE id = ?", (str(name).strip(), user_id))
+            _publish("user_profile", user_id)
+            _publish("user_context", user_id)
 
     @staticmethod
     def is_user_blocked(user_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT is_blocked FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return bool(row and int(row["is_blocked"] or 0) == 1)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT is_blocked FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            return bool(row and int(row["is_blocked"] or 0) == 1)
 
     @staticmethod
     def set_user_blocked(user_id: int, blocked: bool) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, is_blocked)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET is_blocked = excluded.is_blocked""",
-            (user_id, 1 if blocked else 0)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, is_blocked)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET is_blocked = excluded.is_blocked""",
+                (user_id, 1 if blocked else 0)
+            )
+            _publish("user_profile", user_id)
+            _publish("user_context", user_id)
 
     @staticmethod
-    def get_all_users_with_stats() -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT u.id, u.telegram_id, u.name, u.created_at,
-            COALESCE(us.is_blocked, 0) as is_blocked,
-            COALESCE(us.include_in_leaderboard, 1) as include_in_leaderboard,
-            COALESCE(us.broadcast_enabled, 1) as broadcast_enabled,
-            COALESCE(COUNT(DISTINCT s.id), 0) as shifts_count,
-            COALESCE(SUM(c.total_amount), 0) as total_amount
-            FROM users u
-            LEFT JOIN user_settings us ON us.user_id = u.id
-            LEFT JOIN shifts s ON s.user_id = u.id
-            LEFT JOIN cars c ON c.shift_id = s.id
-            GROUP BY u.id
-            ORDER BY u.created_at DESC"""
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+    def get_admin_user_page(cursor: Optional[int] = None, limit: int = 30, order: str = "recent") -> tuple:
+        """Страница списка пользователей для админки и курсор следующей страницы.
+
+        order="recent" — новые сверху (курсор — id), order="telegram" — по telegram_id.
+        Итоги берутся из user_totals, так что страница не зависит от истории смен.
+        """
+        if order == "telegram":
+            key, where, sort = "u.telegram_id", "u.telegram_id > ?", "u.telegram_id ASC"
+        else:
+            key, where, sort = "u.id", "u.id < ?", "u.id DESC"
+        params: list = []
+        if cursor is not None:
+            params.append(cursor)
+        params.append(int(limit) + 1)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT {_ADMIN_USER_COLUMNS}, {key} as cursor_key
+                FROM users u
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                LEFT JOIN user_totals t ON t.user_id = u.id
+                {"WHERE " + where if cursor is not None else ""}
+                ORDER BY {sort}
+                LIMIT ?""",
+                params
+            )
+            rows = [dict(row) for row in cur.fetchall()]
+        next_cursor = rows[limit - 1]["cursor_key"] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    @staticmethod
+    def get_admin_user_row(user_id: int) -> Optional[Dict]:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT {_ADMIN_USER_COLUMNS}
+                FROM users u
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                LEFT JOIN user_totals t ON t.user_id = u.id
+                WHERE u.id = ?""",
+                (user_id,)
+            )
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_users_without_subscription() -> List[Dict]:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """SELECT u.id, u.telegram_id
+                FROM users u
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                WHERE COALESCE(us.subscription_expires_at, '') = ''
+                ORDER BY u.id"""
+            )
+            return [dict(row) for row in cur.fetchall()]
+
+    @staticmethod
+    def get_period_report_candidates(decade_key: str, month_key: str = "") -> List[Dict]:
+        """Незаблокированные пользователи, которым пора отправить итог декады или месяца.
+
+        month_key передаётся только в первый день месяца: тогда в выборку попадают
+        и те, кому ещё не ушёл месячный отчёт (ключ month_report_sent_<id>).
+        """
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT u.id, u.telegram_id, u.name, u.created_at
+                FROM users u
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                LEFT JOIN app_content a ON a.key = 'month_report_sent_' || u.id
+                WHERE COALESCE(us.is_blocked, 0) = 0
+                  AND (
+                    COALESCE(us.last_decade_notified, '') != ?
+                    OR (? != '' AND COALESCE(a.value, '') != ?)
+                  )
+                ORDER BY u.id""",
+                (decade_key, month_key, month_key)
+            )
+            return [dict(row) for row in cur.fetchall()]
 
     @staticmethod
     def is_telegram_banned(telegram_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1 FROM banned_users WHERE telegram_id = ?", (telegram_id,))
-        row = cur.fetchone()
-        conn.close()
-        return bool(row)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1 FROM banned_users WHERE telegram_id = ?", (telegram_id,))
+            row = cur.fetchone()
+            return bool(row)
 
     @staticmethod
     def get_banned_users() -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """SELECT telegram_id, name, banned_at, reason
-            FROM banned_users
-            ORDER BY banned_at DESC"""
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """SELECT telegram_id, name, banned_at, reason
+                FROM banned_users
+                ORDER BY banned_at DESC"""
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def unban_telegram_user(telegram_id: int) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM banned_users WHERE telegram_id = ?", (telegram_id,))
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM banned_users WHERE telegram_id = ?", (telegram_id,))
 
     @staticmethod
     def ban_and_delete_user(user_id: int, reason: str = "") -> None:
-        conn = get_connection()
-        cur = conn.cursor()
+        with db.session() as conn:
+            cur = conn.cursor()
 
-        cur.execute("SELECT telegram_id, name FROM users WHERE id = ?", (user_id,))
-        row = cur.fetchone()
-        if not row:
-            conn.close()
-            return
+            cur.execute("SELECT telegram_id, name FROM users WHERE id = ?", (user_id,))
+            row = cur.fetchone()
+            if not row:
+                return
 
-        telegram_id = int(row["telegram_id"])
-        name = str(row["name"] or "Пользователь")
+            telegram_id = int(row["telegram_id"])
+            name = str(row["name"] or "Пользователь")
 
-        cur.execute(
-            """INSERT INTO banned_users (telegram_id, name, reason)
-            VALUES (?, ?, ?)
-            ON CONFLICT(telegram_id) DO UPDATE SET
-                name = excluded.name,
-                reason = excluded.reason,
-                banned_at = CURRENT_TIMESTAMP""",
-            (telegram_id, name, reason),
-        )
+            cur.execute(
+                """INSERT INTO banned_users (telegram_id, name, reason)
+                VALUES (?, ?, ?)
+                ON CONFLICT(telegram_id) DO UPDATE SET
+                    name = excluded.name,
+                    reason = excluded.reason,
+                    banned_at = CURRENT_TIMESTAMP""",
+                (telegram_id, name, reason),
+            )
 
-        cur.execute(
-            """DELETE FROM car_services
-            WHERE car_id IN (
-                SELECT c.id
-                FROM cars c
-                JOIN shifts s ON s.id = c.shift_id
-                WHERE s.user_id = ?
-            )""",
-            (user_id,),
-        )
-        cur.execute("DELETE FROM cars WHERE shift_id IN (SELECT id FROM shifts WHERE user_id = ?)", (user_id,))
-        cur.execute("DELETE FROM shifts WHERE user_id = ?", (user_id,))
-        cur.execute("DELETE FROM user_calendar_overrides WHERE user_id = ?", (user_id,))
-        cur.execute("DELETE FROM user_combos WHERE user_id = ?", (user_id,))
-        cur.execute("DELETE FROM user_settings WHERE user_id = ?", (user_id,))
-        cur.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            cur.execute(
+                """DELETE FROM car_services
+                WHERE car_id IN (
+                    SELECT c.id
+                    FROM cars c
+                    JOIN shifts s ON s.id = c.shift_id
+                    WHERE s.user_id = ?
+                )""",
+                (user_id,),
+            )
+            cur.execute("DELETE FROM cars WHERE shift_id IN (SELECT id FROM shifts WHERE user_id = ?)", (user_id,))
+            cur.execute("DELETE FROM shifts WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM user_day_stats WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM user_calendar_overrides WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM user_combos WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM user_settings WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            _publish("user_profile", user_id)
+            _publish("user_context", user_id)
+            _publish("user_settings_reset", user_id)
 
-        conn.commit()
-        conn.close()
 
     # ========== СМЕНЫ ==========
     @staticmethod
     def start_shift(user_id: int) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO shifts (user_id, start_time, work_date) VALUES (?, ?, ?)",
-            (user_id, now_local(), now_local().date().isoformat())
-        )
-        shift_id = cur.lastrowid
-        conn.commit()
-        conn.close()
-        return shift_id
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO shifts (user_id, start_time, work_date) VALUES (?, ?, ?)",
+                (user_id, now_local(), now_local().date().isoformat())
+            )
+            shift_id = cur.lastrowid
+            _publish("user_context", user_id)
+            return shift_id
 
     @staticmethod
     def set_shift_target(shift_id: int, shift_target: int) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("UPDATE shifts SET shift_target = ? WHERE id = ?", (int(shift_target or 0), shift_id))
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE shifts SET shift_target = ? WHERE id = ?", (int(shift_target or 0), shift_id))
+            _publish_shift_owner(cur, shift_id)
 
     @staticmethod
     def get_active_shift(user_id: int) -> Optional[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT * FROM shifts WHERE user_id = ? AND status = 'active' ORDER BY start_time DESC LIMIT 1",
-            (user_id,)
-        )
-        row = cur.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM shifts WHERE user_id = ? AND status = 'active' ORDER BY start_time DESC LIMIT 1",
+                (user_id,)
+            )
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_long_open_shifts(started_before: datetime) -> List[Dict]:
+        """Активные смены, начатые не позже started_before, вместе с владельцем.
+
+        Идёт по индексу (status, start_time). start_time хранится так, как его
+        записывает sqlite3 ("2026-10-18 09:00:00.000000+03:00"), и граница
+        форматируется так же, иначе текстовое сравнение захватывает весь день.
+        """
+        started_before = started_before.astimezone(LOCAL_TZ).isoformat(" ")
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT s.id, s.user_id, s.start_time, u.telegram_id,
+                COALESCE(us.is_blocked, 0) as is_blocked
+                FROM shifts s
+                JOIN users u ON u.id = s.user_id
+                LEFT JOIN user_settings us ON us.user_id = s.user_id
+                WHERE s.status = 'active' AND s.start_time <= ?
+                ORDER BY s.start_time""",
+                (started_before,)
+            )
+            return [dict(row) for row in cur.fetchall()]
 
     @staticmethod
     def get_shift_cars(shift_id: int) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT * FROM cars WHERE shift_id = ? ORDER BY created_at",
-            (shift_id,)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM cars WHERE shift_id = ? ORDER BY created_at",
+                (shift_id,)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def get_shift_total(shift_id: int) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT COALESCE(SUM(total_amount), 0) FROM cars WHERE shift_id = ?",
-            (shift_id,)
-        )
-        row = cur.fetchone()
-        conn.close()
-        return row[0] if row else 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT COALESCE(SUM(total_amount), 0) FROM cars WHERE shift_id = ?",
+                (shift_id,)
+            )
+            row = cur.fetchone()
+            return row[0] if row else 0
 
     @staticmethod
     def get_shift_top_services(shift_id: int, limit: int = 3) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT cs.service_name,
-            SUM(cs.quantity) as total_count,
-            SUM(cs.price * cs.quantity) as total_amount
-            FROM cars c
-            JOIN car_services cs ON cs.car_id = c.id
-            WHERE c.shift_id = ?
-            GROUP BY cs.service_name
-            ORDER BY total_amount DESC
-            LIMIT ?""",
-            (shift_id, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT cs.service_name,
+                SUM(cs.quantity) as total_count,
+                SUM(cs.price * cs.quantity) as total_amount
+                FROM cars c
+                JOIN car_services cs ON cs.car_id = c.id
+                WHERE c.shift_id = ?
+                GROUP BY cs.service_name
+                ORDER BY total_amount DESC
+                LIMIT ?""",
+                (shift_id, limit)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def get_user_shifts(user_id: int, limit: int = 10) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT s.*, COALESCE(SUM(c.total_amount), 0) as total_amount
-            FROM shifts s
-            LEFT JOIN cars c ON s.id = c.shift_id
-            WHERE s.user_id = ?
-            GROUP BY s.id
-            ORDER BY s.start_time DESC
-            LIMIT ?""",
-            (user_id, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT s.*, COALESCE(SUM(c.total_amount), 0) as total_amount
+                FROM shifts s
+                LEFT JOIN cars c ON s.id = c.shift_id
+                WHERE s.user_id = ?
+                GROUP BY s.id
+                ORDER BY s.start_time DESC
+                LIMIT ?""",
+                (user_id, limit)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def get_shift(shift_id: int) -> Optional[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM shifts WHERE id = ?", (shift_id,))
-        row = cur.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM shifts WHERE id = ?", (shift_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
 
     @staticmethod
     def close_shift(shift_id: int):
-        conn = get_connection()
-        cur = conn.cursor()
-        row = DatabaseManager.get_shift(shift_id)
-        paused_seconds = int((row or {}).get("paused_seconds") or 0)
-        pause_started_at = (row or {}).get("pause_started_at")
-        if pause_started_at:
-            try:
-                started_dt = datetime.fromisoformat(str(pause_started_at))
-                paused_seconds += max(0, int((now_local() - started_dt).total_seconds()))
-            except Exception:
-                pass
-        cur.execute(
-            "UPDATE shifts SET end_time = ?, status = 'closed', pause_started_at = '', paused_seconds = ? WHERE id = ?",
-            (now_local(), paused_seconds, shift_id)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            row = DatabaseManager.get_shift(shift_id)
+            paused_seconds = int((row or {}).get("paused_seconds") or 0)
+            pause_started_at = (row or {}).get("pause_started_at")
+            if pause_started_at:
+                try:
+                    started_dt = datetime.fromisoformat(str(pause_started_at))
+                    paused_seconds += max(0, int((now_local() - started_dt).total_seconds()))
+                except Exception:
+                    pass
+            cur.execute(
+                "UPDATE shifts SET end_time = ?, status = 'closed', pause_started_at = '', paused_seconds = ? WHERE id = ?",
+                (now_local(), paused_seconds, shift_id)
+            )
+            _refresh_day_keys(cur, _day_key_for_shift(cur, shift_id))
+            _publish_shift_owner(cur, shift_id)
 
     @staticmethod
     def toggle_shift_pause(shift_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT pause_started_at, paused_seconds FROM shifts WHERE id = ?", (shift_id,))
-        row = cur.fetchone()
-        if not row:
-            conn.close()
-            return False
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT user_id, pause_started_at, paused_seconds FROM shifts WHERE id = ?", (shift_id,))
+            row = cur.fetchone()
+            if not row:
+                return False
+            _publish("user_context", row["user_id"])
+
+            pause_started_at = str(row["pause_started_at"] or "").strip()
+            paused_seconds = int(row["paused_seconds"] or 0)
+            if pause_started_at:
+                try:
+                    started_dt = datetime.fromisoformat(pause_started_at)
+                    paused_seconds += max(0, int((now_local() - started_dt).total_seconds()))
+                except Exception:
+                    pass
+                cur.execute(
+                    "UPDATE shifts SET pause_started_at = '', paused_seconds = ? WHERE id = ?",
+                    (paused_seconds, shift_id),
+                )
+                return False
 
-        pause_started_at = str(row["pause_started_at"] or "").strip()
-        paused_seconds = int(row["paused_seconds"] or 0)
-        if pause_started_at:
-            try:
-                started_dt = datetime.fromisoformat(pause_started_at)
-                paused_seconds += max(0, int((now_local() - started_dt).total_seconds()))
-            except Exception:
-                pass
             cur.execute(
-                "UPDATE shifts SET pause_started_at = '', paused_seconds = ? WHERE id = ?",
-                (paused_seconds, shift_id),
+                "UPDATE shifts SET pause_started_at = ? WHERE id = ?",
+                (now_local().isoformat(), shift_id),
             )
-            conn.commit()
-            conn.close()
-            return False
-
-        cur.execute(
-            "UPDATE shifts SET pause_started_at = ? WHERE id = ?",
-            (now_local().isoformat(), shift_id),
-        )
-        conn.commit()
-        conn.close()
-        return True
+            return True
 
     @staticmethod
     def get_shift_effective_hours(shift: Dict) -> float:
@@ -528,189 +1260,168 @@ class DatabaseManager:
 
     @staticmethod
     def delete_shift(shift_id: int) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM car_services WHERE car_id IN (SELECT id FROM cars WHERE shift_id = ?)", (shift_id,))
-        cur.execute("DELETE FROM cars WHERE shift_id = ?", (shift_id,))
-        cur.execute("DELETE FROM shifts WHERE id = ?", (shift_id,))
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            day_keys = _day_key_for_shift(cur, shift_id)
+            _publish_shift_owner(cur, shift_id)
+            cur.execute("DELETE FROM car_services WHERE car_id IN (SELECT id FROM cars WHERE shift_id = ?)", (shift_id,))
+            cur.execute("DELETE FROM cars WHERE shift_id = ?", (shift_id,))
+            cur.execute("DELETE FROM shifts WHERE id = ?", (shift_id,))
+            _refresh_day_keys(cur, day_keys)
 
     @staticmethod
     def get_daily_goal(user_id: int) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT daily_goal FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if row and row["daily_goal"] is not None:
-            return int(row["daily_goal"])
-        return 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT daily_goal FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            if row and row["daily_goal"] is not None:
+                return int(row["daily_goal"])
+            return 0
 
     @staticmethod
     def get_shift_goal(user_id: int) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT shift_goal FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if row and row["shift_goal"] is not None:
-            return int(row["shift_goal"])
-        return 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT shift_goal FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            if row and row["shift_goal"] is not None:
+                return int(row["shift_goal"])
+            return 0
 
     @staticmethod
     def set_daily_goal(user_id: int, goal: int):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, daily_goal)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET daily_goal = excluded.daily_goal""",
-            (user_id, goal)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, daily_goal)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET daily_goal = excluded.daily_goal""",
+                (user_id, goal)
+            )
 
     @staticmethod
     def set_shift_goal(user_id: int, goal: int):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, shift_goal)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET shift_goal = excluded.shift_goal""",
-            (user_id, int(goal or 0))
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, shift_goal)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET shift_goal = excluded.shift_goal""",
+                (user_id, int(goal or 0))
+            )
 
 
     @staticmethod
     def get_decade_goal(user_id: int) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT decade_goal FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if row and row["decade_goal"] is not None:
-            return int(row["decade_goal"])
-        return 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT decade_goal FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            if row and row["decade_goal"] is not None:
+                return int(row["decade_goal"])
+            return 0
 
     @staticmethod
     def set_decade_goal(user_id: int, goal: int):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, decade_goal)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET decade_goal = excluded.decade_goal""",
-            (user_id, goal)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, decade_goal)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET decade_goal = excluded.decade_goal""",
+                (user_id, goal)
+            )
+            _publish("user_profile", user_id)
 
 
     @staticmethod
     def get_price_mode(user_id: int) -> str:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT price_mode FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if row and row["price_mode"] in {"day", "night"}:
-            return row["price_mode"]
-        return "day"
+        """Действующий режим цен: ручной до price_mode_lock_until, иначе по расписанию."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT price_mode, price_mode_lock_until FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            if not row:
+                return get_mode_by_time()
+            return effective_price_mode(row["price_mode"], str(row["price_mode_lock_until"] or ""))
 
     @staticmethod
     def set_price_mode(user_id: int, mode: str, lock_until: str = ""):
         normalized_mode = "night" if mode == "night" else "day"
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, price_mode, price_mode_lock_until)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                price_mode = excluded.price_mode,
-                price_mode_lock_until = excluded.price_mode_lock_until""",
-            (user_id, normalized_mode, lock_until or "")
-        )
-        conn.commit()
-        conn.close()
-
-    @staticmethod
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, price_mode, price_mode_lock_until)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    price_mode = excluded.price_mode,
+                    price_mode_lock_until = excluded.price_mode_lock_until""",
+                (user_id, normalized_mode, lock_until or "")
+            )
+
+    @staticmethod
     def get_last_decade_notified(user_id: int) -> str:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT last_decade_notified FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return row["last_decade_notified"] if row and row["last_decade_notified"] else ""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT last_decade_notified FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            return row["last_decade_notified"] if row and row["last_decade_notified"] else ""
 
     @staticmethod
     def set_last_decade_notified(user_id: int, decade_key: str):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, last_decade_notified)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET last_decade_notified = excluded.last_decade_notified""",
-            (user_id, decade_key)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, last_decade_notified)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET last_decade_notified = excluded.last_decade_notified""",
+                (user_id, decade_key)
+            )
 
     @staticmethod
     def get_user_total_for_date(user_id: int, date_str: str) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT COALESCE(SUM(c.total_amount), 0)
-            FROM cars c
-            JOIN shifts s ON s.id = c.shift_id
-            WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} = date(?)""",
-            (user_id, date_str)
-        )
-        row = cur.fetchone()
-        conn.close()
-        return int(row[0] or 0) if row else 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT revenue FROM user_day_stats WHERE user_id = ? AND day = date(?)",
+                (user_id, date_str)
+            )
+            row = cur.fetchone()
+            return int(row[0] or 0) if row else 0
 
     @staticmethod
     def get_user_cars_count_for_date(user_id: int, date_str: str) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT COUNT(c.id)
-            FROM cars c
-            JOIN shifts s ON s.id = c.shift_id
-            WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} = date(?)""",
-            (user_id, date_str)
-        )
-        row = cur.fetchone()
-        conn.close()
-        return int(row[0] or 0) if row else 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT cars FROM user_day_stats WHERE user_id = ? AND day = date(?)",
+                (user_id, date_str)
+            )
+            row = cur.fetchone()
+            return int(row[0] or 0) if row else 0
 
     @staticmethod
     def get_active_leaderboard(limit: int = 10) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT u.name, u.telegram_id,
-            COUNT(DISTINCT s.id) as shift_count,
-            COALESCE(SUM(c.total_amount), 0) as total_amount
-            FROM users u
-            JOIN shifts s ON s.user_id = u.id AND s.status = 'active'
-            LEFT JOIN cars c ON c.shift_id = s.id
-            LEFT JOIN user_settings us ON us.user_id = u.id
-            WHERE COALESCE(us.is_blocked, 0) = 0
-              AND COALESCE(us.include_in_leaderboard, 1) = 1
-            GROUP BY u.id
-            ORDER BY total_amount DESC
-            LIMIT ?""",
-            (limit,)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT u.name, u.telegram_id,
+                COUNT(DISTINCT s.id) as shift_count,
+                COALESCE(SUM(c.total_amount), 0) as total_amount
+                FROM users u
+                JOIN shifts s ON s.user_id = u.id AND s.status = 'active'
+                LEFT JOIN cars c ON c.shift_id = s.id
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                WHERE COALESCE(us.is_blocked, 0) = 0
+                  AND COALESCE(us.include_in_leaderboard, 1) = 1
+                GROUP BY u.id
+                ORDER BY total_amount DESC
+                LIMIT ?""",
+                (limit,)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def get_decade_leaderboard(year: int, month: int, decade_index: int, limit: int = 10) -> List[Dict]:
@@ -724,27 +1435,26 @@ class DatabaseManager:
         start_date = f"{year:04d}-{month:02d}-{start_day:02d}"
         end_date = f"{year:04d}-{month:02d}-{end_day:02d}"
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT u.name, u.telegram_id,
-            COUNT(DISTINCT s.id) as shift_count,
-            COALESCE(SUM(c.total_amount), 0) as total_amount
-            FROM users u
-            JOIN shifts s ON s.user_id = u.id
-            JOIN cars c ON c.shift_id = s.id
-            LEFT JOIN user_settings us ON us.user_id = u.id
-            WHERE COALESCE(us.is_blocked, 0) = 0
-              AND COALESCE(us.include_in_leaderboard, 1) = 1
-              AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
-            GROUP BY u.id
-            ORDER BY total_amount DESC
-            LIMIT ?""",
-            (start_date, end_date, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT u.name, u.telegram_id,
+                COUNT(DISTINCT s.id) as shift_count,
+                COALESCE(SUM(c.total_amount), 0) as total_amount
+                FROM users u
+                JOIN shifts s ON s.user_id = u.id
+                JOIN cars c ON c.shift_id = s.id
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                WHERE COALESCE(us.is_blocked, 0) = 0
+                  AND COALESCE(us.include_in_leaderboard, 1) = 1
+                  AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
+                GROUP BY u.id
+                ORDER BY total_amount DESC
+                LIMIT ?""",
+                (start_date, end_date, limit)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def get_decade_leaderboard_daily(year: int, month: int, decade_index: int, limit: int = 10) -> List[Dict]:
@@ -762,1153 +1472,1769 @@ class DatabaseManager:
         elapsed_days = min(max(current_day - start_day + 1, 0), total_days)
         elapsed_ratio = (elapsed_days / total_days) if total_days > 0 else 1.0
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT u.id as user_id, u.name, u.telegram_id,
-            COALESCE(SUM(c.total_amount), 0) as total_amount,
-            COUNT(c.id) as cars_count,
-            COUNT(DISTINCT s.id) as shift_count,
-            COALESCE(us.decade_goal, 0) as decade_goal,
-            COALESCE(us.rank_prefix, '') as rank_prefix
-            FROM users u
-            JOIN shifts s ON s.user_id = u.id
-            JOIN cars c ON c.shift_id = s.id
-            LEFT JOIN user_settings us ON us.user_id = u.id
-            WHERE COALESCE(us.is_blocked, 0) = 0
-              AND COALESCE(us.include_in_leaderboard, 1) = 1
-              AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
-            GROUP BY u.id
-            ORDER BY total_amount DESC
-            LIMIT ?""",
-            (start_date, end_date, limit)
-        )
-        users = [dict(row) for row in cur.fetchall()]
-        if not users:
-            conn.close()
-            return []
-
-        user_ids = [u["user_id"] for u in users]
-        placeholders = ",".join("?" for _ in user_ids)
-        cur.execute(
-            f"""SELECT s.user_id as user_id,
-            CAST(strftime('%d', {SHIFT_WORK_DAY_EXPR}) AS INTEGER) as day,
-            COALESCE(SUM(c.total_amount), 0) as total_amount
-            FROM cars c
-            JOIN shifts s ON s.id = c.shift_id
-            WHERE s.user_id IN ({placeholders})
-              AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
-            GROUP BY s.user_id, day""",
-            [*user_ids, start_date, end_date]
-        )
-        per_day = cur.fetchall()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT u.id as user_id, u.name, u.telegram_id,
+                COALESCE(SUM(ds.revenue), 0) as total_amount,
+                COALESCE(SUM(ds.cars), 0) as cars_count,
+                COALESCE(SUM(ds.shifts), 0) as shift_count,
+                COALESCE(SUM(ds.hours), 0) as closed_hours,
+                COALESCE(us.decade_goal, 0) as decade_goal,
+                COALESCE(us.rank_prefix, '') as rank_prefix
+                FROM user_day_stats ds
+                JOIN users u ON u.id = ds.user_id
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                WHERE ds.day BETWEEN date(?) AND date(?)
+                  AND COALESCE(us.is_blocked, 0) = 0
+                  AND COALESCE(us.include_in_leaderboard, 1) = 1
+                GROUP BY u.id
+                ORDER BY total_amount DESC
+                LIMIT ?""",
+                (start_date, end_date, limit)
+            )
+            users = [dict(row) for row in cur.fetchall()]
+            if not users:
+                return []
 
-        now_str = now_local().strftime("%Y-%m-%d %H:%M:%S")
-        cur.execute(
-            f"""SELECT s.user_id as user_id,
-            COALESCE(SUM(((julianday(COALESCE(s.end_time, ?)) - julianday(s.start_time)) * 24.0) - ((COALESCE(s.paused_seconds,0) + CASE WHEN COALESCE(s.pause_started_at,'') <> '' AND s.end_time IS NULL THEN (julianday(?) - julianday(s.pause_started_at)) * 86400 ELSE 0 END) / 3600.0)), 0) as total_hours
-            FROM shifts s
-            WHERE s.user_id IN ({placeholders})
-              AND EXISTS (
-                SELECT 1 FROM cars c
-                WHERE c.shift_id = s.id
-                  AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
-              )
-            GROUP BY s.user_id""",
-            [now_str, now_str, *user_ids, start_date, end_date]
-        )
-        hours_rows = cur.fetchall()
-        conn.close()
-
-        day_map: Dict[int, Dict[int, int]] = {}
-        for row in per_day:
-            uid = int(row["user_id"])
-            day_map.setdefault(uid, {})[int(row["day"])] = int(row["total_amount"] or 0)
-
-        hours_map: Dict[int, float] = {}
-        for row in hours_rows:
-            uid = int(row["user_id"])
-            hours_map[uid] = max(float(row["total_hours"] or 0.0), 0.0)
-
-        for row in users:
-            uid = int(row["user_id"])
-            total_amount = int(row.get("total_amount") or 0)
-            total_hours = float(hours_map.get(uid, 0.0))
-            avg_per_hour = int(total_amount / total_hours) if total_hours > 0 else 0
-            decade_goal = int(row.get("decade_goal") or 0)
-            progress_pct = 100 if decade_goal <= 0 else min(200, int((total_amount * 100) / max(decade_goal, 1)))
-            run_rate = None
-            if decade_goal > 0 and elapsed_ratio > 0:
-                expected_now = max(1.0, decade_goal * elapsed_ratio)
-                run_rate = max(0.0, min(2.0, total_amount / expected_now))
-            row["daily_amounts"] = day_map.get(uid, {})
-            row["avg_per_hour"] = avg_per_hour
-            row["total_hours"] = round(total_hours, 1)
-            row["progress_pct"] = progress_pct
-            row["run_rate"] = run_rate
-            row["shifts_count"] = int(row.get("shift_count") or 0)
-        return users
+            user_ids = [u["user_id"] for u in users]
+            placeholders = ",".join("?" for _ in user_ids)
+            cur.execute(
+                f"""SELECT user_id,
+                CAST(strftime('%d', day) AS INTEGER) as day,
+                revenue as total_amount
+                FROM user_day_stats
+                WHERE user_id IN ({placeholders})
+                  AND day BETWEEN date(?) AND date(?)""",
+                [*user_ids, start_date, end_date]
+            )
+            per_day = cur.fetchall()
+
+            active_hours = DatabaseManager.get_active_shift_hours(user_ids, start_date, end_date)
+
+            day_map: Dict[int, Dict[int, int]] = {}
+            for row in per_day:
+                uid = int(row["user_id"])
+                day_map.setdefault(uid, {})[int(row["day"])] = int(row["total_amount"] or 0)
+
+            hours_map: Dict[int, float] = {
+                int(row["user_id"]): float(row.pop("closed_hours") or 0.0) + active_hours.get(int(row["user_id"]), 0.0)
+                for row in users
+            }
+
+            for row in users:
+                uid = int(row["user_id"])
+                total_amount = int(row.get("total_amount") or 0)
+                total_hours = float(hours_map.get(uid, 0.0))
+                avg_per_hour = int(total_amount / total_hours) if total_hours > 0 else 0
+                decade_goal = int(row.get("decade_goal") or 0)
+                progress_pct = 100 if decade_goal <= 0 else min(200, int((total_amount * 100) / max(decade_goal, 1)))
+                run_rate = None
+                if decade_goal > 0 and elapsed_ratio > 0:
+                    expected_now = max(1.0, decade_goal * elapsed_ratio)
+                    run_rate = max(0.0, min(2.0, total_amount / expected_now))
+                row["daily_amounts"] = day_map.get(uid, {})
+                row["avg_per_hour"] = avg_per_hour
+                row["total_hours"] = round(total_hours, 1)
+                row["progress_pct"] = progress_pct
+                row["run_rate"] = run_rate
+                row["shifts_count"] = int(row.get("shift_count") or 0)
+            return users
 
     @staticmethod
     def is_user_in_leaderboard(user_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT include_in_leaderboard FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if not row or row["include_in_leaderboard"] is None:
-            return True
-        return int(row["include_in_leaderboard"]) == 1
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT include_in_leaderboard FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            if not row or row["include_in_leaderboard"] is None:
+                return True
+            return int(row["include_in_leaderboard"]) == 1
 
     @staticmethod
     def set_user_in_leaderboard(user_id: int, include: bool) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, include_in_leaderboard)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET include_in_leaderboard = excluded.include_in_leaderboard""",
-            (user_id, 1 if include else 0)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, include_in_leaderboard)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET include_in_leaderboard = excluded.include_in_leaderboard""",
+                (user_id, 1 if include else 0)
+            )
+            _publish("user_profile", user_id)
 
     @staticmethod
     def is_user_in_broadcast(user_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT broadcast_enabled FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if not row or row["broadcast_enabled"] is None:
-            return True
-        return int(row["broadcast_enabled"]) == 1
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT broadcast_enabled FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            if not row or row["broadcast_enabled"] is None:
+                return True
+            return int(row["broadcast_enabled"]) == 1
 
     @staticmethod
     def set_user_in_broadcast(user_id: int, include: bool) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, broadcast_enabled)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET broadcast_enabled = excluded.broadcast_enabled""",
-            (user_id, 1 if include else 0)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, broadcast_enabled)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET broadcast_enabled = excluded.broadcast_enabled""",
+                (user_id, 1 if include else 0)
+            )
 
     @staticmethod
     def is_images_enabled(user_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT images_enabled FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if not row or row["images_enabled"] is None:
-            return True
-        return int(row["images_enabled"]) == 1
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT images_enabled FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            if not row or row["images_enabled"] is None:
+                return True
+            return int(row["images_enabled"]) == 1
 
     @staticmethod
     def set_images_enabled(user_id: int, enabled: bool) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, images_enabled)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET images_enabled = excluded.images_enabled""",
-            (user_id, 1 if enabled else 0)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, images_enabled)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET images_enabled = excluded.images_enabled""",
+                (user_id, 1 if enabled else 0)
+            )
 
     @staticmethod
     def is_user_admin(user_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT is_admin FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return bool(row and int(row["is_admin"] or 0) == 1)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT is_admin FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            return bool(row and int(row["is_admin"] or 0) == 1)
 
     @staticmethod
     def is_telegram_admin(telegram_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """SELECT COALESCE(us.is_admin, 0) AS is_admin
-            FROM users u
-            LEFT JOIN user_settings us ON us.user_id = u.id
-            WHERE u.telegram_id = ?""",
-            (telegram_id,),
-        )
-        row = cur.fetchone()
-        conn.close()
-        return bool(row and int(row["is_admin"] or 0) == 1)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """SELECT COALESCE(us.is_admin, 0) AS is_admin
+                FROM users u
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                WHERE u.telegram_id = ?""",
+                (telegram_id,),
+            )
+            row = cur.fetchone()
+            return bool(row and int(row["is_admin"] or 0) == 1)
 
     @staticmethod
     def set_user_admin(user_id: int, is_admin: bool) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """INSERT INTO user_settings (user_id, is_admin)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET is_admin = excluded.is_admin""",
-            (user_id, 1 if is_admin else 0),
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """INSERT INTO user_settings (user_id, is_admin)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET is_admin = excluded.is_admin""",
+                (user_id, 1 if is_admin else 0),
+            )
 
     @staticmethod
     def get_avatar_settings(user_id: int) -> Dict[str, str]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT avatar_source, custom_avatar_path, telegram_avatar_path FROM user_settings WHERE user_id = ?",
-            (user_id,),
-        )
-        row = cur.fetchone()
-        conn.close()
-        if not row:
-            return {"avatar_source": "telegram", "custom_avatar_path": "", "telegram_avatar_path": ""}
-        return {
-            "avatar_source": str(row["avatar_source"] or "telegram"),
-            "custom_avatar_path": str(row["custom_avatar_path"] or ""),
-            "telegram_avatar_path": str(row["telegram_avatar_path"] or ""),
-        }
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT avatar_source, custom_avatar_path, telegram_avatar_path FROM user_settings WHERE user_id = ?",
+                (user_id,),
+            )
+            row = cur.fetchone()
+            if not row:
+                return {"avatar_source": "telegram", "custom_avatar_path": "", "telegram_avatar_path": ""}
+            return {
+                "avatar_source": str(row["avatar_source"] or "telegram"),
+                "custom_avatar_path": str(row["custom_avatar_path"] or ""),
+                "telegram_avatar_path": str(row["telegram_avatar_path"] or ""),
+            }
 
     @staticmethod
     def get_rank_prefix(user_id: int) -> str:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT rank_prefix FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return str(row["rank_prefix"] or "") if row else ""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT rank_prefix FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            return str(row["rank_prefix"] or "") if row else ""
 
     @staticmethod
     def set_rank_prefix(user_id: int, rank_prefix: str) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, rank_prefix)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET rank_prefix = excluded.rank_prefix""",
-            (user_id, (rank_prefix or "").strip()),
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, rank_prefix)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET rank_prefix = excluded.rank_prefix""",
+                (user_id, (rank_prefix or "").strip()),
+            )
+            _publish("user_profile", user_id)
 
     @staticmethod
     def set_custom_avatar(user_id: int, path: str) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, avatar_source, custom_avatar_path)
-            VALUES (?, 'custom', ?)
-            ON CONFLICT(user_id) DO UPDATE SET avatar_source = 'custom', custom_avatar_path = excluded.custom_avatar_path""",
-            (user_id, path or ""),
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, avatar_source, custom_avatar_path)
+                VALUES (?, 'custom', ?)
+                ON CONFLICT(user_id) DO UPDATE SET avatar_source = 'custom', custom_avatar_path = excluded.custom_avatar_path""",
+                (user_id, path or ""),
+            )
 
     @staticmethod
     def set_telegram_avatar_path(user_id: int, path: str) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, telegram_avatar_path)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET telegram_avatar_path = excluded.telegram_avatar_path""",
-            (user_id, path or ""),
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, telegram_avatar_path)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET telegram_avatar_path = excluded.telegram_avatar_path""",
+                (user_id, path or ""),
+            )
 
     @staticmethod
     def reset_avatar_source(user_id: int) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, avatar_source)
-            VALUES (?, 'telegram')
-            ON CONFLICT(user_id) DO UPDATE SET avatar_source = 'telegram'""",
-            (user_id,),
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, avatar_source)
+                VALUES (?, 'telegram')
+                ON CONFLICT(user_id) DO UPDATE SET avatar_source = 'telegram'""",
+                (user_id,),
+            )
 
     @staticmethod
     def get_user_total_between_dates(user_id: int, start_date: str, end_date: str) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT COALESCE(SUM(c.total_amount), 0)
-            FROM shifts s
-            LEFT JOIN cars c ON s.id = c.shift_id
-            WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)""",
-            (user_id, start_date, end_date)
-        )
-        row = cur.fetchone()
-        conn.close()
-        return row[0] if row else 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """SELECT COALESCE(SUM(revenue), 0)
+                FROM user_day_stats
+                WHERE user_id = ? AND day BETWEEN date(?) AND date(?)""",
+                (user_id, start_date, end_date)
+            )
+            row = cur.fetchone()
+            return row[0] if row else 0
 
     @staticmethod
     def get_service_stats(user_id: int, limit: int = 10) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT cs.service_name,
-            SUM(cs.quantity) as total_count,
-            SUM(cs.price * cs.quantity) as total_amount
-            FROM shifts s
-            JOIN cars c ON c.shift_id = s.id
-            JOIN car_services cs ON cs.car_id = c.id
-            WHERE s.user_id = ?
-            GROUP BY cs.service_name
-            ORDER BY total_amount DESC
-            LIMIT ?""",
-            (user_id, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT cs.service_name,
+                SUM(cs.quantity) as total_count,
+                SUM(cs.price * cs.quantity) as total_amount
+                FROM shifts s
+                JOIN cars c ON c.shift_id = s.id
+                JOIN car_services cs ON cs.car_id = c.id
+                WHERE s.user_id = ?
+                GROUP BY cs.service_name
+                ORDER BY total_amount DESC
+                LIMIT ?""",
+                (user_id, limit)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def get_car_stats(user_id: int, limit: int = 10) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT c.car_number,
-            COUNT(c.id) as visits,
-            SUM(c.total_amount) as total_amount
-            FROM shifts s
-            JOIN cars c ON c.shift_id = s.id
-            WHERE s.user_id = ?
-            GROUP BY c.car_number
-            ORDER BY total_amount DESC
-            LIMIT ?""",
-            (user_id, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT c.car_number,
+                COUNT(c.id) as visits,
+                SUM(c.total_amount) as total_amount
+                FROM shifts s
+                JOIN cars c ON c.shift_id = s.id
+                WHERE s.user_id = ?
+                GROUP BY c.car_number
+                ORDER BY total_amount DESC
+                LIMIT ?""",
+                (user_id, limit)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
-    def get_shift_report_rows(user_id: int) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT s.id as shift_id,
-            s.start_time,
-            s.end_time,
-            c.car_number,
-            c.total_amount,
-            GROUP_CONCAT(cs.service_name || ' x' || cs.quantity, '; ') as services
-            FROM shifts s
-            LEFT JOIN cars c ON c.shift_id = s.id
-            LEFT JOIN car_services cs ON cs.car_id = c.id
-            WHERE s.user_id = ?
-            GROUP BY s.id, c.id
-            ORDER BY s.start_time DESC""",
-            (user_id,)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+    def iter_shift_report_rows(user_id: int, batch_size: int = 500) -> Iterator[Dict]:
+        """Строки отчёта по сменам (смена + машина) потоком; читать в том же потоке."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT s.id as shift_id,
+                s.start_time,
+                s.end_time,
+                c.car_number,
+                c.total_amount,
+                GROUP_CONCAT(cs.service_name || ' x' || cs.quantity, '; ') as services
+                FROM shifts s
+                LEFT JOIN cars c ON c.shift_id = s.id
+                LEFT JOIN car_services cs ON cs.car_id = c.id
+                WHERE s.user_id = ?
+                GROUP BY s.id, c.id
+                ORDER BY s.start_time DESC""",
+                (user_id,)
+            )
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+
+    @staticmethod
+    def iter_export_service_rows(
+        user_id: int,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        batch_size: int = 500,
+    ) -> Iterator[Dict]:
+        """Машины пользователя с услугами одним упорядоченным курсором: строка на услугу.
+
+        Порядок — день, машина, услуга; машина без услуг даёт одну строку с пустой услугой.
+        Генератор держит курсор открытым, поэтому читать его нужно в том же потоке.
+        """
+        where = "s.user_id = ?"
+        params: list = [user_id]
+        if start_date:
+            where += f" AND {SHIFT_WORK_DAY_EXPR} >= date(?)"
+            params.append(start_date)
+        if end_date:
+            where += f" AND {SHIFT_WORK_DAY_EXPR} <= date(?)"
+            params.append(end_date)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT {SHIFT_WORK_DAY_EXPR} as day, c.id as car_id, c.car_number, c.total_amount,
+                cs.service_name, cs.quantity
+                FROM shifts s
+                JOIN cars c ON c.shift_id = s.id
+                LEFT JOIN car_services cs ON cs.car_id = c.id
+                WHERE {where}
+                ORDER BY {SHIFT_WORK_DAY_EXPR}, c.created_at, c.id, cs.created_at, cs.id""",
+                params
+            )
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
 
     # ========== МАШИНЫ ==========
     @staticmethod
     def add_car(shift_id: int, car_number: str) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO cars (shift_id, car_number) VALUES (?, ?)",
-            (shift_id, car_number)
-        )
-        car_id = cur.lastrowid
-        conn.commit()
-        conn.close()
-        return car_id
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO cars (shift_id, car_number, car_number_norm) VALUES (?, ?, ?)",
+                (shift_id, car_number, car_number_key(car_number))
+            )
+            car_id = cur.lastrowid
+            _refresh_day_keys(cur, _day_key_for_shift(cur, shift_id))
+            return car_id
+
+    @staticmethod
+    def add_car_with_services(shift_id: int, car_number: str, services: List[tuple]) -> Dict:
+        """Создаёт машину сразу с услугами [(service_id, name, price, qty), ...] одной транзакцией."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO cars (shift_id, car_number, car_number_norm) VALUES (?, ?, ?)",
+                (shift_id, car_number, car_number_key(car_number))
+            )
+            car_id = cur.lastrowid
+            total_amount = _add_services_to_car(cur, car_id, services, day_keys=_day_key_for_shift(cur, shift_id))
+            return {"id": car_id, "shift_id": shift_id, "car_number": car_number, "total_amount": total_amount}
+
+    @staticmethod
+    def find_car_in_shift(shift_id: int, normalized_number: str) -> Optional[Dict]:
+        """Первая машина смены с этим номером (по индексу shift_id, car_number_norm)."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM cars WHERE shift_id = ? AND car_number_norm = ? ORDER BY id LIMIT 1",
+                (shift_id, car_number_key(normalized_number))
+            )
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_or_create_car_in_shift(shift_id: int, car_number: str, refresh_stats: bool = True) -> Dict:
+        """Находит машину по номеру или создаёт её; BEGIN IMMEDIATE не даёт двум
+        параллельным запросам создать две одинаковые машины.
+
+        refresh_stats=False — дневной агрегат пересчитает вызывающий код.
+        """
+        with db.session(immediate=True) as conn:
+            car = DatabaseManager.find_car_in_shift(shift_id, car_number)
+            if car:
+                return {**car, "created": False}
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO cars (shift_id, car_number, car_number_norm) VALUES (?, ?, ?)",
+                (shift_id, car_number, car_number_key(car_number))
+            )
+            car_id = cur.lastrowid
+            if refresh_stats:
+                _refresh_day_keys(cur, _day_key_for_shift(cur, shift_id))
+            return {**DatabaseManager.get_car(car_id), "created": True}
+
+    @staticmethod
+    def add_services_to_shift_cars(shift_id: int, cars: Dict[str, List[tuple]]) -> Dict[str, Dict]:
+        """Добавляет услуги сразу нескольким машинам смены {номер: [(service_id, name, price, qty), ...]}.
+
+        Машины находит или создаёт get_or_create_car_in_shift; дневной агрегат
+        пересчитывается один раз на всю смену. Блокировка записи берётся до
+        поиска, поэтому параллельные запросы не создают дубли машин.
+        """
+        if not cars:
+            return {}
+        with db.session(immediate=True) as conn:
+            cur = conn.cursor()
+            result: Dict[str, Dict] = {}
+            for number, services in cars.items():
+                car = DatabaseManager.get_or_create_car_in_shift(shift_id, number, refresh_stats=False)
+                total_amount = _add_services_to_car(cur, car["id"], services, day_keys=set())
+                result[number] = {"id": car["id"], "created": car["created"], "total_amount": total_amount}
+            _refresh_day_keys(cur, _day_key_for_shift(cur, shift_id))
+            return result
 
     @staticmethod
     def get_car(car_id: int) -> Optional[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM cars WHERE id = ?", (car_id,))
-        row = cur.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM cars WHERE id = ?", (car_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
 
     @staticmethod
     def get_previous_car_with_services(shift_id: int, current_car_id: int) -> Optional[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT c.*
-            FROM cars c
-            WHERE c.shift_id = ?
-              AND c.id < ?
-              AND EXISTS (SELECT 1 FROM car_services cs WHERE cs.car_id = c.id)
-            ORDER BY c.id DESC
-            LIMIT 1""",
-            (shift_id, current_car_id)
-        )
-        row = cur.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT c.*
+                FROM cars c
+                WHERE c.shift_id = ?
+                  AND c.id < ?
+                  AND EXISTS (SELECT 1 FROM car_services cs WHERE cs.car_id = c.id)
+                ORDER BY c.id DESC
+                LIMIT 1""",
+                (shift_id, current_car_id)
+            )
+            row = cur.fetchone()
+            return dict(row) if row else None
 
     @staticmethod
     def delete_car(car_id: int):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM car_services WHERE car_id = ?", (car_id,))
-        cur.execute("DELETE FROM cars WHERE id = ?", (car_id,))
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            day_keys = _day_keys_for_cars(cur, [car_id])
+            cur.execute("DELETE FROM car_services WHERE car_id = ?", (car_id,))
+            cur.execute("DELETE FROM cars WHERE id = ?", (car_id,))
+            _refresh_day_keys(cur, day_keys)
 
     @staticmethod
     def get_car_services(car_id: int) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT * FROM car_services WHERE car_id = ? ORDER BY created_at",
-            (car_id,)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM car_services WHERE car_id = ? ORDER BY created_at",
+                (car_id,)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     # ========== УСЛУГИ ==========
     @staticmethod
     def add_service_to_car(car_id: int, service_id: int, service_name: str, price: int) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        # Проверяем, есть ли уже такая услуга
-        cur.execute(
-            f"""SELECT id, quantity FROM car_services 
-            WHERE car_id = ? AND service_id = ? AND price = ?""",
-            (car_id, service_id, price)
-        )
-        existing = cur.fetchone()
-        
-        if existing:
-            # Увеличиваем количество
-            new_quantity = existing['quantity'] + 1
-            cur.execute(
-                "UPDATE car_services SET quantity = ? WHERE id = ?",
-                (new_quantity, existing['id'])
-            )
-        else:
-            # Добавляем новую услугу
-            cur.execute(
-                """INSERT INTO car_services (car_id, service_id, service_name, price, quantity) 
-                VALUES (?, ?, ?, ?, 1)""",
-                (car_id, service_id, service_name, price)
-            )
-        
-        # Обновляем общую сумму машины
-        cur.execute(
-            f"""UPDATE cars 
-            SET total_amount = (
-                SELECT COALESCE(SUM(price * quantity), 0) 
-                FROM car_services 
-                WHERE car_id = ?
-            ) WHERE id = ?""",
-            (car_id, car_id)
-        )
-        
-        conn.commit()
-        conn.close()
-        return price
+        with db.session() as conn:
+            _add_services_to_car(conn.cursor(), car_id, [(service_id, service_name, price, 1)])
+            return price
 
     @staticmethod
-    def remove_service_from_car(car_id: int, service_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT id, quantity FROM car_services
-            WHERE car_id = ? AND service_id = ?
-            ORDER BY created_at DESC
-            LIMIT 1""",
-            (car_id, service_id)
-        )
-        existing = cur.fetchone()
-        if not existing:
-            conn.close()
-            return False
+    def add_services_to_car(car_id: int, services: List[tuple]) -> int:
+        """Добавляет услуги [(service_id, name, price, qty), ...] одной транзакцией, возвращает сумму машины."""
+        with db.session() as conn:
+            return _add_services_to_car(conn.cursor(), car_id, services)
 
-        if existing["quantity"] > 1:
-            new_quantity = existing["quantity"] - 1
+    @staticmethod
+    def remove_service_from_car(car_id: int, service_id: int) -> bool:
+        with db.session() as conn:
+            cur = conn.cursor()
             cur.execute(
-                "UPDATE car_services SET quantity = ? WHERE id = ?",
-                (new_quantity, existing["id"])
+                f"""SELECT id, quantity FROM car_services
+                WHERE car_id = ? AND service_id = ?
+                ORDER BY created_at DESC
+                LIMIT 1""",
+                (car_id, service_id)
             )
-        else:
-            cur.execute("DELETE FROM car_services WHERE id = ?", (existing["id"],))
+            existing = cur.fetchone()
+            if not existing:
+                return False
+
+            if existing["quantity"] > 1:
+                new_quantity = existing["quantity"] - 1
+                cur.execute(
+                    "UPDATE car_services SET quantity = ? WHERE id = ?",
+                    (new_quantity, existing["id"])
+                )
+            else:
+                cur.execute("DELETE FROM car_services WHERE id = ?", (existing["id"],))
 
-        cur.execute(
-            f"""UPDATE cars
-            SET total_amount = (
-                SELECT COALESCE(SUM(price * quantity), 0)
-                FROM car_services
-                WHERE car_id = ?
-            ) WHERE id = ?""",
-            (car_id, car_id)
-        )
-        conn.commit()
-        conn.close()
-        return True
+            cur.execute(
+                f"""UPDATE cars
+                SET total_amount = (
+                    SELECT COALESCE(SUM(price * quantity), 0)
+                    FROM car_services
+                    WHERE car_id = ?
+                ) WHERE id = ?""",
+                (car_id, car_id)
+            )
+            _refresh_day_keys(cur, _day_keys_for_cars(cur, [car_id]))
+            return True
 
     @staticmethod
     def clear_car_services(car_id: int):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM car_services WHERE car_id = ?", (car_id,))
-        cur.execute("UPDATE cars SET total_amount = 0 WHERE id = ?", (car_id,))
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM car_services WHERE car_id = ?", (car_id,))
+            cur.execute("UPDATE cars SET total_amount = 0 WHERE id = ?", (car_id,))
+            _refresh_day_keys(cur, _day_keys_for_cars(cur, [car_id]))
 
 
     @staticmethod
     def get_month_days_with_totals(user_id: int, year: int, month: int) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT date(s.start_time) as day,
-            COUNT(c.id) as cars_count,
-            COALESCE(SUM(c.total_amount), 0) as total_amount
-            FROM shifts s
-            LEFT JOIN cars c ON c.shift_id = s.id
-            WHERE s.user_id = ?
-              AND strftime('%Y', s.start_time) = ?
-              AND strftime('%m', s.start_time) = ?
-            GROUP BY day
-            ORDER BY day DESC""",
-            (user_id, f"{year:04d}", f"{month:02d}")
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT {SHIFT_WORK_DAY_EXPR} as day,
+                COUNT(c.id) as cars_count,
+                COALESCE(SUM(c.total_amount), 0) as total_amount
+                FROM shifts s
+                LEFT JOIN cars c ON c.shift_id = s.id
+                WHERE s.user_id = ?
+                  AND {SHIFT_WORK_DAY_EXPR} BETWEEN ? AND ?
+                GROUP BY day
+                ORDER BY day DESC""",
+                (user_id, *_month_bounds(year, month))
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def get_cars_for_day(user_id: int, day: str) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT c.id, c.car_number, c.total_amount, c.shift_id, c.created_at
-            FROM cars c
-            JOIN shifts s ON s.id = c.shift_id
-            WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} = date(?)
-            ORDER BY c.created_at""",
-            (user_id, day)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT c.id, c.car_number, c.total_amount, c.shift_id, c.created_at
+                FROM cars c
+                JOIN shifts s ON s.id = c.shift_id
+                WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} = date(?)
+                ORDER BY c.created_at""",
+                (user_id, day)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def delete_car_for_user(user_id: int, car_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT c.id
-            FROM cars c
-            JOIN shifts s ON s.id = c.shift_id
-            WHERE c.id = ? AND s.user_id = ?""",
-            (car_id, user_id)
-        )
-        row = cur.fetchone()
-        if not row:
-            conn.close()
-            return False
-        cur.execute("DELETE FROM car_services WHERE car_id = ?", (car_id,))
-        cur.execute("DELETE FROM cars WHERE id = ?", (car_id,))
-        conn.commit()
-        conn.close()
-        return True
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT c.id
+                FROM cars c
+                JOIN shifts s ON s.id = c.shift_id
+                WHERE c.id = ? AND s.user_id = ?""",
+                (car_id, user_id)
+            )
+            row = cur.fetchone()
+            if not row:
+                return False
+            day_keys = _day_keys_for_cars(cur, [car_id])
+            cur.execute("DELETE FROM car_services WHERE car_id = ?", (car_id,))
+            cur.execute("DELETE FROM cars WHERE id = ?", (car_id,))
+            _refresh_day_keys(cur, day_keys)
+            return True
 
     @staticmethod
     def delete_day_data(user_id: int, day: str) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT c.id
-            FROM cars c
-            JOIN shifts s ON s.id = c.shift_id
-            WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} = date(?)""",
-            (user_id, day)
-        )
-        car_ids = [row[0] for row in cur.fetchall()]
-        for car_id in car_ids:
-            cur.execute("DELETE FROM car_services WHERE car_id = ?", (car_id,))
-            cur.execute("DELETE FROM cars WHERE id = ?", (car_id,))
-        conn.commit()
-        conn.close()
-        return len(car_ids)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT c.id
+                FROM cars c
+                JOIN shifts s ON s.id = c.shift_id
+                WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} = date(?)""",
+                (user_id, day)
+            )
+            car_ids = [row[0] for row in cur.fetchall()]
+            day_keys = _day_keys_for_cars(cur, car_ids)
+            for car_id in car_ids:
+                cur.execute("DELETE FROM car_services WHERE car_id = ?", (car_id,))
+                cur.execute("DELETE FROM cars WHERE id = ?", (car_id,))
+            _refresh_day_keys(cur, day_keys)
+            return len(car_ids)
 
     @staticmethod
     def get_decades_with_data(user_id: int, limit: int = 18) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT
-            CAST(strftime('%Y', {SHIFT_WORK_DAY_EXPR}) AS INTEGER) as year,
-            CAST(strftime('%m', {SHIFT_WORK_DAY_EXPR}) AS INTEGER) as month,
-            CASE
-                WHEN CAST(strftime('%d', {SHIFT_WORK_DAY_EXPR}) AS INTEGER) <= 10 THEN 1
-                WHEN CAST(strftime('%d', {SHIFT_WORK_DAY_EXPR}) AS INTEGER) <= 20 THEN 2
-                ELSE 3
-            END as decade_index,
-            COUNT(c.id) as cars_count,
-            COALESCE(SUM(c.total_amount), 0) as total_amount
-            FROM shifts s
-            JOIN cars c ON c.shift_id = s.id
-            WHERE s.user_id = ?
-            GROUP BY year, month, decade_index
-            ORDER BY year DESC, month DESC, decade_index DESC
-            LIMIT ?""",
-            (user_id, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT
+                CAST(strftime('%Y', {SHIFT_WORK_DAY_EXPR}) AS INTEGER) as year,
+                CAST(strftime('%m', {SHIFT_WORK_DAY_EXPR}) AS INTEGER) as month,
+                CASE
+                    WHEN CAST(strftime('%d', {SHIFT_WORK_DAY_EXPR}) AS INTEGER) <= 10 THEN 1
+                    WHEN CAST(strftime('%d', {SHIFT_WORK_DAY_EXPR}) AS INTEGER) <= 20 THEN 2
+                    ELSE 3
+                END as decade_index,
+                COUNT(c.id) as cars_count,
+                COALESCE(SUM(c.total_amount), 0) as total_amount
+                FROM shifts s
+                JOIN cars c ON c.shift_id = s.id
+                WHERE s.user_id = ?
+                GROUP BY year, month, decade_index
+                ORDER BY year DESC, month DESC, decade_index DESC
+                LIMIT ?""",
+                (user_id, limit)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     # ========== МАШИНЫ ==========
     @staticmethod
     def get_days_for_decade(user_id: int, year: int, month: int, decade_index: int) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
+        with db.session() as conn:
+            cur = conn.cursor()
 
-        if decade_index == 1:
-            start_day, end_day = 1, 10
-        elif decade_index == 2:
-            start_day, end_day = 11, 20
-        else:
-            start_day = 21
-            end_day = calendar.monthrange(year, month)[1]
+            if decade_index == 1:
+                start_day, end_day = 1, 10
+            elif decade_index == 2:
+                start_day, end_day = 11, 20
+            else:
+                start_day = 21
+                end_day = calendar.monthrange(year, month)[1]
 
-        start_date = f"{year:04d}-{month:02d}-{start_day:02d}"
-        end_date = f"{year:04d}-{month:02d}-{end_day:02d}"
+            start_date = f"{year:04d}-{month:02d}-{start_day:02d}"
+            end_date = f"{year:04d}-{month:02d}-{end_day:02d}"
 
-        cur.execute(
-            f"""SELECT {SHIFT_WORK_DAY_EXPR} as day,
-            COUNT(c.id) as cars_count,
-            COALESCE(SUM(c.total_amount), 0) as total_amount
-            FROM shifts s
-            JOIN cars c ON c.shift_id = s.id
-            WHERE s.user_id = ?
-              AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
-            GROUP BY day
-            ORDER BY day""",
-            (user_id, start_date, end_date)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+            cur.execute(
+                """SELECT day,
+                cars as cars_count,
+                revenue as total_amount
+                FROM user_day_stats
+                WHERE user_id = ?
+                  AND day BETWEEN date(?) AND date(?)
+                  AND cars > 0
+                ORDER BY day""",
+                (user_id, start_date, end_date)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def get_user_months_with_data(user_id: int, limit: int = 12) -> List[str]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT DISTINCT strftime('%Y-%m', {SHIFT_WORK_DAY_EXPR}) as ym
-            FROM shifts s
-            WHERE s.user_id = ?
-            ORDER BY ym DESC
-            LIMIT ?""",
-            (user_id, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [row["ym"] for row in rows if row["ym"]]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT DISTINCT strftime('%Y-%m', {SHIFT_WORK_DAY_EXPR}) as ym
+                FROM shifts s
+                WHERE s.user_id = ?
+                ORDER BY ym DESC
+                LIMIT ?""",
+                (user_id, limit)
+            )
+            rows = cur.fetchall()
+            return [row["ym"] for row in rows if row["ym"]]
 
 
     @staticmethod
     def prune_empty_shifts_for_user(user_id: int) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT s.id
-            FROM shifts s
-            LEFT JOIN cars c ON c.shift_id = s.id
-            WHERE s.user_id = ?
-            GROUP BY s.id
-            HAVING COUNT(c.id) = 0""",
-            (user_id,)
-        )
-        shift_ids = [row[0] for row in cur.fetchall()]
-        for shift_id in shift_ids:
-            cur.execute("DELETE FROM shifts WHERE id = ?", (shift_id,))
-        conn.commit()
-        conn.close()
-        return len(shift_ids)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT s.id
+                FROM shifts s
+                LEFT JOIN cars c ON c.shift_id = s.id
+                WHERE s.user_id = ?
+                GROUP BY s.id
+                HAVING COUNT(c.id) = 0""",
+                (user_id,)
+            )
+            shift_ids = [row[0] for row in cur.fetchall()]
+            for shift_id in shift_ids:
+                cur.execute("DELETE FROM shifts WHERE id = ?", (shift_id,))
+            return len(shift_ids)
 
     @staticmethod
     def reset_user_data(user_id: int) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM shifts WHERE user_id = ?", (user_id,))
-        shift_ids = [row[0] for row in cur.fetchall()]
-
-        if shift_ids:
-            placeholders = ",".join("?" for _ in shift_ids)
-            cur.execute(f"SELECT id FROM cars WHERE shift_id IN ({placeholders})", shift_ids)
-            car_ids = [row[0] for row in cur.fetchall()]
-            if car_ids:
-                car_ph = ",".join("?" for _ in car_ids)
-                cur.execute(f"DELETE FROM car_services WHERE car_id IN ({car_ph})", car_ids)
-            cur.execute(f"DELETE FROM cars WHERE shift_id IN ({placeholders})", shift_ids)
-
-        cur.execute("DELETE FROM shifts WHERE user_id = ?", (user_id,))
-        cur.execute("DELETE FROM user_combos WHERE user_id = ?", (user_id,))
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, daily_goal, shift_goal, decade_goal, price_mode, last_decade_notified)
-            VALUES (?, 0, 0, 0, 'day', '')
-            ON CONFLICT(user_id) DO UPDATE SET
-                daily_goal = 0,
-                shift_goal = 0,
-                decade_goal = 0,
-                price_mode = 'day',
-                last_decade_notified = ''""",
-            (user_id,)
-        )
-
-        conn.commit()
-        conn.close()
-
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM shifts WHERE user_id = ?", (user_id,))
+            shift_ids = [row[0] for row in cur.fetchall()]
+
+            if shift_ids:
+                placeholders = ",".join("?" for _ in shift_ids)
+                cur.execute(f"SELECT id FROM cars WHERE shift_id IN ({placeholders})", shift_ids)
+                car_ids = [row[0] for row in cur.fetchall()]
+                if car_ids:
+                    car_ph = ",".join("?" for _ in car_ids)
+                    cur.execute(f"DELETE FROM car_services WHERE car_id IN ({car_ph})", car_ids)
+                cur.execute(f"DELETE FROM cars WHERE shift_id IN ({placeholders})", shift_ids)
+
+            cur.execute("DELETE FROM shifts WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM user_day_stats WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM user_combos WHERE user_id = ?", (user_id,))
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, daily_goal, shift_goal, decade_goal, price_mode, last_decade_notified)
+                VALUES (?, 0, 0, 0, 'day', '')
+                ON CONFLICT(user_id) DO UPDATE SET
+                    daily_goal = 0,
+                    shift_goal = 0,
+                    decade_goal = 0,
+                    price_mode = 'day',
+                    last_decade_notified = ''""",
+                (user_id,)
+            )
+            _publish("day_stats_reset", user_id)
+            _publish("user_profile", user_id)
+            _publish("user_context", user_id)
+            _publish("user_settings_reset", user_id)
 
     @staticmethod
     def get_user_service_usage(user_id: int) -> Dict[int, int]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT cs.service_id, COALESCE(SUM(cs.quantity), 0) AS qty
-            FROM car_services cs
-            JOIN cars c ON c.id = cs.car_id
-            JOIN shifts s ON s.id = c.shift_id
-            WHERE s.user_id = ?
-            GROUP BY cs.service_id""",
-            (user_id,)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return {int(row["service_id"]): int(row["qty"]) for row in rows}
+        """Счётчики выбора услуг из user_service_usage (ведутся триггерами)."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT service_id, qty FROM user_service_usage WHERE user_id = ? AND qty > 0",
+                (user_id,)
+            )
+            rows = cur.fetchall()
+            return {int(row["service_id"]): int(row["qty"]) for row in rows}
 
 
 
     @staticmethod
     def get_top_services_between_dates(user_id: int, start_date: str, end_date: str, limit: int = 5) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT cs.service_name,
-            SUM(cs.quantity) as total_count,
-            SUM(cs.price * cs.quantity) as total_amount
-            FROM shifts s
-            JOIN cars c ON c.shift_id = s.id
-            JOIN car_services cs ON cs.car_id = c.id
-            WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
-            GROUP BY cs.service_name
-            ORDER BY total_amount DESC
-            LIMIT ?""",
-            (user_id, start_date, end_date, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT cs.service_name,
+                SUM(cs.quantity) as total_count,
+                SUM(cs.price * cs.quantity) as total_amount
+                FROM shifts s
+                JOIN cars c ON c.shift_id = s.id
+                JOIN car_services cs ON cs.car_id = c.id
+                WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
+                GROUP BY cs.service_name
+                ORDER BY total_amount DESC
+                LIMIT ?""",
+                (user_id, start_date, end_date, limit)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def get_top_cars_between_dates(user_id: int, start_date: str, end_date: str, limit: int = 5) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT c.car_number,
-            COUNT(c.id) as visits,
-            SUM(c.total_amount) as total_amount
-            FROM shifts s
-            JOIN cars c ON c.shift_id = s.id
-            WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
-            GROUP BY c.car_number
-            ORDER BY total_amount DESC
-            LIMIT ?""",
-            (user_id, start_date, end_date, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT c.car_number,
+                COUNT(c.id) as visits,
+                SUM(c.total_amount) as total_amount
+                FROM shifts s
+                JOIN cars c ON c.shift_id = s.id
+                WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
+                GROUP BY c.car_number
+                ORDER BY total_amount DESC
+                LIMIT ?""",
+                (user_id, start_date, end_date, limit)
+            )
+            rows = cur.fetchall()
+            return [dict(row) for row in rows]
 
     @staticmethod
     def save_user_combo(user_id: int, name: str, service_ids: List[int], alias: str = "") -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO user_combos (user_id, name, alias, service_ids) VALUES (?, ?, ?, ?)",
-            (user_id, name, (alias or "").strip().lower(), json.dumps(service_ids, ensure_ascii=False))
-        )
-        combo_id = cur.lastrowid
-        conn.commit()
-        conn.close()
-        return int(combo_id)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO user_combos (user_id, name, alias, service_ids) VALUES (?, ?, ?, ?)",
+                (user_id, name, (alias or "").strip().lower(), json.dumps(service_ids, ensure_ascii=False))
+            )
+            combo_id = cur.lastrowid
+            return int(combo_id)
 
     @staticmethod
     def get_user_combos(user_id: int) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT * FROM user_combos WHERE user_id = ? ORDER BY created_at DESC",
-            (user_id,)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        result = []
-        for row in rows:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM user_combos WHERE user_id = ? ORDER BY created_at DESC",
+                (user_id,)
+            )
+            rows = cur.fetchall()
+            result = []
+            for row in rows:
+                item = dict(row)
+                try:
+                    item["service_ids"] = json.loads(item.get("service_ids") or "[]")
+                except json.JSONDecodeError:
+                    item["service_ids"] = []
+                result.append(item)
+            return result
+
+    @staticmethod
+    def get_combo_by_alias(user_id: int, combo_alias: str) -> Optional[Dict]:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM user_combos WHERE user_id = ? AND lower(alias) = ?",
+                (user_id, (combo_alias or "").strip().lower()),
+            )
+            row = cur.fetchone()
+            if not row:
+                return None
             item = dict(row)
             try:
                 item["service_ids"] = json.loads(item.get("service_ids") or "[]")
             except json.JSONDecodeError:
                 item["service_ids"] = []
-            result.append(item)
-        return result
-
-    @staticmethod
-    def get_combo_by_alias(user_id: int, combo_alias: str) -> Optional[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT * FROM user_combos WHERE user_id = ? AND lower(alias) = ?",
-            (user_id, (combo_alias or "").strip().lower()),
-        )
-        row = cur.fetchone()
-        conn.close()
-        if not row:
-            return None
-        item = dict(row)
-        try:
-            item["service_ids"] = json.loads(item.get("service_ids") or "[]")
-        except json.JSONDecodeError:
-            item["service_ids"] = []
-        return item
+            return item
 
     @staticmethod
     def is_combo_alias_taken(user_id: int, combo_alias: str, exclude_combo_id: int | None = None) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        if exclude_combo_id:
-            cur.execute(
-                "SELECT 1 FROM user_combos WHERE user_id = ? AND lower(alias) = ? AND id <> ? LIMIT 1",
-                (user_id, (combo_alias or "").strip().lower(), exclude_combo_id),
-            )
-        else:
-            cur.execute(
-                "SELECT 1 FROM user_combos WHERE user_id = ? AND lower(alias) = ? LIMIT 1",
-                (user_id, (combo_alias or "").strip().lower()),
-            )
-        row = cur.fetchone()
-        conn.close()
-        return bool(row)
+        with db.session() as conn:
+            cur = conn.cursor()
+            if exclude_combo_id:
+                cur.execute(
+                    "SELECT 1 FROM user_combos WHERE user_id = ? AND lower(alias) = ? AND id <> ? LIMIT 1",
+                    (user_id, (combo_alias or "").strip().lower(), exclude_combo_id),
+                )
+            else:
+                cur.execute(
+                    "SELECT 1 FROM user_combos WHERE user_id = ? AND lower(alias) = ? LIMIT 1",
+                    (user_id, (combo_alias or "").strip().lower()),
+                )
+            row = cur.fetchone()
+            return bool(row)
 
     @staticmethod
     def get_combo(combo_id: int, user_id: int) -> Optional[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM user_combos WHERE id = ? AND user_id = ?", (combo_id, user_id))
-        row = cur.fetchone()
-        conn.close()
-        if not row:
-            return None
-        item = dict(row)
-        try:
-            item["service_ids"] = json.loads(item.get("service_ids") or "[]")
-        except json.JSONDecodeError:
-            item["service_ids"] = []
-        return item
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM user_combos WHERE id = ? AND user_id = ?", (combo_id, user_id))
+            row = cur.fetchone()
+            if not row:
+                return None
+            item = dict(row)
+            try:
+                item["service_ids"] = json.loads(item.get("service_ids") or "[]")
+            except json.JSONDecodeError:
+                item["service_ids"] = []
+            return item
 
     @staticmethod
     def update_combo_name(combo_id: int, user_id: int, new_name: str) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE user_combos SET name = ? WHERE id = ? AND user_id = ?",
-            (new_name, combo_id, user_id)
-        )
-        updated = cur.rowcount
-        conn.commit()
-        conn.close()
-        return bool(updated)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE user_combos SET name = ? WHERE id = ? AND user_id = ?",
+                (new_name, combo_id, user_id)
+            )
+            updated = cur.rowcount
+            return bool(updated)
 
     @staticmethod
     def update_combo_alias(combo_id: int, user_id: int, new_alias: str) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE user_combos SET alias = ? WHERE id = ? AND user_id = ?",
-            ((new_alias or "").strip().lower(), combo_id, user_id)
-        )
-        updated = cur.rowcount
-        conn.commit()
-        conn.close()
-        return bool(updated)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE user_combos SET alias = ? WHERE id = ? AND user_id = ?",
+                ((new_alias or "").strip().lower(), combo_id, user_id)
+            )
+            updated = cur.rowcount
+            return bool(updated)
 
     @staticmethod
     def update_combo_services(combo_id: int, user_id: int, service_ids: List[int]) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE user_combos SET service_ids = ? WHERE id = ? AND user_id = ?",
-            (json.dumps(service_ids, ensure_ascii=False), combo_id, user_id)
-        )
-        updated = cur.rowcount
-        conn.commit()
-        conn.close()
-        return bool(updated)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE user_combos SET service_ids = ? WHERE id = ? AND user_id = ?",
+                (json.dumps(service_ids, ensure_ascii=False), combo_id, user_id)
+            )
+            updated = cur.rowcount
+            return bool(updated)
 
 
     @staticmethod
     def delete_combo(combo_id: int, user_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM user_combos WHERE id = ? AND user_id = ?", (combo_id, user_id))
-        deleted = cur.rowcount
-        conn.commit()
-        conn.close()
-        return bool(deleted)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM user_combos WHERE id = ? AND user_id = ?", (combo_id, user_id))
+            deleted = cur.rowcount
+            return bool(deleted)
 
 
     @staticmethod
     def get_user_by_id(user_id: int) -> Optional[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
 
     @staticmethod
     def get_subscription_expires_at(user_id: int) -> str:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT subscription_expires_at FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return str(row["subscription_expires_at"]) if row and row["subscription_expires_at"] else ""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT subscription_expires_at FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            return str(row["subscription_expires_at"]) if row and row["subscription_expires_at"] else ""
 
     @staticmethod
     def set_subscription_expires_at(user_id: int, expires_at: str) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, subscription_expires_at)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET subscription_expires_at = excluded.subscription_expires_at""",
-            (user_id, expires_at or "")
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, subscription_expires_at)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET subscription_expires_at = excluded.subscription_expires_at""",
+                (user_id, expires_at or "")
+            )
+            _publish("user_context", user_id)
+
+    @staticmethod
+    def get_expiring_subscriptions(start_date: str, end_date: str) -> List[Dict]:
+        """Незаблокированные пользователи с окончанием подписки в [start_date, end_date)."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT u.id, u.telegram_id, us.subscription_expires_at
+                FROM user_settings us
+                JOIN users u ON u.id = us.user_id
+                WHERE us.subscription_expires_at >= ? AND us.subscription_expires_at < ?
+                  AND COALESCE(us.is_blocked, 0) = 0
+                ORDER BY us.subscription_expires_at""",
+                (start_date, end_date)
+            )
+            return [dict(row) for row in cur.fetchall()]
 
     @staticmethod
     def get_work_anchor_date(user_id: int) -> str:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT work_anchor_date FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return str(row["work_anchor_date"]) if row and row["work_anchor_date"] else ""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT work_anchor_date FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            return str(row["work_anchor_date"]) if row and row["work_anchor_date"] else ""
 
     @staticmethod
     def set_work_anchor_date(user_id: int, anchor_date: str) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, work_anchor_date)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET work_anchor_date = excluded.work_anchor_date""",
-            (user_id, anchor_date or "")
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, work_anchor_date)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET work_anchor_date = excluded.work_anchor_date""",
+                (user_id, anchor_date or "")
+            )
 
     @staticmethod
     def get_calendar_overrides(user_id: int) -> Dict[str, str]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT day, day_type FROM user_calendar_overrides WHERE user_id = ?", (user_id,))
-        rows = cur.fetchall()
-        conn.close()
-        return {str(r["day"]): str(r["day_type"]) for r in rows}
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT day, day_type FROM user_calendar_overrides WHERE user_id = ?", (user_id,))
+            rows = cur.fetchall()
+            return {str(r["day"]): str(r["day_type"]) for r in rows}
 
     @staticmethod
     def set_calendar_override(user_id: int, day: str, day_type: str) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        if day_type not in {"off", "extra", "planned"}:
-            cur.execute("DELETE FROM user_calendar_overrides WHERE user_id = ? AND day = ?", (user_id, day))
-        else:
-            cur.execute(
-                """INSERT INTO user_calendar_overrides (user_id, day, day_type)
-                VALUES (?, ?, ?)
-                ON CONFLICT(user_id, day) DO UPDATE SET day_type = excluded.day_type""",
-                (user_id, day, day_type)
-            )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            if day_type not in {"off", "extra", "planned"}:
+                cur.execute("DELETE FROM user_calendar_overrides WHERE user_id = ? AND day = ?", (user_id, day))
+            else:
+                cur.execute(
+                    """INSERT INTO user_calendar_overrides (user_id, day, day_type)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(user_id, day) DO UPDATE SET day_type = excluded.day_type""",
+                    (user_id, day, day_type)
+                )
 
     @staticmethod
     def is_goal_enabled(user_id: int) -> bool:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT goal_enabled FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return bool(row and int(row["goal_enabled"] or 0) == 1)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT goal_enabled FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            return bool(row and int(row["goal_enabled"] or 0) == 1)
 
     @staticmethod
     def set_goal_enabled(user_id: int, enabled: bool) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, goal_enabled)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET goal_enabled = excluded.goal_enabled""",
-            (user_id, 1 if enabled else 0)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, goal_enabled)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET goal_enabled = excluded.goal_enabled""",
+                (user_id, 1 if enabled else 0)
+            )
 
     @staticmethod
     def get_goal_message_binding(user_id: int) -> tuple[int, int]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT goal_chat_id, goal_message_id FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if not row:
-            return 0, 0
-        return int(row["goal_chat_id"] or 0), int(row["goal_message_id"] or 0)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT goal_chat_id, goal_message_id FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            if not row:
+                return 0, 0
+            return int(row["goal_chat_id"] or 0), int(row["goal_message_id"] or 0)
 
     @staticmethod
     def set_goal_message_binding(user_id: int, chat_id: int, message_id: int) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, goal_chat_id, goal_message_id)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET goal_chat_id = excluded.goal_chat_id, goal_message_id = excluded.goal_message_id""",
-            (user_id, int(chat_id), int(message_id))
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, goal_chat_id, goal_message_id)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET goal_chat_id = excluded.goal_chat_id, goal_message_id = excluded.goal_message_id""",
+                (user_id, int(chat_id), int(message_id))
+            )
 
     @staticmethod
     def clear_goal_message_binding(user_id: int) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO user_settings (user_id, goal_chat_id, goal_message_id)
-            VALUES (?, 0, 0)
-            ON CONFLICT(user_id) DO UPDATE SET goal_chat_id = 0, goal_message_id = 0""",
-            (user_id,)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO user_settings (user_id, goal_chat_id, goal_message_id)
+                VALUES (?, 0, 0)
+                ON CONFLICT(user_id) DO UPDATE SET goal_chat_id = 0, goal_message_id = 0""",
+                (user_id,)
+            )
+
+    @staticmethod
+    def get_user_settings_fields(user_id: int, fields: List[str]) -> Optional[Dict]:
+        columns = ", ".join(fields)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(f"SELECT {columns} FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def save_user_settings_many(changes: Dict[int, Dict]) -> int:
+        """Записывает накопленные изменения {user_id: {поле: значение}} одной транзакцией."""
+        saved = 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            for user_id, values in changes.items():
+                if not values:
+                    continue
+                columns = list(values)
+                cur.execute(
+                    f"""INSERT INTO user_settings (user_id, {", ".join(columns)})
+                    SELECT ?, {", ".join("?" for _ in columns)}
+                    WHERE EXISTS (SELECT 1 FROM users WHERE id = ?)
+                    ON CONFLICT(user_id) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in columns)}""",
+                    (user_id, *values.values(), user_id)
+                )
+                saved += cur.rowcount
+        return saved
 
     @staticmethod
     def get_price_mode_lock_until(user_id: int) -> str:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT price_mode_lock_until FROM user_settings WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return str(row["price_mode_lock_until"]) if row and row["price_mode_lock_until"] else ""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT price_mode_lock_until FROM user_settings WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+            return str(row["price_mode_lock_until"]) if row and row["price_mode_lock_until"] else ""
 
     @staticmethod
     def get_shifts_count_between_dates(user_id: int, start_date: str, end_date: str) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT COUNT(DISTINCT s.id)
-            FROM shifts s
-            JOIN cars c ON c.shift_id = s.id
-            WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)""",
-            (user_id, start_date, end_date)
-        )
-        row = cur.fetchone()
-        conn.close()
-        return int(row[0] or 0) if row else 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """SELECT COALESCE(SUM(shifts), 0)
+                FROM user_day_stats
+                WHERE user_id = ? AND day BETWEEN date(?) AND date(?)""",
+                (user_id, start_date, end_date)
+            )
+            row = cur.fetchone()
+            return int(row[0] or 0) if row else 0
 
     @staticmethod
     def get_cars_count_between_dates(user_id: int, start_date: str, end_date: str) -> int:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT COUNT(c.id)
-            FROM cars c
-            JOIN shifts s ON s.id = c.shift_id
-            WHERE s.user_id = ? AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)""",
-            (user_id, start_date, end_date)
-        )
-        row = cur.fetchone()
-        conn.close()
-        return int(row[0] or 0) if row else 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """SELECT COALESCE(SUM(cars), 0)
+                FROM user_day_stats
+                WHERE user_id = ? AND day BETWEEN date(?) AND date(?)""",
+                (user_id, start_date, end_date)
+            )
+            row = cur.fetchone()
+            return int(row[0] or 0) if row else 0
 
     @staticmethod
     def get_shift_repeated_services(shift_id: int) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT c.id as car_id, c.car_number, cs.service_name, SUM(cs.quantity) as total_count
-            FROM cars c JOIN car_services cs ON cs.car_id = c.id
-            WHERE c.shift_id = ?
-            GROUP BY c.id, c.car_number, cs.service_name
-            HAVING SUM(cs.quantity) > 1
-            ORDER BY c.created_at ASC, total_count DESC""",
-            (shift_id,)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(r) for r in rows]
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT c.id as car_id, c.car_number, cs.service_name, SUM(cs.quantity) as total_count
+                FROM cars c JOIN car_services cs ON cs.car_id = c.id
+                WHERE c.shift_id = ?
+                GROUP BY c.id, c.car_number, cs.service_name
+                HAVING SUM(cs.quantity) > 1
+                ORDER BY c.created_at ASC, total_count DESC""",
+                (shift_id,)
+            )
+            rows = cur.fetchall()
+            return [dict(r) for r in rows]
 
     @staticmethod
     def get_days_for_month(user_id: int, year_month: str) -> List[Dict]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""SELECT {SHIFT_WORK_DAY_EXPR} as day,
-            COUNT(DISTINCT s.id) as shifts_count,
-            COALESCE(SUM(c.total_amount),0) as total_amount
-            FROM shifts s
-            JOIN cars c ON c.shift_id = s.id
-            WHERE s.user_id = ? AND strftime('%Y-%m', {SHIFT_WORK_DAY_EXPR}) = ?
-            GROUP BY {SHIFT_WORK_DAY_EXPR}
-            ORDER BY day""",
-            (user_id, year_month)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(r) for r in rows]
+        year_s, month_s = year_month.split("-", 1)
+        start_date, end_date = _month_bounds(int(year_s), int(month_s))
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """SELECT day,
+                shifts as shifts_count,
+                revenue as total_amount
+                FROM user_day_stats
+                WHERE user_id = ? AND day BETWEEN ? AND ? AND cars > 0
+                ORDER BY day""",
+                (user_id, start_date, end_date)
+            )
+            rows = cur.fetchall()
+            return [dict(r) for r in rows]
 
     @staticmethod
     def get_app_content(key: str, default: str = "") -> str:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT value FROM app_content WHERE key = ?", (key,))
-        row = cur.fetchone()
-        conn.close()
-        return str(row["value"]) if row and row["value"] is not None else default
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT value FROM app_content WHERE key = ?", (key,))
+            row = cur.fetchone()
+            return str(row["value"]) if row and row["value"] is not None else default
+
+    @staticmethod
+    def get_app_content_many(keys: List[str]) -> Dict[str, str]:
+        """Значения сразу для набора ключей; отсутствующих ключей в ответе нет."""
+        keys = list(dict.fromkeys(keys))
+        result: Dict[str, str] = {}
+        if not keys:
+            return result
+        with db.session() as conn:
+            cur = conn.cursor()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" for _ in chunk)
+                cur.execute(f"SELECT key, value FROM app_content WHERE key IN ({placeholders})", chunk)
+                result.update({row["key"]: str(row["value"] or "") for row in cur.fetchall()})
+        return result
+
+    @staticmethod
+    def set_app_content_many(values: Dict[str, str]) -> None:
+        if not values:
+            return
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                f"""INSERT INTO app_content (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value""",
+                list(values.items())
+            )
 
     @staticmethod
     def set_app_content(key: str, value: str) -> None:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"""INSERT INTO app_content (key, value) VALUES (?, ?)
-            ON CONFLICT(key) DO UPDATE SET value = excluded.value""",
-            (key, value)
-        )
-        conn.commit()
-        conn.close()
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""INSERT INTO app_content (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value""",
+                (key, value)
+            )
+
+
+    # ========== ЖУРНАЛ API ==========
+    @staticmethod
+    def find_api_task_duplicates(idem_keys: List[str], tasks: List[tuple], since_ts: int) -> tuple:
+        """Какие ключи идемпотентности уже есть в журнале ({ключ: ts}) и какие задачи (shift_id, car, service)
+        уже приходили после since_ts. Задача считается повтором, только пока услуга стоит
+        у машины этой смены: удалённую пользователем услугу можно прислать снова.
+        Не больше двух запросов по индексам журнала."""
+        seen_keys: dict = {}
+        seen_tasks: set = set()
+        idem_keys = list(dict.fromkeys(key for key in idem_keys if key))
+        tasks = list(dict.fromkeys(tasks))
+        still_on_car = """EXISTS (
+            SELECT 1 FROM cars c
+            JOIN car_services cs ON cs.car_id = c.id
+            WHERE c.shift_id = l.shift_id AND c.car_number_norm = l.car AND cs.service_id = l.service
+        )"""
+        with db.session() as conn:
+            cur = conn.cursor()
+            if idem_keys:
+                placeholders = ",".join("?" for _ in idem_keys)
+                cur.execute(f"SELECT idem_key, ts FROM api_task_log WHERE idem_key IN ({placeholders})", idem_keys)
+                seen_keys = {row["idem_key"]: int(row["ts"]) for row in cur.fetchall()}
+            if len(tasks) == 1:
+                cur.execute(
+                    f"""SELECT l.shift_id, l.car, l.service FROM api_task_log l
+                    WHERE l.shift_id = ? AND l.car = ? AND l.service = ? AND l.ts >= ? AND {still_on_car}
+                    LIMIT 1""",
+                    (*tasks[0], since_ts)
+                )
+                seen_tasks = {(int(row["shift_id"]), row["car"], int(row["service"])) for row in cur.fetchall()}
+            elif tasks:
+                shift_ids = sorted({int(task[0]) for task in tasks})
+                placeholders = ",".join("?" for _ in shift_ids)
+                cur.execute(
+                    f"""SELECT DISTINCT l.shift_id, l.car, l.service FROM api_task_log l
+                    WHERE l.shift_id IN ({placeholders}) AND l.ts >= ? AND {still_on_car}""",
+                    [*shift_ids, since_ts]
+                )
+                wanted = set(tasks)
+                seen_tasks = {
+                    key for key in ((int(row["shift_id"]), row["car"], int(row["service"])) for row in cur.fetchall())
+                    if key in wanted
+                }
+        return seen_keys, seen_tasks
+
+    @staticmethod
+    def log_api_tasks(rows: List[tuple]) -> None:
+        """Записывает [(device_key, chat_id, shift_id, car, service, ts, idem_key), ...] в журнал."""
+        if not rows:
+            return
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                """INSERT OR IGNORE INTO api_task_log (device_key, chat_id, shift_id, car, service, ts, idem_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                [(device_key or "", chat_id, shift_id, car, service, ts, idem_key or None)
+                 for device_key, chat_id, shift_id, car, service, ts, idem_key in rows]
+            )
+
+    @staticmethod
+    def prune_api_task_log(before_ts: int) -> int:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM api_task_log WHERE ts < ?", (before_ts,))
+            return cur.rowcount
+
+    # ========== ВХОДЯЩИЕ ОБНОВЛЕНИЯ ==========
+    @staticmethod
+    def enqueue_telegram_update(update_id: int, payload: str, received_at: int) -> bool:
+        """Кладёт обновление webhook во входящую очередь; повтор того же update_id игнорируется."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT OR IGNORE INTO telegram_update_inbox (update_id, payload, received_at) VALUES (?, ?, ?)",
+                (update_id, payload, received_at)
+            )
+            return cur.rowcount > 0
+
+    @staticmethod
+    def take_telegram_updates(limit: int = 100, taken_at: int = 0) -> List[tuple]:
+        """Выдаёт до limit ещё не выданных обновлений по порядку update_id: [(update_id, payload), ...].
+
+        Строки остаются в таблице: обработанные помечает mark_telegram_updates_processed.
+        """
+        with db.session(immediate=True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """SELECT update_id, payload FROM telegram_update_inbox
+                WHERE processed_at IS NULL AND taken_at IS NULL
+                ORDER BY update_id LIMIT ?""",
+                (limit,)
+            )
+            rows = [(int(row["update_id"]), row["payload"]) for row in cur.fetchall()]
+            if rows:
+                placeholders = ",".join("?" for _ in rows)
+                cur.execute(
+                    f"UPDATE telegram_update_inbox SET taken_at = ? WHERE update_id IN ({placeholders})",
+                    [taken_at or int(time.time())] + [update_id for update_id, _ in rows]
+                )
+            return rows
+
+    @staticmethod
+    def mark_telegram_updates_processed(update_ids: List[int], processed_at: int) -> int:
+        if not update_ids:
+            return 0
+        with db.session() as conn:
+            cur = conn.cursor()
+            placeholders = ",".join("?" for _ in update_ids)
+            cur.execute(
+                f"UPDATE telegram_update_inbox SET processed_at = ? WHERE update_id IN ({placeholders})",
+                [processed_at] + list(update_ids)
+            )
+            return cur.rowcount
+
+    @staticmethod
+    def release_telegram_updates() -> int:
+        """Возвращает в очередь выданные, но не обработанные обновления (после смены лидера)."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE telegram_update_inbox SET taken_at = NULL WHERE processed_at IS NULL AND taken_at IS NOT NULL"
+            )
+            return cur.rowcount
+
+    @staticmethod
+    def prune_telegram_updates(before_ts: int) -> int:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM telegram_update_inbox WHERE processed_at < ?", (before_ts,))
+            return cur.rowcount
+
+    # ========== РАССЫЛКИ ==========
+    @staticmethod
+    def get_broadcast_recipient_rows() -> List[Dict]:
+        """Все, кто получает рассылки: без заблокированных и отключивших рассылку."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT u.id, u.telegram_id,
+                COALESCE(us.subscription_expires_at, '') as subscription_expires_at
+                FROM users u
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                WHERE COALESCE(us.is_blocked, 0) = 0
+                  AND COALESCE(us.broadcast_enabled, 1) = 1
+                ORDER BY u.id"""
+            )
+            return [dict(row) for row in cur.fetchall()]
+
+    @staticmethod
+    def create_broadcast_job(admin_telegram_id: int, target: str, text: str, recipients: List[int]) -> int:
+        recipients = list(dict.fromkeys(int(telegram_id) for telegram_id in recipients))
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO broadcast_jobs (admin_telegram_id, target, text, total) VALUES (?, ?, ?, ?)",
+                (admin_telegram_id, target, text, len(recipients))
+            )
+            job_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO broadcast_deliveries (job_id, telegram_id) VALUES (?, ?)",
+                [(job_id, telegram_id) for telegram_id in recipients]
+            )
+            return job_id
+
+    @staticmethod
+    def get_broadcast_job(job_id: int) -> Optional[Dict]:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_unfinished_broadcast_jobs() -> List[int]:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+            return [int(row["id"]) for row in cur.fetchall()]
+
+    @staticmethod
+    def get_pending_broadcast_deliveries(job_id: int, limit: int = 500) -> List[int]:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """SELECT telegram_id FROM broadcast_deliveries
+                WHERE job_id = ? AND status = 'pending'
+                ORDER BY telegram_id
+                LIMIT ?""",
+                (job_id, limit)
+            )
+            return [int(row["telegram_id"]) for row in cur.fetchall()]
+
+    @staticmethod
+    def save_broadcast_results(job_id: int, results: Dict[int, tuple]) -> None:
+        """Сохраняет пачку результатов {telegram_id: (status, attempts, error)} и счётчики задания."""
+        if not results:
+            return
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                """UPDATE broadcast_deliveries
+                SET status = ?, attempts = attempts + ?, error = ?
+                WHERE job_id = ? AND telegram_id = ? AND status = 'pending'""",
+                [(status, attempts, error or "", job_id, telegram_id) for telegram_id, (status, attempts, error) in results.items()]
+            )
+            cur.execute(
+                f"""UPDATE broadcast_jobs SET
+                sent = (SELECT COUNT(*) FROM broadcast_deliveries WHERE job_id = ? AND status = 'sent'),
+                failed = (SELECT COUNT(*) FROM broadcast_deliveries WHERE job_id = ? AND status = 'failed')
+                WHERE id = ?""",
+                (job_id, job_id, job_id)
+            )
+
+    @staticmethod
+    def set_broadcast_progress_message(job_id: int, chat_id: int, message_id: int) -> None:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE broadcast_jobs SET progress_chat_id = ?, progress_message_id = ? WHERE id = ?",
+                (chat_id, message_id, job_id)
+            )
+
+    @staticmethod
+    def finish_broadcast_job(job_id: int, status: str = "done") -> None:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE broadcast_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (status, job_id)
+            )
+
+
+    # ========== АГРЕГАТЫ ==========
+    @staticmethod
+    def rebuild_user_day_stats(user_id: Optional[int] = None) -> int:
+        with db.session() as conn:
+            return _rebuild_user_day_stats(conn.cursor(), user_id)
+
+    @staticmethod
+    def get_decade_day_stats(start_date: str, end_date: str) -> List[Dict]:
+        """Строки user_day_stats за период вместе с полями профиля для рейтинга."""
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT ds.user_id, ds.day, ds.revenue, ds.cars, ds.shifts, ds.hours,
+                u.name, u.telegram_id,
+                COALESCE(us.decade_goal, 0) as decade_goal,
+                COALESCE(us.rank_prefix, '') as rank_prefix,
+                COALESCE(us.is_blocked, 0) as is_blocked,
+                COALESCE(us.include_in_leaderboard, 1) as include_in_leaderboard
+                FROM user_day_stats ds
+                JOIN users u ON u.id = ds.user_id
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                WHERE ds.day BETWEEN date(?) AND date(?)""",
+                (start_date, end_date)
+            )
+            return [dict(row) for row in cur.fetchall()]
+
+    @staticmethod
+    def get_leaderboard_profile(user_id: int) -> Optional[Dict]:
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT u.id as user_id, u.name, u.telegram_id,
+                COALESCE(us.decade_goal, 0) as decade_goal,
+                COALESCE(us.rank_prefix, '') as rank_prefix,
+                COALESCE(us.is_blocked, 0) as is_blocked,
+                COALESCE(us.include_in_leaderboard, 1) as include_in_leaderboard
+                FROM users u
+                LEFT JOIN user_settings us ON us.user_id = u.id
+                WHERE u.id = ?""",
+                (user_id,)
+            )
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_active_shift_hours(user_ids: List[int], start_date: str, end_date: str) -> Dict[int, float]:
+        """Часы идущих сейчас смен с машинами (закрытые смены уже лежат в user_day_stats.hours)."""
+        if not user_ids:
+            return {}
+        placeholders = ",".join("?" for _ in user_ids)
+        now_str = now_local().isoformat(sep=" ")
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""SELECT s.user_id as user_id,
+                COALESCE(SUM(((julianday(?) - julianday(s.start_time)) * 24.0) - ((COALESCE(s.paused_seconds,0) + CASE WHEN COALESCE(s.pause_started_at,'') <> '' THEN (julianday(?) - julianday(s.pause_started_at)) * 86400 ELSE 0 END) / 3600.0)), 0) as total_hours
+                FROM shifts s
+                WHERE s.user_id IN ({placeholders})
+                  AND s.status = 'active'
+                  AND {SHIFT_WORK_DAY_EXPR} BETWEEN date(?) AND date(?)
+                  AND EXISTS (SELECT 1 FROM cars c WHERE c.shift_id = s.id)
+                GROUP BY s.user_id""",
+                [now_str, now_str, *user_ids, start_date, end_date]
+            )
+            return {int(row["user_id"]): max(float(row["total_hours"] or 0.0), 0.0) for row in cur.fetchall()}
+
+    @staticmethod
+    def verify_user_day_stats(user_id: Optional[int] = None) -> List[Dict]:
+        """Сверяет user_day_stats с сырыми таблицами и возвращает расхождения."""
+        if user_id is None:
+            where, params = "1 = 1", ()
+        else:
+            where, params = "s.user_id = ?", (user_id,)
+        with db.session() as conn:
+            cur = conn.cursor()
+            cur.execute(_USER_DAY_STATS_SELECT.format(where=where), params)
+            expected = {(int(row["user_id"]), row["day"]): dict(row) for row in cur.fetchall()}
+            cur.execute(
+                "SELECT * FROM user_day_stats" + ("" if user_id is None else " WHERE user_id = ?"),
+                params,
+            )
+            actual = {(int(row["user_id"]), row["day"]): dict(row) for row in cur.fetchall()}
+
+        mismatches = []
+        for key in sorted(set(expected) | set(actual)):
+            exp = expected.get(key)
+            act = actual.get(key)
+            same = bool(exp and act) and all(int(exp[f] or 0) == int(act[f] or 0) for f in ("revenue", "cars", "shifts"))
+            if same and abs(float(exp["hours"] or 0) - float(act["hours"] or 0)) > 0.01:
+                same = False
+            if not same:
+                mismatches.append({"user_id": key[0], "day": key[1], "expected": exp, "actual": act})
+        return mismatches
+
+
+# ========== МЕТРИКИ ==========
+# Методы DatabaseManager с этими префиксами только читают; остальные пишут.
+_READ_METHOD_PREFIXES = ("get_", "is_", "find_", "iter_", "verify_")
+_WRITE_METHODS = {"get_or_create_car_in_shift"}
+
+
+def is_write_method(name: str) -> bool:
+    return name in _WRITE_METHODS or not name.startswith(_READ_METHOD_PREFIXES)
+
+
+def _row_count(result) -> Optional[int]:
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple, set)):
+        return len(result)
+    if isinstance(result, (dict, sqlite3.Row)):
+        return 1
+    return None
+
+
+def _instrument_method(name: str, func: Callable):
+    write = is_write_method(name)
+
+    @functools.wraps(func)
+    def method(*args, **kwargs):
+        # синхронная запись вне транзакции тоже идёт через писателя: иначе она
+        # боролась бы с его BEGIN IMMEDIATE (внутри своей транзакции — на месте)
+        if write and db_writer.running and not db_writer.in_writer_thread() and not db.in_session():
+            return db_writer.call(getattr(DatabaseManager, name), *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, method=name)
+        rows = _row_count(result)
+        if rows is not None:
+            DB_QUERY_ROWS.observe(rows, method=name)
+        return result
+
+    return staticmethod(method)
+
+
+# Время и число строк каждого метода DatabaseManager; генераторы (iter_*) не оборачиваются.
+for _name, _value in list(vars(DatabaseManager).items()):
+    if isinstance(_value, staticmethod) and not inspect.isgeneratorfunction(_value.__func__):
+        setattr(DatabaseManager, _name, _instrument_method(_name, _value.__func__))
+
+
+# ========== АСИНХРОННЫЙ ДОСТУП ==========
+_db_executor: Optional[ThreadPoolExecutor] = None
+_db_executor_lock = threading.Lock()
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+        return _db_executor
+
+
+def shutdown_db_executor() -> None:
+    global _db_executor
+    db_writer.stop()
+    with _db_executor_lock:
+        executor, _db_executor = _db_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+    db.close_all()
+
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронную работу с БД в отдельном ограниченном пуле потоков."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(func, *args, **kwargs))
+
+
+# ========== ОДИН ПИСАТЕЛЬ ==========
+class DatabaseWriter:
+    """Единственный поток записи процесса.
+
+    Команды (синхронные функции) приходят через очередь. Всё, что накопилось
+    к моменту выборки (до batch_size), выполняется в одной транзакции
+    BEGIN IMMEDIATE, каждая команда — в своей точке сохранения: ошибка одной
+    откатывает только её, а на всю пачку приходится один commit. Потоки
+    процесса не борются за блокировку записи, чтение идёт параллельно через
+    собственные соединения потоков (WAL). Синхронный вызов пишущего метода
+    DatabaseManager вне транзакции тоже передаётся писателю и ждёт результата.
+    """
+
+    def __init__(self, batch_size: int = DB_WRITE_BATCH):
+        self.batch_size = batch_size
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._accepting = False
+        self.batches = 0
+        self.commands = 0
+
+    @property
+    def running(self) -> bool:
+        return self._accepting
+
+    def in_writer_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+            self._accepting = True
+            self._thread.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Выполняет уже принятые команды и останавливает поток."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._accepting = False
+            self._queue.put(None)
+        thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def submit(self, func: Callable, *args, **kwargs) -> Optional[Future]:
+        """Ставит команду в очередь; None, если писатель не запущен."""
+        future: Future = Future()
+        with self._lock:
+            if not self._accepting:
+                return None
+            self._queue.put((func, args, kwargs, future))
+        return future
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Синхронно выполняет команду через писателя (или на месте, если он не запущен)."""
+        if not self.in_writer_thread():
+            future = self.submit(func, *args, **kwargs)
+            if future is not None:
+                return future.result()
+        return func(*args, **kwargs)
+
+    def _loop(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            stopping = item is None
+            if batch:
+                self._run_batch(batch)
+
+    def _run_batch(self, batch: list) -> None:
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        outcomes = []
+        try:
+            with db.session(immediate=True):
+                for func, args, kwargs, _ in batch:
+                    try:
+                        with db.savepoint("writer_command"):
+                            outcomes.append((True, func(*args, **kwargs)))
+                    except Exception as exc:
+                        outcomes.append((False, exc))
+        except Exception as exc:
+            logger.exception("db writer batch failed size=%s", len(batch))
+            for *_, future in batch:
+                future.set_exception(exc)
+            return
+        self.batches += 1
+        self.commands += len(batch)
+        for (*_, future), (ok, value) in zip(batch, outcomes):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+db_writer = DatabaseWriter()
+
+
+def start_db_writer() -> bool:
+    """Запускает писателя, если включён DB_SINGLE_WRITER."""
+    if DB_SINGLE_WRITER:
+        db_writer.start()
+    return db_writer.running
+
+
+async def run_write(func, *args, **kwargs):
+    """Выполняет запись через поток-писатель, если он запущен, иначе — в общем пуле."""
+    future = db_writer.submit(func, *args, **kwargs)
+    if future is None:
+        return await run_db(func, *args, **kwargs)
+    return await asyncio.wrap_future(future)
+
+
+class AsyncDatabaseManager:
+    """Асинхронный фасад DatabaseManager: те же методы, но без блокировки event loop.
+
+    Методы генерируются из DatabaseManager и ищут оригинал в момент вызова,
+    поэтому подмены DatabaseManager.* (например, в тестах) продолжают работать.
+    Пишущие методы идут через db_writer, если он запущен. run() выполняет в пуле
+    произвольную синхронную функцию из нескольких запросов, write() — то же
+    через писателя.
+    """
+
+    run = staticmethod(run_db)
+    write = staticmethod(run_write)
+
+
+def _make_async_method(name: str):
+    runner = run_write if is_write_method(name) else run_db
+
+    async def method(*args, **kwargs):
+        return await runner(getattr(DatabaseManager, name), *args, **kwargs)
+
+    method.__name__ = name
+    method.__qualname__ = f"AsyncDatabaseManager.{name}"
+    return staticmethod(method)
+
+
+for _name, _value in list(vars(DatabaseManager).items()):
+    if isinstance(_value, staticmethod):
+        setattr(AsyncDatabaseManager, _name, _make_async_method(_name))
 
 
 if __name__ == "__main__":
+    import sys
+
     init_database()
-    print("База данных готова")
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "rebuild-stats":
+        print(f"Пересчитано строк user_day_stats: {DatabaseManager.rebuild_user_day_stats()}")
+    elif command == "verify-stats":
+        problems = DatabaseManager.verify_user_day_stats()
+        for item in problems[:50]:
+            print(f"user_id={item['user_id']} day={item['day']} ожидалось={item['expected']} в таблице={item['actual']}")
+        print(f"Расхождений user_day_stats: {len(problems)}")
+        sys.exit(1 if problems else 0)
+    else:
+        print("База данных готова")
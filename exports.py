@@ -1,11 +1,23 @@
+import csv
+import itertools
 import os
 import re
 import zipfile
+from calendar import monthrange
 from datetime import date
+from typing import Iterable, Iterator
 from xml.sax.saxutils import escape
 
 from database import DatabaseManager, now_local
 
+# Сколько строк листа собирать перед записью в zip-поток.
+XLSX_ROWS_PER_WRITE = 200
+# Предел таблицы sharedStrings. В неё попадают заголовки, даты и списки услуг:
+# списки повторяются ("Проверка x1"), а набор услуг небольшой и фиксированный.
+# Новые значения сверх предела пишутся inline, так что память не растёт с
+# размером выгрузки. Номера машин почти не повторяются и всегда пишутся inline.
+XLSX_SHARED_STRINGS_MAX = 5000
+
 
 def plain_service_name(name: str) -> str:
     return re.sub(r"^[^0-9A-Za-zА-Яа-я]+\s*", "", str(name)).strip()
@@ -17,72 +29,110 @@ def get_decade_date_range(year: int, month: int, decade_index: int) -> tuple[dat
     elif decade_index == 2:
         start_day, end_day = 11, 20
     else:
-        from calendar import monthrange
-
         start_day = 21
         end_day = monthrange(year, month)[1]
     return date(year, month, start_day), date(year, month, end_day)
 
 
-def _build_rows_for_days(days: list[str], user_id: int) -> list[dict]:
-    rows: list[dict] = []
-    for day in sorted(days):
-        for car in DatabaseManager.get_cars_for_day(user_id, day):
-            services = DatabaseManager.get_car_services(car["id"])
-            services_text = "; ".join(
-                f"{plain_service_name(item['service_name'])} x{item.get('quantity', 1)}"
-                for item in services
-            )
-            rows.append(
-                {
-                    "day": day,
-                    "car_number": car["car_number"],
-                    "services": services_text,
-                    "total_amount": int(car.get("total_amount", 0) or 0),
-                }
-            )
-    return rows
-
-
-def build_decade_export_rows(user_id: int, year: int, month: int, decade_index: int) -> list[dict]:
-    days = DatabaseManager.get_days_for_decade(user_id, year, month, decade_index)
-    return _build_rows_for_days([d["day"] for d in days], user_id)
-
-
-def _write_xlsx(path: str, rows: list[dict]) -> str:
+def iter_car_rows(user_id: int, start_date: str | None = None, end_date: str | None = None) -> Iterator[dict]:
+    """Строки отчёта «день, машина, услуги, сумма» из одного курсора по машинам."""
+    car: dict | None = None
+    services: list[str] = []
+    for row in DatabaseManager.iter_export_service_rows(user_id, start_date, end_date):
+        if car is None or row["car_id"] != car["car_id"]:
+            if car is not None:
+                yield _car_row(car, services)
+            car, services = row, []
+        if row["service_name"] is not None:
+            services.append(f"{plain_service_name(row['service_name'])} x{row['quantity'] if row['quantity'] is not None else 1}")
+    if car is not None:
+        yield _car_row(car, services)
+
+
+def _car_row(car: dict, services: list[str]) -> dict:
+    return {
+        "day": car["day"],
+        "car_number": car["car_number"],
+        "services": "; ".join(services),
+        "total_amount": int(car.get("total_amount", 0) or 0),
+    }
+
+
+def _col_name(idx: int) -> str:
+    name = ""
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+
+def _inline_cell(ref: str, value: str) -> str:
+    """Значение пишется прямо в лист и не копится в памяти."""
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(value)}</t></is></c>'
+
+
+class _SharedStrings:
+    """Таблица sharedStrings: повторяющиеся строки хранятся один раз, не больше max_size."""
+
+    def __init__(self, max_size: int = XLSX_SHARED_STRINGS_MAX) -> None:
+        self.max_size = max_size
+        self.index: dict[str, int] = {}
+        self.count = 0
+
+    def cell(self, ref: str, value: str) -> str:
+        idx = self.index.get(value)
+        if idx is None:
+            if len(self.index) >= self.max_size:
+                return _inline_cell(ref, value)
+            idx = self.index[value] = len(self.index)
+        self.count += 1
+        return f'<c r="{ref}" t="s"><v>{idx}</v></c>'
+
+    def write(self, stream) -> None:
+        stream.write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            f'count="{self.count}" uniqueCount="{len(self.index)}">'.encode("utf-8")
+        )
+        for value in self.index:
+            stream.write(f'<si><t xml:space="preserve">{escape(value)}</t></si>'.encode("utf-8"))
+        stream.write(b"</sst>")
+
+
+def _write_sheet(stream, rows: Iterable[dict], strings: _SharedStrings) -> None:
     headers = ["Дата", "Машина", "Услуги", "Сумма"]
-    all_rows = [headers] + [[r["day"], r["car_number"], r["services"], str(r["total_amount"])] for r in rows]
-
-    def col_name(idx: int) -> str:
-        name = ""
-        idx += 1
-        while idx:
-            idx, rem = divmod(idx - 1, 26)
-            name = chr(65 + rem) + name
-        return name
-
-    worksheet_rows = []
-    for ridx, row in enumerate(all_rows, start=1):
-        cells = []
-        for cidx, value in enumerate(row):
-            ref = f"{col_name(cidx)}{ridx}"
-            cells.append(f'<c r="{ref}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>')
-        worksheet_rows.append(f"<row r=\"{ridx}\">{''.join(cells)}</row>")
-
-    sheet_xml = (
+    stream.write(
         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
-        '<sheetData>'
-        + ''.join(worksheet_rows)
-        + '</sheetData></worksheet>'
+        '<sheetData>'.encode("utf-8")
     )
-
+    header_cells = "".join(strings.cell(f"{_col_name(cidx)}1", value) for cidx, value in enumerate(headers))
+    chunk = [f'<row r="1">{header_cells}</row>']
+    for ridx, row in enumerate(rows, start=2):
+        chunk.append(
+            f'<row r="{ridx}">'
+            + strings.cell(f"A{ridx}", str(row["day"]))
+            + _inline_cell(f"B{ridx}", str(row["car_number"]))
+            + strings.cell(f"C{ridx}", str(row["services"]))
+            + f'<c r="D{ridx}"><v>{int(row["total_amount"])}</v></c>'
+            + "</row>"
+        )
+        if len(chunk) >= XLSX_ROWS_PER_WRITE:
+            stream.write("".join(chunk).encode("utf-8"))
+            chunk = []
+    chunk.append("</sheetData></worksheet>")
+    stream.write("".join(chunk).encode("utf-8"))
+
+
+def _write_xlsx(path: str, rows: Iterable[dict]) -> str:
     content_types = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
 <Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
   <Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
   <Default Extension="xml" ContentType="application/xml"/>
   <Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
   <Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+  <Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
   <Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>
   <Override PartName="/docProps/app.xml" ContentType="application/vnd.openxmlformats-officedocument.extended-properties+xml"/>
 </Types>"""
@@ -99,6 +149,7 @@ def _write_xlsx(path: str, rows: list[dict]) -> str:
     workbook_rels = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
 <Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
   <Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+  <Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>
 </Relationships>"""
     app = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
 <Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties"><Application>ServiseBot</Application></Properties>"""
@@ -107,19 +158,24 @@ def _write_xlsx(path: str, rows: list[dict]) -> str:
   <dc:title>ServiceBot report</dc:title>
 </cp:coreProperties>"""
 
+    strings = _SharedStrings()
     with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
         zf.writestr("[Content_Types].xml", content_types)
         zf.writestr("_rels/.rels", rels)
         zf.writestr("xl/workbook.xml", workbook)
         zf.writestr("xl/_rels/workbook.xml.rels", workbook_rels)
-        zf.writestr("xl/worksheets/sheet1.xml", sheet_xml)
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as stream:
+            _write_sheet(stream, rows, strings)
+        with zf.open("xl/sharedStrings.xml", "w") as stream:
+            strings.write(stream)
         zf.writestr("docProps/app.xml", app)
         zf.writestr("docProps/core.xml", core)
     return path
 
 
 def create_decade_xlsx(user_id: int, year: int, month: int, decade_index: int) -> str:
-    rows = build_decade_export_rows(user_id, year, month, decade_index)
+    start, end = get_decade_date_range(year, month, decade_index)
+    rows = iter_car_rows(user_id, start.isoformat(), end.isoformat())
     os.makedirs("reports", exist_ok=True)
     filename = f"decade_{year}_{month:02d}_D{decade_index}_{now_local().strftime('%Y%m%d_%H%M%S')}.xlsx"
     return _write_xlsx(os.path.join("reports", filename), rows)
@@ -156,8 +212,39 @@ def create_decade_pdf(user_id: int, year: int, month: int, decade_index: int) ->
 
 
 def create_month_xlsx(user_id: int, year: int, month: int) -> str:
-    days = DatabaseManager.get_days_for_month(user_id, f"{year:04d}-{month:02d}")
-    rows = _build_rows_for_days([d["day"] for d in days], user_id)
+    last_day = monthrange(year, month)[1]
+    rows = iter_car_rows(user_id, f"{year:04d}-{month:02d}-01", f"{year:04d}-{month:02d}-{last_day:02d}")
     os.makedirs("reports", exist_ok=True)
     filename = f"month_{year}_{month:02d}_{now_local().strftime('%Y%m%d_%H%M%S')}.xlsx"
     return _write_xlsx(os.path.join("reports", filename), rows)
+
+
+def create_history_xlsx(user_id: int) -> str:
+    os.makedirs("reports", exist_ok=True)
+    filename = f"history_{now_local().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    return _write_xlsx(os.path.join("reports", filename), iter_car_rows(user_id))
+
+
+def create_history_csv(user_id: int) -> str:
+    rows = DatabaseManager.iter_shift_report_rows(user_id)
+    first = next(rows, None)
+    if first is None:
+        return ""
+
+    os.makedirs("reports", exist_ok=True)
+    filename = f"report_{now_local().strftime('%Y%m%d_%H%M%S')}.csv"
+    path = os.path.join("reports", filename)
+
+    with open(path, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["shift_id", "start_time", "end_time", "car_number", "services", "total_amount"])
+        for row in itertools.chain([first], rows):
+            writer.writerow([
+                row.get("shift_id"),
+                row.get("start_time"),
+                row.get("end_time") or "",
+                row.get("car_number") or "",
+                row.get("services") or "",
+                row.get("total_amount") or 0,
+            ])
+    return path
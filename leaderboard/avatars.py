@@ -8,6 +8,8 @@ from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
 from telegram import Bot
 
+from services.metrics import cache_result
+
 AVATAR_CACHE_DIR = Path("cache/avatars")
 AVATAR_TTL_DAYS = 7
 MAX_PARALLEL_DOWNLOADS = 4
@@ -67,6 +69,8 @@ async def get_avatar_image(bot: Bot, user_id: int, size: int, fallback_name: str
             raw = cache.read_bytes()
         except Exception:
             raw = None
+    if user_id:
+        cache_result("avatar", raw is not None)
 
     if raw is None and user_id:
         raw = await fetch_avatar_bytes(bot, user_id)
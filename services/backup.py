@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+try:  # zstd необязателен: без пакета zstandard бэкапы сжимаются gzip
+    import zstandard
+except ImportError:  # pragma: no cover - зависит от окружения
+    zstandard = None
+
+import database
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = max(1, int(os.getenv("BACKUP_KEEP", "14")))
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gzip").strip().lower()
+BACKUP_PAGES_PER_STEP = max(1, int(os.getenv("BACKUP_PAGES_PER_STEP", "256")))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+
+BACKUP_PREFIX = "backup_"
+_SUFFIXES = {None: ".db", "gzip": ".db.gz", "zstd": ".db.zst"}
+
+
+class BackupError(RuntimeError):
+    pass
+
+
+@dataclass(slots=True)
+class BackupResult:
+    path: str
+    pages: int
+    raw_size: int
+    size: int
+    compression: str | None
+    removed: list[str]
+
+
+def resolve_compression(value: str | None) -> str | None:
+    value = (value or "").strip().lower()
+    if value in {"", "none", "off", "0"}:
+        return None
+    if value in {"zstd", "zst"}:
+        if zstandard is None:
+            logger.warning("zstandard is not installed, falling back to gzip backups")
+            return "gzip"
+        return "zstd"
+    return "gzip"
+
+
+def snapshot_database(source_path: str, target_path: str, *, pages: int = BACKUP_PAGES_PER_STEP,
+                      pause: float = BACKUP_STEP_PAUSE) -> int:
+    """Онлайн-копия через sqlite3 backup API (с учётом WAL) порциями по pages страниц.
+
+    Между порциями поток засыпает на pause секунд, чтобы писатели успевали
+    брать блокировку. Возвращает число скопированных страниц.
+    """
+    copied = 0
+
+    def progress(status, remaining, total):
+        nonlocal copied
+        copied = total - remaining
+        if remaining and pause > 0:
+            time.sleep(pause)
+
+    source = sqlite3.connect(source_path, timeout=30)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=pages, progress=progress)
+            # копия должна быть самодостаточным файлом, без -wal рядом
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return copied
+
+
+def check_integrity(path: str) -> str:
+    conn = sqlite3.connect(f"file:{Path(path).resolve()}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    return "\n".join(str(row[0]) for row in rows)
+
+
+def _compress(raw_path: str, final_path: str, compression: str | None) -> None:
+    if compression is None:
+        os.replace(raw_path, final_path)
+        return
+    tmp_path = final_path + ".part"
+    with open(raw_path, "rb") as src:
+        if compression == "zstd":
+            with open(tmp_path, "wb") as dst, zstandard.ZstdCompressor(level=10).stream_writer(dst) as writer:
+                shutil.copyfileobj(src, writer, 1024 * 1024)
+        else:
+            with gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, final_path)
+    os.remove(raw_path)
+
+
+def rotate_backups(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> list[str]:
+    """Оставляет keep самых свежих бэкапов, остальные удаляет."""
+    directory = Path(backup_dir)
+    if not directory.is_dir():
+        return []
+    backups = sorted(
+        (item for item in directory.iterdir()
+         if item.is_file() and item.name.startswith(BACKUP_PREFIX) and not item.name.endswith(".part")),
+        key=lambda item: item.name,
+        reverse=True,
+    )
+    removed = []
+    for item in backups[keep:]:
+        try:
+            item.unlink()
+            removed.append(str(item))
+        except OSError:
+            logger.warning("failed to remove old backup %s", item)
+    return removed
+
+
+def create_backup(db_path: str | None = None, backup_dir: str = BACKUP_DIR, *,
+                  compression: str | None = BACKUP_COMPRESSION, keep: int = BACKUP_KEEP,
+                  pages: int = BACKUP_PAGES_PER_STEP, pause: float = BACKUP_STEP_PAUSE) -> BackupResult | None:
+    """Снимок БД → проверка integrity_check → сжатие → ротация.
+
+    Вызывается из пула потоков; None, если файла базы нет.
+    """
+    source_path = db_path or database.DB_PATH
+    if not os.path.exists(source_path):
+        return None
+    compression = resolve_compression(compression)
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = database.now_local().strftime("%Y%m%d_%H%M%S")
+    base_path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}")
+    raw_path = base_path + ".db.part"
+    final_path = base_path + _SUFFIXES[compression]
+
+    started = time.monotonic()
+    try:
+        copied = snapshot_database(source_path, raw_path, pages=pages, pause=pause)
+        integrity = check_integrity(raw_path)
+        if integrity != "ok":
+            raise BackupError(f"integrity_check failed: {integrity[:200]}")
+        raw_size = os.path.getsize(raw_path)
+        _compress(raw_path, final_path, compression)
+    except Exception:
+        for leftover in (raw_path, final_path + ".part"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    removed = rotate_backups(backup_dir, keep)
+    result = BackupResult(
+        path=final_path,
+        pages=copied,
+        raw_size=raw_size,
+        size=os.path.getsize(final_path),
+        compression=compression,
+        removed=removed,
+    )
+    logger.info(
+        "backup created path=%s pages=%s raw=%s size=%s removed=%s in %.2fs",
+        result.path, result.pages, result.raw_size, result.size, len(removed), time.monotonic() - started,
+    )
+    return result
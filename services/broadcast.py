@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from database import AsyncDatabaseManager
+from services.fanout import RateLimiter, fan_out
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_SENDERS = max(1, int(os.getenv("BROADCAST_SENDERS", "8")))
+BROADCAST_BATCH_SIZE = max(1, int(os.getenv("BROADCAST_BATCH_SIZE", "50")))
+BROADCAST_MAX_ATTEMPTS = max(1, int(os.getenv("BROADCAST_MAX_ATTEMPTS", "3")))
+BROADCAST_PROGRESS_SECONDS = 2.0
+# Telegram: не чаще сообщения в секунду в один чат
+BROADCAST_PER_CHAT_INTERVAL = 1.0
+# сколько раз подряд можно получить flood wait по одному адресату
+BROADCAST_MAX_FLOOD_WAITS = 10
+
+
+@dataclass(slots=True)
+class BroadcastProgress:
+    job_id: int
+    total: int
+    sent: int
+    failed: int
+    done: bool = False
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed
+
+
+class ChatRateLimiter:
+    """Минимальный интервал между сообщениями в один и тот же чат."""
+
+    def __init__(self, interval: float = BROADCAST_PER_CHAT_INTERVAL, clock: Callable[[], float] = time.monotonic):
+        self.interval = interval
+        self._clock = clock
+        self._next_at: dict[int, float] = {}
+
+    def reserve(self, chat_id: int) -> float:
+        """Занимает ближайший слот для чата; возвращает, сколько секунд до него ждать."""
+        now = self._clock()
+        if len(self._next_at) > 10000:
+            self._next_at = {key: value for key, value in self._next_at.items() if value > now}
+        slot = max(now, self._next_at.get(chat_id, now))
+        self._next_at[chat_id] = slot + self.interval
+        return slot - now
+
+    async def acquire(self, chat_id: int) -> None:
+        delay = self.reserve(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BroadcastRunner:
+    """Доставка одного задания рассылки.
+
+    Адресаты берутся из broadcast_deliveries пачками, отправляются несколькими
+    параллельными отправителями под общим и поканальным ограничителями,
+    а результаты каждой пачки сразу сохраняются — после рестарта задание
+    продолжается с непройденных адресатов. RetryAfter приостанавливает всех
+    отправителей на время, указанное Telegram.
+    """
+
+    def __init__(
+        self,
+        bot,
+        *,
+        limiter: RateLimiter,
+        chat_limiter: ChatRateLimiter | None = None,
+        senders: int = BROADCAST_SENDERS,
+        batch_size: int = BROADCAST_BATCH_SIZE,
+        max_attempts: int = BROADCAST_MAX_ATTEMPTS,
+        progress_seconds: float = BROADCAST_PROGRESS_SECONDS,
+    ):
+        self.bot = bot
+        self.limiter = limiter
+        self.chat_limiter = chat_limiter or ChatRateLimiter()
+        self.senders = senders
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.progress_seconds = progress_seconds
+        self._paused_until = 0.0
+
+    async def _wait_flood(self) -> None:
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _deliver(self, chat_id: int, text: str) -> tuple[str, int, str]:
+        attempts = 0
+        flood_waits = 0
+        while True:
+            await self._wait_flood()
+            await self.chat_limiter.acquire(chat_id)
+            await self.limiter.acquire()
+            attempts += 1
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return "sent", attempts, ""
+            except RetryAfter as exc:
+                flood_waits += 1
+                retry_after = float(exc.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning("broadcast flood wait %.1fs chat_id=%s", retry_after, chat_id)
+                if flood_waits >= BROADCAST_MAX_FLOOD_WAITS:
+                    return "failed", attempts, f"RetryAfter {retry_after}"
+            except (Forbidden, BadRequest) as exc:
+                return "failed", attempts, str(exc)[:200]
+            except NetworkError as exc:
+                if attempts - flood_waits >= self.max_attempts:
+                    return "failed", attempts, str(exc)[:200]
+                await asyncio.sleep(2 ** (attempts - flood_waits - 1))
+            except Exception as exc:
+                logger.exception("broadcast delivery failed chat_id=%s", chat_id)
+                return "failed", attempts, str(exc)[:200]
+
+    async def run(
+        self,
+        job_id: int,
+        on_progress: Callable[[BroadcastProgress], Awaitable[None]] | None = None,
+    ) -> BroadcastProgress | None:
+        job = await AsyncDatabaseManager.get_broadcast_job(job_id)
+        if not job:
+            return None
+        text = job["text"]
+        progress = BroadcastProgress(job_id=job_id, total=int(job["total"]), sent=int(job["sent"]), failed=int(job["failed"]))
+        last_report = 0.0
+
+        while True:
+            chat_ids = await AsyncDatabaseManager.get_pending_broadcast_deliveries(job_id, self.batch_size)
+            if not chat_ids:
+                break
+            results: dict[int, tuple] = {}
+
+            async def send(chat_id: int) -> None:
+                results[chat_id] = await self._deliver(chat_id, text)
+
+            try:
+                await fan_out(chat_ids, send, concurrency=self.senders)
+            except asyncio.CancelledError:
+                # остановка бота: сохраняем то, что успели отправить, остальное — при следующем запуске;
+                # запись уходит в поток БД и не обрывается повторной отменой
+                await asyncio.shield(AsyncDatabaseManager.save_broadcast_results(job_id, results))
+                raise
+            await AsyncDatabaseManager.save_broadcast_results(job_id, results)
+            for status, _, _ in results.values():
+                if status == "sent":
+                    progress.sent += 1
+                else:
+                    progress.failed += 1
+
+            if on_progress and time.monotonic() - last_report >= self.progress_seconds:
+                last_report = time.monotonic()
+                try:
+                    await on_progress(progress)
+                except Exception:
+                    logger.warning("broadcast progress update failed job_id=%s", job_id, exc_info=True)
+
+        await AsyncDatabaseManager.finish_broadcast_job(job_id)
+        progress.done = True
+        if on_progress:
+            try:
+                await on_progress(progress)
+            except Exception:
+                logger.warning("broadcast progress update failed job_id=%s", job_id, exc_info=True)
+        return progress
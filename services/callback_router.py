@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import secrets
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, make_dataclass
+from typing import Any, Callable
+
+# лимит Telegram на callback_data, байт
+CALLBACK_DATA_LIMIT = 64
+# версия формата: первая цифра callback_data; старые строки "prefix_a_b" с цифры не начинаются
+CALLBACK_VERSION = "1"
+CALLBACK_TOKEN_TABLE_SIZE = 10000
+_SEPARATOR = ":"
+_TOKEN_MARK = "#"
+
+
+class CallbackDataError(ValueError):
+    """callback_data не разбирается по схеме маршрута (или токен устарел)."""
+
+
+@dataclass(slots=True)
+class CallbackMatch:
+    name: str
+    handler: Callable
+    payload: Any = None
+    # старые обработчики получают исходную строку, типизированные — payload
+    typed: bool = False
+
+
+@dataclass(slots=True)
+class _Route:
+    opcode: str
+    handler: Callable
+    fields: tuple[tuple[str, type, Any], ...]
+    payload_type: type
+    legacy_prefix: str | None
+
+
+class CallbackTokenTable:
+    """Серверная таблица для payload, которые не помещаются в 64 байта.
+
+    Держится в памяти процесса (LRU): после рестарта такие кнопки устаревают
+    и обработчик получает CallbackDataError.
+    """
+
+    def __init__(self, max_size: int = CALLBACK_TOKEN_TABLE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, tuple] = OrderedDict()
+        self._tokens: dict[tuple, str] = {}
+
+    def put(self, data: tuple) -> str:
+        """data — (opcode, значения полей строками); повторный put вернёт тот же токен."""
+        with self._lock:
+            token = self._tokens.get(data)
+            if token is None:
+                token = secrets.token_urlsafe(9)
+                self._tokens[data] = token
+            self._items[token] = data
+            self._items.move_to_end(token)
+            while len(self._items) > self.max_size:
+                _, old = self._items.popitem(last=False)
+                self._tokens.pop(old, None)
+            return token
+
+    def get(self, token: str) -> tuple | None:
+        with self._lock:
+            data = self._items.get(token)
+            if data is not None:
+                self._items.move_to_end(token)
+            return data
+
+
+def _parse_value(kind: type, raw: str):
+    if kind is bool:
+        if raw not in {"0", "1"}:
+            raise CallbackDataError(f"bad bool {raw!r}")
+        return raw == "1"
+    if kind is int:
+        try:
+            return int(raw)
+        except ValueError:
+            raise CallbackDataError(f"bad int {raw!r}") from None
+    return raw
+
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+class CallbackRouter:
+    """Маршрутизатор callback-кнопок.
+
+    Новые кнопки кодируются как "<версия><opcode>:<поле>:<поле>" и разбираются
+    по схеме маршрута в типизированный payload; поиск маршрута — один поиск
+    в словаре по opcode. Если строка не помещается в CALLBACK_DATA_LIMIT,
+    в кнопку кладётся токен "<версия>#<token>" из CallbackTokenTable.
+    Старые строки ("history_0", "service_12_345_0") разбираются через точные
+    ключи и самый длинный совпавший префикс — порядок регистрации не важен.
+    """
+
+    def __init__(self, tokens: CallbackTokenTable | None = None):
+        self.tokens = tokens or CallbackTokenTable()
+        self._routes: dict[str, _Route] = {}
+        self._exact: dict[str, Callable] = {}
+        self._prefixes: dict[str, tuple[Callable, _Route | None]] = {}
+        self._prefix_lengths: list[int] = []
+
+    # ---- регистрация ----
+    def route(self, opcode: str, *, legacy: str | None = None, **fields):
+        """Декоратор типизированного обработчика handler(query, context, payload).
+
+        fields — схема payload в порядке кодирования: имя=тип или имя=(тип, значение
+        по умолчанию). legacy — префикс старого формата "prefix_a_b" с теми же полями.
+        """
+        if not opcode or _SEPARATOR in opcode or _TOKEN_MARK in opcode:
+            raise ValueError(f"bad opcode {opcode!r}")
+        schema = []
+        for name, spec in fields.items():
+            kind, default = spec if isinstance(spec, tuple) else (spec, None)
+            schema.append((name, kind, default))
+
+        def decorator(handler: Callable) -> Callable:
+            if opcode in self._routes:
+                raise ValueError(f"opcode {opcode!r} already registered")
+            payload_type = make_dataclass(
+                f"{handler.__name__}_payload",
+                [(name, kind) for name, kind, _ in schema],
+                frozen=True,
+                slots=True,
+            )
+            route = _Route(opcode, handler, tuple(schema), payload_type, legacy)
+            self._routes[opcode] = route
+            if legacy:
+                self._add_prefix(legacy, handler, route)
+            return handler
+
+        return decorator
+
+    def exact(self, data: str, handler: Callable) -> None:
+        """Старая кнопка с фиксированной строкой: handler(query, context)."""
+        self._exact[data] = handler
+
+    def prefix(self, prefix: str, handler: Callable) -> None:
+        """Старая кнопка "prefix...": handler(query, context, data)."""
+        self._add_prefix(prefix, handler, None)
+
+    def _add_prefix(self, prefix: str, handler: Callable, route: _Route | None) -> None:
+        self._prefixes[prefix] = (handler, route)
+        self._prefix_lengths = sorted({len(item) for item in self._prefixes}, reverse=True)
+
+    def payload(self, opcode: str, **values):
+        """Payload маршрута для прямого вызова обработчика из кода."""
+        route = self._routes[opcode]
+        return route.payload_type(**{name: values.get(name, default) for name, _, default in route.fields})
+
+    # ---- кодирование ----
+    def encode(self, opcode: str, **values) -> str:
+        route = self._routes[opcode]
+        raw = []
+        for name, _, default in route.fields:
+            value = values.get(name, default)
+            if value is None:
+                raise ValueError(f"{opcode}: missing {name}")
+            raw.append(_format_value(value))
+        data = _SEPARATOR.join([CALLBACK_VERSION + opcode, *raw])
+        if any(_SEPARATOR in item for item in raw) or len(data.encode()) > CALLBACK_DATA_LIMIT:
+            return CALLBACK_VERSION + _TOKEN_MARK + self.tokens.put((opcode, tuple(raw)))
+        return data
+
+    # ---- разбор ----
+    def match(self, data: str) -> CallbackMatch | None:
+        """Находит обработчик; CallbackDataError, если строка не разбирается по схеме."""
+        if data[:1] == CALLBACK_VERSION:
+            return self._match_versioned(data)
+        handler = self._exact.get(data)
+        if handler is not None:
+            return CallbackMatch(data, handler)
+        for length in self._prefix_lengths:
+            found = self._prefixes.get(data[:length])
+            if found is None:
+                continue
+            handler, route = found
+            if route is None:
+                return CallbackMatch(data[:length], handler, data)
+            raw = data[length:].split("_", len(route.fields) - 1) if route.fields else []
+            return CallbackMatch(route.opcode, handler, self._build(route, raw), typed=True)
+        return None
+
+    def _match_versioned(self, data: str) -> CallbackMatch:
+        body = data[len(CALLBACK_VERSION):]
+        if body.startswith(_TOKEN_MARK):
+            resolved = self.tokens.get(body[len(_TOKEN_MARK):])
+            if resolved is None:
+                raise CallbackDataError("callback token expired")
+            opcode, raw = resolved
+        else:
+            opcode, *raw = body.split(_SEPARATOR)
+        route = self._routes.get(opcode)
+        if route is None:
+            raise CallbackDataError(f"unknown opcode {opcode!r}")
+        return CallbackMatch(route.opcode, route.handler, self._build(route, raw), typed=True)
+
+    def _build(self, route: _Route, raw: list[str] | tuple[str, ...]):
+        if len(raw) > len(route.fields):
+            raise CallbackDataError(f"{route.opcode}: too many fields")
+        values = {}
+        for index, (name, kind, default) in enumerate(route.fields):
+            if index < len(raw) and raw[index] != "":
+                values[name] = _parse_value(kind, raw[index])
+            elif default is not None:
+                values[name] = default
+            else:
+                raise CallbackDataError(f"{route.opcode}: missing {name}")
+        return route.payload_type(**values)
+
+    async def dispatch(self, match: CallbackMatch, query, context) -> None:
+        if match.typed or match.payload is not None:
+            await match.handler(query, context, match.payload)
+        else:
+            await match.handler(query, context)
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Iterable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+JOB_SEND_CONCURRENCY = max(1, int(os.getenv("JOB_SEND_CONCURRENCY", "8")))
+# Telegram допускает около 30 сообщений в секунду на бота; держим запас.
+JOB_SEND_RATE = float(os.getenv("JOB_SEND_RATE", "25"))
+
+
+class RateLimiter:
+    """Асинхронный token bucket: не больше rate событий в секунду, всплеск до burst."""
+
+    def __init__(self, rate: float, burst: int | None = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, int(rate)))
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Берёт токен, если он есть; иначе возвращает, сколько секунд ждать."""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                delay = self.try_acquire()
+                if not delay:
+                    return
+                await asyncio.sleep(delay)
+
+
+async def fan_out(
+    items: Iterable[T],
+    worker: Callable[[T], Awaitable[Any]],
+    *,
+    concurrency: int = JOB_SEND_CONCURRENCY,
+) -> list[Any]:
+    """Запускает worker для каждого элемента, не больше concurrency одновременно.
+
+    Ошибка одного элемента не останавливает остальные: она логируется,
+    а на её месте в результате стоит None.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(item: T) -> Any:
+        async with semaphore:
+            try:
+                return await worker(item)
+            except Exception:
+                logger.exception("fan-out worker failed item=%r", item)
+                return None
+
+    return list(await asyncio.gather(*(run(item) for item in items)))
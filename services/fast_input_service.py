@@ -2,14 +2,24 @@ from __future__ import annotations
 
 import logging
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from config import validate_car_number
 from database import DatabaseManager
+from services.service_search import SERVICE_INDEX, ServiceSearchIndex
 
 logger = logging.getLogger(__name__)
 
 ALIAS_RE = re.compile(r"^[a-zа-я0-9_-]{2,16}$", re.IGNORECASE)
+# "запр3" — три заправки
+MULTIPLIER_RE = re.compile(r"^([а-яёa-z]+)(\d+)$")
+
+
+@dataclass(slots=True)
+class FastServiceToken:
+    service_id: int
+    quantity: int = 1
+    half_price: bool = False
 
 
 @dataclass(slots=True)
@@ -19,6 +29,8 @@ class FastInputParse:
     service_ids: list[int]
     unknown_tokens: list[str]
     error_message: str = ""
+    # услуги с количеством и признаком "?" (половина цены), комбо — первыми
+    services: list[FastServiceToken] = field(default_factory=list)
 
 
 def normalize_alias(value: str) -> str:
@@ -29,7 +41,8 @@ def is_valid_alias(value: str) -> bool:
     return bool(ALIAS_RE.fullmatch(normalize_alias(value)))
 
 
-def parse_fast_input(text: str, user_id: int, service_aliases: dict[int, list[str]]) -> FastInputParse:
+def parse_fast_input(text: str, user_id: int, service_aliases: dict[int, list[str]] | None = None) -> FastInputParse:
+    """Разбирает "номер alias alias..."; service_aliases задаёт свой набор alias вместо общего индекса."""
     tokens = [p.strip(" ,.;:!").lower() for p in text.split() if p.strip()]
     if not tokens:
         return FastInputParse(None, None, [], [], "Пустой ввод")
@@ -45,18 +58,14 @@ def parse_fast_input(text: str, user_id: int, service_aliases: dict[int, list[st
         if normalize_alias(str(c.get("alias") or ""))
     }
 
-    service_alias_map: dict[str, int] = {}
-    for sid, aliases in service_aliases.items():
-        for alias in aliases:
-            service_alias_map[normalize_alias(alias)] = sid
-
-    conflicts = sorted(set(combo_aliases.keys()) & set(service_alias_map.keys()))
+    index = SERVICE_INDEX if service_aliases is None else ServiceSearchIndex(services={}, aliases=service_aliases)
+    conflicts = sorted(set(combo_aliases.keys()) & set(index.aliases.keys()))
     if conflicts:
         logger.warning("alias conflict user_id=%s aliases=%s", user_id, conflicts)
         return FastInputParse(number, None, [], [], f"Конфликт alias: {', '.join(conflicts)}")
 
     combo_ids: list[int] = []
-    service_ids: list[int] = []
+    services: list[FastServiceToken] = []
     unknown: list[str] = []
 
     for token in tokens[1:]:
@@ -65,12 +74,21 @@ def parse_fast_input(text: str, user_id: int, service_aliases: dict[int, list[st
             combo_ids.append(combo_aliases[norm])
             continue
 
-        service_id = service_alias_map.get(norm)
+        half_price = norm.endswith("?")
+        norm = norm.rstrip("?")
+        quantity = 1
+        mult_match = MULTIPLIER_RE.match(norm)
+        service_id = index.match_token(mult_match.group(1)) if mult_match else None
+        if service_id:
+            quantity = max(1, int(mult_match.group(2)))
+        else:
+            service_id = index.match_token(norm)
         if service_id:
-            service_ids.append(service_id)
+            services.append(FastServiceToken(service_id, quantity, half_price))
         else:
             unknown.append(token)
 
+    service_ids = [item.service_id for item in services]
     if len(combo_ids) > 1:
         return FastInputParse(number, None, service_ids, unknown, "Поддерживается только одно комбо в строке")
 
@@ -78,7 +96,8 @@ def parse_fast_input(text: str, user_id: int, service_aliases: dict[int, list[st
     if combo_id:
         combo = DatabaseManager.get_combo(combo_id, user_id)
         if combo:
-            service_ids = list(combo.get("service_ids", [])) + service_ids
+            services = [FastServiceToken(int(sid)) for sid in combo.get("service_ids", [])] + services
+            service_ids = [item.service_id for item in services]
 
     if not service_ids:
         return FastInputParse(number, combo_id, [], unknown, "Не распознал услуги или комбо")
@@ -91,4 +110,4 @@ def parse_fast_input(text: str, user_id: int, service_aliases: dict[int, list[st
         service_ids,
         unknown,
     )
-    return FastInputParse(number, combo_id, service_ids, unknown)
+    return FastInputParse(number, combo_id, service_ids, unknown, services=services)
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from services.metrics import cache_result
+
+API_TASK_LOG_TTL_HOURS = max(1, int(os.getenv("API_TASK_LOG_TTL_HOURS", "48")))
+API_TASK_CACHE_SIZE = max(1, int(os.getenv("API_TASK_CACHE_SIZE", "20000")))
+
+
+class RecentTaskCache:
+    """LRU недавних ключей идемпотентности API в памяти процесса.
+
+    Повтор того же запроса с тем же ключом отсекается без обращения к SQLite.
+    Повторы без ключа (та же услуга той же машине) так не кэшируются: они зависят
+    от смены и от того, не удалил ли пользователь услугу, и проверяются по
+    api_task_log. Промах ничего не значит: источник истины — журнал.
+
+    Ключ живёт API_TASK_LOG_TTL_HOURS от времени записи в журнал, как и строка
+    журнала: после prune_api_task_log ни один воркер не считает его повтором.
+    """
+
+    def __init__(self, max_size: int = API_TASK_CACHE_SIZE, ttl_seconds: int = API_TASK_LOG_TTL_HOURS * 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def seen_key(self, idem_key: str | None) -> bool:
+        if not idem_key:
+            return False
+        with self._lock:
+            ts = self._items.get(idem_key)
+            found = ts is not None and ts >= time.time() - self.ttl_seconds
+            if ts is not None and not found:
+                del self._items[idem_key]
+            if found:
+                self._items.move_to_end(idem_key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        cache_result("api_tasks", found)
+        return found
+
+    def remember(self, idem_key: str | None, ts: int) -> None:
+        """ts — время строки журнала с этим ключом (unix-секунды)."""
+        if not idem_key:
+            return
+        with self._lock:
+            if ts >= self._items.get(idem_key, ts):
+                self._items[idem_key] = ts
+            self._items.move_to_end(idem_key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import bisect
+import calendar
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+from database import DatabaseManager, add_change_listener, now_local, remove_change_listener
+from services.metrics import cache_result
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_RESYNC_SECONDS = 60
+MAX_LOADED_DECADES = 4
+# сколько раз перечитать декаду, если во время чтения пришли события
+DECADE_LOAD_ATTEMPTS = 3
+
+DecadeKey = tuple[int, int, int]
+
+
+def decade_key_for_day(day: date) -> DecadeKey:
+    idx = 1 if day.day <= 10 else 2 if day.day <= 20 else 3
+    return day.year, day.month, idx
+
+
+def decade_bounds(year: int, month: int, decade_index: int) -> tuple[date, date]:
+    if decade_index == 1:
+        return date(year, month, 1), date(year, month, 10)
+    if decade_index == 2:
+        return date(year, month, 11), date(year, month, 20)
+    return date(year, month, 21), date(year, month, calendar.monthrange(year, month)[1])
+
+
+@dataclass(slots=True)
+class Standing:
+    user_id: int
+    name: str = ""
+    telegram_id: int = 0
+    decade_goal: int = 0
+    rank_prefix: str = ""
+    eligible: bool = True
+    days: dict[int, dict] = field(default_factory=dict)
+    total_amount: int = 0
+    cars_count: int = 0
+    shift_count: int = 0
+    closed_hours: float = 0.0
+
+    def apply_profile(self, profile: dict) -> None:
+        self.name = str(profile.get("name") or "")
+        self.telegram_id = int(profile.get("telegram_id") or 0)
+        self.decade_goal = int(profile.get("decade_goal") or 0)
+        self.rank_prefix = str(profile.get("rank_prefix") or "")
+        self.eligible = int(profile.get("is_blocked") or 0) == 0 and int(profile.get("include_in_leaderboard", 1) or 0) == 1
+
+    def set_day(self, day_of_month: int, stats: dict | None) -> None:
+        old = self.days.pop(day_of_month, None)
+        if old:
+            self.total_amount -= old["revenue"]
+            self.cars_count -= old["cars"]
+            self.shift_count -= old["shifts"]
+            self.closed_hours -= old["hours"]
+        if stats and int(stats.get("cars") or 0) > 0:
+            new = {
+                "revenue": int(stats.get("revenue") or 0),
+                "cars": int(stats.get("cars") or 0),
+                "shifts": int(stats.get("shifts") or 0),
+                "hours": float(stats.get("hours") or 0.0),
+            }
+            self.days[day_of_month] = new
+            self.total_amount += new["revenue"]
+            self.cars_count += new["cars"]
+            self.shift_count += new["shifts"]
+            self.closed_hours += new["hours"]
+
+
+@dataclass(slots=True)
+class DecadeStandings:
+    key: DecadeKey
+    start: date
+    end: date
+    loaded_at: float
+    standings: dict[int, Standing] = field(default_factory=dict)
+    order: list[tuple[int, int]] = field(default_factory=list)
+
+    def _order_key(self, standing: Standing) -> tuple[int, int]:
+        return -standing.total_amount, standing.user_id
+
+    def detach(self, standing: Standing) -> None:
+        key = self._order_key(standing)
+        pos = bisect.bisect_left(self.order, key)
+        if pos < len(self.order) and self.order[pos] == key:
+            self.order.pop(pos)
+
+    def attach(self, standing: Standing) -> None:
+        if standing.eligible and standing.days:
+            bisect.insort(self.order, self._order_key(standing))
+
+
+class LeaderboardEngine:
+    """Рейтинг декад, который обновляется точечно по событиям записи.
+
+    Стартовое состояние декады читается из user_day_stats одним запросом,
+    дальше каждое изменение дня пользователя (событие "day_stats") и профиля
+    ("user_profile") меняет только его строку и позицию в упорядоченном списке.
+    Чтение top() стоит O(limit). Записи из других процессов (например, API)
+    подтягиваются полной перечиткой декады раз в LEADERBOARD_RESYNC_SECONDS.
+    """
+
+    def __init__(self, resync_seconds: int = LEADERBOARD_RESYNC_SECONDS):
+        self.resync_seconds = resync_seconds
+        self._lock = threading.RLock()
+        self._decades: dict[DecadeKey, DecadeStandings] = {}
+        # счётчики событий: по декаде (день) и общий (профиль, сброс); по ним
+        # чтение декады без блокировки узнаёт, что успело устареть
+        self._versions: dict[DecadeKey, int] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    # ---- подписка на события БД ----
+    def attach(self) -> "LeaderboardEngine":
+        add_change_listener("day_stats", self.apply_day_stats)
+        add_change_listener("day_stats_reset", self.reset)
+        add_change_listener("user_profile", self.refresh_user)
+        return self
+
+    def detach(self) -> None:
+        remove_change_listener("day_stats", self.apply_day_stats)
+        remove_change_listener("day_stats_reset", self.reset)
+        remove_change_listener("user_profile", self.refresh_user)
+
+    # ---- чтение ----
+    def top(self, year: int, month: int, decade_index: int, limit: int = 10) -> list[dict]:
+        decade = self._get_decade((year, month, decade_index))
+        with self._lock:
+            leaders = [decade.standings[user_id] for _, user_id in decade.order[:limit]]
+            snapshot = [(standing, dict(standing.days)) for standing in leaders]
+        active_hours = DatabaseManager.get_active_shift_hours(
+            [standing.user_id for standing, _ in snapshot],
+            decade.start.isoformat(),
+            decade.end.isoformat(),
+        )
+        return [self._to_row(decade, standing, days, active_hours.get(standing.user_id, 0.0)) for standing, days in snapshot]
+
+    def _get_decade(self, key: DecadeKey) -> DecadeStandings:
+        with self._lock:
+            decade = self._decades.get(key)
+            if decade and time.monotonic() - decade.loaded_at < self.resync_seconds:
+                self.hits += 1
+                cache_result("leaderboard", True)
+                return decade
+            self.misses += 1
+            cache_result("leaderboard", False)
+            version = self._version(key)
+        # запрос декады идёт без блокировки; результат ставится, только если
+        # за это время никто не поставил более свежий и не пришли события
+        for attempt in range(1, DECADE_LOAD_ATTEMPTS + 1):
+            decade = self._load(key)
+            with self._lock:
+                current = self._decades.get(key)
+                if current is not None and current.loaded_at >= decade.loaded_at:
+                    return current
+                latest = self._version(key)
+                if latest != version and attempt < DECADE_LOAD_ATTEMPTS:
+                    version = latest
+                    continue
+                if latest != version:
+                    decade.loaded_at = 0.0  # перечитать при следующем обращении
+                self._decades[key] = decade
+                while len(self._decades) > MAX_LOADED_DECADES:
+                    oldest = min(self._decades.values(), key=lambda item: item.loaded_at)
+                    self._decades.pop(oldest.key, None)
+                return decade
+
+    def _version(self, key: DecadeKey) -> tuple[int, int]:
+        return self._generation, self._versions.get(key, 0)
+
+    def _load(self, key: DecadeKey) -> DecadeStandings:
+        start, end = decade_bounds(*key)
+        decade = DecadeStandings(key=key, start=start, end=end, loaded_at=time.monotonic())
+        for row in DatabaseManager.get_decade_day_stats(start.isoformat(), end.isoformat()):
+            user_id = int(row["user_id"])
+            standing = decade.standings.get(user_id)
+            if standing is None:
+                standing = Standing(user_id=user_id)
+                standing.apply_profile(row)
+                decade.standings[user_id] = standing
+            standing.set_day(int(str(row["day"])[8:10]), row)
+        for standing in decade.standings.values():
+            decade.attach(standing)
+        return decade
+
+    def _to_row(self, decade: DecadeStandings, standing: Standing, days: dict[int, dict], active_hours: float) -> dict:
+        total_amount = standing.total_amount
+        total_hours = max(standing.closed_hours, 0.0) + active_hours
+        decade_goal = standing.decade_goal
+        total_days = max((decade.end - decade.start).days + 1, 1)
+        today = now_local().date()
+        if (today.year, today.month) == (decade.start.year, decade.start.month):
+            current_day = today.day
+        else:
+            current_day = decade.end.day
+        elapsed_days = min(max(current_day - decade.start.day + 1, 0), total_days)
+        elapsed_ratio = elapsed_days / total_days
+        run_rate = None
+        if decade_goal > 0 and elapsed_ratio > 0:
+            expected_now = max(1.0, decade_goal * elapsed_ratio)
+            run_rate = max(0.0, min(2.0, total_amount / expected_now))
+        return {
+            "user_id": standing.user_id,
+            "name": standing.name,
+            "telegram_id": standing.telegram_id,
+            "total_amount": total_amount,
+            "cars_count": standing.cars_count,
+            "shift_count": standing.shift_count,
+            "shifts_count": standing.shift_count,
+            "decade_goal": decade_goal,
+            "rank_prefix": standing.rank_prefix,
+            "daily_amounts": {day: item["revenue"] for day, item in days.items()},
+            "avg_per_hour": int(total_amount / total_hours) if total_hours > 0 else 0,
+            "total_hours": round(total_hours, 1),
+            "progress_pct": 100 if decade_goal <= 0 else min(200, int((total_amount * 100) / max(decade_goal, 1))),
+            "run_rate": run_rate,
+        }
+
+    # ---- события ----
+    def apply_day_stats(self, user_id: int, day: str, stats: dict | None) -> None:
+        try:
+            day_value = datetime.strptime(str(day), "%Y-%m-%d").date()
+        except ValueError:
+            return
+        key = decade_key_for_day(day_value)
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            decade = self._decades.get(key)
+            if decade is None:
+                return
+            need_profile = bool(stats) and user_id not in decade.standings
+        # профиль читается без блокировки: запрос к БД не должен держать чтение рейтинга
+        profile = DatabaseManager.get_leaderboard_profile(user_id) if need_profile else None
+        with self._lock:
+            decade = self._decades.get(key)
+            if decade is None:
+                return
+            standing = decade.standings.get(user_id)
+            if standing is None:
+                if not stats or not profile:
+                    return
+                standing = Standing(user_id=user_id)
+                standing.apply_profile(profile)
+                decade.standings[user_id] = standing
+            decade.detach(standing)
+            standing.set_day(day_value.day, stats)
+            decade.attach(standing)
+
+    def refresh_user(self, user_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            if not any(user_id in decade.standings for decade in self._decades.values()):
+                return
+        profile = DatabaseManager.get_leaderboard_profile(user_id)
+        with self._lock:
+            touched = [decade for decade in self._decades.values() if user_id in decade.standings]
+            for decade in touched:
+                standing = decade.standings[user_id]
+                decade.detach(standing)
+                if profile is None:
+                    decade.standings.pop(user_id, None)
+                    continue
+                standing.apply_profile(profile)
+                decade.attach(standing)
+
+    def reset(self, user_id: int | None = None) -> None:
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._decades.clear()
+                return
+            for decade in self._decades.values():
+                standing = decade.standings.pop(user_id, None)
+                if standing is not None:
+                    decade.detach(standing)
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# порт отдельного HTTP-сервера метрик для бота; 0 — не запускать
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, "_Metric"] = {}
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> "_Metric | None":
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: list[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), registry: Registry | None = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+# ========== МЕТРИКИ ==========
+CALLBACK_SECONDS = Histogram("bot_callback_seconds", "Время обработки callback-кнопки", ("handler",))
+CALLBACKS_TOTAL = Counter("bot_callbacks_total", "Обработанные callback-кнопки", ("handler", "status"))
+MESSAGE_SECONDS = Histogram("bot_message_seconds", "Время обработки текстового сообщения", ("branch",))
+MESSAGES_TOTAL = Counter("bot_messages_total", "Обработанные текстовые сообщения", ("branch", "status"))
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Время метода DatabaseManager", ("method",))
+DB_QUERY_ROWS = Histogram("db_query_rows", "Строк вернул метод DatabaseManager", ("method",), buckets=ROW_BUCKETS)
+CACHE_REQUESTS_TOTAL = Counter("cache_requests_total", "Обращения к кэшам", ("cache", "result"))
+JOB_SECONDS = Histogram("job_seconds", "Длительность фоновых задач", ("job",))
+JOBS_TOTAL = Counter("jobs_total", "Запуски фоновых задач", ("job", "status"))
+UPDATES_ACTIVE = Gauge("bot_updates_active", "Обновления Telegram в обработке")
+UPDATES_WAITING = Gauge("bot_updates_waiting", "Обновления, ждущие свою очередь пользователя или свободный слот")
+UPDATE_QUEUES = Gauge("bot_update_user_queues", "Пользователи с обновлениями в обработке или в очереди")
+UPDATE_WAIT_SECONDS = Histogram("bot_update_wait_seconds", "Ожидание обновления до начала обработки")
+
+_current_timer: ContextVar["Timer | None"] = ContextVar("metrics_timer", default=None)
+
+
+class Timer:
+    """Замер блока: длительность — в histogram, исход (ok/error) — в counter.
+
+    Метки можно уточнить внутри блока через set_labels(): так обработчик сообщает,
+    какая ветка сработала, не зная о таймере.
+    """
+
+    def __init__(self, histogram: Histogram, counter: Counter | None = None, **labels):
+        self.histogram = histogram
+        self.counter = counter
+        self.labels = labels
+        self.status = "ok"
+        self._started = 0.0
+        self._token = None
+
+    def fail(self) -> None:
+        self.status = "error"
+
+    def __enter__(self) -> "Timer":
+        self._started = time.perf_counter()
+        self._token = _current_timer.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current_timer.reset(self._token)
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            self.status = "error"
+        self.histogram.observe(time.perf_counter() - self._started, **self.labels)
+        if self.counter is not None:
+            self.counter.inc(status=self.status, **self.labels)
+
+
+def set_labels(**labels) -> None:
+    """Уточняет метки текущего Timer (если он есть)."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.labels.update(labels)
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS_TOTAL.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def track_job(func):
+    """Декоратор задач job_queue: длительность и исход по имени функции."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with Timer(JOB_SECONDS, JOBS_TOTAL, job=func.__name__):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "0.0.0.0") -> ThreadingHTTPServer | None:
+    """Поднимает /metrics в фоновом потоке (для процесса бота); None, если port == 0."""
+    if port <= 0:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("metrics server listening on %s:%s", host, server.server_port)
+    return server
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+REPORT_WORKERS = max(1, int(os.getenv("REPORT_WORKERS", "2")))
+
+
+@dataclass(slots=True)
+class ReportJob:
+    key: Hashable
+    seq: int
+    future: asyncio.Future
+    started: asyncio.Event = field(default_factory=asyncio.Event)
+
+    async def result(self) -> Any:
+        # shield: отмена одного ожидающего не должна отменять общий отчёт
+        return await asyncio.shield(self.future)
+
+
+class ReportJobQueue:
+    """Очередь тяжёлых отчётов (XLSX, PDF, бэкап) в отдельном пуле потоков.
+
+    Одинаковые задачи (по ключу) пока они в работе не дублируются: второй запрос
+    получает тот же ReportJob и ждёт его результат.
+    """
+
+    def __init__(self, max_workers: int = REPORT_WORKERS):
+        self.max_workers = max_workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
+        self._jobs: dict[Hashable, ReportJob] = {}
+        self._seq = itertools.count(1)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="report")
+            return self._executor
+
+    def submit(self, key: Hashable, func: Callable[..., Any], *args, **kwargs) -> tuple[ReportJob, bool]:
+        """Ставит задачу в очередь; возвращает (задача, была ли она уже в работе)."""
+        job = self._jobs.get(key)
+        if job is not None:
+            return job, True
+
+        loop = asyncio.get_running_loop()
+        started = asyncio.Event()
+
+        def run():
+            loop.call_soon_threadsafe(started.set)
+            return func(*args, **kwargs)
+
+        future = loop.run_in_executor(self._get_executor(), run)
+        job = ReportJob(key=key, seq=next(self._seq), future=future, started=started)
+        self._jobs[key] = job
+        future.add_done_callback(functools.partial(self._finish, job))
+        return job, False
+
+    def _finish(self, job: ReportJob, future: asyncio.Future) -> None:
+        if self._jobs.get(job.key) is job:
+            self._jobs.pop(job.key, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("report job failed key=%s", job.key, exc_info=future.exception())
+
+    def queued_ahead(self, job: ReportJob) -> int:
+        """Сколько задач должно завершиться, прежде чем эта получит поток (0 — стартует сразу)."""
+        if job.started.is_set():
+            return 0
+        earlier = sum(1 for other in self._jobs.values() if other.seq < job.seq)
+        return max(0, earlier - self.max_workers + 1)
+
+    def in_flight(self) -> int:
+        return len(self._jobs)
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
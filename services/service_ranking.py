@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Mapping
+
+from config import SERVICES
+from database import DatabaseManager, add_change_listener, remove_change_listener
+from services.metrics import cache_result
+
+logger = logging.getLogger(__name__)
+
+SERVICE_RANKING_CACHE_SIZE = max(1, int(os.getenv("SERVICE_RANKING_CACHE_SIZE", "5000")))
+# записи услуг из других процессов (API) подтягиваются перечиткой счётчиков
+SERVICE_RANKING_RESYNC_SECONDS = 60
+
+
+@dataclass(slots=True)
+class _UserRanking:
+    order: tuple[int, ...]
+    loaded_at: float
+    stale: bool = False
+    layouts: dict[tuple, object] = field(default_factory=dict)
+
+
+class ServiceRanking:
+    """Порядок услуг пользователя и готовые раскладки клавиатуры в памяти.
+
+    Порядок строится по счётчикам user_service_usage (их ведут триггеры
+    car_services), поэтому промах — одно чтение по первичному ключу, без
+    агрегатов по истории. События "day_stats"/"day_stats_reset" только помечают
+    пользователя устаревшим: раскладки страниц сбрасываются, если после
+    перечитки счётчиков порядок услуг действительно изменился.
+    """
+
+    def __init__(
+        self,
+        services: Mapping[int, dict] = SERVICES,
+        max_size: int = SERVICE_RANKING_CACHE_SIZE,
+        resync_seconds: int = SERVICE_RANKING_RESYNC_SECONDS,
+    ):
+        self.services = services
+        self.max_size = max_size
+        self.resync_seconds = resync_seconds
+        self._lock = threading.RLock()
+        self._users: OrderedDict[int, _UserRanking] = OrderedDict()
+        self._default: tuple[int, ...] | None = None
+        # растёт при каждой инвалидации: чтение счётчиков без блокировки по нему
+        # узнаёт, что за время запроса порядок мог устареть
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    # ---- подписка на события БД ----
+    def attach(self) -> "ServiceRanking":
+        add_change_listener("day_stats", self._on_day_stats)
+        add_change_listener("day_stats_reset", self.invalidate)
+        return self
+
+    def detach(self) -> None:
+        remove_change_listener("day_stats", self._on_day_stats)
+        remove_change_listener("day_stats_reset", self.invalidate)
+
+    def _on_day_stats(self, user_id: int, day: str, stats: dict | None) -> None:
+        self.invalidate(user_id)
+
+    def invalidate(self, user_id: int | None = None) -> None:
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                for entry in self._users.values():
+                    entry.stale = True
+                return
+            entry = self._users.get(user_id)
+            if entry is not None:
+                entry.stale = True
+
+    # ---- чтение ----
+    def rank(self, usage: Mapping[int, int]) -> tuple[int, ...]:
+        visible = [
+            (service_id, service)
+            for service_id, service in self.services.items()
+            if not service.get("hidden")
+        ]
+        visible.sort(
+            key=lambda item: (
+                -usage.get(item[0], 0),
+                item[1].get("priority", 999),
+                item[1].get("order", 999),
+                item[0],
+            )
+        )
+        return tuple(service_id for service_id, _ in visible)
+
+    def order(self, user_id: int | None) -> tuple[int, ...]:
+        if not user_id:
+            if self._default is None:
+                self._default = self.rank({})
+            return self._default
+        return self._entry(user_id).order
+
+    def _entry(self, user_id: int) -> _UserRanking:
+        with self._lock:
+            entry = self._users.get(user_id)
+            fresh = (
+                entry is not None
+                and not entry.stale
+                and time.monotonic() - entry.loaded_at < self.resync_seconds
+            )
+            cache_result("service_ranking", fresh)
+            if fresh:
+                self.hits += 1
+                self._users.move_to_end(user_id)
+                return entry
+            self.misses += 1
+            generation = self._generation
+        # запрос холодного пользователя не должен задерживать клавиатуры остальных
+        order = self.rank(DatabaseManager.get_user_service_usage(user_id))
+        with self._lock:
+            stale = self._generation != generation
+            entry = self._users.get(user_id)
+            if entry is None or entry.order != order:
+                entry = _UserRanking(order=order, loaded_at=time.monotonic(), stale=stale)
+            else:
+                entry.loaded_at = time.monotonic()
+                entry.stale = stale
+            self._users[user_id] = entry
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+            return entry
+
+    def layout(self, user_id: int | None, key: tuple, build: Callable[[tuple[int, ...]], object]):
+        """Раскладка страницы по порядку услуг: build(order) вызывается, пока порядок не изменится."""
+        if not user_id:
+            return build(self.order(None))
+        entry = self._entry(user_id)
+        with self._lock:
+            value = entry.layouts.get(key)
+            cache_result("service_layouts", value is not None)
+            if value is None:
+                value = entry.layouts[key] = build(entry.order)
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import re
+from typing import Iterable, Mapping, Sequence
+
+from config import FAST_SERVICE_ALIASES, SERVICES
+
+_WORD_RE = re.compile(r"[0-9a-zа-я]+")
+_CYRILLIC_RE = re.compile(r"[а-я]")
+_LATIN_RE = re.compile(r"[a-z]")
+# латиница, похожая на кириллицу: "пpoверка", набранная вперемешку
+_HOMOGLYPHS = str.maketrans("abcehkmoptxy", "авсенкмортху")
+# та же клавиша в раскладке ЙЦУКЕН: "ghjd" -> "пров"
+_KEYBOARD_LAYOUT = str.maketrans("`qwertyuiop[]asdfghjkl;'zxcvbnm,.", "ёйцукенгшщзхъфывапролджэячсмитьбю")
+
+
+def _fix_word(word: str) -> str:
+    if _CYRILLIC_RE.search(word) and _LATIN_RE.search(word):
+        return word.translate(_HOMOGLYPHS)
+    return word
+
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр, ё -> е, без emoji и знаков; смешанные слова приводятся к кириллице."""
+    value = (text or "").lower().replace("ё", "е")
+    return " ".join(_fix_word(word) for word in _WORD_RE.findall(value))
+
+
+def query_variants(text: str) -> list[str]:
+    """Нормализованный запрос и, для чистой латиницы, он же в русской раскладке."""
+    lowered = (text or "").lower()
+    variants = [normalize_text(lowered)]
+    if _LATIN_RE.search(lowered) and not _CYRILLIC_RE.search(lowered):
+        switched = normalize_text(lowered.translate(_KEYBOARD_LAYOUT))
+        if switched and switched not in variants:
+            variants.append(switched)
+    return [variant for variant in variants if variant]
+
+
+def max_typos(length: int) -> int:
+    if length <= 3:
+        return 0
+    return 1 if length <= 6 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Дамерау–Левенштейна (перестановка соседних букв — одна правка); больше limit — limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before: list[int] | None = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            value = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            if before is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def _trigrams(term: str, padded: bool = True) -> set[str]:
+    value = f"  {term} " if padded else term
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        # услуги всех терминов в поддереве: ответ на префикс — один проход вниз
+        self.ids: set[int] = set()
+
+
+def _trie_insert(root: _TrieNode, term: str, service_id: int) -> None:
+    node = root
+    node.ids.add(service_id)
+    for char in term:
+        node = node.children.setdefault(char, _TrieNode())
+        node.ids.add(service_id)
+
+
+def _trie_find(root: _TrieNode, prefix: str) -> set[int]:
+    node = root
+    for char in prefix:
+        node = node.children.get(char)
+        if node is None:
+            return set()
+    return node.ids
+
+
+class ServiceSearchIndex:
+    """Поисковый индекс услуг: строится один раз, дальше только чтение.
+
+    Термины — нормализованные названия, их слова и короткие alias. Точные
+    совпадения ищутся по словарям, префиксы — по trie, опечатки — по общим
+    триграммам с проверкой расстоянием Дамерау–Левенштейна. Запрос латиницей
+    дополнительно пробуется в русской раскладке ("pfghfdrf" -> "заправка").
+    """
+
+    def __init__(
+        self,
+        services: Mapping[int, dict] = SERVICES,
+        aliases: Mapping[int, Iterable[str]] = FAST_SERVICE_ALIASES,
+    ):
+        self._hidden = {service_id for service_id, service in services.items() if service.get("hidden")}
+        self._rank = {
+            service_id: (service.get("priority", 999), service.get("order", 999), service_id)
+            for service_id, service in services.items()
+        }
+        self.names: dict[int, str] = {}
+        self.aliases: dict[str, int] = {}
+        self._phrases: dict[str, set[int]] = {}
+        self._words: dict[str, set[int]] = {}
+        self._phrase_trie = _TrieNode()
+        self._word_trie = _TrieNode()
+        self._word_trigrams: dict[str, set[str]] = {}
+        self._name_trigrams: dict[str, set[int]] = {}
+
+        for service_id, service in services.items():
+            name = normalize_text(service.get("name", ""))
+            if not name:
+                continue
+            self.names[service_id] = name
+            self._add_phrase(name, service_id)
+            for word in name.split():
+                if len(word) >= 2:
+                    self._add_word(word, service_id)
+            for trigram in _trigrams(name, padded=False):
+                self._name_trigrams.setdefault(trigram, set()).add(service_id)
+        for service_id, items in aliases.items():
+            for alias in items:
+                alias = normalize_text(alias)
+                if not alias:
+                    continue
+                self.aliases.setdefault(alias, service_id)
+                self._add_phrase(alias, service_id)
+                self._add_word(alias, service_id)
+
+    def _add_phrase(self, phrase: str, service_id: int) -> None:
+        self._phrases.setdefault(phrase, set()).add(service_id)
+        _trie_insert(self._phrase_trie, phrase, service_id)
+
+    def _add_word(self, word: str, service_id: int) -> None:
+        if word not in self._words:
+            for trigram in _trigrams(word):
+                self._word_trigrams.setdefault(trigram, set()).add(word)
+        self._words.setdefault(word, set()).add(service_id)
+        _trie_insert(self._word_trie, word, service_id)
+
+    # ---- термины ----
+    def has_alias(self, value: str) -> bool:
+        return normalize_text(value) in self.aliases
+
+    def _similar_words(self, word: str, limit: int) -> list[tuple[str, int]]:
+        """Термины-слова на расстоянии не больше limit; кандидаты — по общим триграммам."""
+        candidates: set[str] = set()
+        for trigram in _trigrams(word):
+            candidates.update(self._word_trigrams.get(trigram, ()))
+        found = []
+        for term in candidates:
+            distance = edit_distance(word, term, limit)
+            if distance <= limit:
+                found.append((term, distance))
+        return found
+
+    def _word_matches(self, word: str) -> dict[int, tuple[int, int]]:
+        """service_id -> (0 точно | 1 префикс | 2 с опечаткой, число правок)."""
+        matches: dict[int, tuple[int, int]] = {}
+        for service_id in self._words.get(word, ()):
+            matches[service_id] = (0, 0)
+        for service_id in _trie_find(self._word_trie, word):
+            matches.setdefault(service_id, (1, 0))
+        limit = max_typos(len(word))
+        if limit:
+            for term, distance in self._similar_words(word, limit):
+                for service_id in self._words[term]:
+                    if (2, distance) < matches.get(service_id, (3, 0)):
+                        matches[service_id] = (2, distance)
+        return matches
+
+    def _score(self, query: str) -> dict[int, tuple[int, int]]:
+        """Оценки услуг для нормализованного запроса: меньше — лучше."""
+        scores: dict[int, tuple[int, int]] = {}
+
+        def offer(service_id: int, score: tuple[int, int]) -> None:
+            if score < scores.get(service_id, (9, 0)):
+                scores[service_id] = score
+
+        for service_id in self._phrases.get(query, ()):
+            offer(service_id, (0, 0))
+        for service_id in _trie_find(self._phrase_trie, query):
+            offer(service_id, (1, 0))
+        per_word = [self._word_matches(word) for word in query.split()]
+        if per_word:
+            for service_id in set.intersection(*(set(matches) for matches in per_word)):
+                tiers = [matches[service_id] for matches in per_word]
+                fuzzy = any(tier == 2 for tier, _ in tiers)
+                offer(service_id, (4 if fuzzy else 2, sum(distance for _, distance in tiers)))
+        if len(query) >= 3:
+            candidates = set.intersection(*(self._name_trigrams.get(t, set()) for t in _trigrams(query, padded=False)))
+            for service_id in candidates:
+                if query in self.names[service_id]:
+                    offer(service_id, (3, 0))
+        return scores
+
+    # ---- поиск ----
+    def search(
+        self,
+        query: str,
+        limit: int = 12,
+        order: Sequence[int] | None = None,
+        include_hidden: bool = False,
+    ) -> list[int]:
+        """Услуги по убыванию релевантности; при равной оценке — в порядке order (рейтинг пользователя)."""
+        scores: dict[int, tuple[int, int]] = {}
+        for variant in query_variants(query):
+            for service_id, score in self._score(variant).items():
+                if score < scores.get(service_id, (9, 0)):
+                    scores[service_id] = score
+        if not include_hidden:
+            for service_id in self._hidden:
+                scores.pop(service_id, None)
+        positions = {service_id: index for index, service_id in enumerate(order or ())}
+        ranked = sorted(
+            scores,
+            key=lambda service_id: (
+                scores[service_id],
+                positions.get(service_id, len(positions)),
+                self._rank.get(service_id, (999, 999, service_id)),
+            ),
+        )
+        return ranked[:limit]
+
+    def resolve(self, query: str) -> int | None:
+        """Услуга по свободному названию для API; None, если ничего не совпало.
+
+        Строже search: префиксы не засчитываются, раскладка и опечатки — только
+        для слов от трёх букв, иначе "x" через "ч" стал бы платной "Проверкой".
+        Из нескольких подходящих услуг берётся первая по priority/order.
+        """
+        normalized = normalize_text(query)
+        variants = [
+            variant for variant in query_variants(query)
+            if variant == normalized or len(variant.replace(" ", "")) >= 3
+        ]
+        for variant in variants:
+            service_ids = self._phrases.get(variant)
+            if service_ids:
+                return min(service_ids, key=lambda service_id: self._rank.get(service_id, (999, 999, service_id)))
+        for variant in variants:
+            found: set[int] | None = None
+            for word in variant.split():
+                service_ids = set(self._words.get(word, ()))
+                if not service_ids and len(word) >= 3:
+                    similar = self._similar_words(word, max_typos(len(word)))
+                    best = min((distance for _, distance in similar), default=None)
+                    for term, distance in similar:
+                        if distance == best:
+                            service_ids.update(self._words[term])
+                found = service_ids if found is None else found & service_ids
+            if found:
+                return min(found, key=lambda service_id: self._rank.get(service_id, (999, 999, service_id)))
+        return None
+
+    def match_token(self, token: str) -> int | None:
+        """Одно слово быстрого ввода: alias или однозначное слово названия, допускается опечатка."""
+        variants = [variant for variant in query_variants(token) if " " not in variant]
+        for variant in variants:
+            if variant in self.aliases:
+                return self.aliases[variant]
+            service_ids = self._words.get(variant, set())
+            if len(variant) >= 3 and len(service_ids) == 1:
+                return next(iter(service_ids))
+        # при равном числе правок alias важнее слова из названия
+        best_key: tuple[int, int] | None = None
+        best_ids: set[int] = set()
+        for variant in variants:
+            for term, distance in self._similar_words(variant, max_typos(len(variant))):
+                if term in self.aliases:
+                    key, service_ids = (distance, 0), {self.aliases[term]}
+                else:
+                    key, service_ids = (distance, 1), self._words[term]
+                if best_key is None or key < best_key:
+                    best_key, best_ids = key, set(service_ids)
+                elif key == best_key:
+                    best_ids.update(service_ids)
+        return next(iter(best_ids)) if len(best_ids) == 1 else None
+
+
+SERVICE_INDEX = ServiceSearchIndex()
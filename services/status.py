@@ -1,13 +1,16 @@
 from __future__ import annotations
 
+import os
 from io import BytesIO
-from telegram import Update
+
+from telegram import CallbackQuery, Update
 from telegram.ext import CallbackContext
 
 
-async def send_status(update: Update, context: CallbackContext, text: str, *, reply_markup=None):
-    if update.callback_query:
-        return await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
+async def send_status(update: Update | CallbackQuery, context: CallbackContext, text: str, *, reply_markup=None):
+    callback_query = getattr(update, "callback_query", None)
+    if callback_query:
+        return await callback_query.message.reply_text(text, reply_markup=reply_markup)
     if update.message:
         return await update.message.reply_text(text, reply_markup=reply_markup)
     return await context.bot.send_message(chat_id=update.effective_chat.id, text=text, reply_markup=reply_markup)
@@ -36,3 +39,12 @@ async def done_status(msg, text: str, *, attach_photo_bytes: bytes | BytesIO | N
     except Exception:
         pass
     await msg.reply_photo(photo=photo, caption=caption or text, reply_markup=reply_markup)
+
+
+async def done_status_document(msg, path: str, *, caption: str | None = None, filename: str | None = None) -> None:
+    try:
+        await msg.delete()
+    except Exception:
+        pass
+    with open(path, "rb") as document:
+        await msg.reply_document(document=document, filename=filename or os.path.basename(path), caption=caption)
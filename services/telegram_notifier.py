@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+NOTIFY_COALESCE_SECONDS = float(os.getenv("NOTIFY_COALESCE_SECONDS", "1.0"))
+NOTIFY_WORKERS = max(1, int(os.getenv("NOTIFY_WORKERS", "4")))
+NOTIFY_MAX_ATTEMPTS = max(1, int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5")))
+NOTIFY_MAX_PENDING = 10000
+# лимит Telegram на длину сообщения
+MESSAGE_LIMIT = 4096
+
+
+class TelegramNotifier:
+    """Фоновая очередь уведомлений в Telegram для API.
+
+    notify() только кладёт текст в очередь чата и сразу возвращается. Воркеры
+    ждут окно NOTIFY_COALESCE_SECONDS, склеивают всё, что накопилось по чату,
+    в одно сообщение и отправляют его через общий httpx.AsyncClient
+    (keep-alive). 429 и ошибки сети/5xx повторяются с паузой, остальные 4xx
+    отбрасываются. Один чат в каждый момент обслуживает один воркер, поэтому
+    порядок сообщений в чате сохраняется.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        *,
+        base_url: str = TELEGRAM_API_BASE,
+        coalesce_seconds: float = NOTIFY_COALESCE_SECONDS,
+        workers: int = NOTIFY_WORKERS,
+        max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+        backoff: float = 0.5,
+        timeout: float = 10.0,
+    ):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.coalesce_seconds = coalesce_seconds
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+        self._client: httpx.AsyncClient | None = None
+        self._queue: asyncio.Queue[int] | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._pending: dict[int, list[str]] = {}
+        self._first_at: dict[int, float] = {}
+        self._scheduled: set[int] = set()
+        self._size = 0
+        self.sent = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers),
+        )
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Дожидается отправки очереди (не дольше timeout) и закрывает клиент."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("telegram notifier stopped with %s pending messages", self._size)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._client.aclose()
+        self._client = None
+
+    def notify(self, chat_id: int, text: str) -> bool:
+        """Ставит сообщение в очередь; False, если очередь переполнена или не запущена."""
+        if not self.running or self._size >= NOTIFY_MAX_PENDING:
+            self.dropped += 1
+            return False
+        self._pending.setdefault(chat_id, []).append(text)
+        self._first_at.setdefault(chat_id, time.monotonic())
+        self._size += 1
+        if chat_id not in self._scheduled:
+            self._scheduled.add(chat_id)
+            self._queue.put_nowait(chat_id)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._queue.get()
+            try:
+                delay = self._first_at.get(chat_id, 0) + self.coalesce_seconds - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                texts = self._pending.pop(chat_id, [])
+                self._first_at.pop(chat_id, None)
+                self._size -= len(texts)
+                for chunk in _join_messages(texts):
+                    await self._send(chat_id, chunk)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("telegram notifier failed chat_id=%s", chat_id)
+            finally:
+                self._scheduled.discard(chat_id)
+                # пока шла отправка, в чат могли добавиться новые сообщения
+                if chat_id in self._pending:
+                    self._scheduled.add(chat_id)
+                    self._queue.put_nowait(chat_id)
+                self._queue.task_done()
+
+    async def _send(self, chat_id: int, text: str) -> bool:
+        for attempt in range(1, self.max_attempts + 1):
+            delay = self.backoff * 2 ** (attempt - 1)
+            try:
+                response = await self._client.post(
+                    f"/bot{self.token}/sendMessage", data={"chat_id": chat_id, "text": text}
+                )
+            except httpx.HTTPError as exc:
+                logger.warning("telegram notify attempt %s failed: %s", attempt, exc)
+            else:
+                if response.status_code == 200:
+                    self.sent += 1
+                    return True
+                if response.status_code == 429:
+                    delay = max(delay, _retry_after(response))
+                elif response.status_code < 500:
+                    logger.warning("telegram notify rejected chat_id=%s status=%s", chat_id, response.status_code)
+                    self.dropped += 1
+                    return False
+            if attempt < self.max_attempts:
+                await asyncio.sleep(delay)
+        logger.warning("telegram notify gave up chat_id=%s", chat_id)
+        self.dropped += 1
+        return False
+
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return float(response.json().get("parameters", {}).get("retry_after", 0))
+    except (ValueError, AttributeError):
+        return 0.0
+
+
+def _join_messages(texts: list[str]) -> list[str]:
+    chunks: list[str] = []
+    current = ""
+    for text in texts:
+        text = text[:MESSAGE_LIMIT]
+        candidate = f"{current}\n\n{text}" if current else text
+        if len(candidate) > MESSAGE_LIMIT:
+            chunks.append(current)
+            candidate = text
+        current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Callable
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from database import AsyncDatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# публичный https-адрес эндпоинта; пусто — webhook выключен, бот работает через polling
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "0.2"))
+WEBHOOK_BATCH_SIZE = 100
+# как часто воркер без Application пытается перехватить лидерство
+WEBHOOK_LEADER_RETRY_SECONDS = 5.0
+# сколько хранить обработанные update_id: Telegram повторяет доставку не дольше суток
+TELEGRAM_UPDATE_TTL_HOURS = max(1, int(os.getenv("TELEGRAM_UPDATE_TTL_HOURS", "24")))
+WEBHOOK_PRUNE_SECONDS = 3600
+# группа обработчика, который отмечает обновление обработанным: после всех остальных
+WEBHOOK_DONE_GROUP = 1000
+# флаг в bot_data: Application работает внутри API, пулом и писателем БД владеет api.py
+EMBEDDED_BOT_DATA_KEY = "webhook_embedded"
+
+
+def webhook_enabled() -> bool:
+    return bool(TELEGRAM_WEBHOOK_URL)
+
+
+def secret_matches(header: str | None, secret: str) -> bool:
+    """Сверяет X-Telegram-Bot-Api-Secret-Token; без настроенного секрета запросы не принимаются."""
+    return bool(secret) and header is not None and hmac.compare_digest(header.encode(), secret.encode())
+
+
+class LeaderLock:
+    """Неблокирующий flock на файле: из нескольких воркеров его держит ровно один."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        handle = open(self.path, "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._file = handle
+        return True
+
+    def release(self) -> None:
+        if self._file is None:
+            return
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+class WebhookIngress:
+    """Приём обновлений Telegram через webhook в приложении FastAPI.
+
+    Любой воркер uvicorn проверяет секрет и кладёт обновление во входящую очередь
+    в SQLite (повтор update_id отбрасывается). Application с обработчиками бота
+    поднимает только воркер, взявший LeaderLock: он забирает очередь по порядку
+    update_id и передаёт обновления в application.update_queue. Так user_data,
+    порядок обновлений пользователя и задачи job_queue остаются в одном процессе,
+    а при падении лидера его место занимает другой воркер.
+    """
+
+    def __init__(
+        self,
+        load_application: Callable[[], tuple[Application, list[str]]],
+        *,
+        url: str = TELEGRAM_WEBHOOK_URL,
+        secret: str = TELEGRAM_WEBHOOK_SECRET,
+        lock_path: str = "",
+        poll_seconds: float = WEBHOOK_POLL_SECONDS,
+    ):
+        self.load_application = load_application
+        self.url = url
+        self.secret = secret
+        self.lock = LeaderLock(lock_path) if lock_path else None
+        self.poll_seconds = poll_seconds
+        self.application: Application | None = None
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._done: list[int] = []
+        self._pruned_at = 0.0
+
+    async def start(self) -> None:
+        if not self.secret:
+            logger.error("TELEGRAM_WEBHOOK_SECRET is empty: webhook requests will be rejected")
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.application is not None:
+            await self._stop_application(self.application)
+            self.application = None
+            await self._flush_done()
+        if self.lock is not None:
+            self.lock.release()
+
+    async def accept(self, payload: dict) -> bool:
+        """Сохраняет обновление; False — такой update_id уже в очереди."""
+        update_id = int(payload["update_id"])
+        raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        added = await AsyncDatabaseManager.enqueue_telegram_update(update_id, raw, int(time.time()))
+        self._wake.set()
+        return added
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self.application is None:
+                    if self.lock is not None and not self.lock.acquire():
+                        await asyncio.sleep(WEBHOOK_LEADER_RETRY_SECONDS)
+                        continue
+                    self.application = await self._start_application()
+                await self.drain()
+                await self._prune()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("webhook ingress iteration failed")
+                await asyncio.sleep(self.poll_seconds)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def drain(self) -> int:
+        """Передаёт накопленные обновления в Application; возвращает их число."""
+        await self._flush_done()
+        application = self.application
+        total = 0
+        while application is not None:
+            rows = await AsyncDatabaseManager.take_telegram_updates(WEBHOOK_BATCH_SIZE, int(time.time()))
+            for update_id, raw in rows:
+                try:
+                    update = Update.de_json(json.loads(raw), application.bot)
+                except Exception:
+                    logger.exception("bad webhook update update_id=%s", update_id)
+                    self._done.append(update_id)
+                    continue
+                await application.update_queue.put(update)
+            total += len(rows)
+            if len(rows) < WEBHOOK_BATCH_SIZE:
+                break
+        return total
+
+    async def _mark_done(self, update: Update, context) -> None:
+        self._done.append(update.update_id)
+        self._wake.set()
+
+    async def _flush_done(self) -> None:
+        done, self._done = self._done, []
+        if done:
+            await AsyncDatabaseManager.mark_telegram_updates_processed(done, int(time.time()))
+
+    async def _prune(self) -> None:
+        if time.monotonic() - self._pruned_at < WEBHOOK_PRUNE_SECONDS:
+            return
+        self._pruned_at = time.monotonic()
+        removed = await AsyncDatabaseManager.prune_telegram_updates(int(time.time()) - TELEGRAM_UPDATE_TTL_HOURS * 3600)
+        if removed:
+            logger.info("telegram_update_inbox pruned rows=%s", removed)
+
+    async def _start_application(self) -> Application:
+        application, allowed_updates = self.load_application()
+        application.add_handler(TypeHandler(Update, self._mark_done), group=WEBHOOK_DONE_GROUP)
+        application.bot_data[EMBEDDED_BOT_DATA_KEY] = True
+        released = await AsyncDatabaseManager.release_telegram_updates()
+        if released:
+            logger.info("webhook leader re-queued %s unfinished updates", released)
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        # getWebhookInfo не возвращает секрет, поэтому webhook переустанавливается при каждом
+        # старте лидера: иначе после смены TELEGRAM_WEBHOOK_SECRET все запросы получали бы 403
+        await application.bot.set_webhook(url=self.url, secret_token=self.secret or None, allowed_updates=allowed_updates)
+        logger.info("webhook leader started url=%s", self.url)
+        return application
+
+    async def _stop_application(self, application: Application) -> None:
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
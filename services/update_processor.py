@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from services.metrics import UPDATE_QUEUES, UPDATE_WAIT_SECONDS, UPDATES_ACTIVE, UPDATES_WAITING
+
+logger = logging.getLogger(__name__)
+
+# сколько обновлений обрабатывается одновременно; 1 — строго последовательно, как раньше
+UPDATE_CONCURRENCY = max(1, int(os.getenv("UPDATE_CONCURRENCY", "16")))
+# сколько обновлений может ждать в памяти, прежде чем polling притормозит
+UPDATE_MAX_PENDING = max(1, int(os.getenv("UPDATE_MAX_PENDING", "1000")))
+
+
+def update_ordering_key(update: object) -> int | None:
+    """Ключ очереди: пользователь, а для обновлений без пользователя — чат."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных пользователей.
+
+    Обновления одного пользователя выполняются строго по очереди (asyncio.Lock
+    на effective_user.id), поэтому user_data и порядок нажатий не ломаются.
+    Общее число одновременно работающих обработчиков ограничено concurrency;
+    слот берётся уже после очереди пользователя, так что поток нажатий одного
+    пользователя не занимает слоты остальных. max_pending ограничивает
+    число принятых, но ещё не обработанных обновлений.
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING):
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._users: dict[int, int] = {}
+        self._waiting = 0
+        self._active = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _set_gauges(self) -> None:
+        UPDATES_WAITING.set(self._waiting)
+        UPDATES_ACTIVE.set(self._active)
+        UPDATE_QUEUES.set(len(self._locks))
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = update_ordering_key(update)
+        lock = None
+        if key is not None:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = asyncio.Lock()
+            self._users[key] = self._users.get(key, 0) + 1
+        queued_at = time.perf_counter()
+        started = False
+        self._waiting += 1
+        self._set_gauges()
+        try:
+            if lock is not None:
+                await lock.acquire()
+            try:
+                async with self._slots:
+                    started = True
+                    self._waiting -= 1
+                    self._active += 1
+                    UPDATE_WAIT_SECONDS.observe(time.perf_counter() - queued_at)
+                    self._set_gauges()
+                    try:
+                        await coroutine
+                    finally:
+                        self._active -= 1
+            finally:
+                if lock is not None:
+                    lock.release()
+        finally:
+            if not started:
+                self._waiting -= 1
+            if key is not None:
+                self._users[key] -= 1
+                if not self._users[key]:
+                    del self._users[key]
+                    self._locks.pop(key, None)
+            self._set_gauges()
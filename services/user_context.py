@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any
+
+from database import DatabaseManager, add_change_listener
+
+logger = logging.getLogger(__name__)
+
+_MEMO_ATTR = "user_context_memo"
+_SHIFT_FIELDS = (
+    "start_time",
+    "end_time",
+    "status",
+    "shift_target",
+    "work_date",
+    "pause_started_at",
+    "paused_seconds",
+)
+
+# Поколения данных пользователя: запись в БД увеличивает счётчик, и все
+# контексты, загруженные раньше, считаются устаревшими.
+_generation_lock = threading.Lock()
+_generations: dict[int, int] = {}
+_anonymous_generation = 0
+_total_generation = 0
+
+
+@dataclass(slots=True)
+class UserContext:
+    telegram_id: int
+    banned: bool
+    user: dict | None
+    is_blocked: bool
+    subscription_expires_at: str
+    active_shift: dict | None
+    generation: tuple[int, int] = field(default=(0, 0))
+
+    @property
+    def user_id(self) -> int | None:
+        return int(self.user["id"]) if self.user else None
+
+    @classmethod
+    def from_row(cls, row: dict[str, Any]) -> "UserContext":
+        user = None
+        if row.get("user_id") is not None:
+            user = {
+                "id": row["user_id"],
+                "telegram_id": row["telegram_id"],
+                "name": row["name"],
+                "created_at": row["created_at"],
+            }
+        active_shift = None
+        if row.get("shift_id") is not None:
+            active_shift = {"id": row["shift_id"], "user_id": row["user_id"]}
+            active_shift.update({name: row[f"shift_{name}"] for name in _SHIFT_FIELDS})
+        return cls(
+            telegram_id=int(row["telegram_id"]),
+            banned=bool(row.get("banned")),
+            user=user,
+            is_blocked=int(row.get("is_blocked") or 0) == 1,
+            subscription_expires_at=str(row.get("subscription_expires_at") or ""),
+            active_shift=active_shift,
+        )
+
+
+def _current_generation(user_id: int | None) -> tuple[int, int]:
+    with _generation_lock:
+        return _anonymous_generation, _generations.get(user_id, 0) if user_id is not None else 0
+
+
+def invalidate_user_context(user_id: int | None = None) -> None:
+    """Помечает устаревшими контексты пользователя (None — всех, кто ещё не зарегистрирован)."""
+    global _anonymous_generation, _total_generation
+    with _generation_lock:
+        _total_generation += 1
+        if user_id is None:
+            _anonymous_generation += 1
+        else:
+            _generations[user_id] = _generations.get(user_id, 0) + 1
+
+
+add_change_listener("user_context", invalidate_user_context)
+
+
+def load_user_context(telegram_id: int) -> UserContext:
+    with _generation_lock:
+        started_at = _total_generation
+    user_context = UserContext.from_row(DatabaseManager.get_user_context(telegram_id))
+    with _generation_lock:
+        # Если во время чтения была запись, контекст не кэшируем.
+        if started_at != _total_generation:
+            user_context.generation = (-1, -1)
+        else:
+            user_context.generation = (_anonymous_generation, _generations.get(user_context.user_id, 0))
+    return user_context
+
+
+def _is_fresh(user_context: UserContext) -> bool:
+    current = _current_generation(user_context.user_id)
+    if user_context.user_id is None:
+        return user_context.generation[0] == current[0]
+    return user_context.generation[1] == current[1]
+
+
+def _memo(context: Any) -> dict[int, UserContext] | None:
+    if context is None:
+        return None
+    memo = getattr(context, _MEMO_ATTR, None)
+    if memo is None:
+        memo = {}
+        try:
+            setattr(context, _MEMO_ATTR, memo)
+        except AttributeError:
+            return None
+    return memo
+
+
+def get_user_context(context: Any, telegram_id: int) -> UserContext:
+    """Контекст пользователя на время обработки одного апдейта."""
+    memo = _memo(context)
+    if memo is not None:
+        cached = memo.get(telegram_id)
+        if cached is not None and _is_fresh(cached):
+            return cached
+    user_context = load_user_context(telegram_id)
+    if memo is not None:
+        memo[telegram_id] = user_context
+    return user_context
+
+
+def peek_user_context(context: Any, *, telegram_id: int | None = None, user_id: int | None = None) -> UserContext | None:
+    """Актуальный контекст из памяти апдейта без обращения к БД."""
+    memo = getattr(context, _MEMO_ATTR, None) if context is not None else None
+    if not memo:
+        return None
+    if telegram_id is not None:
+        candidates = [memo.get(telegram_id)]
+    else:
+        candidates = [item for item in memo.values() if item.user_id == user_id]
+    for user_context in candidates:
+        if user_context is not None and _is_fresh(user_context):
+            return user_context
+    return None
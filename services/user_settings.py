@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import logging
+import threading
+from collections import OrderedDict
+
+from database import DatabaseManager, add_change_listener, effective_price_mode, remove_change_listener
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_FLUSH_SECONDS = 10
+SETTINGS_CACHE_SIZE = 5000
+
+# Поля user_settings, которые читает и пишет только бот: их можно держать в памяти
+# и сбрасывать в БД пачкой. Значения по умолчанию совпадают с DatabaseManager.
+SETTINGS_DEFAULTS = {
+    "images_enabled": 1,
+    "goal_enabled": 0,
+    "goal_chat_id": 0,
+    "goal_message_id": 0,
+    "last_decade_notified": "",
+    "price_mode": "day",
+    "price_mode_lock_until": "",
+}
+
+
+class UserSettingsStore:
+    """Кэш части user_settings с отложенной записью.
+
+    Чтение идёт из памяти (при промахе — одним запросом), запись только помечает
+    поле грязным. flush() сохраняет все накопленные изменения одной транзакцией;
+    его вызывает периодическая задача и остановка бота. Ручной режим цен пишется
+    сразу, чтобы его видел API.
+    """
+
+    def __init__(self, max_size: int = SETTINGS_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.RLock()
+        self._values: OrderedDict[int, dict] = OrderedDict()
+        self._dirty: dict[int, set[str]] = {}
+
+    def attach(self) -> "UserSettingsStore":
+        add_change_listener("user_settings_reset", self.discard)
+        return self
+
+    def detach(self) -> None:
+        remove_change_listener("user_settings_reset", self.discard)
+
+    # ---- базовые операции ----
+    def _load(self, user_id: int) -> dict:
+        values = self._values.get(user_id)
+        if values is not None:
+            self._values.move_to_end(user_id)
+            return values
+        row = DatabaseManager.get_user_settings_fields(user_id, list(SETTINGS_DEFAULTS)) or {}
+        values = {
+            name: default if row.get(name) is None else row[name]
+            for name, default in SETTINGS_DEFAULTS.items()
+        }
+        self._values[user_id] = values
+        self._evict()
+        return values
+
+    def _evict(self) -> None:
+        for user_id in list(self._values):
+            if len(self._values) <= self.max_size:
+                break
+            if user_id not in self._dirty:
+                self._values.pop(user_id, None)
+
+    def get(self, user_id: int, name: str):
+        with self._lock:
+            return self._load(user_id)[name]
+
+    def update(self, user_id: int, *, flush: bool = False, **changes) -> None:
+        with self._lock:
+            values = self._load(user_id)
+            changed = {name for name, value in changes.items() if values.get(name) != value}
+            values.update(changes)
+            if changed:
+                self._dirty.setdefault(user_id, set()).update(changed)
+        if flush and changed:
+            self.flush()
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            self._values.pop(user_id, None)
+            self._dirty.pop(user_id, None)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._dirty)
+
+    def flush(self) -> int:
+        with self._lock:
+            if not self._dirty:
+                return 0
+            changes = {
+                user_id: {name: self._values[user_id][name] for name in names}
+                for user_id, names in self._dirty.items()
+                if user_id in self._values
+            }
+            self._dirty.clear()
+        try:
+            DatabaseManager.save_user_settings_many(changes)
+        except Exception:
+            logger.exception("user settings flush failed users=%s", len(changes))
+            with self._lock:
+                for user_id, values in changes.items():
+                    self._dirty.setdefault(user_id, set()).update(values)
+            raise
+        return len(changes)
+
+    # ---- поля ----
+    def is_images_enabled(self, user_id: int) -> bool:
+        return int(self.get(user_id, "images_enabled")) == 1
+
+    def set_images_enabled(self, user_id: int, enabled: bool) -> None:
+        self.update(user_id, images_enabled=1 if enabled else 0)
+
+    def is_goal_enabled(self, user_id: int) -> bool:
+        return int(self.get(user_id, "goal_enabled")) == 1
+
+    def set_goal_enabled(self, user_id: int, enabled: bool) -> None:
+        self.update(user_id, goal_enabled=1 if enabled else 0)
+
+    def get_goal_message_binding(self, user_id: int) -> tuple[int, int]:
+        with self._lock:
+            values = self._load(user_id)
+            return int(values["goal_chat_id"] or 0), int(values["goal_message_id"] or 0)
+
+    def set_goal_message_binding(self, user_id: int, chat_id: int, message_id: int) -> None:
+        self.update(user_id, goal_chat_id=int(chat_id), goal_message_id=int(message_id))
+
+    def clear_goal_message_binding(self, user_id: int) -> None:
+        self.update(user_id, goal_chat_id=0, goal_message_id=0)
+
+    def get_last_decade_notified(self, user_id: int) -> str:
+        return str(self.get(user_id, "last_decade_notified") or "")
+
+    def set_last_decade_notified(self, user_id: int, decade_key: str) -> None:
+        self.update(user_id, last_decade_notified=decade_key)
+
+    def get_price_mode(self, user_id: int) -> str:
+        with self._lock:
+            values = self._load(user_id)
+            return effective_price_mode(values["price_mode"], str(values["price_mode_lock_until"] or ""))
+
+    def set_price_mode(self, user_id: int, mode: str, lock_until: str = "") -> None:
+        normalized_mode = "night" if mode == "night" else "day"
+        self.update(user_id, flush=True, price_mode=normalized_mode, price_mode_lock_until=lock_until or "")
@@ -0,0 +1,20 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import bot
+
+
+def test_backup_db_is_admin_only(monkeypatch):
+    run_report_job = AsyncMock()
+    monkeypatch.setattr(bot, "run_report_job", run_report_job)
+    monkeypatch.setattr(bot, "ADMIN_TELEGRAM_IDS", {1})
+
+    query = SimpleNamespace(from_user=SimpleNamespace(id=2), edit_message_text=AsyncMock())
+    asyncio.run(bot.backup_db(query, SimpleNamespace()))
+    query.edit_message_text.assert_awaited_once_with("⛔ Доступно только администратору")
+    run_report_job.assert_not_awaited()
+
+    query.from_user.id = 1
+    asyncio.run(bot.backup_db(query, SimpleNamespace()))
+    run_report_job.assert_awaited_once()
@@ -0,0 +1,32 @@
+def test_user_totals_follow_day_stats(tmp_db):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(1201, "Driver")
+    user_id = manager.get_user(1201)["id"]
+    shift_id = manager.start_shift(user_id)
+    car_id = manager.add_car(shift_id, "А123ВС777")
+    manager.add_service_to_car(car_id, 1, "Проверка", 300)
+    manager.add_car_with_services(shift_id, "В456ОР777", [(2, "Мойка", 200, 2)])
+
+    row = manager.get_admin_user_row(user_id)
+    assert (row["total_amount"], row["shifts_count"]) == (700, 1)
+
+    manager.delete_car(car_id)
+    assert manager.get_admin_user_row(user_id)["total_amount"] == 400
+
+    manager.rebuild_user_day_stats()
+    assert manager.get_admin_user_row(user_id)["total_amount"] == 400
+
+
+def test_admin_user_page_uses_keyset_cursor(tmp_db):
+    manager = tmp_db.DatabaseManager
+    for telegram_id in (1303, 1301, 1302):
+        manager.register_user(telegram_id, f"User {telegram_id}")
+
+    first, cursor = manager.get_admin_user_page(limit=2)
+    rest, last_cursor = manager.get_admin_user_page(cursor, limit=2)
+    assert [row["telegram_id"] for row in first + rest] == [1302, 1301, 1303]
+    assert last_cursor is None
+
+    first, cursor = manager.get_admin_user_page(limit=2, order="telegram")
+    rest, _ = manager.get_admin_user_page(cursor, limit=2, order="telegram")
+    assert [row["telegram_id"] for row in first + rest] == [1301, 1302, 1303]
@@ -0,0 +1,80 @@
+from fastapi.testclient import TestClient
+
+
+def _client(tmp_db, monkeypatch):
+    import api
+
+    monkeypatch.delenv("DEVICE_KEY", raising=False)
+    monkeypatch.delenv("NOTIFY_TELEGRAM", raising=False)
+    monkeypatch.setenv("AUTO_START_SHIFT", "0")
+    api.recent_tasks.clear()
+    return TestClient(api.app)
+
+
+def test_batch_dedupes_and_reports_per_item(tmp_db, monkeypatch):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(1501, "Driver")
+    manager.register_user(1502, "No shift")
+    user_id = manager.get_user(1501)["id"]
+    shift_id = manager.start_shift(user_id)
+    tasks = [
+        {"chat_id": 1501, "car_id": "а111аа777", "task_type": 1, "timestamp": 1},
+        {"chat_id": 1501, "car_id": "В222ВВ777", "task_type": "заправка", "timestamp": 2},
+        {"chat_id": 1501, "car_id": "В222ВВ777", "task_type": 2, "timestamp": 3},
+        {"chat_id": 1501, "car_id": "В222ВВ777", "task_type": 1, "timestamp": 4},
+        {"chat_id": 1502, "car_id": "С333СС777", "task_type": 1, "timestamp": 5},
+        {"chat_id": 1599, "car_id": "С333СС777", "task_type": 1, "timestamp": 6},
+        {"chat_id": 1501, "car_id": "С333СС777", "task_type": "???", "timestamp": 7},
+    ]
+
+    with _client(tmp_db, monkeypatch) as client:
+        first = client.post("/api/task", json={"chat_id": 1501, "car_id": "А111АА777", "task_type": 1, "timestamp": 0})
+        response = client.post("/api/tasks:batch", json={"tasks": tasks})
+
+    body = response.json()
+    assert first.json() == {"status": "ok"}
+    assert response.status_code == 200
+    assert body["counts"] == {"ok": 2, "dedup": 2, "error": 3}
+    assert [item.get("dedup", False) for item in body["results"][:4]] == [True, False, True, False]
+    assert [item.get("reason") for item in body["results"][4:]] == ["no_active_shift", "user_not_registered", "unknown_task_type"]
+
+    cars = {car["car_number"]: car for car in manager.get_shift_cars(shift_id)}
+    assert set(cars) == {"А111АА777", "В222ВВ777"}
+    services = {row["service_id"]: row["quantity"] for row in manager.get_car_services(cars["В222ВВ777"]["id"])}
+    assert services == {1: 1, 2: 1}
+
+
+def test_batch_writes_in_one_transaction(tmp_db, monkeypatch):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(1601, "Driver")
+    manager.start_shift(manager.get_user(1601)["id"])
+    tasks = [{"chat_id": 1601, "car_id": f"Н{i:03d}НН77", "task_type": 1, "timestamp": i} for i in range(50)]
+
+    import api
+
+    api.recent_tasks.clear()
+    statements = []
+    tmp_db.db.connection().set_trace_callback(statements.append)
+    results, notifications = api.ingest_task_batch([api.TaskPayload(**task) for task in tasks], None)
+    tmp_db.db.connection().set_trace_callback(None)
+
+    assert len(notifications) == 50 and all(item["status"] == "ok" for item in results)
+    assert sum(1 for sql in statements if sql.strip().upper() == "COMMIT") == 1
+
+
+def test_junk_task_types_are_rejected(tmp_db, monkeypatch):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(1701, "Driver")
+    shift_id = manager.start_shift(manager.get_user(1701)["id"])
+
+    with _client(tmp_db, monkeypatch) as client:
+        responses = [
+            client.post("/api/task", json={"chat_id": 1701, "car_id": "А111АА777", "task_type": junk, "timestamp": index})
+            for index, junk in enumerate(["x", "a", "п", "pj", "xyz"])
+        ]
+        accepted = client.post("/api/task", json={"chat_id": 1701, "car_id": "А111АА777", "task_type": "прверка", "timestamp": 9})
+
+    assert [response.status_code for response in responses] == [422] * 5
+    assert accepted.json() == {"status": "ok"}
+    cars = manager.get_shift_cars(shift_id)
+    assert [row["service_id"] for row in manager.get_car_services(cars[0]["id"])] == [1]
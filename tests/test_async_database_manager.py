@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+import database
+
+
+def test_async_facade_exposes_manager_methods():
+    for name, value in vars(database.DatabaseManager).items():
+        if isinstance(value, staticmethod):
+            assert hasattr(database.AsyncDatabaseManager, name)
+
+
+def test_async_methods_run_off_the_event_loop_thread(monkeypatch):
+    seen = {}
+
+    def fake_get_user(telegram_id):
+        seen["thread"] = threading.current_thread().name
+        return {"id": 1, "telegram_id": telegram_id}
+
+    monkeypatch.setattr(database.DatabaseManager, "get_user", fake_get_user)
+
+    result = asyncio.run(database.AsyncDatabaseManager.get_user(42))
+
+    assert result == {"id": 1, "telegram_id": 42}
+    assert seen["thread"].startswith("db")
+
+
+def test_run_executes_composite_function():
+    async def scenario():
+        return await database.AsyncDatabaseManager.run(lambda a, b=0: a + b, 2, b=3)
+
+    assert asyncio.run(scenario()) == 5
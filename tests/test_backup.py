@@ -0,0 +1,37 @@
+import gzip
+import sqlite3
+
+from services.backup import check_integrity, create_backup, rotate_backups
+
+
+def test_backup_includes_wal_and_passes_integrity_check(tmp_db, tmp_path):
+    tmp_db.DatabaseManager.register_user(900, "Backup")
+    # запись остаётся в -wal, пока соединение пула открыто
+    result = create_backup(tmp_db.DB_PATH, str(tmp_path / "backups"), compression="gzip", pages=1, pause=0)
+
+    assert result.path.endswith(".db.gz")
+    assert result.pages > 1
+    restored = tmp_path / "restored.db"
+    with gzip.open(result.path, "rb") as src:
+        restored.write_bytes(src.read())
+    assert check_integrity(str(restored)) == "ok"
+    conn = sqlite3.connect(restored)
+    try:
+        assert conn.execute("SELECT name FROM users WHERE telegram_id = 900").fetchone() == ("Backup",)
+    finally:
+        conn.close()
+
+
+def test_rotation_keeps_newest_backups(tmp_path):
+    for stamp in ("20261001_000000", "20261002_000000", "20261003_000000"):
+        (tmp_path / f"backup_{stamp}.db.gz").write_bytes(b"x")
+    (tmp_path / "backup_20261004_000000.db.part").write_bytes(b"x")
+
+    removed = rotate_backups(str(tmp_path), keep=2)
+
+    assert [name.rsplit("/", 1)[-1] for name in removed] == ["backup_20261001_000000.db.gz"]
+    assert sorted(item.name for item in tmp_path.iterdir()) == [
+        "backup_20261002_000000.db.gz",
+        "backup_20261003_000000.db.gz",
+        "backup_20261004_000000.db.part",
+    ]
@@ -0,0 +1,84 @@
+import asyncio
+
+from telegram.error import Forbidden, RetryAfter
+
+from services.broadcast import BroadcastRunner, ChatRateLimiter
+from services.fanout import RateLimiter
+
+
+class FakeBot:
+    def __init__(self, blocked=(), flood_once=()):
+        self.sent = []
+        self.blocked = set(blocked)
+        self.flood_once = set(flood_once)
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.flood_once:
+            self.flood_once.discard(chat_id)
+            raise RetryAfter(0)
+        if chat_id in self.blocked:
+            raise Forbidden("bot was blocked by the user")
+        self.sent.append(chat_id)
+
+
+def _runner(bot):
+    return BroadcastRunner(bot, limiter=RateLimiter(rate=0), chat_limiter=ChatRateLimiter(interval=0), batch_size=2, progress_seconds=0)
+
+
+def test_broadcast_delivers_and_records_progress(tmp_db):
+    manager = tmp_db.DatabaseManager
+    job_id = manager.create_broadcast_job(1, "all", "Привет", [11, 12, 13, 14, 12])
+    bot = FakeBot(blocked={13}, flood_once={14})
+    updates = []
+
+    async def on_progress(progress):
+        updates.append((progress.processed, progress.done))
+
+    progress = asyncio.run(_runner(bot).run(job_id, on_progress))
+
+    assert sorted(bot.sent) == [11, 12, 14]
+    assert (progress.total, progress.sent, progress.failed, progress.done) == (4, 3, 1, True)
+    assert updates[-1] == (4, True)
+    job = manager.get_broadcast_job(job_id)
+    assert (job["status"], job["sent"], job["failed"]) == ("done", 3, 1)
+    assert manager.get_unfinished_broadcast_jobs() == []
+
+
+def test_broadcast_resumes_from_pending_deliveries(tmp_db):
+    manager = tmp_db.DatabaseManager
+    job_id = manager.create_broadcast_job(1, "all", "Привет", [21, 22, 23])
+    manager.save_broadcast_results(job_id, {21: ("sent", 1, ""), 22: ("sent", 1, "")})
+    assert manager.get_unfinished_broadcast_jobs() == [job_id]
+
+    bot = FakeBot()
+    progress = asyncio.run(_runner(bot).run(job_id))
+
+    assert bot.sent == [23]
+    assert (progress.sent, progress.failed) == (3, 0)
+
+
+def test_cancelled_broadcast_keeps_delivered_results(tmp_db):
+    manager = tmp_db.DatabaseManager
+    job_id = manager.create_broadcast_job(1, "all", "Привет", [31, 32])
+
+    class StuckBot(FakeBot):
+        async def send_message(self, chat_id, text):
+            if chat_id == 32:
+                await asyncio.Event().wait()
+            await super().send_message(chat_id, text)
+
+    bot = StuckBot()
+
+    async def scenario():
+        task = asyncio.create_task(_runner(bot).run(job_id))
+        while not bot.sent:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(scenario())
+    assert manager.get_pending_broadcast_deliveries(job_id, 10) == [32]
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from services.callback_router import CALLBACK_DATA_LIMIT, CallbackDataError, CallbackRouter
+
+
+def _router():
+    router = CallbackRouter()
+    calls = []
+
+    @router.route("sv", legacy="service_", service_id=int, car_id=int, page=int)
+    async def add_service(query, context, payload):
+        calls.append(("sv", payload))
+
+    @router.route("nt", note=str, flag=(bool, False))
+    async def note(query, context, payload):
+        calls.append(("nt", payload))
+
+    router.exact("noop", lambda query, context: calls.append(("noop",)) or asyncio.sleep(0))
+    router.prefix("close_", lambda query, context, data: calls.append(("close", data)) or asyncio.sleep(0))
+    router.prefix("close_confirm_yes_", lambda query, context, data: calls.append(("yes", data)) or asyncio.sleep(0))
+    router.prefix("service_page_", lambda query, context, data: calls.append(("page", data)) or asyncio.sleep(0))
+    return router, calls
+
+
+def test_versioned_and_legacy_data_resolve_to_same_typed_payload():
+    router, calls = _router()
+    data = router.encode("sv", service_id=12, car_id=345, page=0)
+    assert data == "1sv:12:345:0"
+
+    for raw in (data, "service_12_345_0", "service_page_345_1", "close_confirm_yes_7", "close_7", "noop"):
+        match = router.match(raw)
+        asyncio.run(router.dispatch(match, None, None))
+
+    assert calls[0] == calls[1]
+    assert (calls[0][1].service_id, calls[0][1].car_id, calls[0][1].page) == (12, 345, 0)
+    assert calls[2:] == [("page", "service_page_345_1"), ("yes", "close_confirm_yes_7"), ("close", "close_7"), ("noop",)]
+    assert router.match("unknown_1") is None
+
+    for bad in ("1sv:12:x:0", "1sv:12", "1zz:1", "service_1_2_x", "1#missing"):
+        with pytest.raises(CallbackDataError):
+            router.match(bad)
+
+
+def test_long_or_unsafe_payloads_go_through_token_table():
+    router, calls = _router()
+    short = router.encode("nt", note="ok")
+    long_data = router.encode("nt", note="я" * 40, flag=True)
+    unsafe = router.encode("nt", note="a:b")
+
+    assert short == "1nt:ok:0"
+    assert long_data.startswith("1#") and len(long_data.encode()) <= CALLBACK_DATA_LIMIT
+    assert router.encode("nt", note="я" * 40, flag=True) == long_data
+    payloads = [router.match(data).payload for data in (long_data, unsafe)]
+    assert (payloads[0].note, payloads[0].flag) == ("я" * 40, True)
+    assert payloads[1].note == "a:b"
+
+
+def test_bot_parameterized_buttons_are_typed_routes():
+    import bot
+
+    assert all(route is not None for _, route in bot.CALLBACKS._prefixes.values())
+    cases = {
+        "close_confirm_yes_7": ("cy", {"shift_id": 7}),
+        "close_7": ("sc", {"shift_id": 7}),
+        "calendar_set_planned_2026-10-01": ("ks", {"mode": "planned", "day": "2026-10-01"}),
+        "calendar_nav_2026_10_prev": ("kn", {"year": 2026, "month": 10, "direction": "prev"}),
+        "history_edit_car_15_2026-10-01": ("he", {"car_id": 15, "day": "2026-10-01"}),
+        "admin_sub_user_3": ("as", {"user_id": 3}),
+        "combo_edit_4_0_0": ("ce", {"combo_id": 4, "car_id": 0, "page": 0}),
+        "export_decade_xlsx_2026_10_2": ("xx", {"year": 2026, "month": 10, "decade": 2}),
+        "export_month_xlsx_2026_10": ("xm", {"year": 2026, "month": 10}),
+    }
+    for legacy, (opcode, fields) in cases.items():
+        current = bot.CALLBACKS.encode(opcode, **fields)
+        for data in (legacy, current):
+            match = bot.CALLBACKS.match(data)
+            assert match.typed and match.name == opcode
+            assert {name: getattr(match.payload, name) for name in fields} == fields
+    assert bot.CALLBACKS.match("combo_builder_toggle_prev").name == "combo_builder_toggle_prev"
@@ -0,0 +1,47 @@
+import threading
+
+
+def _shift(manager):
+    manager.register_user(1701, "Driver")
+    return manager.start_shift(manager.get_user(1701)["id"])
+
+
+def test_find_car_uses_normalized_number(tmp_db):
+    manager = tmp_db.DatabaseManager
+    shift_id = _shift(manager)
+    car_id = manager.add_car(shift_id, "А123ВС777")
+
+    assert manager.find_car_in_shift(shift_id, " a123bc777 ")["id"] == car_id
+    assert manager.find_car_in_shift(shift_id, "А999ВС777") is None
+
+
+def test_concurrent_get_or_create_makes_one_car(tmp_db):
+    manager = tmp_db.DatabaseManager
+    shift_id = _shift(manager)
+    barrier = threading.Barrier(4)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(manager.get_or_create_car_in_shift(shift_id, "В456ОР777"))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({car["id"] for car in results}) == 1
+    assert sum(car["created"] for car in results) == 1
+    assert len(manager.get_shift_cars(shift_id)) == 1
+
+
+def test_api_batch_reuses_shift_car(tmp_db):
+    manager = tmp_db.DatabaseManager
+    shift_id = _shift(manager)
+    car_id = manager.add_car(shift_id, "А123ВС777")
+
+    result = manager.add_services_to_shift_cars(shift_id, {" a123bc777 ": [(1, "Проверка", 300, 1)]})
+
+    assert result[" a123bc777 "] == {"id": car_id, "created": False, "total_amount": 300}
+    assert len(manager.get_shift_cars(shift_id)) == 1
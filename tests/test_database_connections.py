@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+
+def test_session_reuses_connection_within_thread(tmp_db):
+    with tmp_db.db.session() as first:
+        pass
+    with tmp_db.db.session() as second:
+        pass
+    assert first is second
+
+
+def test_threads_get_own_connections(tmp_db):
+    seen = []
+
+    def worker():
+        with tmp_db.db.session() as conn:
+            seen.append(conn)
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with tmp_db.db.session() as main_conn:
+        pass
+    assert len({id(conn) for conn in seen + [main_conn]}) == 3
+
+
+def test_nested_session_rolls_back_as_one_transaction(tmp_db):
+    with pytest.raises(RuntimeError):
+        with tmp_db.db.session() as conn:
+            conn.execute("INSERT INTO users (telegram_id, name) VALUES (1, 'A')")
+            with tmp_db.db.session() as inner:
+                inner.execute("INSERT INTO users (telegram_id, name) VALUES (2, 'B')")
+            raise RuntimeError("boom")
+
+    assert tmp_db.DatabaseManager.get_user(1) is None
+    assert tmp_db.DatabaseManager.get_user(2) is None
+
+
+def test_manager_methods_commit_through_session(tmp_db):
+    tmp_db.DatabaseManager.register_user(10, "Driver")
+    user = tmp_db.DatabaseManager.get_user(10)
+    shift_id = tmp_db.DatabaseManager.start_shift(user["id"])
+    tmp_db.DatabaseManager.close_shift(shift_id)
+
+    fresh = tmp_db.get_connection()
+    row = fresh.execute("SELECT status FROM shifts WHERE id = ?", (shift_id,)).fetchone()
+    fresh.close()
+    assert row["status"] == "closed"
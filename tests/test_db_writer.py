@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+import pytest
+
+
+def test_writer_group_commits_and_isolates_failures(tmp_db):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(1801, "Driver")
+    shift_id = manager.start_shift(manager.get_user(1801)["id"])
+    writer = tmp_db.DatabaseWriter()
+    writer.start()
+    release = threading.Event()
+
+    def broken():
+        manager.add_car(shift_id, "Х999ХХ77")
+        raise ValueError("boom")
+
+    try:
+        first = writer.submit(release.wait)
+        while not first.running():
+            release.wait(0.001)
+        futures = [writer.submit(manager.add_car, shift_id, f"А{i:03d}АА77") for i in range(5)]
+        failed = writer.submit(broken)
+        release.set()
+        car_ids = [future.result(timeout=5) for future in futures]
+        with pytest.raises(ValueError):
+            failed.result(timeout=5)
+        first.result(timeout=5)
+    finally:
+        writer.stop()
+
+    assert (writer.batches, writer.commands) == (2, 7)
+    numbers = [car["car_number"] for car in manager.get_shift_cars(shift_id)]
+    assert sorted(numbers) == [f"А{i:03d}АА77" for i in range(5)]
+    assert len(set(car_ids)) == 5
+    assert writer.submit(manager.add_car, shift_id, "В100ВВ77") is None
+
+
+def test_async_writes_go_through_writer_thread(tmp_db, monkeypatch):
+    threads = {}
+
+    def fake_set_user_blocked(user_id, blocked):
+        threads["write"] = threading.current_thread().name
+
+    def fake_get_user(telegram_id):
+        threads["read"] = threading.current_thread().name
+
+    monkeypatch.setattr(tmp_db.DatabaseManager, "set_user_blocked", fake_set_user_blocked)
+    monkeypatch.setattr(tmp_db.DatabaseManager, "get_user", fake_get_user)
+    tmp_db.db_writer.start()
+
+    async def scenario():
+        await tmp_db.AsyncDatabaseManager.set_user_blocked(1, True)
+        await tmp_db.AsyncDatabaseManager.get_user(1)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        tmp_db.shutdown_db_executor()
+
+    assert threads["write"] == "db-writer"
+    assert threads["read"].startswith("db_")
+    assert not tmp_db.db_writer.running
+
+
+def test_sync_writes_outside_transaction_are_routed_to_writer(tmp_db):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(1802, "Driver")
+    user_id = manager.get_user(1802)["id"]
+    tmp_db.db_writer.start()
+    try:
+        before = tmp_db.db_writer.commands
+        shift_id = manager.start_shift(user_id)
+        manager.add_car(shift_id, "А100АА77")
+        manager.get_shift_cars(shift_id)
+        routed = tmp_db.db_writer.commands - before
+        # внутри своей транзакции запись выполняется на месте, без ожидания писателя
+        with tmp_db.db.session(immediate=True):
+            manager.add_car(shift_id, "В200ВВ77")
+        assert tmp_db.db_writer.commands - before == routed
+    finally:
+        tmp_db.db_writer.stop()
+
+    assert routed == 2
+    assert len(manager.get_shift_cars(shift_id)) == 2
@@ -0,0 +1,84 @@
+import csv
+import re
+import zipfile
+
+import pytest
+
+import exports
+
+
+@pytest.fixture
+def history(tmp_db, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = tmp_db.DatabaseManager
+    manager.register_user(900, "Driver")
+    user_id = manager.get_user(900)["id"]
+    shift_id = manager.start_shift(user_id)
+    day = manager.get_shift(shift_id)["work_date"]
+    manager.add_car_with_services(shift_id, "А111АА777", [(1, "Проверка", 300, 2), (2, "Заправка", 500, 1)])
+    manager.add_car_with_services(shift_id, "В222ВВ777", [(1, "Проверка", 300, 1)])
+    manager.add_car(shift_id, "С333СС777")
+    manager.add_car_with_services(shift_id, "Е444ЕЕ777", [(1, "Проверка", 300, 1)])
+    return tmp_db, user_id, day
+
+
+def _read_sheet(path):
+    with zipfile.ZipFile(path) as zf:
+        strings = re.findall(r"<t[^>]*>(.*?)</t>", zf.read("xl/sharedStrings.xml").decode("utf-8"))
+        sheet = zf.read("xl/worksheets/sheet1.xml").decode("utf-8")
+    rows = []
+    for row_xml in re.findall(r"<row [^>]*>(.*?)</row>", sheet):
+        cells = []
+        for kind, body in re.findall(r'<c r="[A-Z]+\d+"(?: t="(\w+)")?>(.*?)</c>', row_xml):
+            value = re.search(r"<(?:v|t)[^>]*>(.*?)</(?:v|t)>", body).group(1)
+            if kind == "s":
+                cells.append(strings[int(value)])
+            elif kind == "inlineStr":
+                cells.append(value)
+            else:
+                cells.append(int(value))
+        rows.append(cells)
+    return rows, strings
+
+
+def test_month_xlsx_streams_single_query(history):
+    tmp_db, user_id, day = history
+    year, month = int(day[:4]), int(day[5:7])
+    statements = []
+    tmp_db.db.connection().set_trace_callback(statements.append)
+
+    path = exports.create_month_xlsx(user_id, year, month)
+
+    tmp_db.db.connection().set_trace_callback(None)
+    assert sum(1 for sql in statements if sql.lstrip().upper().startswith("SELECT")) == 1
+    rows, strings = _read_sheet(path)
+    assert rows == [
+        ["Дата", "Машина", "Услуги", "Сумма"],
+        [day, "А111АА777", "Проверка x2; Заправка x1", 1100],
+        [day, "В222ВВ777", "Проверка x1", 300],
+        [day, "С333СС777", "", 0],
+        [day, "Е444ЕЕ777", "Проверка x1", 300],
+    ]
+    # даты и списки услуг хранятся в sharedStrings по одному разу, номера машин — inline
+    assert strings == ["Дата", "Машина", "Услуги", "Сумма", day, "Проверка x2; Заправка x1", "Проверка x1", ""]
+
+
+def test_shared_strings_are_bounded():
+    strings = exports._SharedStrings(max_size=2)
+
+    cells = [strings.cell(f"A{idx}", value) for idx, value in enumerate(["a", "b", "a", "c"], start=1)]
+
+    assert cells[2] == '<c r="A3" t="s"><v>0</v></c>'
+    assert cells[3] == '<c r="A4" t="inlineStr"><is><t xml:space="preserve">c</t></is></c>'
+    assert list(strings.index) == ["a", "b"] and strings.count == 3
+
+
+def test_history_csv_has_row_per_car(history):
+    _, user_id, _ = history
+
+    path = exports.create_history_csv(user_id)
+
+    with open(path, encoding="utf-8") as handle:
+        rows = list(csv.reader(handle))
+    assert rows[0][3:] == ["car_number", "services", "total_amount"]
+    assert sorted(row[3] for row in rows[1:]) == ["А111АА777", "В222ВВ777", "Е444ЕЕ777", "С333СС777"]
@@ -61,3 +61,19 @@ def test_two_combo_rejected(monkeypatch):
     monkeypatch.setattr(fi.DatabaseManager, "get_combo", lambda combo_id, user_id: next(c for c in combos if c["id"] == combo_id))
     r = parse_fast_input("а123вс777 к1 к2", 1, {})
     assert "одно комбо" in r.error_message
+
+
+def test_quantity_and_half_price_with_combo(monkeypatch):
+    from services import fast_input_service as fi
+
+    combos = [{"id": 1, "alias": "пзз", "service_ids": [14]}]
+    monkeypatch.setattr(fi.DatabaseManager, "get_user_combos", lambda user_id: combos)
+    monkeypatch.setattr(fi.DatabaseManager, "get_combo", lambda combo_id, user_id: combos[0])
+    r = parse_fast_input("В964АН797 пров запр3 зо? пзз", 1)
+    assert [(s.service_id, s.quantity, s.half_price) for s in r.services] == [
+        (14, 1, False),
+        (1, 1, False),
+        (2, 3, False),
+        (3, 1, True),
+    ]
+    assert r.service_ids == [14, 1, 2, 3]
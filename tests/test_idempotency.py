@@ -0,0 +1,101 @@
+import time
+
+from fastapi.testclient import TestClient
+
+
+def _client(tmp_db, monkeypatch):
+    import api
+
+    monkeypatch.delenv("DEVICE_KEY", raising=False)
+    monkeypatch.delenv("NOTIFY_TELEGRAM", raising=False)
+    monkeypatch.setenv("AUTO_START_SHIFT", "0")
+    api.recent_tasks.clear()
+    return TestClient(api.app)
+
+
+def test_idempotency_key_repeat_skips_database(tmp_db, monkeypatch):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(1701, "Driver")
+    shift_id = manager.start_shift(manager.get_user(1701)["id"])
+    task = {"chat_id": 1701, "car_id": "К701КК77", "task_type": 1, "timestamp": 1}
+
+    with _client(tmp_db, monkeypatch) as client:
+        first = client.post("/api/task", json=task, headers={"Idempotency-Key": "dev-1"})
+        statements = []
+        tmp_db.db.connection().set_trace_callback(statements.append)
+        repeat = client.post("/api/task", json={**task, "car_id": "М702ММ77"}, headers={"Idempotency-Key": "dev-1"})
+        tmp_db.db.connection().set_trace_callback(None)
+
+    assert first.json() == {"status": "ok"}
+    assert repeat.json() == {"status": "ok", "dedup": True}
+    assert statements == []
+    assert [car["car_number"] for car in manager.get_shift_cars(shift_id)] == ["К701КК77"]
+
+
+def test_log_dedupes_within_ttl_and_prunes(tmp_db, monkeypatch):
+    import api
+
+    manager = tmp_db.DatabaseManager
+    manager.register_user(1702, "Driver")
+    shift_id = manager.start_shift(manager.get_user(1702)["id"])
+    manager.add_car_with_services(shift_id, "К703КК77", [(1, "Проверка", 300, 1)])
+    manager.add_car_with_services(shift_id, "К704КК77", [(1, "Проверка", 300, 1)])
+    now = int(time.time())
+    manager.log_api_tasks([
+        (None, 1702, shift_id, "К703КК77", 1, now - 60, "old-key"),
+        (None, 1702, shift_id, "К704КК77", 1, now - 30 * 24 * 3600, None),
+    ])
+
+    api.recent_tasks.clear()
+    tasks = [
+        api.TaskPayload(chat_id=1702, car_id="к703кк77", task_type=1, timestamp=1),
+        api.TaskPayload(chat_id=1702, car_id="К704КК77", task_type=1, timestamp=2),
+        api.TaskPayload(chat_id=1702, car_id="Р705РР77", task_type=2, timestamp=3, idempotency_key="old-key"),
+    ]
+    results, _ = api.ingest_task_batch(tasks, None)
+    assert [item.get("dedup", False) for item in results] == [True, False, True]
+
+    assert manager.prune_api_task_log(now - 3600) == 1
+    assert manager.find_api_task_duplicates([], [(shift_id, "К704КК77", 1)], now - 3600) == (
+        {}, {(shift_id, "К704КК77", 1)}
+    )
+
+
+def test_dedupe_is_scoped_to_shift_and_present_services(tmp_db, monkeypatch):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(1703, "Driver")
+    user_id = manager.get_user(1703)["id"]
+    first_shift = manager.start_shift(user_id)
+    task = {"chat_id": 1703, "car_id": "К706КК77", "task_type": 1, "timestamp": 1}
+
+    with _client(tmp_db, monkeypatch) as client:
+        assert client.post("/api/task", json=task).json() == {"status": "ok"}
+        assert client.post("/api/task", json=task).json() == {"status": "ok", "dedup": True}
+
+        # пользователь удалил услугу — устройство может прислать её снова
+        car_id = manager.get_shift_cars(first_shift)[0]["id"]
+        manager.remove_service_from_car(car_id, 1)
+        assert client.post("/api/task", json=task).json() == {"status": "ok"}
+
+        # новая смена в пределах DEDUPE_TTL_HOURS: первая задача по той же машине принимается
+        manager.close_shift(first_shift)
+        second_shift = manager.start_shift(user_id)
+        assert client.post("/api/task", json=task).json() == {"status": "ok"}
+
+    cars = manager.get_shift_cars(second_shift)
+    assert [row["service_id"] for row in manager.get_car_services(cars[0]["id"])] == [1]
+
+
+def test_cached_keys_expire_with_the_log(monkeypatch):
+    from services import idempotency
+
+    cache = idempotency.RecentTaskCache(ttl_seconds=3600)
+    now = 1_800_000_000
+    monkeypatch.setattr(idempotency.time, "time", lambda: now)
+    cache.remember("fresh", now - 60)
+    cache.remember("old", now - 7200)
+
+    assert cache.seen_key("fresh")
+    assert not cache.seen_key("old")
+    assert not cache.seen_key("old")
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import timedelta
+
+from services.fanout import RateLimiter, fan_out
+
+
+def _user(manager, telegram_id):
+    manager.register_user(telegram_id, f"User {telegram_id}")
+    return manager.get_user(telegram_id)["id"]
+
+
+def test_expiring_subscriptions_window(tmp_db):
+    manager = tmp_db.DatabaseManager
+    now = tmp_db.now_local()
+    soon, later, blocked = _user(manager, 1001), _user(manager, 1002), _user(manager, 1003)
+    manager.set_subscription_expires_at(soon, (now + timedelta(days=1)).isoformat())
+    manager.set_subscription_expires_at(later, (now + timedelta(days=20)).isoformat())
+    manager.set_subscription_expires_at(blocked, (now + timedelta(days=1)).isoformat())
+    manager.set_user_blocked(blocked, True)
+
+    today = now.date()
+    rows = manager.get_expiring_subscriptions((today - timedelta(days=3)).isoformat(), (today + timedelta(days=3)).isoformat())
+
+    assert [row["id"] for row in rows] == [soon]
+
+
+def test_long_open_shifts_and_period_candidates(tmp_db):
+    manager = tmp_db.DatabaseManager
+    old_owner, fresh_owner = _user(manager, 1011), _user(manager, 1012)
+    old_shift = manager.start_shift(old_owner)
+    manager.start_shift(fresh_owner)
+    # как start_shift: datetime с часовым поясом, sqlite3 пишет его через пробел
+    with tmp_db.db.session() as conn:
+        conn.execute("UPDATE shifts SET start_time = ? WHERE id = ?", (tmp_db.now_local() - timedelta(hours=13), old_shift))
+
+    cutoff = tmp_db.now_local() - timedelta(hours=12)
+    assert [row["id"] for row in manager.get_long_open_shifts(cutoff)] == [old_shift]
+    # свежая смена того же дня не попадает в выборку уже на уровне SQL
+    assert [row["id"] for row in manager.get_long_open_shifts(tmp_db.now_local() - timedelta(minutes=1))] == [old_shift]
+
+    manager.set_last_decade_notified(old_owner, "2026-10-D2")
+    manager.set_last_decade_notified(fresh_owner, "2026-10-D2")
+    assert manager.get_period_report_candidates("2026-10-D2") == []
+    manager.set_app_content(f"month_report_sent_{old_owner}", "2026-09")
+    ids = [row["id"] for row in manager.get_period_report_candidates("2026-10-D2", "2026-09")]
+    assert ids == [fresh_owner]
+
+
+def test_app_content_many_roundtrip(tmp_db):
+    manager = tmp_db.DatabaseManager
+    manager.set_app_content_many({"a": "1", "b": "2"})
+
+    assert manager.get_app_content_many(["a", "b", "missing", "a"]) == {"a": "1", "b": "2"}
+
+
+def test_fan_out_respects_concurrency_and_rate():
+    clock = [0.0]
+    limiter = RateLimiter(rate=2, burst=1, clock=lambda: clock[0])
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() == 0.5
+    clock[0] += 0.5
+    assert limiter.try_acquire() == 0
+
+    running = peak = 0
+
+    async def worker(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0)
+        running -= 1
+        if item == 3:
+            raise RuntimeError("boom")
+        return item * 10
+
+    results = asyncio.run(fan_out(range(6), worker, concurrency=2))
+
+    assert peak == 2
+    assert results == [0, 10, 20, None, 40, 50]
@@ -0,0 +1,118 @@
+import threading
+from datetime import date
+
+import pytest
+
+from services.leaderboard_engine import LeaderboardEngine, decade_key_for_day
+
+
+@pytest.fixture
+def engine(tmp_db):
+    engine = LeaderboardEngine(resync_seconds=3600).attach()
+    yield engine
+    engine.detach()
+
+
+def _start_driver(manager, telegram_id, name):
+    manager.register_user(telegram_id, name)
+    user = manager.get_user(telegram_id)
+    shift_id = manager.start_shift(user["id"])
+    return user["id"], shift_id, manager.get_shift(shift_id)["work_date"]
+
+
+def _comparable(rows):
+    return [{k: v for k, v in row.items() if k not in ("total_hours", "avg_per_hour")} for row in rows]
+
+
+def test_writes_update_loaded_decade_in_place(tmp_db, engine):
+    manager = tmp_db.DatabaseManager
+    first_id, first_shift, day = _start_driver(manager, 601, "Первый")
+    second_id, second_shift, _ = _start_driver(manager, 602, "Второй")
+    key = decade_key_for_day(date.fromisoformat(day))
+
+    car_id = manager.add_car(first_shift, "А111АА777")
+    manager.add_service_to_car(car_id, 1, "Проверка", 300)
+    assert [row["user_id"] for row in engine.top(*key)] == [first_id]
+    assert engine.misses == 1
+
+    other_car = manager.add_car(second_shift, "В222ВВ777")
+    manager.add_service_to_car(other_car, 2, "Заправка", 500)
+    rows = engine.top(*key)
+    assert engine.misses == 1
+    assert [(row["user_id"], row["total_amount"]) for row in rows] == [(second_id, 500), (first_id, 300)]
+    assert _comparable(rows) == _comparable(manager.get_decade_leaderboard_daily(*key))
+
+    manager.remove_service_from_car(other_car, 2)
+    rows = engine.top(*key)
+    assert [(row["user_id"], row["total_amount"]) for row in rows] == [(first_id, 300), (second_id, 0)]
+    assert _comparable(rows) == _comparable(manager.get_decade_leaderboard_daily(*key))
+    assert engine.misses == 1
+
+
+def test_profile_changes_are_applied(tmp_db, engine):
+    manager = tmp_db.DatabaseManager
+    user_id, shift_id, day = _start_driver(manager, 603, "Третий")
+    key = decade_key_for_day(date.fromisoformat(day))
+    car_id = manager.add_car(shift_id, "А111АА777")
+    manager.add_service_to_car(car_id, 1, "Проверка", 300)
+    engine.top(*key)
+
+    manager.set_rank_prefix(user_id, "Ас")
+    assert engine.top(*key)[0]["rank_prefix"] == "Ас"
+
+    manager.set_user_in_leaderboard(user_id, False)
+    assert engine.top(*key) == []
+    assert engine.misses == 1
+
+
+def test_profile_is_read_without_holding_the_lock(tmp_db, engine, monkeypatch):
+    manager = tmp_db.DatabaseManager
+    user_id, shift_id, day = _start_driver(manager, 604, "Четвёртый")
+    key = decade_key_for_day(date.fromisoformat(day))
+    engine.top(*key)
+
+    original = manager.get_leaderboard_profile
+    lock_free = []
+
+    def profile(uid):
+        # другой поток должен успеть взять блокировку, пока идёт запрос профиля
+        result = []
+        thread = threading.Thread(target=lambda: result.append(engine._lock.acquire(timeout=1) and engine._lock.release() is None))
+        thread.start()
+        thread.join()
+        lock_free.extend(result)
+        return original(uid)
+
+    monkeypatch.setattr(manager, "get_leaderboard_profile", profile)
+    car_id = manager.add_car(shift_id, "А111АА777")
+    manager.add_service_to_car(car_id, 1, "Проверка", 300)
+    manager.set_rank_prefix(user_id, "Ас")
+
+    assert lock_free == [True, True]
+    assert engine.top(*key)[0]["rank_prefix"] == "Ас"
+
+
+def test_decade_is_loaded_without_holding_the_lock(tmp_db, engine, monkeypatch):
+    manager = tmp_db.DatabaseManager
+    user_id, shift_id, day = _start_driver(manager, 605, "Пятый")
+    key = decade_key_for_day(date.fromisoformat(day))
+    car_id = manager.add_car(shift_id, "А111АА777")
+
+    original = manager.get_decade_day_stats
+    lock_free = []
+
+    def day_stats(start, end):
+        thread = threading.Thread(target=lambda: lock_free.append(engine._lock.acquire(timeout=1) and engine._lock.release() is None))
+        thread.start()
+        thread.join()
+        rows = original(start, end)
+        if len(lock_free) == 1:
+            # запись между чтением и установкой декады: результат перечитывается
+            manager.add_service_to_car(car_id, 1, "Проверка", 300)
+        return rows
+
+    monkeypatch.setattr(manager, "get_decade_day_stats", day_stats)
+
+    assert [(row["user_id"], row["total_amount"]) for row in engine.top(*key)] == [(user_id, 300)]
+    assert lock_free == [True, True]
+    assert engine.misses == 1
@@ -0,0 +1,66 @@
+import asyncio
+import socket
+import urllib.request
+
+import pytest
+
+from services.metrics import Counter, Histogram, Registry, Timer, set_labels, start_metrics_server, track_job
+
+
+def test_timer_renders_labels_set_inside_block():
+    registry = Registry()
+    seconds = Histogram("demo_seconds", "Время", ("branch",), buckets=(0.1, 1), registry=registry)
+    total = Counter("demo_total", "Исходы", ("branch", "status"), registry=registry)
+
+    with Timer(seconds, total, branch="other"):
+        set_labels(branch='main "menu"')
+    with pytest.raises(RuntimeError):
+        with Timer(seconds, total, branch="other"):
+            raise RuntimeError
+    set_labels(branch="ignored")
+
+    text = registry.render()
+    assert "# TYPE demo_seconds histogram" in text
+    assert 'demo_seconds_bucket{branch="main \\"menu\\"",le="+Inf"} 1' in text
+    assert 'demo_seconds_count{branch="other"} 1' in text
+    assert 'demo_total{branch="main \\"menu\\"",status="ok"} 1' in text
+    assert 'demo_total{branch="other",status="error"} 1' in text
+
+
+def test_database_methods_and_jobs_are_exported(tmp_db):
+    from fastapi.testclient import TestClient
+
+    import api
+    from services.metrics import JOBS_TOTAL
+
+    tmp_db.DatabaseManager.register_user(1901, "Driver")
+    tmp_db.DatabaseManager.get_user(1901)
+
+    @track_job
+    async def nightly_job(context):
+        return context
+
+    assert asyncio.run(nightly_job(5)) == 5
+    assert JOBS_TOTAL.value(job="nightly_job", status="ok") >= 1
+
+    with TestClient(api.app) as client:
+        body = client.get("/metrics").text
+    assert 'db_query_seconds_count{method="get_user"}' in body
+    assert 'db_query_rows_bucket{method="get_user",le="1"}' in body
+
+
+def test_standalone_metrics_server():
+    assert start_metrics_server(port=0) is None
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = start_metrics_server(port=port, host="127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            body = response.read().decode()
+            content_type = response.headers["Content-Type"]
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert "# TYPE bot_callback_seconds histogram" in body
@@ -0,0 +1,93 @@
+import re
+
+import pytest
+
+SCANNED_TABLES = ("shifts", "cars", "car_services", "user_day_stats", "s", "c", "cs", "ds")
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?! USING (?:COVERING )?INDEX)")
+DAY_SEEK = re.compile(r"\b(?:work_date|day)[=<>]")
+
+
+@pytest.fixture
+def seeded_db(tmp_db):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(101, "Driver")
+    user = manager.get_user(101)
+    shift_id = manager.start_shift(user["id"])
+    car_id = manager.add_car(shift_id, "А123ВС777")
+    manager.add_service_to_car(car_id, 1, "Проверка", 300)
+    return tmp_db, user["id"], shift_id
+
+
+def _capture_plans(database, call):
+    statements = []
+    conn = database.db.connection()
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+    plans = {}
+    for sql in statements:
+        if not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        plans[sql] = [row["detail"] for row in rows]
+    return plans
+
+
+def _full_scans(plans):
+    found = []
+    for sql, details in plans.items():
+        for detail in details:
+            match = FULL_SCAN.match(detail)
+            if match and match.group(1) in SCANNED_TABLES:
+                found.append((detail, sql))
+    return found
+
+
+def test_work_date_filled_by_trigger(seeded_db):
+    database, user_id, _ = seeded_db
+    conn = database.db.connection()
+    conn.execute(
+        "INSERT INTO shifts (user_id, start_time) VALUES (?, ?)",
+        (user_id, "2026-03-07 23:30:00+03:00"),
+    )
+    conn.commit()
+    row = conn.execute("SELECT work_date FROM shifts ORDER BY id DESC LIMIT 1").fetchone()
+    assert row["work_date"] == "2026-03-07"
+
+
+@pytest.mark.parametrize(
+    "method, args, seeks_work_date",
+    [
+        ("get_user_total_for_date", ("{user}", "2026-03-07"), True),
+        ("get_user_cars_count_for_date", ("{user}", "2026-03-07"), True),
+        ("get_cars_for_day", ("{user}", "2026-03-07"), True),
+        ("get_days_for_decade", ("{user}", 2026, 3, 1), True),
+        ("get_days_for_month", ("{user}", "2026-03"), True),
+        ("get_month_days_with_totals", ("{user}", 2026, 3), True),
+        ("get_user_total_between_dates", ("{user}", "2026-03-01", "2026-03-10"), True),
+        ("get_shifts_count_between_dates", ("{user}", "2026-03-01", "2026-03-10"), True),
+        ("get_cars_count_between_dates", ("{user}", "2026-03-01", "2026-03-10"), True),
+        ("get_top_services_between_dates", ("{user}", "2026-03-01", "2026-03-10"), True),
+        ("get_top_cars_between_dates", ("{user}", "2026-03-01", "2026-03-10"), True),
+        ("get_decade_leaderboard_daily", (2026, 3, 1), True),
+        ("get_shift_total", ("{shift}",), False),
+        ("get_shift_cars", ("{shift}",), False),
+        ("get_admin_user_page", (), False),
+        ("find_car_in_shift", ("{shift}", "А123ВС777"), False),
+        ("get_admin_user_row", ("{user}",), False),
+        ("get_user_service_usage", ("{user}",), False),
+    ],
+)
+def test_date_queries_use_indexes(seeded_db, method, args, seeks_work_date):
+    database, user_id, shift_id = seeded_db
+    resolved = [user_id if a == "{user}" else shift_id if a == "{shift}" else a for a in args]
+
+    plans = _capture_plans(database, lambda: getattr(database.DatabaseManager, method)(*resolved))
+
+    assert plans, f"{method} issued no SELECT"
+    assert _full_scans(plans) == []
+    if seeks_work_date:
+        details = [detail for rows in plans.values() for detail in rows]
+        assert any(DAY_SEEK.search(detail) for detail in details), details
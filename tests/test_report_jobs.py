@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+import pytest
+
+from services.report_jobs import ReportJobQueue
+
+
+def test_identical_jobs_share_one_run():
+    queue = ReportJobQueue(max_workers=1)
+    release = threading.Event()
+    calls = []
+
+    def build(name):
+        calls.append(name)
+        release.wait(5)
+        return f"reports/{name}.xlsx"
+
+    async def scenario():
+        first, first_deduped = queue.submit(("month", 1), build, "m1")
+        second, second_deduped = queue.submit(("month", 1), build, "m1")
+        other, _ = queue.submit(("month", 2), build, "m2")
+        await first.started.wait()
+        assert queue.queued_ahead(other) == 1
+        release.set()
+        return first_deduped, second_deduped, first is second, await first.result(), await second.result(), await other.result()
+
+    try:
+        result = asyncio.run(scenario())
+    finally:
+        queue.shutdown()
+
+    assert result == (False, True, True, "reports/m1.xlsx", "reports/m1.xlsx", "reports/m2.xlsx")
+    assert calls == ["m1", "m2"]
+    assert queue.in_flight() == 0
+
+
+def test_failed_job_is_reported_and_released():
+    queue = ReportJobQueue(max_workers=1)
+
+    def broken():
+        raise RuntimeError("disk full")
+
+    async def scenario():
+        job, _ = queue.submit(("csv", 1), broken)
+        with pytest.raises(RuntimeError):
+            await job.result()
+        await asyncio.sleep(0)
+        return queue.in_flight()
+
+    try:
+        assert asyncio.run(scenario()) == 0
+    finally:
+        queue.shutdown()
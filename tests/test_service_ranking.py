@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from services.service_ranking import ServiceRanking
+
+SERVICES = {
+    1: {"name": "Проверка", "priority": 1},
+    2: {"name": "Заправка", "priority": 2},
+    3: {"name": "Омывайка", "priority": 3},
+    4: {"name": "Скрытая", "hidden": True},
+}
+
+
+@pytest.fixture
+def user_id(tmp_db):
+    tmp_db.DatabaseManager.register_user(900, "Driver")
+    return tmp_db.DatabaseManager.get_user(900)["id"]
+
+
+@pytest.fixture
+def ranking(tmp_db):
+    ranking = ServiceRanking(services=SERVICES).attach()
+    yield ranking
+    ranking.detach()
+
+
+def _aggregate_usage(database, user_id):
+    rows = database.db.connection().execute(
+        """SELECT cs.service_id, SUM(cs.quantity) FROM car_services cs
+        JOIN cars c ON c.id = cs.car_id JOIN shifts s ON s.id = c.shift_id
+        WHERE s.user_id = ? GROUP BY cs.service_id HAVING SUM(cs.quantity) > 0""",
+        (user_id,),
+    ).fetchall()
+    return {int(row[0]): int(row[1]) for row in rows}
+
+
+def test_usage_counters_follow_adds_and_removals(tmp_db, user_id):
+    manager = tmp_db.DatabaseManager
+    shift_id = manager.start_shift(user_id)
+    first = manager.add_car(shift_id, "А123ВС777")
+    second = manager.add_car(shift_id, "В456ОР777")
+    manager.add_service_to_car(first, 1, "Проверка", 300)
+    manager.add_service_to_car(first, 1, "Проверка", 300)
+    manager.add_service_to_car(first, 2, "Заправка", 200)
+    manager.add_service_to_car(second, 2, "Заправка", 200)
+    manager.add_service_to_car(second, 3, "Омывайка", 100)
+    assert manager.get_user_service_usage(user_id) == {1: 2, 2: 2, 3: 1}
+
+    manager.remove_service_from_car(first, 1)
+    assert manager.get_user_service_usage(user_id) == _aggregate_usage(tmp_db, user_id)
+    manager.delete_car(second)
+    assert manager.get_user_service_usage(user_id) == _aggregate_usage(tmp_db, user_id) == {1: 1, 2: 1}
+    manager.delete_shift(shift_id)
+    assert manager.get_user_service_usage(user_id) == {}
+
+
+def test_keyboard_layout_is_memoized_until_ranking_changes(tmp_db, user_id, ranking):
+    manager = tmp_db.DatabaseManager
+    shift_id = manager.start_shift(user_id)
+    car_id = manager.add_car(shift_id, "А123ВС777")
+    builds = []
+
+    def render():
+        return ranking.layout(user_id, (0, "day", False), lambda order: builds.append(order) or order)
+
+    assert render() == (1, 2, 3)
+    statements = []
+    tmp_db.db.connection().set_trace_callback(statements.append)
+    assert render() == (1, 2, 3)
+    tmp_db.db.connection().set_trace_callback(None)
+    assert statements == []
+    assert len(builds) == 1
+
+    # новая услуга не меняет порядок — раскладка остаётся прежней
+    manager.add_service_to_car(car_id, 1, "Проверка", 300)
+    assert render() == (1, 2, 3)
+    assert len(builds) == 1
+
+    manager.add_service_to_car(car_id, 3, "Омывайка", 100)
+    manager.add_service_to_car(car_id, 3, "Омывайка", 100)
+    assert render() == (3, 1, 2)
+    assert len(builds) == 2
+    assert ranking.hits >= 1 and ranking.misses >= 3
+
+
+def test_usage_is_read_without_holding_the_lock(tmp_db, user_id, ranking, monkeypatch):
+    original = tmp_db.DatabaseManager.get_user_service_usage
+    lock_free = []
+
+    def usage(uid):
+        thread = threading.Thread(target=lambda: lock_free.append(ranking._lock.acquire(timeout=1) and ranking._lock.release() is None))
+        thread.start()
+        thread.join()
+        return original(uid)
+
+    monkeypatch.setattr(tmp_db.DatabaseManager, "get_user_service_usage", usage)
+
+    assert ranking.layout(user_id, (0, "day", False), lambda order: order) == (1, 2, 3)
+    assert lock_free == [True]
@@ -0,0 +1,49 @@
+from services import fast_input_service as fi
+from services.service_search import SERVICE_INDEX, ServiceSearchIndex, edit_distance
+
+SERVICES = {
+    1: {"name": "✅ Проверка", "priority": 1, "order": 1},
+    2: {"name": "⛽ Заправка ТС", "priority": 1, "order": 2},
+    15: {"name": "🧰 Проверка ходовой", "priority": 3, "order": 4},
+    22: {"name": "💡 Замена лампочки", "priority": 4, "order": 5},
+    30: {"name": "⏱️ Длительные поездки до 1 часа", "hidden": True},
+}
+ALIASES = {1: ["проверка", "пров"], 2: ["заправка", "запр"]}
+
+
+def test_search_handles_typos_layout_and_prefixes():
+    index = ServiceSearchIndex(SERVICES, ALIASES)
+
+    assert edit_distance("прверка", "проверка", 2) == 1
+    assert edit_distance("пвороерка", "проверка", 1) == 2
+    assert index.search("прверка") == [1, 15]
+    assert index.search("pfghfdrf") == [2]
+    assert index.search("зам лам") == [22]
+    assert index.search("пpoверка ход") == [15]
+    assert index.search("поездки") == []
+    assert index.search("поездки", include_hidden=True) == [30]
+    # точное совпадение важнее рейтинга, при равной оценке побеждает порядок пользователя
+    assert index.search("проверка", order=[15, 1]) == [1, 15]
+    assert index.search("провер", order=[15, 1]) == [15, 1]
+
+
+def test_match_token_prefers_aliases_and_rejects_ambiguity():
+    index = ServiceSearchIndex(SERVICES, ALIASES)
+
+    assert index.match_token("пров") == 1
+    assert index.match_token("прверка") == 1
+    assert index.match_token("ghjd") == 1
+    assert index.match_token("лампчки") == 22
+    assert index.match_token("xyz") is None
+    assert index.has_alias("Запр")
+
+
+def test_fast_input_and_api_share_the_index(monkeypatch):
+    import api
+
+    monkeypatch.setattr(fi.DatabaseManager, "get_user_combos", lambda user_id: [])
+    parsed = fi.parse_fast_input("а123вс777 прверка pfgh перепарквка", 1)
+    assert parsed.service_ids == [1, 2, 14]
+    assert api.resolve_service_id("Перепарковка") == 14
+    assert api.resolve_service_id("канистр") == SERVICE_INDEX.resolve("заправка из канистры") == 45
+    assert api.resolve_service_id("xyz") is None
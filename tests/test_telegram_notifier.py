@@ -0,0 +1,75 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from services.telegram_notifier import TelegramNotifier
+
+
+@pytest.fixture
+def telegram_stub():
+    requests = []
+    responses = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            requests.append((self.path, form))
+            status, payload = responses.pop(0) if responses else (200, {"ok": True})
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", requests, responses
+    server.shutdown()
+    server.server_close()
+
+
+def test_notifications_are_coalesced_per_chat(telegram_stub):
+    base_url, requests, _ = telegram_stub
+    notifier = TelegramNotifier("TOKEN", base_url=base_url, coalesce_seconds=0.05)
+
+    async def scenario():
+        await notifier.start()
+        assert notifier.notify(1, "first")
+        assert notifier.notify(2, "other chat")
+        assert notifier.notify(1, "second")
+        await notifier.stop()
+
+    asyncio.run(scenario())
+
+    by_chat = {form["chat_id"]: form["text"] for _, form in requests}
+    assert len(requests) == 2
+    assert all(path == "/botTOKEN/sendMessage" for path, _ in requests)
+    assert by_chat == {"1": "first\n\nsecond", "2": "other chat"}
+    assert notifier.sent == 2
+
+
+def test_rate_limited_notification_is_retried(telegram_stub):
+    base_url, requests, responses = telegram_stub
+    responses.append((429, {"ok": False, "parameters": {"retry_after": 0}}))
+    responses.append((500, {"ok": False}))
+    notifier = TelegramNotifier("TOKEN", base_url=base_url, coalesce_seconds=0, backoff=0.01)
+
+    async def scenario():
+        await notifier.start()
+        notifier.notify(5, "hello")
+        await notifier.stop()
+
+    asyncio.run(scenario())
+
+    assert [form["text"] for _, form in requests] == ["hello"] * 3
+    assert (notifier.sent, notifier.dropped) == (1, 0)
@@ -0,0 +1,52 @@
+import asyncio
+
+from telegram import CallbackQuery, Update, User
+
+from services.metrics import UPDATES_ACTIVE, UPDATES_WAITING
+from services.update_processor import PerUserUpdateProcessor
+
+
+def _update(update_id, user_id):
+    query = CallbackQuery(id=str(update_id), from_user=User(user_id, "u", False), chat_instance="c")
+    return Update(update_id, callback_query=query)
+
+
+def _run(processor, updates, delays):
+    events = []
+    running = {"now": 0, "peak": 0}
+
+    async def handle(update, delay):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        events.append(("start", update.update_id))
+        await asyncio.sleep(delay)
+        events.append(("end", update.update_id))
+        running["now"] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(
+            processor.process_update(update, handle(update, delay)) for update, delay in zip(updates, delays)
+        ))
+
+    asyncio.run(scenario())
+    return events, running["peak"]
+
+
+def test_updates_of_one_user_are_serialized_and_users_run_in_parallel():
+    processor = PerUserUpdateProcessor(concurrency=8)
+    updates = [_update(1, 100), _update(2, 100), _update(3, 200)]
+    events, peak = _run(processor, updates, [0.05, 0, 0])
+
+    assert events.index(("end", 1)) < events.index(("start", 2))
+    assert events.index(("end", 3)) < events.index(("end", 1))
+    assert peak == 2
+    assert processor._locks == {} and processor._users == {}
+    assert (UPDATES_ACTIVE.value(), UPDATES_WAITING.value()) == (0, 0)
+
+
+def test_global_limit_bounds_running_handlers():
+    processor = PerUserUpdateProcessor(concurrency=2)
+    updates = [_update(index, 300 + index) for index in range(6)]
+    _, peak = _run(processor, updates, [0.01] * 6)
+
+    assert peak == 2
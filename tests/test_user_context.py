@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+from services.user_context import get_user_context, peek_user_context
+
+
+def _trace_statements(tmp_db):
+    statements = []
+    tmp_db.db.connection().set_trace_callback(statements.append)
+    return statements
+
+
+def test_context_is_loaded_once_per_update(tmp_db):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(700, "Driver")
+    context = SimpleNamespace(user_data={})
+    statements = _trace_statements(tmp_db)
+
+    first = get_user_context(context, 700)
+    second = get_user_context(context, 700)
+
+    assert first is second
+    assert sum(1 for sql in statements if sql.lstrip().upper().startswith("SELECT")) == 1
+    assert first.user["name"] == "Driver"
+    assert first.active_shift is None
+    assert not first.banned and not first.is_blocked
+
+
+def test_writes_invalidate_memoized_context(tmp_db):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(701, "Driver")
+    context = SimpleNamespace(user_data={})
+    user_context = get_user_context(context, 701)
+
+    shift_id = manager.start_shift(user_context.user_id)
+
+    assert peek_user_context(context, user_id=user_context.user_id) is None
+    refreshed = get_user_context(context, 701)
+    assert refreshed.active_shift["id"] == shift_id
+
+    manager.set_user_blocked(refreshed.user_id, True)
+    assert get_user_context(context, 701).is_blocked
+
+
+def test_unknown_user_sees_registration(tmp_db):
+    context = SimpleNamespace(user_data={})
+    assert get_user_context(context, 702).user is None
+
+    tmp_db.DatabaseManager.register_user(702, "Новый")
+
+    assert get_user_context(context, 702).user["name"] == "Новый"
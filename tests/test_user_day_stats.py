@@ -0,0 +1,92 @@
+import pytest
+
+
+@pytest.fixture
+def driver(tmp_db):
+    manager = tmp_db.DatabaseManager
+    manager.register_user(500, "Driver")
+    user = manager.get_user(500)
+    shift_id = manager.start_shift(user["id"])
+    day = manager.get_shift(shift_id)["work_date"]
+    return manager, user["id"], shift_id, day
+
+
+def _stats(manager, user_id, day):
+    return (
+        manager.get_user_total_for_date(user_id, day),
+        manager.get_user_cars_count_for_date(user_id, day),
+        manager.get_shifts_count_between_dates(user_id, day, day),
+    )
+
+
+def test_service_writes_keep_rollup_in_sync(driver):
+    manager, user_id, shift_id, day = driver
+
+    first = manager.add_car(shift_id, "А111АА777")
+    second = manager.add_car(shift_id, "В222ВВ777")
+    manager.add_service_to_car(first, 1, "Проверка", 300)
+    manager.add_service_to_car(first, 1, "Проверка", 300)
+    manager.add_service_to_car(second, 2, "Заправка", 500)
+    assert _stats(manager, user_id, day) == (1100, 2, 1)
+
+    manager.remove_service_from_car(first, 1)
+    assert _stats(manager, user_id, day) == (800, 2, 1)
+
+    manager.clear_car_services(second)
+    assert _stats(manager, user_id, day) == (300, 2, 1)
+
+    manager.delete_car_for_user(user_id, second)
+    assert _stats(manager, user_id, day) == (300, 1, 1)
+    assert manager.verify_user_day_stats() == []
+
+    manager.delete_day_data(user_id, day)
+    assert _stats(manager, user_id, day) == (0, 0, 0)
+    assert manager.verify_user_day_stats() == []
+
+
+def test_close_shift_records_hours(driver):
+    manager, user_id, shift_id, day = driver
+    car_id = manager.add_car(shift_id, "А111АА777")
+    manager.add_service_to_car(car_id, 1, "Проверка", 300)
+
+    manager.close_shift(shift_id)
+
+    assert manager.verify_user_day_stats() == []
+    days = manager.get_days_for_month(user_id, day[:7])
+    assert days == [{"day": day, "shifts_count": 1, "total_amount": 300}]
+
+
+def test_verify_detects_drift_and_rebuild_fixes_it(tmp_db, driver):
+    manager, user_id, shift_id, day = driver
+    car_id = manager.add_car(shift_id, "А111АА777")
+    manager.add_service_to_car(car_id, 1, "Проверка", 300)
+
+    conn = tmp_db.db.connection()
+    conn.execute("UPDATE user_day_stats SET revenue = 1 WHERE user_id = ?", (user_id,))
+    conn.commit()
+
+    problems = manager.verify_user_day_stats()
+    assert [(p["user_id"], p["day"]) for p in problems] == [(user_id, day)]
+
+    manager.rebuild_user_day_stats()
+    assert manager.verify_user_day_stats() == []
+    assert manager.get_user_total_for_date(user_id, day) == 300
+
+
+def test_add_car_with_services_is_one_transaction(tmp_db, driver):
+    manager, user_id, shift_id, day = driver
+    statements = []
+    tmp_db.db.connection().set_trace_callback(statements.append)
+
+    car = manager.add_car_with_services(shift_id, "А111АА777", [
+        (1, "Проверка", 300, 1),
+        (2, "Заправка", 500, 3),
+        (1, "Проверка", 300, 1),
+    ])
+
+    tmp_db.db.connection().set_trace_callback(None)
+    assert sum(1 for sql in statements if sql.strip().upper() == "COMMIT") == 1
+    assert car["total_amount"] == 2100
+    assert [(s["service_id"], s["quantity"]) for s in manager.get_car_services(car["id"])] == [(1, 2), (2, 3)]
+    assert _stats(manager, user_id, day) == (2100, 1, 1)
+    assert manager.verify_user_day_stats() == []
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from services.user_settings import UserSettingsStore
+
+
+@pytest.fixture
+def store(tmp_db):
+    store = UserSettingsStore().attach()
+    yield store
+    store.detach()
+
+
+@pytest.fixture
+def user_id(tmp_db):
+    tmp_db.DatabaseManager.register_user(800, "Driver")
+    return tmp_db.DatabaseManager.get_user(800)["id"]
+
+
+def test_writes_are_coalesced_until_flush(tmp_db, store, user_id):
+    manager = tmp_db.DatabaseManager
+    store.set_goal_enabled(user_id, True)
+    store.set_goal_message_binding(user_id, 10, 20)
+    store.set_goal_message_binding(user_id, 10, 21)
+    store.set_last_decade_notified(user_id, "2026-10-D2")
+
+    assert store.get_goal_message_binding(user_id) == (10, 21)
+    assert manager.get_goal_message_binding(user_id) == (0, 0)
+
+    statements = []
+    tmp_db.db.connection().set_trace_callback(statements.append)
+    assert store.flush() == 1
+    tmp_db.db.connection().set_trace_callback(None)
+
+    assert sum(1 for sql in statements if sql.strip().upper() == "COMMIT") == 1
+    assert manager.is_goal_enabled(user_id)
+    assert manager.get_goal_message_binding(user_id) == (10, 21)
+    assert manager.get_last_decade_notified(user_id) == "2026-10-D2"
+    assert store.pending() == 0
+
+
+def test_reset_discards_cached_values(tmp_db, store, user_id):
+    store.set_goal_message_binding(user_id, 10, 20)
+    tmp_db.DatabaseManager.reset_user_data(user_id)
+
+    assert store.pending() == 0
+    assert store.get_goal_message_binding(user_id) == (0, 0)
+
+
+def test_price_mode_follows_schedule_after_lock_expires(tmp_db, store, user_id):
+    manager = tmp_db.DatabaseManager
+    now = tmp_db.now_local()
+    expired = (now - timedelta(minutes=1)).isoformat()
+    manager.set_price_mode(user_id, "night" if tmp_db.get_mode_by_time(now) == "day" else "day", expired)
+
+    assert store.get_price_mode(user_id) == tmp_db.get_mode_by_time()
+    assert manager.get_price_mode(user_id) == tmp_db.get_mode_by_time()
+    assert store.pending() == 0
+
+    store.set_price_mode(user_id, "night", (now + timedelta(hours=1)).isoformat())
+    assert manager.get_price_mode(user_id) == "night"
+
+
+def test_effective_price_mode_uses_lock_then_schedule(tmp_db):
+    lock = datetime(2026, 10, 17, 21, 0, tzinfo=tmp_db.LOCAL_TZ).isoformat()
+    before = datetime(2026, 10, 17, 12, 0, tzinfo=tmp_db.LOCAL_TZ)
+    after = datetime(2026, 10, 17, 22, 0, tzinfo=tmp_db.LOCAL_TZ)
+
+    assert tmp_db.effective_price_mode("night", lock, before) == "night"
+    assert tmp_db.effective_price_mode("day", lock, after) == "night"
+    assert tmp_db.effective_price_mode("night", "", before) == "day"
+
+
+def test_goal_handlers_load_settings_off_the_event_loop(tmp_db, user_id, monkeypatch):
+    import bot
+
+    store = UserSettingsStore()
+    monkeypatch.setattr(bot, "SETTINGS_STORE", store)
+    original = tmp_db.DatabaseManager.get_user_settings_fields
+    readers = []
+    monkeypatch.setattr(
+        tmp_db.DatabaseManager,
+        "get_user_settings_fields",
+        lambda *args: readers.append(threading.get_ident()) or original(*args),
+    )
+
+    async def main():
+        await bot.disable_goal_status(SimpleNamespace(bot=AsyncMock()), user_id)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert readers and loop_thread not in readers
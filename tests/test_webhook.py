@@ -0,0 +1,134 @@
+import asyncio
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+from services.telegram_webhook import LeaderLock, WebhookIngress
+
+
+def _message_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": text,
+        },
+    }
+
+
+def test_webhook_checks_secret_and_queues_updates_in_order(tmp_db):
+    import api
+
+    ingress = WebhookIngress(lambda: None, secret="s3cret")
+    with TestClient(api.app) as client:
+        api.app.state.webhook = ingress
+        try:
+            forbidden = client.post("/telegram/webhook", json=_message_update(1, 7, "x"))
+            wrong = client.post("/telegram/webhook", json=_message_update(1, 7, "x"), headers={"X-Telegram-Bot-Api-Secret-Token": "nope"})
+            headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+            statuses = [
+                client.post("/telegram/webhook", json=_message_update(update_id, 7, str(update_id)), headers=headers).status_code
+                for update_id in (12, 11, 12)
+            ]
+            bad = client.post("/telegram/webhook", json={"message": {}}, headers=headers)
+        finally:
+            del api.app.state.webhook
+
+    assert (forbidden.status_code, wrong.status_code, bad.status_code) == (403, 403, 400)
+    assert statuses == [200, 200, 200]
+
+    ingress.application = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+
+    async def drain():
+        count = await ingress.drain()
+        queue = ingress.application.update_queue
+        return count, [queue.get_nowait() for _ in range(queue.qsize())]
+
+    count, updates = asyncio.run(drain())
+    assert count == 2
+    assert [(update.update_id, update.effective_user.id, update.message.text) for update in updates] == [(11, 7, "11"), (12, 7, "12")]
+    manager = tmp_db.DatabaseManager
+    assert manager.take_telegram_updates() == []
+    # повтор от Telegram после выдачи не попадает в очередь второй раз
+    assert not manager.enqueue_telegram_update(12, "{}", 0)
+
+
+def test_unfinished_updates_survive_leader_loss_and_processed_ones_expire(tmp_db):
+    manager = tmp_db.DatabaseManager
+    for update_id in (1, 2):
+        manager.enqueue_telegram_update(update_id, "{}", 100)
+    assert [row[0] for row in manager.take_telegram_updates(10, 100)] == [1, 2]
+    manager.mark_telegram_updates_processed([1], 200)
+
+    # новый лидер получает обратно только необработанное
+    assert manager.release_telegram_updates() == 1
+    assert [row[0] for row in manager.take_telegram_updates(10, 300)] == [2]
+    manager.mark_telegram_updates_processed([2], 300)
+
+    assert manager.prune_telegram_updates(250) == 1
+    assert manager.enqueue_telegram_update(1, "{}", 400)
+    assert not manager.enqueue_telegram_update(2, "{}", 400)
+
+
+def test_leader_lock_is_held_by_one_owner(tmp_path):
+    path = str(tmp_path / "webhook.lock")
+    first, second = LeaderLock(path), LeaderLock(path)
+
+    assert first.acquire() and first.held
+    assert not second.acquire()
+    first.release()
+    assert second.acquire()
+    second.release()
+
+
+def test_leader_start_always_registers_current_secret(tmp_db):
+    calls = []
+
+    class Bot:
+        async def set_webhook(self, **kwargs):
+            calls.append(kwargs)
+
+    class App:
+        bot = Bot()
+        post_init = None
+        running = False
+
+        def __init__(self):
+            self.bot_data = {}
+
+        def add_handler(self, handler, group=0):
+            self.group = group
+
+        async def initialize(self):
+            pass
+
+        async def start(self):
+            pass
+
+    ingress = WebhookIngress(lambda: (App(), ["message"]), url="https://x/telegram/webhook", secret="rotated")
+    application = asyncio.run(ingress._start_application())
+
+    assert calls == [{"url": "https://x/telegram/webhook", "secret_token": "rotated", "allowed_updates": ["message"]}]
+    assert application.group == 1000
+    assert application.bot_data == {"webhook_embedded": True}
+
+
+def test_embedded_bot_leaves_db_teardown_to_api(monkeypatch):
+    from unittest.mock import AsyncMock, Mock
+
+    import bot
+    from services.telegram_webhook import EMBEDDED_BOT_DATA_KEY
+
+    shutdown = Mock()
+    monkeypatch.setattr(bot, "shutdown_db_executor", shutdown)
+    monkeypatch.setattr(bot, "stop_broadcast_jobs", AsyncMock())
+    monkeypatch.setattr(bot, "REPORT_JOBS", Mock())
+    monkeypatch.setattr(bot, "SETTINGS_STORE", Mock())
+
+    asyncio.run(bot.on_shutdown(SimpleNamespace(bot_data={EMBEDDED_BOT_DATA_KEY: True})))
+    shutdown.assert_not_called()
+    asyncio.run(bot.on_shutdown(SimpleNamespace(bot_data={})))
+    shutdown.assert_called_once()